@@ -0,0 +1,4 @@
+# Performance benchmarks for the polldata project.
+#
+# Run them from the base directory, eg:
+#     python -m benchmarks.seenstore
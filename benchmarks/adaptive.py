@@ -0,0 +1,140 @@
+"""
+Check AdaptiveConcurrency (see polldata.extensions) against a local server
+that can only serve a few requests at once.
+
+A synthetic site (see benchmarks/synthetic.py) is served by RCPServer with
+--latency milliseconds per response, --capacity requests served at once and
+--queue more waiting; past that the server answers 503.  The spider crawls it
+once with AdaptiveConcurrency (up to --max requests at once) and once for
+each fixed concurrency in --fixed, and the benchmark reports for each crawl:
+
+    crawl       seconds from the spider opening to it closing
+    rejected    503s the server sent
+    in flight   the most requests the server held at once
+    polls       polls exported (pages that ran out of retries lose theirs)
+
+and, for the adaptive crawl, the concurrency changes it logged.
+
+Usage:
+    python -m benchmarks.adaptive [--options 600] [--latency 50] [--capacity 4] [--fixed 4,16]
+"""
+
+from __future__ import print_function
+
+import argparse
+import glob
+import json
+import os
+import re
+import shutil
+import subprocess
+import sys
+import tempfile
+
+from benchmarks import synthetic
+from benchmarks.quickcrawl import REPO_DIR, parseTime
+from benchmarks.rcpserver import RCPServer
+
+DECISION_RE = re.compile(r'Adaptive concurrency for \S+: (.*)$')
+
+
+def runCrawl(project_dir, spider, proxy, settings):
+    """Crawl in a fresh data/ directory.
+
+    Returns:
+        (crawl seconds, polls exported to every output, the log's lines)
+    """
+    for dirname in ('data', 'logs'):
+        shutil.rmtree(os.path.join(project_dir, dirname), ignore_errors=True)
+        os.makedirs(os.path.join(project_dir, dirname))
+
+    args = [sys.executable, '-c', 'from scrapy.cmdline import execute; execute()', 'crawl', spider,
+            '-s', 'LOG_FILE=logs/run.txt']
+    for name, value in sorted(settings.items()):
+        args.extend(['-s', '%s=%s' % (name, value)])
+    env = dict(os.environ, http_proxy=proxy,
+               PYTHONPATH=os.pathsep.join([REPO_DIR] + [p for p in [os.environ.get('PYTHONPATH')] if p]))
+    devnull = open(os.devnull, 'w')
+    subprocess.check_call(args, cwd=project_dir, env=env, stdout=devnull, stderr=devnull)
+    devnull.close()
+
+    metrics_file = open(glob.glob(os.path.join(project_dir, 'logs', '*metrics.json'))[0])
+    metrics = json.load(metrics_file)
+    metrics_file.close()
+    crawl_seconds = (parseTime(metrics['finished']) - parseTime(metrics['started'])).total_seconds()
+
+    polls = 0
+    for fName in glob.glob(os.path.join(project_dir, 'data', '*_latest.csv')):
+        latest_file = open(fName)
+        polls += max(0, len(latest_file.readlines()) - 1)
+        latest_file.close()
+    log_file = open(os.path.join(project_dir, 'logs', 'run.txt'))
+    lines = log_file.readlines()
+    log_file.close()
+    return crawl_seconds, polls, lines
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Crawl a local server that has a fixed capacity.")
+    parser.add_argument('--spider', default='races')
+    parser.add_argument('--options', type=int, default=600, help="state pages in the widget (default: %(default)s)")
+    parser.add_argument('--polls', type=int, default=20, help="polls per state page (default: %(default)s)")
+    parser.add_argument('--latency', type=float, default=50,
+                        help="milliseconds each response takes (default: %(default)s)")
+    parser.add_argument('--capacity', type=int, default=4, help="requests served at once (default: %(default)s)")
+    parser.add_argument('--queue', type=int, default=4, help="requests waiting before 503s (default: %(default)s)")
+    parser.add_argument('--max', type=int, default=16,
+                        help="the adaptive crawl's highest concurrency (default: %(default)s)")
+    parser.add_argument('--fixed', default='4,16', help="fixed concurrencies to compare (default: %(default)s)")
+    args = parser.parse_args()
+
+    crawls = [('adaptive', {'ADAPTIVE_CONCURRENCY_ENABLED': 1, 'ADAPTIVE_CONCURRENCY_MAX': args.max,
+                              'CONCURRENT_REQUESTS_PER_DOMAIN': args.max})]
+    for concurrency in [int(value) for value in args.fixed.split(',') if value]:
+        crawls.append(('fixed %d' % concurrency, {'ADAPTIVE_CONCURRENCY_ENABLED': 0,
+                                                  'CONCURRENT_REQUESTS_PER_DOMAIN': concurrency}))
+
+    tmpdir = tempfile.mkdtemp(prefix='adaptive-bench-')
+    results = []
+    decisions = []
+    try:
+        site_dir = os.path.join(tmpdir, 'site')
+        pages = synthetic.writeSite(site_dir, args.polls, args.options)
+        project_dir = os.path.join(tmpdir, 'project')
+        os.makedirs(project_dir)
+        cfg_file = open(os.path.join(project_dir, 'scrapy.cfg'), 'w')
+        cfg_file.write("[settings]\ndefault = polldata.settings\n")
+        cfg_file.close()
+
+        for name, crawl_settings in crawls:
+            server = RCPServer(site_dir, latency=args.latency / 1000.0, capacity=args.capacity, queue=args.queue)
+            server.start()
+            settings = {
+                'CONDITIONAL_RECRAWL_ENABLED': 0,
+                'RECRAWL_SCHEDULE_ENABLED': 0,
+                'ARCHIVE_ENABLED': 0,
+                'SEEN_STORE': 'polldata.utils.seenStore.SeenStore',
+                'CONCURRENT_REQUESTS': 32,
+            }
+            settings.update(crawl_settings)
+            crawl_seconds, polls, lines = runCrawl(project_dir, args.spider, server.base_url, settings)
+            server.shutdown()
+            server.server_close()
+            results.append((name, crawl_seconds, server.counts['rejected'], server.counts['max_in_flight'], polls))
+            if name == 'adaptive':
+                decisions = [match.group(1) for match in map(DECISION_RE.search, lines) if match]
+    finally:
+        shutil.rmtree(tmpdir)
+
+    print("%d pages, %.0fms per response, %d served at once, %d queued" % (
+        pages, args.latency, args.capacity, args.queue))
+    print("%-12s %10s %10s %10s %10s" % ('crawl', 'crawl (s)', 'rejected', 'in flight', 'polls'))
+    for result in results:
+        print("%-12s %10.2f %10d %10d %10d" % result)
+    print("\nAdaptive concurrency decisions:")
+    for decision in decisions:
+        print("  " + decision)
+
+
+if __name__ == '__main__':
+    main()
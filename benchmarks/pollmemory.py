@@ -0,0 +1,137 @@
+"""
+Measure how much memory a poll costs as a PresPollItem and as a PollRecord
+(see polldata.utils.pollRecords).
+
+Synthetic state pages are parsed with PresSpider.parseStatePolls and every
+poll is kept, either as the item the spider returned or converted with
+PollRecord.fromItem, the way CsvExportPipeline buffers new polls.  Each kind
+is measured in its own process, which reports:
+    rss         growth of the resident memory while the polls were kept,
+                divided by the number of polls
+    size        the polls' deep size (sys.getsizeof of every object they
+                reference, counting shared objects once), per poll
+    convert     PollRecord.fromItem and toItem calls per second
+
+Usage:
+    python -m benchmarks.pollmemory [--pages 1000] [--polls 100]
+"""
+
+from __future__ import print_function
+
+import argparse
+import gc
+import multiprocessing
+import resource
+import sys
+import time
+
+from benchmarks import synthetic
+
+KINDS = ('PresPollItem', 'PollRecord')
+
+
+def residentBytes():
+    try:
+        statm = open('/proc/self/statm')
+    except IOError:
+        # no /proc: fall back to the peak, which only grows
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak if sys.platform == 'darwin' else peak * 1024
+    try:
+        return int(statm.read().split()[1]) * resource.getpagesize()
+    finally:
+        statm.close()
+
+
+def deepSize(objects):
+    """Return the total sys.getsizeof of objects and everything they hold, once each."""
+    seen = set()
+    total = 0
+    stack = list(objects)
+    while stack:
+        obj = stack.pop()
+        if id(obj) in seen:
+            continue
+        seen.add(id(obj))
+        total += sys.getsizeof(obj)
+        if isinstance(obj, dict):
+            stack.extend(obj.keys())
+            stack.extend(obj.values())
+        elif hasattr(obj, '_values'):
+            # a scrapy Item keeps its fields in a dict
+            stack.append(obj._values)
+        elif hasattr(obj, '__slots__'):
+            stack.extend(getattr(obj, slot) for slot in obj.__slots__)
+    return total
+
+
+def keepPolls(kind, params):
+    from scrapy.http import HtmlResponse
+    from polldata.spiders.pres import PresSpider
+    from polldata.utils.pollRecords import PollRecord
+
+    spider = PresSpider()
+    values = {}
+    kept = []
+    gc.collect()
+    baseline = residentBytes()
+    for url, body in synthetic.statePages(params.pages, params.polls, params.seed):
+        items = spider.parseStatePolls(HtmlResponse(url, body=body, encoding='utf-8'))
+        if kind == 'PollRecord':
+            items = [PollRecord.fromItem(item, values) for item in items]
+        kept.extend(items)
+        del items
+    gc.collect()
+    rss = residentBytes() - baseline
+
+    result = {'polls': len(kept), 'rss_bytes_per_poll': float(rss) / len(kept),
+              'size_bytes_per_poll': float(deepSize(kept)) / len(kept)}
+    if kind == 'PollRecord':
+        start = time.time()
+        items = [record.toItem() for record in kept]
+        result['to_item_per_second'] = len(items) / (time.time() - start)
+        start = time.time()
+        for item in items:
+            PollRecord.fromItem(item, values)
+        result['from_item_per_second'] = len(items) / (time.time() - start)
+    return result
+
+
+def runIsolated(kind, params, queue):
+    try:
+        queue.put(keepPolls(kind, params))
+    except Exception as e:
+        queue.put({'error': '%s: %s' % (e.__class__.__name__, e)})
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure the memory a kept poll costs.")
+    parser.add_argument('--pages', type=int, default=1000, help="state pages to parse (default: %(default)s)")
+    parser.add_argument('--polls', type=int, default=100, help="polls per page (default: %(default)s)")
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    results = {}
+    for kind in KINDS:
+        queue = multiprocessing.Queue()
+        process = multiprocessing.Process(target=runIsolated, args=(kind, args, queue))
+        process.start()
+        results[kind] = queue.get()
+        process.join()
+        if 'error' in results[kind]:
+            print("%s failed: %s" % (kind, results[kind]['error']))
+            sys.exit(1)
+
+    print("%d polls" % results[KINDS[0]]['polls'])
+    print("%-14s %16s %16s" % ('kind', 'rss (bytes/poll)', 'size (bytes/poll)'))
+    for kind in KINDS:
+        result = results[kind]
+        print("%-14s %16.0f %16.0f" % (kind, result['rss_bytes_per_poll'], result['size_bytes_per_poll']))
+    records = results['PollRecord']
+    print("PollRecord is %.1fx smaller; fromItem %.0f/s, toItem %.0f/s" % (
+        results['PresPollItem']['rss_bytes_per_poll'] / records['rss_bytes_per_poll'],
+        records['from_item_per_second'], records['to_item_per_second']))
+
+
+if __name__ == '__main__':
+    main()
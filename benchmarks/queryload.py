@@ -0,0 +1,233 @@
+"""
+Load test the poll query service (`scrapy pollserver`, see
+polldata.commands.pollserver).
+
+Synthetic revisions files (see polldata.utils.pollRevisions) with --polls
+polls over several races are written to a temporary data directory, and a
+mix of queries (a state's latest polls, a state and service, an end date
+window, the polls in the field on a day, the newest poll of each service) is
+run:
+
+    index       against a PollIndex in this process: the time the index
+                takes to answer, without HTTP or json
+    http        against `scrapy pollserver` on the same data, from --clients
+                threads with keep-alive connections, for --seconds
+
+For each it reports queries per second and the median and 99th percentile
+latency.  --url runs the http test against a server that is already running
+instead (eg. on the real data).
+
+Usage:
+    python -m benchmarks.queryload [--polls 100000] [--clients 4] [--seconds 10] [--url URL]
+"""
+
+from __future__ import print_function
+
+import argparse
+import datetime
+import os
+import random
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+try:
+    from httplib import HTTPConnection
+    from urllib import urlencode
+    from urlparse import urlparse
+except ImportError:
+    from http.client import HTTPConnection
+    from urllib.parse import urlencode, urlparse
+
+from benchmarks import synthetic
+from polldata.utils.pollIndex import PollIndex, STATE_ABBREVIATIONS
+from polldata.utils.pollRevisions import PollRevisions
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+RACES = ['pres2012', 'senate2012', 'gov2012', 'pres2008', 'senate2010']
+
+
+def writePolls(data_dir, count, seed):
+    """Write count synthetic polls, spread over RACES, as revisions files."""
+    rand = random.Random(seed)
+    first_day = datetime.date(2012, 1, 1)
+    for n, race in enumerate(RACES):
+        revisions = PollRevisions(os.path.join(data_dir, race))
+        for _ in range(count // len(RACES) + (1 if n < count % len(RACES) else 0)):
+            start = first_day + datetime.timedelta(days=rand.randint(0, 300))
+            dem, rep = rand.randint(35, 60), rand.randint(35, 60)
+            revisions.observe({
+                'race': race, 'year': 2012, 'state': rand.choice(synthetic.STATES)[1],
+                'service': rand.choice(synthetic.SERVICES),
+                'start_date': start.isoformat(),
+                'end_date': (start + datetime.timedelta(days=rand.randint(0, 6))).isoformat(),
+                'sample': rand.choice(['LV', 'RV', 'A']), 'voters': rand.randint(400, 3000),
+                'dem': float(dem), 'rep': float(rep), 'ind': 0.0, 'spread': float(dem - rep),
+            })
+        revisions.close()
+
+
+def queryMix(rand):
+    """Return a random query, as PollIndex.query arguments."""
+    state = rand.choice(list(STATE_ABBREVIATIONS))
+    day = datetime.date(2012, 1, 1) + datetime.timedelta(days=rand.randint(0, 300))
+    kind = rand.randint(0, 4)
+    if kind == 0:
+        return {'state': state, 'limit': 20}
+    if kind == 1:
+        return {'state': state, 'service': rand.choice(synthetic.SERVICES), 'limit': 20}
+    if kind == 2:
+        return {'ended_after': day.isoformat(), 'ended_before': (day + datetime.timedelta(days=6)).isoformat(),
+                'limit': 20}
+    if kind == 3:
+        return {'race': rand.choice(RACES), 'field_from': day.isoformat(), 'field_to': day.isoformat(),
+                'limit': 20}
+    return {'state': state, 'latest': True, 'limit': 50}
+
+
+def queryString(query):
+    names = {'field_from': 'from', 'field_to': 'to'}
+    return '/polls?' + urlencode(sorted((names.get(name, name), '1' if value is True else value)
+                                        for name, value in query.items()))
+
+
+def percentile(values, fraction):
+    values = sorted(values)
+    if not values:
+        return 0.0
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+def benchIndex(data_dir, seconds, seed):
+    index = PollIndex(data_dir)
+    start = time.time()
+    index.reload()
+    load_seconds = time.time() - start
+
+    rand = random.Random(seed)
+    queries = [queryMix(rand) for _ in range(1000)]
+    latencies = []
+    deadline = time.time() + seconds
+    while time.time() < deadline:
+        for query in queries:
+            start = time.time()
+            index.query(**query)
+            latencies.append(time.time() - start)
+    return len(index), load_seconds, latencies
+
+
+def client(host, port, queries, deadline, latencies, errors):
+    connection = HTTPConnection(host, port)
+    while time.time() < deadline:
+        for query in queries:
+            start = time.time()
+            try:
+                connection.request('GET', query)
+                response = connection.getresponse()
+                response.read()
+                if response.status != 200:
+                    errors.append(response.status)
+            except (socket.error, IOError) as error:
+                errors.append(str(error))
+                connection.close()
+                connection = HTTPConnection(host, port)
+                continue
+            latencies.append(time.time() - start)
+            if time.time() >= deadline:
+                break
+    connection.close()
+
+
+def benchHttp(url, clients, seconds, seed):
+    parsed = urlparse(url)
+    latencies = []
+    errors = []
+    threads = []
+    deadline = time.time() + seconds
+    for n in range(clients):
+        rand = random.Random(seed + n)
+        queries = [queryString(queryMix(rand)) for _ in range(200)]
+        thread = threading.Thread(target=client, args=(parsed.hostname, parsed.port, queries, deadline,
+                                                       latencies, errors))
+        thread.start()
+        threads.append(thread)
+    for thread in threads:
+        thread.join()
+    return latencies, errors
+
+
+def startServer(tmpdir, data_dir):
+    """Start `scrapy pollserver` on a free port, and return (process, url)."""
+    project_dir = os.path.join(tmpdir, 'project')
+    os.makedirs(project_dir)
+    cfg_file = open(os.path.join(project_dir, 'scrapy.cfg'), 'w')
+    cfg_file.write("[settings]\ndefault = polldata.settings\n")
+    cfg_file.close()
+
+    probe = socket.socket()
+    probe.bind(('127.0.0.1', 0))
+    port = probe.getsockname()[1]
+    probe.close()
+
+    env = dict(os.environ,
+               PYTHONPATH=os.pathsep.join([REPO_DIR] + [p for p in [os.environ.get('PYTHONPATH')] if p]))
+    process = subprocess.Popen([sys.executable, '-c', 'from scrapy.cmdline import execute; execute()',
+                                'pollserver', '--port', str(port), '--data-dir', data_dir],
+                               cwd=project_dir, env=env, stdout=subprocess.PIPE, stderr=open(os.devnull, 'w'))
+    for line in iter(process.stdout.readline, b''):
+        if line.startswith(b'Serving'):
+            break
+    else:
+        raise RuntimeError("scrapy pollserver exited with status %s" % process.wait())
+    return process, 'http://127.0.0.1:%d' % port
+
+
+def report(name, latencies, seconds):
+    print("%-8s %10d %12.0f %12.3f %12.3f" % (name, len(latencies), len(latencies) / seconds,
+                                             1000 * percentile(latencies, 0.5), 1000 * percentile(latencies, 0.99)))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test the poll query service.")
+    parser.add_argument('--polls', type=int, default=100000, help="synthetic polls (default: %(default)s)")
+    parser.add_argument('--clients', type=int, default=4, help="http client threads (default: %(default)s)")
+    parser.add_argument('--seconds', type=float, default=10, help="seconds per test (default: %(default)s)")
+    parser.add_argument('--url', help="test this running server instead of starting one")
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    tmpdir = tempfile.mkdtemp(prefix='queryload-bench-')
+    process = None
+    try:
+        data_dir = os.path.join(tmpdir, 'data')
+        os.makedirs(data_dir)
+        if not args.url:
+            writePolls(data_dir, args.polls, args.seed)
+            polls, load_seconds, index_latencies = benchIndex(data_dir, args.seconds, args.seed)
+            process, url = startServer(tmpdir, data_dir)
+        else:
+            url = args.url
+        http_latencies, errors = benchHttp(url, args.clients, args.seconds, args.seed)
+    finally:
+        if process is not None:
+            process.terminate()
+            process.wait()
+        shutil.rmtree(tmpdir)
+
+    if not args.url:
+        print("%d polls in %d races, indexed in %.2f seconds" % (polls, len(RACES), load_seconds))
+    print("%-8s %10s %12s %12s %12s" % ('test', 'queries', 'queries/s', 'p50 (ms)', 'p99 (ms)'))
+    if not args.url:
+        report('index', index_latencies, args.seconds)
+    report('http', http_latencies, args.seconds)
+    if errors:
+        print("%d requests failed, eg. %s" % (len(errors), errors[0]))
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
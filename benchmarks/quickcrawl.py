@@ -0,0 +1,164 @@
+"""
+Compare `scrapy crawl` with `scrapy quickcrawl` (see
+polldata.commands.quickcrawl) on a local copy of the site.
+
+A synthetic site (see benchmarks/synthetic.py) is served by RCPServer, with
+--latency milliseconds added to every response, and each command crawls it
+--runs times through the server as a proxy, from a scratch project directory.
+Conditional requests, recrawl scheduling, the archive and the seen store are
+disabled, so every run downloads and exports every page.  For each command
+the benchmark reports the median of:
+
+    process     seconds from starting the command to its exit
+    crawl       seconds from the spider opening to it closing (from
+                StageTiming's metrics.json)
+
+and checks that both commands exported as many polls.  The polls themselves
+can differ by a few rows: CsvExportPipeline's poll hash leaves out the state
+and sample size, so when two pages list the same poll the page that is
+crawled first exports it, and the two commands crawl in a different order.
+
+Usage:
+    python -m benchmarks.quickcrawl [--options 200] [--polls 50] [--runs 3] [--latency 20]
+"""
+
+from __future__ import print_function
+
+import argparse
+import datetime
+import glob
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+from benchmarks import synthetic
+from benchmarks.rcpserver import RCPServer
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+COMMANDS = ['crawl', 'quickcrawl']
+
+
+def parseTime(text):
+    return datetime.datetime.strptime(text.split('.')[0], '%Y-%m-%dT%H:%M:%S') + \
+        datetime.timedelta(microseconds=int(text.split('.')[1]) if '.' in text else 0)
+
+
+def median(values):
+    values = sorted(values)
+    return values[len(values) // 2]
+
+
+def runCrawl(project_dir, command, spider, proxy, settings):
+    """Run a command in a fresh data/ directory.
+
+    Returns:
+        (process seconds, crawl seconds, the sorted lines of _latest.csv)
+    """
+    for dirname in ('data', 'logs'):
+        shutil.rmtree(os.path.join(project_dir, dirname), ignore_errors=True)
+        os.makedirs(os.path.join(project_dir, dirname))
+
+    args = [sys.executable, '-c', 'from scrapy.cmdline import execute; execute()', command, spider,
+            '-s', 'LOG_FILE=logs/run.txt']
+    for name, value in sorted(settings.items()):
+        args.extend(['-s', '%s=%s' % (name, value)])
+    env = dict(os.environ, http_proxy=proxy,
+               PYTHONPATH=os.pathsep.join([REPO_DIR] + [p for p in [os.environ.get('PYTHONPATH')] if p]))
+
+    devnull = open(os.devnull, 'w')
+    start = time.time()
+    subprocess.check_call(args, cwd=project_dir, env=env, stdout=devnull, stderr=devnull)
+    process_seconds = time.time() - start
+    devnull.close()
+
+    metrics_file = open(glob.glob(os.path.join(project_dir, 'logs', '*metrics.json'))[0])
+    metrics = json.load(metrics_file)
+    metrics_file.close()
+    crawl_seconds = (parseTime(metrics['finished']) - parseTime(metrics['started'])).total_seconds()
+
+    latest_file = open(os.path.join(project_dir, 'data', spider + '_latest.csv'))
+    polls = sorted(latest_file)
+    latest_file.close()
+    return process_seconds, crawl_seconds, polls
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare scrapy crawl and scrapy quickcrawl on a local server.")
+    parser.add_argument('--spider', default='pres2012')
+    parser.add_argument('--options', type=int, default=200, help="state pages in the widget (default: %(default)s)")
+    parser.add_argument('--polls', type=int, default=50, help="polls per state page (default: %(default)s)")
+    parser.add_argument('--runs', type=int, default=3, help="crawls per command (default: %(default)s)")
+    parser.add_argument('--latency', type=float, default=20,
+                        help="milliseconds added to every response (default: %(default)s)")
+    parser.add_argument('--concurrency', type=int, default=8,
+                        help="CONCURRENT_REQUESTS_PER_DOMAIN (default: %(default)s)")
+    parser.add_argument('--output', help="write the results as json to this file")
+    args = parser.parse_args()
+
+    tmpdir = tempfile.mkdtemp(prefix='quickcrawl-bench-')
+    try:
+        site_dir = os.path.join(tmpdir, 'site')
+        pages = synthetic.writeSite(site_dir, args.polls, args.options)
+        project_dir = os.path.join(tmpdir, 'project')
+        os.makedirs(project_dir)
+        cfg_file = open(os.path.join(project_dir, 'scrapy.cfg'), 'w')
+        cfg_file.write("[settings]\ndefault = polldata.settings\n")
+        cfg_file.close()
+
+        server = RCPServer(site_dir, latency=args.latency / 1000.0)
+        server.start()
+        settings = {
+            'CONDITIONAL_RECRAWL_ENABLED': 0,
+            'RECRAWL_SCHEDULE_ENABLED': 0,
+            'ARCHIVE_ENABLED': 0,
+            'SEEN_STORE': 'polldata.utils.seenStore.SeenStore',
+            'CONCURRENT_REQUESTS_PER_DOMAIN': args.concurrency,
+        }
+
+        results = {}
+        polls = {}
+        for command in COMMANDS:
+            runs = [runCrawl(project_dir, command, args.spider, server.base_url, settings)
+                    for _ in range(args.runs)]
+            results[command] = {
+                'process_seconds': median([run[0] for run in runs]),
+                'crawl_seconds': median([run[1] for run in runs]),
+                'polls': len(runs[-1][2]) - 1,
+            }
+            polls[command] = runs[-1][2]
+        server.shutdown()
+    finally:
+        shutil.rmtree(tmpdir)
+
+    print("%d pages, %d polls per page, %.0fms latency, %d concurrent requests, median of %d runs" % (
+        pages, args.polls, args.latency, args.concurrency, args.runs))
+    print("%-12s %12s %12s %10s" % ('command', 'process (s)', 'crawl (s)', 'polls'))
+    for command in COMMANDS:
+        result = results[command]
+        print("%-12s %12.2f %12.2f %10d" % (command, result['process_seconds'], result['crawl_seconds'],
+                                            result['polls']))
+    speedup = results['crawl']['crawl_seconds'] / results['quickcrawl']['crawl_seconds']
+    print("quickcrawl crawls %.2fx as fast" % speedup)
+    same = len(polls['crawl']) == len(polls['quickcrawl'])
+    differing = len(set(polls['crawl']) ^ set(polls['quickcrawl']))
+    if not same:
+        print("The two commands exported different numbers of polls!")
+    elif differing:
+        print("%d rows differ, from polls listed on several pages" % differing)
+
+    if args.output:
+        output_file = open(args.output, 'w')
+        json.dump({'results': results, 'speedup': speedup, 'same_count': same, 'differing_rows': differing,
+                   'pages': pages, 'latency_ms': args.latency, 'concurrency': args.concurrency},
+                  output_file, indent=1)
+        output_file.close()
+    if not same:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
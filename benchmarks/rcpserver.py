@@ -0,0 +1,217 @@
+"""
+A local HTTP server that stands in for realclearpolitics.com.
+
+It serves the files in a directory, with the URL path mapped to the file path
+(eg. '/epolls/2012/widget/search_by_race.js').  Every response carries an ETag
+(the md5 of the file) and a Last-Modified header (the file's mtime), and
+conditional requests that match them are answered with '304 Not Modified', so
+it can be used to check polldata.middlewares.ConditionalRequestMiddleware.
+
+It also answers proxy requests, so a spider can crawl the local copy without
+changing its urls:
+
+    http_proxy=http://127.0.0.1:8000 scrapy crawl pres2012
+
+--latency delays every response, to stand in for a distant server.
+--capacity limits how many requests are served at once, each taking
+--latency: the others queue, so the latency grows with the load, and once
+--queue requests are waiting the rest are answered with '503 Service
+Unavailable' and a Retry-After header, like an overloaded site (see
+polldata.extensions.AdaptiveConcurrency).
+
+Usage:
+    python -m benchmarks.rcpserver <directory> [--port 8000] [--latency MS]
+                                   [--capacity N] [--queue N]
+"""
+
+from __future__ import print_function
+
+import argparse
+import email.utils
+import hashlib
+import os
+import posixpath
+import threading
+import time
+
+try:
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+    from SocketServer import ThreadingMixIn
+    from urllib import unquote
+except ImportError:
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+    from socketserver import ThreadingMixIn
+    from urllib.parse import unquote
+
+
+class RCPRequestHandler(BaseHTTPRequestHandler):
+
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        self.server.count('requests')
+        if self.server.workers is None:
+            self._serve()
+            return
+
+        if not self.server.enqueue():
+            self.server.count('rejected')
+            self._send(503, b'Service Unavailable', {'Retry-After': '1'})
+            return
+        try:
+            with self.server.workers:
+                self._serve()
+        finally:
+            self.server.done()
+
+    def _serve(self):
+        if self.server.latency:
+            time.sleep(self.server.latency)
+
+        fName = self._translatePath(self.path)
+        if fName is None or not os.path.isfile(fName):
+            self._send(404, b'Not Found')
+            return
+
+        body_file = open(fName, 'rb')
+        body = body_file.read()
+        body_file.close()
+
+        etag = '"' + hashlib.md5(body).hexdigest() + '"'
+        mtime = int(os.path.getmtime(fName))
+        last_modified = email.utils.formatdate(mtime, usegmt=True)
+
+        if self._notModified(etag, mtime):
+            self.server.count('not_modified')
+            self._send(304, b'', {'ETag': etag, 'Last-Modified': last_modified})
+            return
+
+        self.server.count('bytes', len(body))
+        self._send(200, body, {'ETag': etag, 'Last-Modified': last_modified})
+
+    def _notModified(self, etag, mtime):
+        if_none_match = self.headers.get('If-None-Match')
+        if if_none_match is not None:
+            return etag in [tag.strip() for tag in if_none_match.split(',')]
+
+        if_modified_since = self.headers.get('If-Modified-Since')
+        if if_modified_since is not None:
+            since = email.utils.parsedate_tz(if_modified_since)
+            return since is not None and mtime <= email.utils.mktime_tz(since)
+
+        return False
+
+    def _send(self, status, body, headers=None):
+        self.send_response(status)
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        if status != 304:
+            self.send_header('Content-Type', self._contentType())
+            self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        if body:
+            self.wfile.write(body)
+
+    def _contentType(self):
+        if self.path.endswith('.js'):
+            return 'application/javascript'
+        if self.path.endswith('.txt'):
+            return 'text/plain'
+        return 'text/html; charset=utf-8'
+
+    def _translatePath(self, path):
+        # proxy requests carry the absolute url: 'GET http://host/path'
+        if '://' in path:
+            path = '/' + path.split('://', 1)[1].partition('/')[2]
+        path = posixpath.normpath(unquote(path.split('?', 1)[0]))
+        parts = [part for part in path.split('/') if part and part not in ('.', '..')]
+        return os.path.join(self.server.root, *parts) if parts else None
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            BaseHTTPRequestHandler.log_message(self, format, *args)
+
+
+class RCPServer(ThreadingMixIn, HTTPServer):
+    """Serve a directory of pages, counting requests, 304s and bytes sent.
+
+    Args:
+        root
+            The directory to serve.
+        port
+            The port to listen on; 0 picks a free one (see server_port).
+        latency
+            Seconds every response is delayed by.
+        capacity
+            Requests served at once, or 0 for no limit.
+        queue
+            Requests that may wait for one of the capacity slots before the
+            next ones are rejected with a 503 (default: capacity).
+    """
+
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, root, port=0, verbose=False, latency=0, capacity=0, queue=None):
+        HTTPServer.__init__(self, ('127.0.0.1', port), RCPRequestHandler)
+        self.root = root
+        self.latency = latency
+        self.verbose = verbose
+        self.counts = {'requests': 0, 'not_modified': 0, 'bytes': 0, 'rejected': 0, 'max_in_flight': 0}
+        self.counts_lock = threading.Lock()
+        self.workers = threading.Semaphore(capacity) if capacity else None
+        self.capacity = capacity
+        self.queue = capacity if queue is None else queue
+        self.in_flight = 0
+
+    @property
+    def base_url(self):
+        return 'http://127.0.0.1:%d' % self.server_port
+
+    def count(self, name, value=1):
+        with self.counts_lock:
+            self.counts[name] += value
+
+    def enqueue(self):
+        """Count a request in, unless the queue is full."""
+        with self.counts_lock:
+            if self.in_flight >= self.capacity + self.queue:
+                return False
+            self.in_flight += 1
+            self.counts['max_in_flight'] = max(self.counts['max_in_flight'], self.in_flight)
+            return True
+
+    def done(self):
+        with self.counts_lock:
+            self.in_flight -= 1
+
+    def start(self):
+        """Serve from a background thread, eg. while a benchmark runs."""
+        thread = threading.Thread(target=self.serve_forever)
+        thread.daemon = True
+        thread.start()
+        return thread
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve a directory of RCP pages locally.")
+    parser.add_argument('root', help="the directory to serve")
+    parser.add_argument('--port', type=int, default=8000)
+    parser.add_argument('--latency', type=float, default=0, help="milliseconds added to every response")
+    parser.add_argument('--capacity', type=int, default=0, help="requests served at once (default: no limit)")
+    parser.add_argument('--queue', type=int, help="requests waiting before 503s (default: --capacity)")
+    args = parser.parse_args()
+
+    server = RCPServer(args.root, args.port, verbose=True, latency=args.latency / 1000.0,
+                       capacity=args.capacity, queue=args.queue)
+    print("Serving %s at %s" % (args.root, server.base_url))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    print("Served %(requests)d requests (%(not_modified)d not modified, %(rejected)d rejected, %(bytes)d bytes)"
+          % server.counts)
+
+
+if __name__ == '__main__':
+    main()
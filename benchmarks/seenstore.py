@@ -0,0 +1,123 @@
+"""
+Benchmark the poll seen stores in polldata.utils.seenStore.
+
+For each size, a log of that many random fingerprints is written to a
+temporary directory, then the benchmark measures:
+    load        seconds to open the store (replaying the log)
+    lookups     membership tests per second, half hits and half misses
+    adds        new fingerprints added per second
+    shared      new fingerprints added per second by a SharedSeenStore, which
+                locks and checks the log for other processes' records first
+
+The legacy list lookup (the original _dict.json behaviour) is measured as well
+for sizes where it finishes in reasonable time.
+
+Usage:
+    python -m benchmarks.seenstore [--sizes 10000,1000000,10000000] [--lookups 200000]
+"""
+
+from __future__ import print_function
+
+import argparse
+import hashlib
+import os
+import random
+import shutil
+import tempfile
+import time
+
+from polldata.utils.seenStore import LogSeenStore, SharedSeenStore
+
+LEGACY_MAX_SIZE = 100000
+SHARED_MAX_ADDS = 20000
+
+
+def fingerprints(count, seed):
+    rand = random.Random(seed)
+    for _ in range(count):
+        yield hashlib.md5(str(rand.random()).encode('ascii')).hexdigest()
+
+
+def writeLog(fName, count):
+    log_file = open(fName, 'w')
+    for fingerprint in fingerprints(count, 0):
+        log_file.write('+' + fingerprint + '\n')
+    log_file.close()
+
+
+def benchSize(tmpdir, size, lookups):
+    basename = os.path.join(tmpdir, 'bench%d' % size)
+    writeLog(basename + '_seen.log', size)
+
+    start = time.time()
+    store = LogSeenStore(basename)
+    load = time.time() - start
+
+    hits = list(fingerprints(min(size, lookups // 2), 0))
+    misses = list(fingerprints(lookups // 2, 1))
+    probes = hits + misses
+    random.shuffle(probes)
+
+    start = time.time()
+    for fingerprint in probes:
+        fingerprint in store
+    lookup_rate = len(probes) / (time.time() - start)
+
+    start = time.time()
+    for fingerprint in misses:
+        store.add(fingerprint)
+    add_rate = len(misses) / (time.time() - start)
+    store.close()
+
+    store = SharedSeenStore(basename)
+    shared = list(fingerprints(min(lookups // 2, SHARED_MAX_ADDS), 2))
+    start = time.time()
+    for fingerprint in shared:
+        store.add(fingerprint)
+    shared_rate = len(shared) / (time.time() - start)
+    store.close()
+
+    result = {
+        'size': size,
+        'load_seconds': load,
+        'lookups_per_second': lookup_rate,
+        'adds_per_second': add_rate,
+        'shared_adds_per_second': shared_rate,
+    }
+
+    if size <= LEGACY_MAX_SIZE:
+        legacy = [fingerprint for fingerprint in fingerprints(size, 0)]
+        sample = probes[:1000]
+        start = time.time()
+        for fingerprint in sample:
+            fingerprint in legacy
+        result['legacy_lookups_per_second'] = len(sample) / (time.time() - start)
+
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the poll seen stores.")
+    parser.add_argument('--sizes', default='10000,1000000,10000000',
+                        help="comma separated store sizes (default: %(default)s)")
+    parser.add_argument('--lookups', type=int, default=200000,
+                        help="membership tests per size (default: %(default)s)")
+    args = parser.parse_args()
+
+    tmpdir = tempfile.mkdtemp(prefix='seenstore-bench-')
+    try:
+        print("%10s %10s %14s %14s %14s %14s" % ('size', 'load (s)', 'lookups/s', 'adds/s', 'shared adds/s',
+                                                 'legacy/s'))
+        for size in [int(s) for s in args.sizes.split(',')]:
+            result = benchSize(tmpdir, size, args.lookups)
+            print("%10d %10.3f %14.0f %14.0f %14.0f %14s" % (
+                result['size'], result['load_seconds'], result['lookups_per_second'],
+                result['adds_per_second'], result['shared_adds_per_second'],
+                '%.0f' % result['legacy_lookups_per_second'] if 'legacy_lookups_per_second' in result else '-',
+            ))
+    finally:
+        shutil.rmtree(tmpdir)
+
+
+if __name__ == '__main__':
+    main()
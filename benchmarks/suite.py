@@ -0,0 +1,571 @@
+"""
+Benchmark the spiders' parsing, link extraction and export on synthetic pages.
+
+Each benchmark runs in its own process, so its peak memory can be measured
+without the other benchmarks' allocations.  For each one the suite reports:
+    seconds             time spent in the measured code
+    pages_per_second    pages (or widgets) processed per second
+    rows_per_second     links, polls or items produced per second
+    peak_memory_kb      growth of the process's peak resident memory
+
+The results are written as json, so runs of different versions can be
+compared; --compare prints the change against an earlier result file and
+exits with status 1 if any rate dropped by more than --threshold.
+
+Usage:
+    python -m benchmarks.suite [--output results.json] [--compare baseline.json]
+                               [--only name,...] [--states 50] [--polls 100] ...
+"""
+
+from __future__ import print_function
+
+import argparse
+import gc
+import json
+import multiprocessing
+import os
+import platform
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from collections import OrderedDict
+
+from benchmarks import synthetic
+
+BENCHMARKS = OrderedDict()
+
+RATES = ('pages_per_second', 'rows_per_second')
+
+
+def benchmark(name):
+    """Register a benchmark function.
+
+    The function is called with the parsed command line arguments and returns
+    a dict with 'seconds', 'pages' and 'rows'; extra keys are reported as is.
+    """
+    def register(func):
+        BENCHMARKS[name] = func
+        return func
+    return register
+
+
+def stateResponses(params):
+    from scrapy.http import HtmlResponse
+    return [HtmlResponse(url, body=body, encoding='utf-8')
+            for url, body in synthetic.statePages(params.states, params.polls, params.seed)]
+
+
+@benchmark('link_extractor')
+def benchLinkExtractor(params):
+    from scrapy.http import TextResponse
+    from polldata.spiders.pres import PresSpider
+
+    response = TextResponse(synthetic.WIDGET_URL, body=synthetic.widgetBody(params.options, params.seed),
+                            encoding='utf-8')
+    extractor = PresSpider().rules[0].link_extractor
+
+    links = 0
+    start = time.time()
+    for _ in range(params.repeat):
+        links += len(extractor._extract_links(response.body, response.url, response.encoding))
+    seconds = time.time() - start
+
+    return {'seconds': seconds, 'pages': params.repeat, 'rows': links, 'widget_bytes': len(response.body)}
+
+
+# The link extractor's original pattern, kept as the baseline for the
+# tokenizer in polldata.linkextractors.rcp_regex (see tests/test_rcp_regex.py).
+REGEX_LINKRE = r"\\x3Coption\s.*?value=(\"[.#]+?\"|\'[.#]+?\'|[^\s]+?)(\\x3E|\s.*?\\x3E)(.*?)\\x3C[/ ]?option\\x3E"
+
+
+def regexLinks(body):
+    """The raw (value, text) of each option, found with the original regex."""
+    import re
+    linkre = re.compile(REGEX_LINKRE, re.DOTALL | re.IGNORECASE)
+    return [(url, text) for url, _, text in linkre.findall(body)]
+
+
+def largeWidget(params):
+    """A widget of about params.widget_mb megabytes."""
+    body = synthetic.widgetBody(params.options, params.seed)
+    options = int(params.options * params.widget_mb * 1024 * 1024 / len(body)) + 1
+    return synthetic.widgetBody(options, params.seed)
+
+
+@benchmark('widget_tokenizer')
+def benchWidgetTokenizer(params):
+    from polldata.linkextractors.rcp_regex import iterOptions
+
+    body = largeWidget(params)
+
+    options = 0
+    first_option_seconds = float('inf')
+    start = time.time()
+    for _ in range(params.repeat):
+        begin = time.time()
+        tokens = iterOptions(body)
+        next(tokens)
+        first_option_seconds = min(first_option_seconds, time.time() - begin)
+        options += 1 + sum(1 for _ in tokens)
+    seconds = time.time() - start
+
+    # html lets options go unclosed; the regex backtracks for minutes on a few
+    # dozen of them, so only the tokenizer is timed on this
+    unclosed = body.replace(b'\\x3C/option\\x3E', b'')
+    begin = time.time()
+    unclosed_options = sum(1 for _ in iterOptions(unclosed))
+    unclosed_seconds = time.time() - begin
+
+    return {'seconds': seconds, 'pages': params.repeat, 'rows': options, 'widget_bytes': len(body),
+            'first_option_seconds': first_option_seconds,
+            'unclosed_options_per_second': unclosed_options / unclosed_seconds}
+
+
+@benchmark('widget_regex')
+def benchWidgetRegex(params):
+    body = largeWidget(params)
+
+    options = 0
+    start = time.time()
+    for _ in range(params.repeat):
+        options += len(regexLinks(body))
+    seconds = time.time() - start
+
+    return {'seconds': seconds, 'pages': params.repeat, 'rows': options, 'widget_bytes': len(body)}
+
+
+@benchmark('parse_state_polls')
+def benchParseStatePolls(params):
+    from polldata.spiders.pres import PresSpider
+
+    responses = stateResponses(params)
+    spider = PresSpider()
+
+    rows = 0
+    start = time.time()
+    for _ in range(params.repeat):
+        for response in responses:
+            rows += len(spider.parseStatePolls(response))
+    seconds = time.time() - start
+
+    return {'seconds': seconds, 'pages': len(responses) * params.repeat, 'rows': rows}
+
+
+@benchmark('reparse_pool')
+def benchReparsePool(params):
+    """Re-parse saved state pages with reparsePages, on one core and on --processes."""
+    from polldata import races
+    from polldata.utils.reparse import directoryPages, reparsePages, routePages
+
+    root = tempfile.mkdtemp(prefix='reparse-')
+    try:
+        for url, body in synthetic.statePages(params.states * params.repeat, params.polls, params.seed):
+            fName = synthetic.urlPath(root, url)
+            if not os.path.isdir(os.path.dirname(fName)):
+                os.makedirs(os.path.dirname(fName))
+            page_file = open(fName, 'wb')
+            page_file.write(body.encode('utf-8') if not isinstance(body, bytes) else body)
+            page_file.close()
+
+        race_list = races.getRaces(names=['pres2012'])
+        timings = {}
+        for processes in sorted(set([1, params.processes])):
+            start = time.time()
+            rows = 0
+            pages = 0
+            for _, polls, error in reparsePages(routePages(directoryPages(root), race_list), processes):
+                if error is not None:
+                    raise ValueError(error)
+                pages += 1
+                rows += len(polls)
+            timings[processes] = time.time() - start
+    finally:
+        shutil.rmtree(root)
+
+    seconds = timings[params.processes]
+    speedup = timings[1] / seconds if seconds else float('nan')
+    return {'seconds': seconds, 'pages': pages, 'rows': rows, 'processes': params.processes,
+            'single_process_seconds': timings[1], 'speedup': speedup,
+            'efficiency': speedup / params.processes}
+
+
+def xpathParseStatePolls(spider, response):
+    """The original parseStatePolls, which runs an XPath selector per row.
+
+    It is kept as the baseline for the table extractor benchmark, and
+    normalizes its rows like parseStatePolls does so their items can be
+    compared (see tests/test_tableExtractor.py).
+    """
+    from scrapy.selector import HtmlXPathSelector
+    from polldata.items import PresPollItem
+    from polldata.utils.normalize import normalizeRows
+    from polldata.utils.statePage import legacyFields
+    from polldata.utils.tableExtractor import compilePlan
+
+    items = []
+    hxs = HtmlXPathSelector(response)
+
+    service, date, sample, dem, rep = compilePlan(
+        hxs.select('//*[@id="polling-data-full"]/table/tr[1]/th/text()').extract())
+
+    state = hxs.select('//*[@id="main-poll-title"]/text()').extract()[0].split(':')[0]
+    polls = hxs.select('//*[@id="polling-data-full"]/table/tr[not(@class) or @class="isInRcpAvg"]')
+
+    rows = []
+    for poll in polls:
+        polldata = poll.select('td/text() | td/a/text()')
+        rows.append([polldata[column].extract() for column in (service, date, sample, dem, rep)])
+
+    columns = normalizeRows(rows, spider.races[0]['year'])
+    for i in range(len(rows)):
+        item = PresPollItem()
+        item['race'] = spider.races[0]['name']
+        item['state'] = state
+        for field in ('service', 'start', 'end', 'voters', 'sample', 'dem', 'rep', 'spread'):
+            item[field] = columns[field][i]
+        item['ind'] = 0
+        item['legacy'] = legacyFields(rows[i][1], rows[i][2], spider.races[0]['year'])
+        items.append(item)
+
+    return items
+
+
+@benchmark('parse_state_polls_xpath')
+def benchParseStatePollsXPath(params):
+    from polldata.spiders.pres import PresSpider
+
+    responses = stateResponses(params)
+    spider = PresSpider()
+
+    rows = 0
+    start = time.time()
+    for _ in range(params.repeat):
+        for response in responses:
+            rows += len(xpathParseStatePolls(spider, response))
+    seconds = time.time() - start
+
+    return {'seconds': seconds, 'pages': len(responses) * params.repeat, 'rows': rows}
+
+
+def normalizeRows(params):
+    """Return params.rows raw poll rows, as params.states pages repeated.
+
+    The rows hold unicode strings, like PollTableExtractor's.
+    """
+    pages = []
+    for seed in range(params.states):
+        pages.append([tuple(type(u'')(row[column]) for column in (0, 1, 2, 4, 5))
+                      for row in synthetic.pollRows(params.polls, params.seed + seed)])
+
+    rows = []
+    page_starts = []
+    while len(rows) < params.rows:
+        page = pages[len(page_starts) % len(pages)][:params.rows - len(rows)]
+        page_starts.append(len(rows))
+        rows.extend(page)
+    return rows, page_starts
+
+
+@benchmark('normalize_polls')
+def benchNormalize(params):
+    from polldata.utils.normalize import normalizePolls
+
+    rows, page_starts = normalizeRows(params)
+
+    start = time.time()
+    columns = normalizePolls(rows, 2012, page_starts)
+    seconds = time.time() - start
+
+    return {'seconds': seconds, 'pages': len(page_starts), 'rows': len(columns['end']),
+            'unknown_end_dates': int((columns['end'] == u'').sum())}
+
+
+@benchmark('normalize_polls_per_row')
+def benchNormalizePerRow(params):
+    from polldata.utils.normalize import normalizeRows as normalizePage
+
+    rows, page_starts = normalizeRows(params)
+    pages = [rows[start:end] for start, end in zip(page_starts, page_starts[1:] + [len(rows)])]
+
+    normalized = 0
+    start = time.time()
+    for page in pages:
+        normalized += len(normalizePage(page, 2012)['end'])
+    seconds = time.time() - start
+
+    return {'seconds': seconds, 'pages': len(pages), 'rows': normalized}
+
+
+def statePageRows(params):
+    """The raw rows of params.states pages of params.polls polls, as a crawl sees them."""
+    from polldata.utils.tableExtractor import PollTableExtractor
+
+    extractor = PollTableExtractor()
+    return [extractor.extract(body, 'utf-8')[1]
+            for _, body in synthetic.statePages(params.states, params.polls, params.seed)]
+
+
+@benchmark('normalize_page')
+def benchNormalizePage(params):
+    """normalizeRows on one page at a time, as parseStatePage runs it during a crawl."""
+    from polldata.utils.normalize import normalizeRows as normalizePage
+
+    pages = statePageRows(params)
+    rows = 0
+    start = time.time()
+    for _ in range(params.repeat):
+        for page in pages:
+            rows += len(normalizePage(page, 2012)['end'])
+    seconds = time.time() - start
+
+    return {'seconds': seconds, 'pages': len(pages) * params.repeat, 'rows': rows}
+
+
+@benchmark('normalize_page_numpy')
+def benchNormalizePageNumPy(params):
+    """normalizePolls on one page at a time: the baseline for normalize_page."""
+    from polldata.utils.normalize import normalizePolls, normalizeRows as normalizePage
+
+    pages = statePageRows(params)
+    # both must find the same polls
+    for page in pages:
+        columns, expected = normalizePolls(page, 2012), normalizePage(page, 2012)
+        if [columns[field].tolist() for field in ('start', 'end', 'voters', 'sample')] != \
+                [expected[field] for field in ('start', 'end', 'voters', 'sample')]:
+            raise AssertionError("normalizeRows differs from normalizePolls")
+
+    rows = 0
+    start = time.time()
+    for _ in range(params.repeat):
+        for page in pages:
+            rows += len(normalizePolls(page, 2012)['end'])
+    seconds = time.time() - start
+
+    return {'seconds': seconds, 'pages': len(pages) * params.repeat, 'rows': rows}
+
+
+@benchmark('normalize_page_batch')
+def benchNormalizePageBatch(params):
+    """normalizePolls on batches of 50 pages, as the reparse command's workers run it."""
+    from polldata.utils.normalize import normalizePolls
+
+    pages = statePageRows(params)
+    batches = []
+    for n in range(0, len(pages), 50):
+        rows, page_starts = [], []
+        for page in pages[n:n + 50]:
+            page_starts.append(len(rows))
+            rows.extend(page)
+        batches.append((rows, page_starts))
+
+    rows = 0
+    start = time.time()
+    for _ in range(params.repeat):
+        for batch_rows, page_starts in batches:
+            rows += len(normalizePolls(batch_rows, 2012, page_starts)['end'])
+    seconds = time.time() - start
+
+    return {'seconds': seconds, 'pages': len(pages) * params.repeat, 'rows': rows}
+
+
+@benchmark('pipeline_process_item')
+def benchPipeline(params):
+    from scrapy.exceptions import DropItem
+    from scrapy.settings import Settings
+    from polldata.pipelines import CsvExportPipeline
+    from polldata.spiders.pres import PresSpider
+
+    spider = PresSpider()
+    items = []
+    for response in stateResponses(params):
+        items.extend(spider.parseStatePolls(response))
+
+    pipeline = CsvExportPipeline(Settings({}))
+
+    # the pipeline writes to data/ under the working directory
+    cwd = os.getcwd()
+    workdir = tempfile.mkdtemp(prefix='polldata-bench-')
+    os.mkdir(os.path.join(workdir, 'data'))
+    os.chdir(workdir)
+    try:
+        pipeline.spider_opened(spider)
+
+        dropped = 0
+        start = time.time()
+        for item in items:
+            try:
+                pipeline.process_item(item, spider)
+            except DropItem:
+                dropped += 1
+        seconds = time.time() - start
+
+        start = time.time()
+        pipeline.spider_closed(spider)
+        close_seconds = time.time() - start
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(workdir)
+
+    return {'seconds': seconds, 'pages': params.states, 'rows': len(items), 'dropped': dropped,
+            'close_seconds': close_seconds}
+
+
+@benchmark('sqlite_upsert')
+def benchSqliteUpsert(params):
+    from polldata.spiders.pres import PresSpider
+    from polldata.utils.pollDatabase import PollDatabase, pollRow
+
+    spider = PresSpider()
+    rows = []
+    for response in stateResponses(params):
+        rows.extend(pollRow(item) for item in spider.parseStatePolls(response))
+    # distinct races, so every pass inserts new polls
+    passes = [[dict(row, race='pres%d' % (2012 - 4 * n)) for row in rows] for n in range(params.repeat)]
+
+    workdir = tempfile.mkdtemp(prefix='polldata-bench-')
+    try:
+        database = PollDatabase(os.path.join(workdir, 'polls.db'))
+        inserted = 0
+        start = time.time()
+        for batch_rows in passes:
+            for i in range(0, len(batch_rows), 500):
+                inserted += database.upsert(batch_rows[i:i + 500])[0]
+        seconds = time.time() - start
+
+        # the same polls again: nothing is inserted or changed
+        start = time.time()
+        for i in range(0, len(passes[0]), 500):
+            database.upsert(passes[0][i:i + 500])
+        again_seconds = time.time() - start
+        database.close()
+    finally:
+        shutil.rmtree(workdir)
+
+    return {'seconds': seconds, 'pages': params.states * params.repeat, 'rows': inserted,
+            'unchanged_rows_per_second': len(passes[0]) / again_seconds}
+
+
+def peakMemoryKB():
+    # ru_maxrss is in kilobytes on linux and in bytes on mac os
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak // 1024 if sys.platform == 'darwin' else peak
+
+
+def runIsolated(name, params, queue):
+    try:
+        gc.collect()
+        baseline = peakMemoryKB()
+        result = BENCHMARKS[name](params)
+        result['peak_memory_kb'] = peakMemoryKB() - baseline
+        seconds = result['seconds'] or float('nan')
+        result['pages_per_second'] = result['pages'] / seconds
+        result['rows_per_second'] = result['rows'] / seconds
+        queue.put((name, result))
+    except Exception as e:
+        queue.put((name, {'error': '%s: %s' % (e.__class__.__name__, e)}))
+
+
+def runBenchmark(name, params):
+    queue = multiprocessing.Queue()
+    process = multiprocessing.Process(target=runIsolated, args=(name, params, queue))
+    process.start()
+    _, result = queue.get()
+    process.join()
+    return result
+
+
+def gitRevision():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'],
+                                       stderr=open(os.devnull, 'w')).decode('ascii').strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(results, baseline_fName, threshold):
+    """Print the change in each rate against a baseline result file.
+
+    Returns:
+        True if no rate dropped by more than threshold (a fraction).
+    """
+    baseline_file = open(baseline_fName, 'r')
+    baseline = json.load(baseline_file)
+    baseline_file.close()
+
+    ok = True
+    print("\nCompared with %s (revision %s):" % (baseline_fName, baseline.get('revision')))
+    for name, result in results['benchmarks'].items():
+        old = baseline['benchmarks'].get(name)
+        if old is None or 'error' in old or 'error' in result:
+            continue
+        for rate in RATES:
+            if not old.get(rate):
+                continue
+            change = result[rate] / old[rate] - 1
+            regressed = change < -threshold
+            ok = ok and not regressed
+            print("  %-28s %-18s %+7.1f%%%s" % (name, rate, change * 100, '  REGRESSION' if regressed else ''))
+    return ok
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark polldata on synthetic RCP pages.")
+    parser.add_argument('--only', help="comma separated benchmarks to run (default: all)")
+    parser.add_argument('--output', help="write the results to this json file")
+    parser.add_argument('--compare', help="a previous results file to compare against")
+    parser.add_argument('--threshold', type=float, default=0.1,
+                        help="the rate drop counted as a regression (default: %(default)s)")
+    parser.add_argument('--states', type=int, default=50, help="state pages to parse (default: %(default)s)")
+    parser.add_argument('--polls', type=int, default=100, help="polls per state page (default: %(default)s)")
+    parser.add_argument('--options', type=int, default=2000,
+                        help="options in the synthetic widget (default: %(default)s)")
+    parser.add_argument('--widget-mb', type=float, default=8,
+                        help="size of the widget for the tokenizer benchmarks (default: %(default)s)")
+    parser.add_argument('--rows', type=int, default=1000000,
+                        help="raw rows for the normalization benchmarks (default: %(default)s)")
+    parser.add_argument('--repeat', type=int, default=5, help="passes over the pages (default: %(default)s)")
+    parser.add_argument('--processes', type=int, default=multiprocessing.cpu_count(),
+                        help="worker processes for reparse_pool (default: one per core, %(default)s)")
+    parser.add_argument('--seed', type=int, default=0)
+    params = parser.parse_args()
+
+    names = params.only.split(',') if params.only else list(BENCHMARKS)
+    for name in names:
+        if name not in BENCHMARKS:
+            parser.error("unknown benchmark %r, choose from: %s" % (name, ', '.join(BENCHMARKS)))
+
+    results = {
+        'revision': gitRevision(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'time': time.time(),
+        'params': dict((key, value) for key, value in vars(params).items()
+                       if key not in ('only', 'output', 'compare', 'threshold')),
+        'benchmarks': OrderedDict(),
+    }
+
+    print("%-28s %10s %14s %14s %12s" % ('benchmark', 'seconds', 'pages/s', 'rows/s', 'peak KB'))
+    for name in names:
+        result = runBenchmark(name, params)
+        results['benchmarks'][name] = result
+        if 'error' in result:
+            print("%-28s %s" % (name, result['error']))
+        else:
+            print("%-28s %10.3f %14.1f %14.1f %12d" % (
+                name, result['seconds'], result['pages_per_second'], result['rows_per_second'],
+                result['peak_memory_kb']))
+
+    if params.output:
+        output_file = open(params.output, 'w')
+        json.dump(results, output_file, indent=2)
+        output_file.close()
+
+    if params.compare and not compare(results, params.compare, params.threshold):
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
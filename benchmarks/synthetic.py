@@ -0,0 +1,214 @@
+"""
+Generate synthetic RealClearPolitics pages for the benchmarks.
+
+The pages copy the structure the spiders depend on:
+    widgetBody()
+        The escaped javascript widget (search_by_race.js) that writes the
+        race select box: a stream of '\\x3Coption value=...\\x3E' tags.
+    statePage()
+        A state's poll page: a '#main-poll-title' heading and a
+        '#polling-data-full' table whose first row holds the column headers,
+        followed by an RCP average row and one row per poll, newest first.
+
+Everything is generated from a seed, so the same arguments always produce the
+same pages.  Run as a script to write a synthetic site to a directory, laid out
+by url path so benchmarks.rcpserver can serve it:
+
+    python -m benchmarks.synthetic <directory> [--polls 50] [--options 200]
+"""
+
+import argparse
+import datetime
+import os
+import random
+
+BASE_URL = 'http://www.realclearpolitics.com'
+WIDGET_URL = BASE_URL + '/epolls/2012/widget/search_by_race.js'
+
+STATES = [
+    ('al', 'Alabama'), ('ak', 'Alaska'), ('az', 'Arizona'), ('ar', 'Arkansas'),
+    ('ca', 'California'), ('co', 'Colorado'), ('ct', 'Connecticut'), ('de', 'Delaware'),
+    ('fl', 'Florida'), ('ga', 'Georgia'), ('hi', 'Hawaii'), ('id', 'Idaho'),
+    ('il', 'Illinois'), ('in', 'Indiana'), ('ia', 'Iowa'), ('ks', 'Kansas'),
+    ('ky', 'Kentucky'), ('la', 'Louisiana'), ('me', 'Maine'), ('md', 'Maryland'),
+    ('ma', 'Massachusetts'), ('mi', 'Michigan'), ('mn', 'Minnesota'), ('ms', 'Mississippi'),
+    ('mo', 'Missouri'), ('mt', 'Montana'), ('ne', 'Nebraska'), ('nv', 'Nevada'),
+    ('nh', 'New Hampshire'), ('nj', 'New Jersey'), ('nm', 'New Mexico'), ('ny', 'New York'),
+    ('nc', 'North Carolina'), ('nd', 'North Dakota'), ('oh', 'Ohio'), ('ok', 'Oklahoma'),
+    ('or', 'Oregon'), ('pa', 'Pennsylvania'), ('ri', 'Rhode Island'), ('sc', 'South Carolina'),
+    ('sd', 'South Dakota'), ('tn', 'Tennessee'), ('tx', 'Texas'), ('ut', 'Utah'),
+    ('vt', 'Vermont'), ('va', 'Virginia'), ('wa', 'Washington'), ('wv', 'West Virginia'),
+    ('wi', 'Wisconsin'), ('wy', 'Wyoming'),
+]
+
+SERVICES = [
+    'Rasmussen Reports', 'PPP (D)', 'SurveyUSA', 'Quinnipiac', 'CNN/Opinion Research',
+    'Gravis Marketing', 'Mason-Dixon', 'NBC/WSJ/Marist', 'FOX News', 'Purple Strategies',
+    'We Ask America', 'Suffolk', 'ARG', 'Ipsos/Reuters', 'Survey USA', 'Pulse Opinion Research',
+]
+
+HEADERS = ['Poll', 'Date', 'Sample', 'MoE', 'Obama (D)', 'Romney (R)', 'Spread']
+
+
+def slug(name):
+    return name.lower().replace(' ', '_')
+
+
+def presUrl(abbrev, name, page_id):
+    return '%s/epolls/2012/president/%s/%s_romney_vs_obama-%04d.html' % (BASE_URL, abbrev, slug(name), page_id)
+
+
+def senateUrl(abbrev, name, page_id):
+    return '%s/epolls/2012/senate/%s/%s_senate_race-%04d.html' % (BASE_URL, abbrev, slug(name), page_id)
+
+
+def widgetOptions(options, seed=0):
+    """Return (url, text) for each option in a synthetic widget.
+
+    The first options link to one presidential page per state (so they match
+    PresSpider's rule); the rest link to senate, governor and house pages,
+    like the real widget, which lists every race.
+    """
+    rand = random.Random(seed)
+    links = []
+    for i in range(options):
+        abbrev, name = STATES[i % len(STATES)]
+        page_id = 1000 + i
+        if i < len(STATES):
+            links.append((presUrl(abbrev, name, page_id), '%s: Romney vs. Obama' % name))
+        else:
+            race = rand.choice(['senate', 'governor', 'house'])
+            if race == 'senate':
+                links.append((senateUrl(abbrev, name, page_id), '%s Senate' % name))
+            else:
+                url = '%s/epolls/2012/%s/%s/%s_%s_race-%04d.html' % (BASE_URL, race, abbrev, slug(name), race, page_id)
+                links.append((url, '%s %s' % (name, race.title())))
+    return links
+
+
+def widgetBody(options=200, seed=0):
+    """Return the body of a synthetic search_by_race.js widget.
+
+    Args:
+        options
+            The number of '\\x3Coption' tags in the select box.
+    """
+    parts = ["document.write('\\x3Cselect id=\"race-select\" onchange=\"goToRace(this)\"\\x3E');\n"]
+    parts.append("document.write('\\x3Coption value=\"\"\\x3ESelect a race\\x3C/option\\x3E');\n")
+    for url, text in widgetOptions(options, seed):
+        parts.append("document.write('\\x3Coption value=\"%s\"\\x3E%s\\x3C/option\\x3E');\n" % (url, text))
+    parts.append("document.write('\\x3C/select\\x3E');\n")
+    return ''.join(parts).encode('utf-8')
+
+
+def pollRows(polls, seed=0, end=datetime.date(2012, 11, 5)):
+    """Return the cell values for a state page's polls, newest first.
+
+    Each row is [service, dates, sample, moe, dem, rep, spread].  The dates
+    step backwards from end and cross into earlier years on long pages, like
+    the real tables.
+    """
+    rand = random.Random(seed)
+    rows = []
+    for _ in range(polls):
+        end = end - datetime.timedelta(days=rand.randint(0, 6))
+        start = end - datetime.timedelta(days=rand.randint(0, 4))
+        if start == end:
+            dates = '%d/%d' % (end.month, end.day)
+        else:
+            dates = '%d/%d - %d/%d' % (start.month, start.day, end.month, end.day)
+
+        kind = rand.random()
+        size = rand.randint(400, 2000)
+        if kind < 0.8:
+            sample = '%d %s' % (size, rand.choice(['LV', 'RV', 'A']))
+        elif kind < 0.9:
+            sample = rand.choice(['LV', 'RV'])
+        else:
+            sample = str(size)
+
+        dem = rand.randint(38, 56)
+        rep = rand.randint(38, 56)
+        if dem == rep:
+            spread = 'Tie'
+        elif dem > rep:
+            spread = 'Obama +%d' % (dem - rep)
+        else:
+            spread = 'Romney +%d' % (rep - dem)
+
+        rows.append([rand.choice(SERVICES), dates, sample, '%.1f' % rand.uniform(2, 5), str(dem), str(rep), spread])
+    return rows
+
+
+def statePage(name, polls=50, seed=0):
+    """Return the html of a synthetic state poll page.
+
+    Args:
+        name
+            The state's name, used in the page title.
+        polls
+            The number of poll rows in the polling data table.
+    """
+    parts = [
+        '<!DOCTYPE html>\n<html><head><title>%s: Romney vs. Obama</title></head><body>\n' % name,
+        '<div id="container"><h2 id="main-poll-title">%s: Romney vs. Obama</h2>\n' % name,
+        '<div id="polling-data-full"><table class="data">\n',
+        '<tr class="header">' + ''.join('<th>%s</th>' % header for header in HEADERS) + '</tr>\n',
+        '<tr class="rcpAvg"><td>RCP Average</td><td>10/1 - 11/5</td><td>--</td><td>--</td>'
+        '<td>48.0</td><td>47.0</td><td class="spread">Obama +1.0</td></tr>\n',
+    ]
+    for i, row in enumerate(pollRows(polls, seed)):
+        service, dates, sample, moe, dem, rep, spread = row
+        parts.append(
+            '<tr%s><td class="noCenter"><a class="normal_pollster_name" href="/poll/%d.html">%s</a></td>'
+            '<td>%s</td><td>%s</td><td>%s</td><td>%s</td><td>%s</td>'
+            '<td class="spread"><span>%s</span></td></tr>\n' % (
+                ' class="isInRcpAvg"' if i < 5 else '', i, service, dates, sample, moe, dem, rep, spread,
+            ))
+    parts.append('</table></div></div>\n</body></html>\n')
+    return ''.join(parts).encode('utf-8')
+
+
+def statePages(states=50, polls=50, seed=0):
+    """Yield (url, body) for one synthetic presidential page per state."""
+    for i in range(states):
+        abbrev, name = STATES[i % len(STATES)]
+        yield presUrl(abbrev, name, 1000 + i), statePage(name, polls, seed + i)
+
+
+def urlPath(root, url):
+    return os.path.join(root, *url[len(BASE_URL):].split('/'))
+
+
+def writeSite(root, polls=50, options=200, seed=0):
+    """Write the widget, and a state page for each of its options, under root.
+
+    Returns:
+        The number of files written.
+    """
+    pages = [(WIDGET_URL, widgetBody(options, seed))]
+    for i, (url, text) in enumerate(widgetOptions(options, seed)):
+        pages.append((url, statePage(STATES[i % len(STATES)][1], polls, seed + i)))
+
+    for url, body in pages:
+        fName = urlPath(root, url)
+        if not os.path.isdir(os.path.dirname(fName)):
+            os.makedirs(os.path.dirname(fName))
+        page_file = open(fName, 'wb')
+        page_file.write(body)
+        page_file.close()
+    return len(pages)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Write a synthetic RCP site to a directory.")
+    parser.add_argument('root', help="the directory to write to")
+    parser.add_argument('--polls', type=int, default=50)
+    parser.add_argument('--options', type=int, default=200)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+    writeSite(args.root, args.polls, args.options, args.seed)
+
+
+if __name__ == '__main__':
+    main()
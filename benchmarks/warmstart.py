@@ -0,0 +1,138 @@
+"""
+Compare a cold start with a warm start (see polldata.extensions.WarmStart)
+against a local server with a distant server's latency.
+
+A synthetic site (see benchmarks/synthetic.py), with a robots.txt, is served
+by RCPServer with --latency milliseconds per response.  The spider crawls it:
+
+    disabled    with WARM_START_ENABLED = False
+    cold        with the warm start cache, from an empty data/
+    warm        again, with the data/warmstart.json the cold crawl saved
+
+Each crawl starts from otherwise empty outputs, so every poll is new, and
+the benchmark reports:
+
+    first item  seconds from the spider opening to its first item
+    crawl       seconds from the spider opening to it closing
+    requests    requests the server answered (robots.txt, widget, pages)
+    polls       polls exported
+
+Usage:
+    python -m benchmarks.warmstart [--options 200] [--latency 200] [--runs 3]
+"""
+
+from __future__ import print_function
+
+import argparse
+import glob
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+
+from benchmarks import synthetic
+from benchmarks.quickcrawl import REPO_DIR, parseTime
+from benchmarks.rcpserver import RCPServer
+
+ROBOTS_TXT = "User-agent: *\nDisallow: /epolls/private/\n"
+
+
+def runCrawl(project_dir, spider, proxy, settings):
+    """Crawl with empty outputs, keeping data/warmstart.json.
+
+    Returns:
+        (seconds to the first item, crawl seconds, polls exported)
+    """
+    shutil.rmtree(os.path.join(project_dir, 'logs'), ignore_errors=True)
+    os.makedirs(os.path.join(project_dir, 'logs'))
+    data_dir = os.path.join(project_dir, 'data')
+    if not os.path.isdir(data_dir):
+        os.makedirs(data_dir)
+    for name in os.listdir(data_dir):
+        if name != 'warmstart.json':
+            path = os.path.join(data_dir, name)
+            if os.path.isdir(path):
+                shutil.rmtree(path)
+            else:
+                os.remove(path)
+
+    args = [sys.executable, '-c', 'from scrapy.cmdline import execute; execute()', 'crawl', spider,
+            '-s', 'LOG_FILE=logs/run.txt']
+    for name, value in sorted(settings.items()):
+        args.extend(['-s', '%s=%s' % (name, value)])
+    env = dict(os.environ, http_proxy=proxy,
+               PYTHONPATH=os.pathsep.join([REPO_DIR] + [p for p in [os.environ.get('PYTHONPATH')] if p]))
+    devnull = open(os.devnull, 'w')
+    subprocess.check_call(args, cwd=project_dir, env=env, stdout=devnull, stderr=devnull)
+    devnull.close()
+
+    metrics_file = open(glob.glob(os.path.join(project_dir, 'logs', '*metrics.json'))[0])
+    metrics = json.load(metrics_file)
+    metrics_file.close()
+    crawl_seconds = (parseTime(metrics['finished']) - parseTime(metrics['started'])).total_seconds()
+
+    polls = 0
+    for fName in glob.glob(os.path.join(data_dir, '*_latest.csv')):
+        latest_file = open(fName)
+        polls += max(0, len(latest_file.readlines()) - 1)
+        latest_file.close()
+    return metrics.get('time_to_first_item'), crawl_seconds, polls
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare cold and warm starts on a local server.")
+    parser.add_argument('--spider', default='pres2012')
+    parser.add_argument('--options', type=int, default=200, help="state pages in the widget (default: %(default)s)")
+    parser.add_argument('--polls', type=int, default=20, help="polls per state page (default: %(default)s)")
+    parser.add_argument('--latency', type=float, default=200,
+                        help="milliseconds each response takes (default: %(default)s)")
+    parser.add_argument('--runs', type=int, default=3, help="crawls of each kind (default: %(default)s)")
+    args = parser.parse_args()
+
+    tmpdir = tempfile.mkdtemp(prefix='warmstart-bench-')
+    results = dict((name, []) for name in ('disabled', 'cold', 'warm'))
+    try:
+        site_dir = os.path.join(tmpdir, 'site')
+        pages = synthetic.writeSite(site_dir, args.polls, args.options)
+        robots_file = open(os.path.join(site_dir, 'robots.txt'), 'w')
+        robots_file.write(ROBOTS_TXT)
+        robots_file.close()
+        project_dir = os.path.join(tmpdir, 'project')
+        os.makedirs(project_dir)
+        cfg_file = open(os.path.join(project_dir, 'scrapy.cfg'), 'w')
+        cfg_file.write("[settings]\ndefault = polldata.settings\n")
+        cfg_file.close()
+
+        settings = {
+            'CONDITIONAL_RECRAWL_ENABLED': 0,
+            'RECRAWL_SCHEDULE_ENABLED': 0,
+            'ARCHIVE_ENABLED': 0,
+            'SEEN_STORE': 'polldata.utils.seenStore.SeenStore',
+        }
+        for _ in range(args.runs):
+            for name in ('disabled', 'cold', 'warm'):
+                if name != 'warm' and os.path.exists(os.path.join(project_dir, 'data', 'warmstart.json')):
+                    os.remove(os.path.join(project_dir, 'data', 'warmstart.json'))
+                crawl_settings = dict(settings, WARM_START_ENABLED=int(name != 'disabled'))
+                server = RCPServer(site_dir, latency=args.latency / 1000.0)
+                server.start()
+                first_item, crawl_seconds, polls = runCrawl(project_dir, args.spider, server.base_url,
+                                                            crawl_settings)
+                server.shutdown()
+                server.server_close()
+                results[name].append((first_item, crawl_seconds, server.counts['requests'], polls))
+    finally:
+        shutil.rmtree(tmpdir)
+
+    print("%d pages, %.0fms per response, best of %d crawls" % (pages, args.latency, args.runs))
+    print("%-10s %14s %10s %10s %10s" % ('start', 'first item (s)', 'crawl (s)', 'requests', 'polls'))
+    for name in ('disabled', 'cold', 'warm'):
+        runs = results[name]
+        print("%-10s %14.2f %10.2f %10d %10d" % (
+            name, min(run[0] for run in runs), min(run[1] for run in runs), runs[0][2], runs[0][3]))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,3 @@
+# This package contains the project's scrapy commands (see COMMANDS_MODULE).
+#
+# Each module is a command named after the module, eg. `scrapy compact`.
@@ -0,0 +1,55 @@
+from __future__ import print_function
+
+from scrapy.command import ScrapyCommand
+from scrapy.exceptions import UsageError
+
+from polldata.pipelines import lockOutputs
+from polldata.utils.fileLock import FileLocked
+from polldata.utils.partitions import PartitionedOutput
+
+class Command(ScrapyCommand):
+    """Merge an output's older partitions (see PartitionedExportPipeline)."""
+
+    requires_project = True
+    default_settings = {'LOG_ENABLED': False}
+
+    def syntax(self):
+        return "[options] <output> ..."
+
+    def short_desc(self):
+        return "Merge the older partitions of outputs, one file per state"
+
+    def long_desc(self):
+        return "Merge the partitions of each output (eg. pres2012) up to a seq into one " \
+               "file per state.  By default every run except the latest few is compacted.  " \
+               "Only compact partitions that every consumer has already read."
+
+    def add_options(self, parser):
+        ScrapyCommand.add_options(self, parser)
+        parser.add_option("--before", type="int", metavar="SEQ",
+                          help="compact the partitions with a seq up to SEQ")
+        parser.add_option("--keep-runs", type="int", default=1, metavar="N",
+                          help="when --before isn't given, leave the latest N runs alone (default: 1)")
+
+    def run(self, args, opts):
+        if not args:
+            raise UsageError()
+        try:
+            self.locks = lockOutputs(args, self.settings)
+        except FileLocked as error:
+            raise UsageError("An output is being crawled: %s" % error, print_help=False)
+
+        for output in args:
+            partitioned = PartitionedOutput('data/' + output)
+            before = opts.before
+            if before is None:
+                before = self._keepRunsCursor(partitioned, opts.keep_runs)
+            replaced = partitioned.compact(before)
+            print("%s: compacted %d partitions up to seq %d" % (output, replaced, before))
+
+    def _keepRunsCursor(self, partitioned, keep_runs):
+        """Return the highest seq that isn't part of the latest keep_runs runs."""
+        manifest = partitioned.manifest()
+        kept = set(run['run'] for run in manifest['runs'][-keep_runs:]) if keep_runs > 0 else set()
+        seqs = [p['seq'] for p in manifest['partitions'] if p['run'] not in kept]
+        return max(seqs) if seqs else 0
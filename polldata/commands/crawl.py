@@ -0,0 +1,21 @@
+from scrapy.commands import crawl
+from scrapy.exceptions import UsageError
+
+from polldata.pipelines import lockOutputs, spiderOutputs
+from polldata.utils.fileLock import FileLocked
+
+class Command(crawl.Command):
+    """Scrapy's crawl command, which first locks the spider's outputs (see lockOutputs)."""
+
+    def run(self, args, opts):
+        if len(args) < 1:
+            raise UsageError()
+        elif len(args) > 1:
+            raise UsageError("running 'scrapy crawl' with more than one spider is no longer supported")
+        spider = self.crawler.spiders.create(args[0], **opts.spargs)
+        try:
+            self.locks = lockOutputs(spiderOutputs(spider), self.settings)
+        except FileLocked as error:
+            raise UsageError("%s is already being crawled: %s" % (spider.name, error), print_help=False)
+        self.crawler.crawl(spider)
+        self.crawler.start()
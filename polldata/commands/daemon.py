@@ -0,0 +1,305 @@
+from __future__ import print_function
+
+import json
+import os
+import signal
+import time
+
+from twisted.internet import defer, reactor, task
+from twisted.web import resource, server
+
+from scrapy import log, signals
+from scrapy.command import ScrapyCommand
+from scrapy.crawler import Crawler
+from scrapy.exceptions import UsageError
+from scrapy.resolver import CachingThreadedResolver
+from scrapy.utils.conf import arglist_to_dict
+from scrapy.utils.ossignal import install_shutdown_handlers, signal_names
+
+from polldata.pipelines import lockOutputs, spiderOutputs
+from polldata.utils.fileLock import FileLocked
+from polldata.utils.stateCache import StateCache
+
+# Prometheus counters summed over every crawl of a spider, from its crawl stats
+SPIDER_COUNTERS = [
+    ('polldata_spider_crawls_total', None, "Crawls run."),
+    ('polldata_spider_requests_total', 'downloader/request_count', "Requests sent."),
+    ('polldata_spider_items_scraped_total', 'item_scraped_count', "New polls exported."),
+    ('polldata_spider_items_dropped_total', 'item_dropped_count', "Polls dropped, eg. as already seen."),
+    ('polldata_spider_pages_changed_total', 'conditional/pages_changed', "State pages that changed."),
+    ('polldata_spider_pages_skipped_total', 'conditional/pages_skipped', "State pages skipped as unchanged."),
+    ('polldata_spider_pages_deferred_total', 'recrawl/pages_deferred', "State pages not due for a recrawl."),
+    ('polldata_spider_errors_total', 'log_count/ERROR', "Errors logged."),
+]
+
+
+class Command(ScrapyCommand):
+    """Crawl races again and again from one process (see the README)."""
+
+    requires_project = True
+
+    def syntax(self):
+        return "[options] <spider> ..."
+
+    def short_desc(self):
+        return "Keep crawling spiders on an interval, with their state in memory"
+
+    def long_desc(self):
+        return "Run the spiders one after the other every DAEMON_INTERVAL seconds, in one " \
+               "process.  Seen stores, page validators, recrawl schedules, robots.txt and DNS " \
+               "are kept in memory between cycles, and the state is written to data/ every " \
+               "DAEMON_FLUSH_INTERVAL seconds and on shutdown.  /health and /metrics are served " \
+               "on DAEMON_HTTP_HOST:DAEMON_HTTP_PORT."
+
+    def add_options(self, parser):
+        ScrapyCommand.add_options(self, parser)
+        parser.add_option("-a", dest="spargs", action="append", default=[], metavar="NAME=VALUE",
+                          help="set spider argument for every spider (may be repeated)")
+        parser.add_option("--interval", type="int", metavar="SECONDS",
+                          help="seconds between the starts of two cycles (default: DAEMON_INTERVAL)")
+        parser.add_option("--flush-interval", type="int", metavar="SECONDS",
+                          help="seconds between state writes (default: DAEMON_FLUSH_INTERVAL)")
+        parser.add_option("--port", type="int", metavar="PORT",
+                          help="health and metrics port, 0 to disable (default: DAEMON_HTTP_PORT)")
+        parser.add_option("--cycles", type="int", default=0, metavar="N",
+                          help="exit after N cycles (default: run until interrupted)")
+
+    def process_options(self, args, opts):
+        ScrapyCommand.process_options(self, args, opts)
+        try:
+            opts.spargs = arglist_to_dict(opts.spargs)
+        except ValueError:
+            raise UsageError("Invalid -a value, use -a NAME=VALUE", print_help=False)
+
+    def run(self, args, opts):
+        if not args:
+            raise UsageError()
+        settings = self.settings
+        self.interval = opts.interval if opts.interval is not None else settings.getint('DAEMON_INTERVAL', 1800)
+        self.flush_interval = opts.flush_interval if opts.flush_interval is not None \
+            else settings.getint('DAEMON_FLUSH_INTERVAL', 300)
+        port = opts.port if opts.port is not None else settings.getint('DAEMON_HTTP_PORT', 6090)
+
+        # one crawler for the whole process: its middlewares, pipelines and
+        # downloader (with its connections) are reused by every cycle
+        self.daemon_crawler = Crawler(settings)
+        self.daemon_crawler.state_cache = StateCache()
+        log.start_from_crawler(self.daemon_crawler)
+        self.daemon_crawler.configure()
+        self.daemon_crawler.signals.connect(self._engineStopped, signals.engine_stopped)
+
+        unknown = [name for name in args if name not in self.daemon_crawler.spiders.list()]
+        if unknown:
+            raise UsageError("Unknown spider: " + ', '.join(unknown), print_help=False)
+        # the daemon owns its outputs for as long as it runs
+        outputs = []
+        for name in args:
+            outputs.extend(spiderOutputs(self.daemon_crawler.spiders.create(name, **opts.spargs)))
+        try:
+            self.locks = lockOutputs(outputs, settings)
+        except FileLocked as error:
+            raise UsageError("An output is already being crawled: %s" % error, print_help=False)
+
+        self.spider_names = args
+        self.spargs = opts.spargs
+        self.max_cycles = opts.cycles
+        self.status = DaemonStatus(self.interval)
+        self.stopping = False
+        self.engine_stopped = None
+        self.next_cycle = None
+
+        if settings.getbool('DNSCACHE_ENABLED'):
+            reactor.installResolver(CachingThreadedResolver(reactor))
+        install_shutdown_handlers(self._signalShutdown)
+        if port:
+            site = server.Site(StatusResource(self.status, self.daemon_crawler.state_cache))
+            reactor.listenTCP(port, site, interface=settings.get('DAEMON_HTTP_HOST', '127.0.0.1'))
+            log.msg("Daemon health and metrics on http://%s:%d/health and /metrics" % (
+                        settings.get('DAEMON_HTTP_HOST', '127.0.0.1'), port))
+        if self.flush_interval > 0:
+            self.flusher = task.LoopingCall(self._flush)
+            self.flusher.start(self.flush_interval, now=False)
+
+        reactor.callWhenRunning(self._cycle)
+        reactor.run(installSignalHandlers=False)
+
+    @defer.inlineCallbacks
+    def _cycle(self):
+        self.next_cycle = None
+        self.status.cycleStarted()
+        for name in self.spider_names:
+            if self.stopping:
+                break
+            crawler = self.daemon_crawler
+            spider = crawler.spiders.create(name, **self.spargs)
+            # the stats collector is shared, so every crawl starts from zero
+            crawler.stats.clear_stats()
+            self.status.running = name
+            self.engine_stopped = defer.Deferred()
+            crawler.crawl(spider)
+            crawler.start()
+            yield self.engine_stopped
+            self.status.crawled(name, crawler.stats.get_stats())
+        self.status.running = None
+        self.status.cycleFinished()
+        log.msg("Daemon cycle %d finished in %.2f seconds." % (self.status.cycles, self.status.last_cycle_seconds))
+
+        if self.stopping:
+            return
+        if self.max_cycles and self.status.cycles >= self.max_cycles:
+            self._shutdown()
+            return
+        delay = max(self.interval - self.status.last_cycle_seconds, 0)
+        self.status.next_cycle = time.time() + delay
+        self.next_cycle = reactor.callLater(delay, self._cycle)
+
+    def _engineStopped(self):
+        engine_stopped, self.engine_stopped = self.engine_stopped, None
+        if engine_stopped is not None:
+            engine_stopped.callback(None)
+
+    def _flush(self):
+        flushed = self.daemon_crawler.state_cache.flush()
+        log.msg(format="Flushed %(flushed)d state objects in %(seconds).3f seconds.", level=log.DEBUG,
+                flushed=flushed, seconds=self.daemon_crawler.state_cache.flush_seconds)
+
+    @defer.inlineCallbacks
+    def _shutdown(self):
+        self.stopping = True
+        if self.next_cycle is not None and self.next_cycle.active():
+            self.next_cycle.cancel()
+        if self.flush_interval > 0 and self.flusher.running:
+            self.flusher.stop()
+        # closes the open spider, so its outputs are written
+        yield self.daemon_crawler.stop()
+        self.daemon_crawler.state_cache.close()
+        log.msg("Daemon stopped after %d cycles." % self.status.cycles)
+        try:
+            reactor.stop()
+        except RuntimeError: # already stopped
+            pass
+
+    def _signalShutdown(self, signum, _):
+        install_shutdown_handlers(self._signalKill)
+        log.msg(format="Received %(signame)s, shutting down the daemon gracefully. Send again to force ",
+                level=log.INFO, signame=signal_names[signum])
+        reactor.callFromThread(self._shutdown)
+
+    def _signalKill(self, signum, _):
+        install_shutdown_handlers(signal.SIG_IGN)
+        log.msg(format="Received %(signame)s twice, forcing unclean shutdown",
+                level=log.INFO, signame=signal_names[signum])
+        reactor.callFromThread(reactor.stop)
+
+
+class DaemonStatus(object):
+    """What the daemon has done so far, for the health and metrics endpoint."""
+
+    def __init__(self, interval):
+        self.interval = interval
+        self.started = time.time()
+        self.cycles = 0
+        self.cycle_started = None
+        self.last_cycle_finished = None
+        self.last_cycle_seconds = 0.0
+        self.next_cycle = None
+        self.running = None
+        self.totals = {}
+        self.last_crawls = {}
+
+    def cycleStarted(self):
+        self.cycle_started = time.time()
+        self.next_cycle = None
+
+    def cycleFinished(self):
+        self.cycles += 1
+        self.last_cycle_finished = time.time()
+        self.last_cycle_seconds = self.last_cycle_finished - self.cycle_started
+
+    def crawled(self, name, stats):
+        totals = self.totals.setdefault(name, {})
+        for metric, key, _ in SPIDER_COUNTERS:
+            totals[metric] = totals.get(metric, 0) + (stats.get(key, 0) if key else 1)
+        self.last_crawls[name] = {
+            'finished': time.time(),
+            'finish_reason': stats.get('finish_reason'),
+            'requests': stats.get('downloader/request_count', 0),
+            'items': stats.get('item_scraped_count', 0),
+            'pages_skipped': stats.get('conditional/pages_skipped', 0),
+            'errors': stats.get('log_count/ERROR', 0),
+        }
+
+    def healthy(self, now=None):
+        """A daemon is unhealthy once a cycle is overdue by a whole interval."""
+        now = now or time.time()
+        last = self.last_cycle_finished or self.started
+        return now - last <= 2 * self.interval + max(self.last_cycle_seconds, 60)
+
+    def health(self):
+        return {
+            'status': 'ok' if self.healthy() else 'stale',
+            'pid': os.getpid(),
+            'uptime': round(time.time() - self.started, 3),
+            'cycles': self.cycles,
+            'running': self.running,
+            'last_cycle_finished': self.last_cycle_finished,
+            'last_cycle_seconds': round(self.last_cycle_seconds, 3),
+            'next_cycle': self.next_cycle,
+            'spiders': self.last_crawls,
+        }
+
+
+class StatusResource(resource.Resource):
+    """Serves /health (json, 503 when stale) and /metrics (Prometheus text)."""
+
+    isLeaf = True
+
+    def __init__(self, status, state_cache):
+        resource.Resource.__init__(self)
+        self.status = status
+        self.state_cache = state_cache
+
+    def render_GET(self, request):
+        if request.path == '/health':
+            health = self.status.health()
+            health['state_objects'] = len(self.state_cache)
+            health['last_flush'] = self.state_cache.last_flush
+            if health['status'] != 'ok':
+                request.setResponseCode(503)
+            request.setHeader('Content-Type', 'application/json')
+            return json.dumps(health, sort_keys=True) + '\n'
+        if request.path == '/metrics':
+            request.setHeader('Content-Type', 'text/plain; version=0.0.4')
+            return self.metrics()
+        request.setResponseCode(404)
+        return 'Not found.\n'
+
+    def metrics(self):
+        status = self.status
+        lines = []
+
+        def metric(name, kind, help, samples):
+            lines.append('# HELP %s %s' % (name, help))
+            lines.append('# TYPE %s %s' % (name, kind))
+            for labels, value in samples:
+                lines.append('%s%s %s' % (name, labels, repr(float(value))))
+
+        metric('polldata_daemon_uptime_seconds', 'gauge', "Seconds since the daemon started.",
+               [('', time.time() - status.started)])
+        metric('polldata_daemon_cycles_total', 'counter', "Crawl cycles finished.",
+               [('', status.cycles)])
+        metric('polldata_daemon_last_cycle_seconds', 'gauge', "Duration of the last cycle.",
+               [('', status.last_cycle_seconds)])
+        metric('polldata_daemon_last_cycle_timestamp_seconds', 'gauge', "When the last cycle finished.",
+               [('', status.last_cycle_finished or 0)])
+        metric('polldata_daemon_healthy', 'gauge', "1 unless a cycle is overdue.",
+               [('', 1 if status.healthy() else 0)])
+        metric('polldata_daemon_state_objects', 'gauge', "State objects held in memory.",
+               [('', len(self.state_cache))])
+        metric('polldata_daemon_state_flush_seconds', 'gauge', "Duration of the last state write.",
+               [('', self.state_cache.flush_seconds)])
+        for name, key, help in SPIDER_COUNTERS:
+            metric(name, 'counter', help,
+                   [('{spider="%s"}' % spider, totals.get(name, 0))
+                    for spider, totals in sorted(status.totals.items())])
+        return '\n'.join(lines) + '\n'
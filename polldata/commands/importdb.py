@@ -0,0 +1,76 @@
+from __future__ import print_function
+
+import os
+
+from scrapy.command import ScrapyCommand
+from scrapy.exceptions import UsageError
+
+from polldata.utils.partitions import PartitionedOutput
+from polldata.utils.pollDatabase import PollDatabase, startDates
+from polldata.utils.pollRevisions import loadRevisions, revisionRows
+from polldata.utils.seenStore import JsonSeenStore, LogSeenStore
+
+class Command(ScrapyCommand):
+    """Load the existing files of outputs into the SQLite database (see SqlitePollPipeline)."""
+
+    requires_project = True
+    default_settings = {'LOG_ENABLED': False}
+
+    def syntax(self):
+        return "[options] <output> ..."
+
+    def short_desc(self):
+        return "Import the existing CSV and seen store files of outputs into SQLite"
+
+    def long_desc(self):
+        return "Upsert every poll each output has exported into the SQLite database: its " \
+               "partitions (eg. data/pres2012/), which hold every run, then the latest values of " \
+               "its _revisions.log, which also give the CSV files' polls their start dates.  " \
+               "_latest.csv, which only holds the last run's new polls, is read instead of the " \
+               "partitions if there are none.  Also keep the fingerprints of its seen store " \
+               "(_seen.log or _dict.json).  Importing twice is harmless."
+
+    def add_options(self, parser):
+        ScrapyCommand.add_options(self, parser)
+        parser.add_option("--database", metavar="FILE",
+                          help="the database to import into (default: the SQLITE_DATABASE setting)")
+
+    def run(self, args, opts):
+        if not args:
+            raise UsageError()
+
+        database = PollDatabase(opts.database or self.settings.get('SQLITE_DATABASE', 'data/polls.db'))
+        for output in args:
+            basename = 'data/' + output
+            # the latest values of the polls, with the start dates the CSV
+            # files don't export
+            revisions = list(revisionRows(loadRevisions(basename)[1]))
+            start_dates = startDates(revisions)
+
+            inserted = updated = 0
+            for fName in self._csvFiles(output):
+                counts = database.importCsv(fName, output, start_dates=start_dates)
+                inserted, updated = inserted + counts[0], updated + counts[1]
+            counts = database.importRows(revisions)
+            inserted, updated = inserted + counts[0], updated + counts[1]
+
+            store = None
+            if os.path.exists(basename + '_seen.log'):
+                store = LogSeenStore(basename)
+            elif os.path.exists(basename + '_dict.json'):
+                store = JsonSeenStore(basename)
+            fingerprints = database.importSeenStore(store, output) if store is not None else 0
+
+            print("%s: %d polls inserted, %d updated, %d fingerprints kept (%d polls in the database)" % (
+                output, inserted, updated, fingerprints, database.count(output)))
+        database.close()
+
+    def _csvFiles(self, output):
+        """The output's exported CSV files, oldest polls first."""
+        partitioned = PartitionedOutput('data/' + output)
+        partitions = partitioned.partitionsSince(0)
+        for partition in partitions:
+            yield os.path.join(partitioned.root, partition['path'])
+        # the last run's new polls, which are also in its partitions
+        if not partitions and os.path.exists('data/' + output + '_latest.csv'):
+            yield 'data/' + output + '_latest.csv'
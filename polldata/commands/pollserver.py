@@ -0,0 +1,141 @@
+from __future__ import print_function
+
+import json
+import re
+import sys
+import time
+
+from twisted.internet import reactor, task
+from twisted.web import resource, server
+
+from scrapy.command import ScrapyCommand
+from scrapy.exceptions import UsageError
+
+from polldata.utils.pollIndex import PollIndex
+
+DATE_RE = re.compile(r'^\d{4}-\d{2}-\d{2}$')
+
+# query parameter -> PollIndex.query argument
+TEXT_PARAMETERS = {'race': 'race', 'state': 'state', 'service': 'service', 'sample': 'sample'}
+DATE_PARAMETERS = {'ended_after': 'ended_after', 'ended_before': 'ended_before',
+                   'from': 'field_from', 'to': 'field_to'}
+
+class Command(ScrapyCommand):
+    """Serve the scraped polls from memory, as json over HTTP."""
+
+    requires_project = True
+    default_settings = {'LOG_ENABLED': False}
+
+    def syntax(self):
+        return "[options]"
+
+    def short_desc(self):
+        return "Answer poll queries over HTTP from an in-memory index"
+
+    def long_desc(self):
+        return "Load every race's polls from data/<race>_revisions.log into memory, indexed by " \
+               "state, race, service and dates, and answer read-only json queries on " \
+               "POLL_SERVER_HOST:POLL_SERVER_PORT, eg. /polls?state=FL&limit=10.  A race is " \
+               "loaded again when its crawl finishes."
+
+    def add_options(self, parser):
+        ScrapyCommand.add_options(self, parser)
+        parser.add_option("--port", type="int", metavar="PORT", help="(default: POLL_SERVER_PORT)")
+        parser.add_option("--data-dir", default='data', metavar="DIR",
+                          help="the directory with the revisions files (default: data)")
+        parser.add_option("--reload-interval", type="float", metavar="SECONDS",
+                          help="seconds between checks for finished crawls (default: POLL_SERVER_RELOAD_INTERVAL)")
+
+    def run(self, args, opts):
+        if args:
+            raise UsageError()
+        settings = self.settings
+        port = opts.port if opts.port is not None else settings.getint('POLL_SERVER_PORT', 6091)
+        host = settings.get('POLL_SERVER_HOST', '127.0.0.1')
+        reload_interval = opts.reload_interval if opts.reload_interval is not None \
+            else settings.getfloat('POLL_SERVER_RELOAD_INTERVAL', 2)
+
+        self.index = PollIndex(opts.data_dir)
+        start = time.time()
+        races = self.index.reload()
+        print("Loaded %d polls of %d races in %.2f seconds." % (len(self.index), len(races), time.time() - start))
+
+        reactor.listenTCP(port, server.Site(PollResource(self.index)), interface=host)
+        print("Serving polls on http://%s:%d/polls" % (host, port))
+        sys.stdout.flush()
+        if reload_interval > 0:
+            self.reloader = task.LoopingCall(self._reload)
+            self.reloader.start(reload_interval, now=False)
+        reactor.run()
+
+    def _reload(self):
+        start = time.time()
+        races = self.index.reload()
+        if races:
+            print("Reloaded %s in %.2f seconds: %d polls." % (', '.join(races), time.time() - start, len(self.index)))
+            sys.stdout.flush()
+
+
+class PollResource(resource.Resource):
+    """Serves /polls, /races and /health from a PollIndex.
+
+    /polls takes race, state (a name or postal abbreviation), service,
+    sample, ended_after and ended_before (YYYY-MM-DD, the end date range),
+    from and to (polls in the field at any time between them), latest=1 (the
+    newest poll of each service in each state) and limit (default 100), and
+    returns the matching polls newest first:
+
+        {"matches": 20, "query_ms": 0.07, "polls": [{"race": "pres2012", ...}]}
+    """
+
+    isLeaf = True
+
+    def __init__(self, index):
+        resource.Resource.__init__(self)
+        self.index = index
+
+    def render_GET(self, request):
+        request.setHeader('Content-Type', 'application/json')
+        if request.path == '/polls':
+            try:
+                query = self.query(request.args)
+            except ValueError as error:
+                request.setResponseCode(400)
+                return self._json({'error': str(error)})
+            start = time.time()
+            matches, polls = self.index.query(**query)
+            elapsed = time.time() - start
+            return self._json({'matches': matches, 'query_ms': round(elapsed * 1000, 3), 'polls': polls})
+        if request.path == '/races':
+            return self._json(self.index.summary())
+        if request.path == '/health':
+            return self._json({'status': 'ok', 'polls': len(self.index), 'races': len(self.index.races),
+                               'loaded': self.index.loaded})
+        request.setResponseCode(404)
+        return self._json({'error': "Not found."})
+
+    def query(self, args):
+        """Convert the query string's arguments into PollIndex.query's.
+
+        Raises:
+            ValueError on a malformed date or limit.
+        """
+        query = {}
+        for name, argument in TEXT_PARAMETERS.items():
+            if args.get(name):
+                query[argument] = args[name][0].decode('utf-8')
+        for name, argument in DATE_PARAMETERS.items():
+            if args.get(name):
+                if not DATE_RE.match(args[name][0]):
+                    raise ValueError("%s must be a YYYY-MM-DD date" % name)
+                query[argument] = args[name][0]
+        if args.get('limit'):
+            try:
+                query['limit'] = max(0, int(args['limit'][0]))
+            except ValueError:
+                raise ValueError("limit must be a number")
+        query['latest'] = args.get('latest', ['0'])[0] not in ('', '0', 'false')
+        return query
+
+    def _json(self, data):
+        return json.dumps(data, sort_keys=True) + '\n'
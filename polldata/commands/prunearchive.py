@@ -0,0 +1,39 @@
+from __future__ import print_function
+
+from scrapy.command import ScrapyCommand
+from scrapy.exceptions import UsageError
+
+from polldata.utils.responseArchive import ResponseArchive
+
+class Command(ScrapyCommand):
+    """Remove the old crawls and pages of the response archive (see ResponseArchiveMiddleware)."""
+
+    requires_project = True
+    default_settings = {'LOG_ENABLED': False}
+
+    def syntax(self):
+        return "[options]"
+
+    def short_desc(self):
+        return "Remove archived crawls and pages older than ARCHIVE_MAX_AGE_DAYS"
+
+    def long_desc(self):
+        return "Remove the crawl indexes of ARCHIVE_DIR that are older than the maximum age, the " \
+               "pages of the latest index fetched before then, and the stored bodies nothing " \
+               "refers to any more.  Safe to run while a crawl is recording."
+
+    def add_options(self, parser):
+        ScrapyCommand.add_options(self, parser)
+        parser.add_option("--days", type="float", metavar="DAYS",
+                          help="the maximum age (default: ARCHIVE_MAX_AGE_DAYS)")
+        parser.add_option("--archive-dir", metavar="DIR", help="the archive (default: ARCHIVE_DIR)")
+
+    def run(self, args, opts):
+        if args:
+            raise UsageError()
+        days = opts.days if opts.days is not None else self.settings.getfloat('ARCHIVE_MAX_AGE_DAYS', 30)
+        if days <= 0:
+            raise UsageError("The maximum age must be positive.", print_help=False)
+        archive = ResponseArchive(opts.archive_dir or self.settings.get('ARCHIVE_DIR', 'data/archive'))
+        crawls, bodies, freed = archive.prune(days * 24 * 3600)
+        print("%s: removed %d crawls and %d pages (%.1f MB)" % (archive.root, crawls, bodies, freed / 1e6))
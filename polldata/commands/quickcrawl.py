@@ -0,0 +1,443 @@
+from __future__ import print_function
+
+import heapq
+import time
+from io import BytesIO
+
+try:
+    import robotparser
+    from urlparse import urlparse
+except ImportError:
+    from urllib import robotparser
+    from urllib.parse import urlparse
+
+from twisted.internet import defer, protocol, reactor
+from twisted.internet.endpoints import TCP4ClientEndpoint
+from twisted.internet.error import TimeoutError
+from twisted.python.failure import Failure
+from twisted.web.client import Agent, FileBodyProducer, HTTPConnectionPool, ProxyAgent, ResponseDone
+from twisted.web.http import PotentialDataLoss
+from twisted.web.http_headers import Headers as TwistedHeaders
+
+from scrapy import log, signals
+from scrapy.command import ScrapyCommand
+from scrapy.exceptions import DropItem, IgnoreRequest, UsageError
+from scrapy.http import Headers, Request, Response
+from scrapy.item import BaseItem
+from scrapy.resolver import CachingThreadedResolver
+from scrapy.responsetypes import responsetypes
+from scrapy.utils.conf import arglist_to_dict
+from scrapy.utils.defer import defer_result, iter_errback
+from scrapy.utils.httpobj import urlparse_cached
+from scrapy.utils.ossignal import install_shutdown_handlers, signal_names
+from scrapy.utils.request import request_fingerprint
+from scrapy.utils.spider import iterate_spider_output
+
+from polldata.pipelines import lockOutputs, spiderOutputs
+from polldata.utils.fileLock import FileLocked
+
+class Command(ScrapyCommand):
+    """Crawl a spider with QuickEngine instead of Scrapy's engine (see the README)."""
+
+    requires_project = True
+
+    def syntax(self):
+        return "[options] <spider>"
+
+    def short_desc(self):
+        return "Crawl a small, fixed site over pooled keep-alive connections"
+
+    def long_desc(self):
+        return "Run a spider's rules, callbacks, middlewares and item pipelines like " \
+               "`scrapy crawl`, but fetch its pages with QuickEngine: a priority queue and " \
+               "CONCURRENT_REQUESTS_PER_DOMAIN requests in flight over persistent HTTP/1.1 " \
+               "connections, instead of Scrapy's scheduler and HTTP/1.0 downloader.  " \
+               "robots.txt is fetched and obeyed before a site's first page."
+
+    def add_options(self, parser):
+        ScrapyCommand.add_options(self, parser)
+        parser.add_option("-a", dest="spargs", action="append", default=[], metavar="NAME=VALUE",
+                          help="set spider argument (may be repeated)")
+
+    def process_options(self, args, opts):
+        ScrapyCommand.process_options(self, args, opts)
+        try:
+            opts.spargs = arglist_to_dict(opts.spargs)
+        except ValueError:
+            raise UsageError("Invalid -a value, use -a NAME=VALUE", print_help=False)
+        # QuickEngine obeys robots.txt itself; the middleware needs Scrapy's engine
+        middlewares = dict(self.settings['DOWNLOADER_MIDDLEWARES'])
+        middlewares['polldata.middlewares.RobotsTxtCacheMiddleware'] = None
+        self.settings.overrides['DOWNLOADER_MIDDLEWARES'] = middlewares
+        # and AdaptiveConcurrency tunes the slots of Scrapy's downloader, which it doesn't use
+        self.settings.overrides['ADAPTIVE_CONCURRENCY_ENABLED'] = False
+
+    def run(self, args, opts):
+        if len(args) != 1:
+            raise UsageError()
+        crawler = self.crawler
+        spider = crawler.spiders.create(args[0], **opts.spargs)
+        try:
+            self.locks = lockOutputs(spiderOutputs(spider), self.settings)
+        except FileLocked as error:
+            raise UsageError("%s is already being crawled: %s" % (spider.name, error), print_help=False)
+        spider.set_crawler(crawler)
+
+        self.engine = QuickEngine.from_crawler(crawler, spider)
+        self.engine.closed.addBoth(self._closed)
+        if self.settings.getbool('DNSCACHE_ENABLED'):
+            reactor.installResolver(CachingThreadedResolver(reactor))
+        install_shutdown_handlers(self._signalShutdown)
+        reactor.callWhenRunning(self.engine.start)
+        reactor.run(installSignalHandlers=False)
+
+    def _closed(self, result):
+        if isinstance(result, Failure):
+            log.err(result, "Quick crawl failed")
+            self.exitcode = 1
+        else:
+            print(self.engine.summary())
+        reactor.callLater(0, reactor.stop)
+
+    def _signalShutdown(self, signum, _):
+        log.msg(format="Received %(signame)s, finishing the requests in progress.",
+                signame=signal_names[signum])
+        install_shutdown_handlers(lambda signum, _: reactor.callFromThread(reactor.stop))
+        reactor.callFromThread(self.engine.stop, 'shutdown')
+
+
+class BodyReader(protocol.Protocol):
+    """Collects a Twisted response's body, then fires finished with it."""
+
+    def __init__(self, finished):
+        self.finished = finished
+        self.chunks = []
+
+    def dataReceived(self, data):
+        self.chunks.append(data)
+
+    def connectionLost(self, reason):
+        # PotentialDataLoss: a body without a length, which ends with the connection
+        if reason.check(ResponseDone, PotentialDataLoss):
+            self.finished.callback(b''.join(self.chunks))
+        else:
+            self.finished.errback(reason)
+
+
+class PooledFetcher(object):
+    """Downloads Scrapy requests over persistent HTTP/1.1 connections.
+
+    Scrapy 0.16 opens an HTTP/1.0 connection per request.  Here every request
+    goes through one of Twisted's Agents, which share an HTTPConnectionPool
+    that keeps up to per_host idle connections open to each host, or to the
+    proxy when the request has one (HttpProxyMiddleware sets
+    request.meta['proxy'] from http_proxy).
+
+    Args:
+        per_host
+            The idle connections kept per host.
+        timeout
+            The default download timeout, in seconds.
+    """
+
+    def __init__(self, per_host, timeout):
+        self.pool = HTTPConnectionPool(reactor, persistent=True)
+        self.pool.maxPersistentPerHost = per_host
+        self.timeout = timeout
+        self.agent = Agent(reactor, pool=self.pool)
+        self.proxy_agents = {}
+
+    def fetch(self, request, spider):
+        """Return a Deferred that fires with the request's Response."""
+        headers = TwistedHeaders(dict(request.headers.items()))
+        body = FileBodyProducer(BytesIO(request.body)) if request.body else None
+        dfd = self._agent(request).request(request.method, request.url, headers, body)
+        dfd.addCallback(self._readBody, request)
+
+        timeout = request.meta.get('download_timeout', self.timeout)
+        timer = reactor.callLater(timeout, dfd.cancel)
+        def stopTimer(result):
+            if timer.active():
+                timer.cancel()
+            elif isinstance(result, Failure) and result.check(defer.CancelledError):
+                # like Scrapy's downloader, so RetryMiddleware retries it
+                return Failure(TimeoutError("Getting %s took longer than %s seconds." % (request.url, timeout)))
+            return result
+        return dfd.addBoth(stopTimer)
+
+    def close(self):
+        return self.pool.closeCachedConnections()
+
+    def _agent(self, request):
+        proxy = request.meta.get('proxy')
+        if not proxy:
+            return self.agent
+        agent = self.proxy_agents.get(proxy)
+        if agent is None:
+            proxy_url = urlparse(proxy)
+            endpoint = TCP4ClientEndpoint(reactor, proxy_url.hostname, proxy_url.port or 80)
+            agent = self.proxy_agents[proxy] = ProxyAgent(endpoint, reactor, self.pool)
+        return agent
+
+    def _readBody(self, response, request):
+        finished = defer.Deferred()
+        response.deliverBody(BodyReader(finished))
+        finished.addCallback(self._response, response, request)
+        return finished
+
+    def _response(self, body, response, request):
+        headers = Headers(list(response.headers.getAllRawHeaders()))
+        # the Agent already decoded the chunks
+        headers.pop('Transfer-Encoding', None)
+        respcls = responsetypes.from_args(headers=headers, url=request.url)
+        return respcls(url=request.url, status=response.code, headers=headers, body=body)
+
+
+class QuickEngine(object):
+    """Crawls one spider without Scrapy's engine, scheduler or downloader.
+
+    A crawl of a few hundred pages from one site spends much of its time in
+    Scrapy's machinery: the scheduler's queues, the downloader's slots and
+    heartbeat, and a new HTTP/1.0 connection per page.  QuickEngine keeps the
+    parts that decide what is crawled and what is exported, and replaces the
+    rest:
+
+     - the spider's start requests, rules, link extractors and callbacks run
+       unchanged, through the spider middlewares;
+     - requests go through the downloader middlewares (user agent, proxy,
+       retries, redirects, conditional requests, the archive...) to a
+       PooledFetcher instead of Scrapy's download handlers;
+     - items go through the item pipelines, with the usual item_scraped and
+       item_dropped signals, and the crawl stats are collected as usual.
+
+    Requests wait in a priority queue (so RecrawlSchedule's priorities still
+    order the crawl), duplicates are filtered by fingerprint, and at most
+    concurrency requests are in flight at once, started at least delay
+    seconds apart.  With obey_robots, each site's robots.txt is downloaded
+    before its first page, and the pages it disallows are not requested.
+
+    The crawl is over when the queue is empty and nothing is in flight, or
+    after stop(); closed then fires with the close reason.
+    """
+
+    def __init__(self, crawler, spider, concurrency=8, delay=0.0, timeout=180, obey_robots=True):
+        self.crawler = crawler
+        self.spider = spider
+        self.downloadmw = crawler.engine.downloader.middleware
+        self.spidermw = crawler.engine.scraper.spidermw
+        self.itemproc = crawler.engine.scraper.itemproc
+        self.logformatter = crawler.logformatter
+        self.fetcher = PooledFetcher(concurrency, timeout)
+        self.concurrency = concurrency
+        self.delay = delay
+        self.obey_robots = obey_robots
+        self.useragent = getattr(spider, 'user_agent', None) or crawler.settings['USER_AGENT']
+
+        self.queue = []
+        self.queued = 0
+        self.fingerprints = set()
+        self.downloading = 0
+        self.processing = 0
+        self.next_start = 0
+        self.wakeup = None
+        self.robots = {}
+        self.robots_waiters = {}
+        self.started = None
+        self.finished = None
+        self.reason = None
+        self.closed = defer.Deferred()
+
+    @classmethod
+    def from_crawler(cls, crawler, spider):
+        settings = crawler.settings
+        return cls(crawler, spider,
+                   concurrency=settings.getint('CONCURRENT_REQUESTS_PER_DOMAIN', 8),
+                   delay=settings.getfloat('DOWNLOAD_DELAY', 0),
+                   timeout=settings.getint('DOWNLOAD_TIMEOUT', 180),
+                   obey_robots=settings.getbool('ROBOTSTXT_OBEY', False))
+
+    def start(self):
+        dfd = self._open()
+        dfd.addErrback(self.closed.errback)
+        return dfd
+
+    @defer.inlineCallbacks
+    def _open(self):
+        self.started = time.time()
+        log.msg("Spider opened (quick crawl)", spider=self.spider)
+        yield self.itemproc.open_spider(self.spider)
+        self.crawler.stats.open_spider(self.spider)
+        yield self.crawler.signals.send_catch_log_deferred(signal=signals.spider_opened, spider=self.spider)
+
+        start_requests = yield self.spidermw.process_start_requests(self.spider.start_requests(), self.spider)
+        for request in iter_errback(start_requests, log.err, "Error obtaining a start request",
+                                    spider=self.spider):
+            self.schedule(request)
+        self._next()
+
+    def stop(self, reason='cancelled'):
+        """Stop starting requests; the crawl closes once those in flight are done."""
+        if self.reason is None:
+            self.reason = reason
+        self.queue = []
+        self._next()
+
+    def schedule(self, request, filtered=True):
+        if filtered and not request.dont_filter:
+            fingerprint = request_fingerprint(request)
+            if fingerprint in self.fingerprints:
+                return
+            self.fingerprints.add(fingerprint)
+        self.queued += 1
+        heapq.heappush(self.queue, (-request.priority, self.queued, request))
+
+    def summary(self):
+        stats = self.crawler.stats.get_stats()
+        return "Quick crawl of %s finished (%s) in %.2f seconds: %d requests, %d items scraped, %d dropped." % (
+            self.spider.name, self.reason, self.finished - self.started,
+            stats.get('downloader/request_count', 0), stats.get('item_scraped_count', 0),
+            stats.get('item_dropped_count', 0))
+
+    def _next(self):
+        if self.wakeup is not None:
+            return
+        while self.queue and self.downloading < self.concurrency and self.reason is None:
+            if self.delay:
+                wait = self.next_start - time.time()
+                if wait > 0:
+                    self.wakeup = reactor.callLater(wait, self._wakeup)
+                    return
+                self.next_start = time.time() + self.delay
+            _, _, request = heapq.heappop(self.queue)
+            self.downloading += 1
+            dfd = self._download(request)
+            dfd.addBoth(self._downloaded, request)
+            dfd.addErrback(log.err, spider=self.spider)
+
+        if not (self.downloading or self.processing or self.queue or self.finished):
+            self._close()
+
+    def _wakeup(self):
+        self.wakeup = None
+        self._next()
+
+    @defer.inlineCallbacks
+    def _download(self, request):
+        if self.obey_robots:
+            parser = yield self._robotsParser(urlparse_cached(request))
+            if parser is not None and not parser.can_fetch(self.useragent, request.url):
+                log.msg(format="Forbidden by robots.txt: %(request)s", level=log.DEBUG,
+                        spider=self.spider, request=request)
+                raise IgnoreRequest()
+        response = yield self.downloadmw.download(self.fetcher.fetch, request, self.spider)
+        defer.returnValue(response)
+
+    def _downloaded(self, result, request):
+        self.downloading -= 1
+        if isinstance(result, Request):
+            # a redirect or a retry, which was already filtered
+            self.schedule(result, filtered=False)
+        elif isinstance(result, Response):
+            result.request = request
+            log.msg(spider=self.spider, level=log.DEBUG,
+                    **self.logformatter.crawled(request, result, self.spider))
+            self.crawler.signals.send_catch_log(signal=signals.response_received,
+                                                response=result, request=request, spider=self.spider)
+            self._scrape(result, request)
+        elif not result.check(IgnoreRequest):
+            log.msg(format="Error downloading %(request)s: %(error)s", level=log.ERROR,
+                    spider=self.spider, request=request, error=result.getErrorMessage())
+        self._next()
+
+    def _scrape(self, response, request):
+        self.processing += 1
+        dfd = self.spidermw.scrape_response(self._callSpider, response, request, self.spider)
+        dfd.addCallbacks(self._spiderOutput, self._spiderError,
+                         callbackArgs=(request, response), errbackArgs=(request, response))
+        dfd.addBoth(self._processed)
+
+    def _callSpider(self, response, request, spider):
+        response.request = request
+        dfd = defer_result(response)
+        dfd.addCallbacks(request.callback or spider.parse, request.errback)
+        return dfd.addCallback(iterate_spider_output)
+
+    def _spiderOutput(self, result, request, response):
+        for output in iter_errback(result, self._spiderError, request, response):
+            if isinstance(output, Request):
+                self.schedule(output)
+            elif isinstance(output, BaseItem):
+                self.processing += 1
+                dfd = self.itemproc.process_item(output, self.spider)
+                dfd.addBoth(self._itemProcessed, output, response)
+                dfd.addBoth(self._processed)
+            elif output is not None:
+                log.msg(format="Spider must return Request, BaseItem or None, got %(typename)r in %(request)s",
+                        level=log.ERROR, spider=self.spider, request=request,
+                        typename=type(output).__name__)
+
+    def _spiderError(self, failure, request, response):
+        log.err(failure, "Spider error processing %s" % request, spider=self.spider)
+        self.crawler.signals.send_catch_log(signal=signals.spider_error, failure=failure,
+                                            response=response, spider=self.spider)
+        self.crawler.stats.inc_value("spider_exceptions/%s" % failure.value.__class__.__name__,
+                                     spider=self.spider)
+
+    def _itemProcessed(self, result, item, response):
+        if isinstance(result, Failure):
+            if result.check(DropItem):
+                log.msg(level=log.WARNING, spider=self.spider,
+                        **self.logformatter.dropped(item, result.value, response, self.spider))
+                self.crawler.signals.send_catch_log(signal=signals.item_dropped, item=item,
+                                                    spider=self.spider, exception=result.value)
+            else:
+                log.err(result, "Error processing %s" % item, spider=self.spider)
+        else:
+            log.msg(level=log.DEBUG, spider=self.spider,
+                    **self.logformatter.scraped(result, response, self.spider))
+            self.crawler.signals.send_catch_log(signal=signals.item_scraped, item=result,
+                                                response=response, spider=self.spider)
+
+    def _processed(self, _):
+        self.processing -= 1
+        self._next()
+
+    def _robotsParser(self, url):
+        """Return a Deferred that fires with a site's robots.txt parser, or None."""
+        if url.netloc in self.robots:
+            return defer.succeed(self.robots[url.netloc])
+        waiter = defer.Deferred()
+        waiters = self.robots_waiters.setdefault(url.netloc, [])
+        waiters.append(waiter)
+        if len(waiters) == 1:
+            robots_request = Request("%s://%s/robots.txt" % (url.scheme, url.netloc))
+            dfd = self.downloadmw.download(self.fetcher.fetch, robots_request, self.spider)
+            dfd.addBoth(self._robotsDownloaded, url.netloc)
+        return waiter
+
+    def _robotsDownloaded(self, result, netloc):
+        # like RobotsTxtMiddleware, a site without a robots.txt allows everything
+        parser = None
+        if isinstance(result, Response) and result.status == 200:
+            parser = robotparser.RobotFileParser(result.url)
+            parser.parse(result.body.splitlines())
+        self.robots[netloc] = parser
+        for waiter in self.robots_waiters.pop(netloc):
+            waiter.callback(parser)
+
+    @defer.inlineCallbacks
+    def _close(self):
+        self.finished = time.time()
+        self.reason = self.reason or 'finished'
+        log.msg(format="Closing spider (%(reason)s)", spider=self.spider, reason=self.reason)
+        try:
+            yield self.itemproc.close_spider(self.spider)
+            yield self.crawler.signals.send_catch_log_deferred(signal=signals.spider_closed,
+                                                               spider=self.spider, reason=self.reason)
+            self.crawler.stats.close_spider(self.spider, reason=self.reason)
+            log.msg(format="Spider closed (%(reason)s)", spider=self.spider, reason=self.reason)
+            yield self.fetcher.close()
+        except Exception:
+            self.closed.errback(Failure())
+        else:
+            self.closed.callback(self.reason)
@@ -0,0 +1,142 @@
+from __future__ import print_function
+
+import multiprocessing
+import os
+import time
+
+from twisted.internet import defer, reactor
+
+from scrapy import log, signals
+from scrapy.command import ScrapyCommand
+from scrapy.exceptions import DropItem, UsageError
+from scrapy.utils.conf import arglist_to_dict
+
+from polldata.items import PresPollItem
+from polldata.pipelines import lockOutputs, spiderOutputs
+from polldata.utils.fileLock import FileLocked
+from polldata.utils.reparse import archivePages, directoryPages, reparsePages, routePages
+
+class Command(ScrapyCommand):
+    """Re-parse stored state pages in parallel, without the Scrapy engine."""
+
+    requires_project = True
+
+    def syntax(self):
+        return "[options] <spider> [<directory>]"
+
+    def short_desc(self):
+        return "Re-parse stored state pages with a pool of processes"
+
+    def long_desc(self):
+        return "Parse a spider's stored state pages on every core, and pass their polls " \
+               "through the item pipelines as a crawl would.  The pages are read from a " \
+               "response archive (ARCHIVE_DIR by default) or from a directory of saved pages.  " \
+               "The workers don't import Scrapy or Twisted."
+
+    def add_options(self, parser):
+        ScrapyCommand.add_options(self, parser)
+        parser.add_option("-a", dest="spargs", action="append", default=[], metavar="NAME=VALUE",
+                          help="set spider argument (may be repeated)")
+        parser.add_option("--crawl", default='latest', metavar="ID",
+                          help="the archived crawl to re-parse (default: latest, the newest copy of every page)")
+        parser.add_option("--processes", type="int", metavar="N",
+                          help="worker processes (default: one per core, %d)" % multiprocessing.cpu_count())
+
+    def process_options(self, args, opts):
+        ScrapyCommand.process_options(self, args, opts)
+        try:
+            opts.spargs = arglist_to_dict(opts.spargs)
+        except ValueError:
+            raise UsageError("Invalid -a value, use -a NAME=VALUE", print_help=False)
+        # every stored page is parsed, and nothing is downloaded
+        self.settings.overrides.update({
+            'RECRAWL_SCHEDULE_ENABLED': False,
+            'CONDITIONAL_RECRAWL_ENABLED': False,
+            'ARCHIVE_ENABLED': False,
+            'WARM_START_ENABLED': False,
+        })
+
+    def run(self, args, opts):
+        if len(args) not in (1, 2):
+            raise UsageError()
+
+        crawler = self.crawler
+        spider = crawler.spiders.create(args[0], **opts.spargs)
+        if not getattr(spider, 'races', None):
+            raise UsageError("Spider %s doesn't crawl state pages." % spider.name, print_help=False)
+        try:
+            self.locks = lockOutputs(spiderOutputs(spider), self.settings)
+        except FileLocked as error:
+            raise UsageError("%s is being crawled: %s" % (spider.name, error), print_help=False)
+        spider.set_crawler(crawler)
+
+        source = args[1] if len(args) > 1 else self.settings.get('ARCHIVE_DIR', 'data/archive')
+        if os.path.isdir(os.path.join(source, 'objects')):
+            pages = archivePages(source, spider.name, opts.crawl)
+        elif os.path.isdir(source):
+            pages = directoryPages(source)
+        else:
+            raise UsageError("No such directory: " + source, print_help=False)
+
+        reactor.callWhenRunning(self._reparse, spider, routePages(pages, spider.races), opts.processes)
+        reactor.run(installSignalHandlers=False)
+
+    @defer.inlineCallbacks
+    def _reparse(self, spider, tasks, processes):
+        """Pass the polls of every page through the item pipelines, as a crawl would.
+
+        The pipelines are opened before spider_opened is sent, and closed
+        before spider_closed, in the engine's order, and each step waits for
+        the Deferreds of the one before.
+        """
+        crawler = self.crawler
+        itemproc = crawler.engine.scraper.itemproc
+        try:
+            yield itemproc.open_spider(spider)
+            yield crawler.signals.send_catch_log_deferred(signal=signals.spider_opened, spider=spider)
+
+            counts = {'pages': 0, 'failed': 0, 'polls': 0, 'new': 0}
+            pending = []
+            start = time.time()
+            for url, polls, error in reparsePages(tasks, processes):
+                if error is not None:
+                    counts['failed'] += 1
+                    log.msg(format="Couldn't parse %(url)s: %(error)s", level=log.WARNING,
+                            spider=spider, url=url, error=error)
+                    continue
+                counts['pages'] += 1
+                for poll in polls:
+                    counts['polls'] += 1
+                    dfd = itemproc.process_item(PresPollItem(poll), spider)
+                    dfd.addCallbacks(self._scraped, self._dropped,
+                                     callbackArgs=(spider, counts), errbackArgs=(poll, spider))
+                    if not dfd.called:
+                        pending.append(dfd)
+            yield defer.DeferredList(pending)
+            elapsed = time.time() - start
+
+            yield itemproc.close_spider(spider)
+            yield crawler.signals.send_catch_log_deferred(signal=signals.spider_closed, spider=spider,
+                                                          reason='finished')
+
+            summary = "Re-parsed %d pages (%d failed) in %.2f seconds (%.1f pages/second): %d polls, %d new." % (
+                counts['pages'], counts['failed'], elapsed, counts['pages'] / elapsed if elapsed else 0.0,
+                counts['polls'], counts['new'])
+            log.msg(summary, spider=spider)
+            print(summary)
+        except Exception:
+            log.err(None, "Re-parsing %s failed" % spider.name, spider=spider)
+            self.exitcode = 1
+        finally:
+            reactor.stop()
+
+    def _scraped(self, item, spider, counts):
+        counts['new'] += 1
+        self.crawler.signals.send_catch_log(signal=signals.item_scraped, item=item, response=None, spider=spider)
+
+    def _dropped(self, failure, poll, spider):
+        if failure.check(DropItem):
+            self.crawler.signals.send_catch_log(signal=signals.item_dropped, item=poll, spider=spider,
+                                                exception=failure.value)
+        else:
+            log.err(failure, "Error processing %s" % poll, spider=spider)
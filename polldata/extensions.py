@@ -0,0 +1,687 @@
+# Define your extensions here
+#
+# Don't forget to add your extension to the EXTENSIONS setting (and its
+# middlewares to SPIDER_MIDDLEWARES and DOWNLOADER_MIDDLEWARES)
+# See: http://doc.scrapy.org/topics/extensions.html
+
+from scrapy import log, signals
+from scrapy.exceptions import IgnoreRequest, NotConfigured
+from scrapy.item import BaseItem
+from scrapy.resolver import dnscache
+from scrapy.utils.httpobj import urlparse_cached
+from datetime import datetime
+from timeit import default_timer as timer
+import os
+import random
+import time
+
+from polldata.utils.adaptiveConcurrency import DomainThrottle, crawlDelay, retryAfter
+from polldata.utils.stageMetrics import StageMetrics, ROWS_BUCKETS
+from polldata.utils.stateCache import stateCache
+from polldata.utils.warmStart import WarmStartCache
+
+def firstItem(stats, spider, seconds):
+    """Set the 'time_to_first_item' stat, unless another extension already has."""
+    if stats.get_value('time_to_first_item', spider=spider) is None:
+        stats.set_value('time_to_first_item', seconds, spider=spider)
+
+def pipelineName(process_item):
+    """Return the class name of a pipeline's process_item, even once it is wrapped."""
+    return getattr(process_item, 'pipeline_name', None) or process_item.__self__.__class__.__name__
+
+class StageTiming(object):
+    '''
+    Records where a crawl's time goes, per spider and per stage.
+
+    Metrics (names as in the Prometheus output, without the 'polldata_'
+    prefix):
+        stage_seconds{stage="download"}
+            Each page's download, from the last downloader middleware's
+            process_request to its response (so it includes the wait for a
+            free download slot), see DownloadTimingMiddleware.
+        stage_seconds{stage="parse"}
+            The spider's time on each state page (eg. parseStatePolls), see
+            StageTimingSpiderMiddleware.
+        stage_seconds{stage="links"}
+            The spider's time on every other page, ie. extracting the state
+            links from the widget.
+        stage_seconds{stage="pipeline", pipeline="<class>"}
+            Each item's time in each item pipeline's process_item.
+        rows_per_page
+            The polls found on each state page.
+        pages_total{stage}, responses_total{status},
+        download_errors_total{error}, items_scraped_total,
+        items_dropped_total{reason}
+            Counters.  Polls dropped as already seen have
+            reason="DuplicatePoll".
+
+    The seconds from the spider opening to its first item leaving the item
+    pipelines (scraped or dropped) are set in the crawl stats as
+    'time_to_first_item' (WarmStart sets it too, when this is disabled).
+
+    When the spider closes, the metrics are written next to the log file, as
+    json ('<log> | <spider> metrics.json', with quantile estimates) and in the
+    Prometheus text format ('<log> | <spider> metrics.prom'), and a summary is
+    logged.
+
+    Settings:
+        STAGE_TIMING_ENABLED
+            Set to False to disable the extension and its middlewares.
+    '''
+
+    def __init__(self, crawler):
+        self.crawler = crawler
+        self.metrics = {}
+        self.started = {}
+        self.first_item = {}
+        self.pipelines_timed = False
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        if not crawler.settings.getbool('STAGE_TIMING_ENABLED', True):
+            raise NotConfigured
+        extension = cls(crawler)
+        # found by the middlewares, see stageTiming()
+        crawler.stage_timing = extension
+        crawler.signals.connect(extension.spider_opened, signals.spider_opened)
+        crawler.signals.connect(extension.spider_closed, signals.spider_closed)
+        crawler.signals.connect(extension.response_received, signals.response_received)
+        crawler.signals.connect(extension.item_scraped, signals.item_scraped)
+        crawler.signals.connect(extension.item_dropped, signals.item_dropped)
+        return extension
+
+    def spider_opened(self, spider):
+        metrics = StageMetrics(buckets={'rows_per_page': ROWS_BUCKETS})
+        metrics.describe('stage_seconds', "Seconds spent in each stage, per page or item.")
+        metrics.describe('rows_per_page', "Polls found on each state page.")
+        metrics.describe('pages_total', "Pages handled by the spider.")
+        metrics.describe('responses_total', "Responses received, by status.")
+        metrics.describe('download_errors_total', "Downloads that failed, by error.")
+        metrics.describe('items_scraped_total', "Items that went through every pipeline.")
+        metrics.describe('items_dropped_total', "Items dropped by a pipeline, by reason.")
+        self.metrics[spider] = metrics
+        self.started[spider] = datetime.utcnow()
+        if not self.pipelines_timed:
+            self._timePipelines(self.crawler.engine.scraper.itemproc)
+
+    def spider_closed(self, spider):
+        metrics = self.metrics.pop(spider)
+        started = self.started.pop(spider)
+        first_item = self.first_item.pop(spider, None)
+        base = os.path.splitext(self.crawler.settings.get('LOG_FILE') or
+                                'logs/%s | %s.txt' % (datetime.today(), self.crawler.settings.get('BOT_NAME')))[0]
+        if os.path.dirname(base) and not os.path.isdir(os.path.dirname(base)):
+            os.makedirs(os.path.dirname(base))
+        metrics.writeJson(base + ' | ' + spider.name + ' metrics.json', spider=spider.name,
+                          started=started.isoformat(), finished=datetime.utcnow().isoformat(),
+                          time_to_first_item=first_item)
+        metrics.writePrometheus(base + ' | ' + spider.name + ' metrics.prom')
+        log.msg("Stage timing: " + self._summary(metrics), spider=spider)
+        if first_item is not None:
+            log.msg(format="First item after %(seconds).2fs", spider=spider, seconds=first_item)
+
+    def observe(self, spider, name, value, **labels):
+        metrics = self.metrics.get(spider)
+        if metrics is not None:
+            labels['spider'] = spider.name
+            metrics.observe(name, value, **labels)
+
+    def inc(self, spider, name, count=1, **labels):
+        metrics = self.metrics.get(spider)
+        if metrics is not None:
+            labels['spider'] = spider.name
+            metrics.inc(name, count, **labels)
+
+    def response_received(self, response, request, spider):
+        self.inc(spider, 'responses_total', status=response.status)
+
+    def item_scraped(self, item, response, spider):
+        self.inc(spider, 'items_scraped_total')
+        self._firstItem(spider)
+
+    def item_dropped(self, item, spider, exception):
+        self.inc(spider, 'items_dropped_total', reason=exception.__class__.__name__)
+        self._firstItem(spider)
+
+    def _firstItem(self, spider):
+        if spider in self.started and spider not in self.first_item:
+            seconds = (datetime.utcnow() - self.started[spider]).total_seconds()
+            self.first_item[spider] = seconds
+            firstItem(self.crawler.stats, spider, seconds)
+
+    def _timePipelines(self, itemproc):
+        itemproc.methods['process_item'] = [self._timedPipeline(method)
+                                            for method in itemproc.methods['process_item']]
+        self.pipelines_timed = True
+
+    def _timedPipeline(self, process_item):
+        name = pipelineName(process_item)
+
+        def timed(item, spider):
+            start = timer()
+            try:
+                return process_item(item, spider)
+            finally:
+                self.observe(spider, 'stage_seconds', timer() - start, stage='pipeline', pipeline=name)
+        timed.pipeline_name = name
+        return timed
+
+    def _summary(self, metrics):
+        """Ex: "download 42 x 3.12ms (p95 10.00ms), parse 40 x 1.20ms (p95 2.50ms), ..." """
+        parts = []
+        for (name, labels), histogram in sorted(metrics.histograms.items()):
+            if name != 'stage_seconds' or not histogram.count:
+                continue
+            labels = dict(labels)
+            stage = labels.get('pipeline') or labels['stage']
+            parts.append("%s %d x %.2fms (p95 %.2fms)" % (
+                stage, histogram.count, 1000 * histogram.sum / histogram.count, 1000 * histogram.quantile(0.95)))
+        return ', '.join(parts) or "nothing recorded"
+
+class Profiling(object):
+    '''
+    Profiles a sample of the spider's callbacks, link extraction and item
+    pipelines, to find where a parse regression comes from without editing
+    the code.
+
+    When enabled, each call of these hooks is profiled with probability
+    PROFILE_SAMPLE_RATE:
+        <callback>      each rule's callback, eg. parseStatePolls (per page)
+        links           CrawlSpider._requests_to_follow, ie. link extraction
+                        (per page)
+        <pipeline>      each item pipeline's process_item (per item)
+    The sampled calls of each hook are profiled with cProfile and, when
+    tracemalloc is available, their allocations are traced (see
+    polldata.utils.profiling.CallProfiler).  When the spider closes, the
+    reports are written in 'PROFILE_DIR/<spider> <crawl time>/'.
+
+    Calls made while another hook is being profiled (eg. a pipeline called
+    from a callback) are not sampled, so profiles don't nest.
+
+    The extension is disabled unless PROFILE_ENABLED is set, and then nothing
+    is wrapped, so profiling costs nothing when it is off.
+
+    Settings:
+        PROFILE_ENABLED
+            Set to True to profile.  Ex: scrapy crawl pres2012 -s PROFILE_ENABLED=1
+        PROFILE_SAMPLE_RATE
+            The fraction of calls profiled, from 0 to 1.
+        PROFILE_DIR
+            Where the reports are written.
+        PROFILE_TRACEMALLOC_FRAMES
+            The traceback depth kept for each allocation; 0 to not trace
+            allocations.
+    '''
+
+    def __init__(self, crawler, sample_rate, out_dir, trace_frames):
+        self.crawler = crawler
+        self.sample_rate = sample_rate
+        self.out_dir = out_dir
+        self.trace_frames = trace_frames
+        self.profilers = {}
+        self.calls = {}
+        self.active = False
+        self.pipelines_profiled = False
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        settings = crawler.settings
+        if not settings.getbool('PROFILE_ENABLED'):
+            raise NotConfigured
+        extension = cls(crawler,
+                        settings.getfloat('PROFILE_SAMPLE_RATE', 0.1),
+                        settings.get('PROFILE_DIR', 'logs/profiles'),
+                        settings.getint('PROFILE_TRACEMALLOC_FRAMES', 25))
+        crawler.signals.connect(extension.spider_opened, signals.spider_opened)
+        crawler.signals.connect(extension.spider_closed, signals.spider_closed)
+        return extension
+
+    def spider_opened(self, spider):
+        self.profilers[spider] = {}
+        self.calls[spider] = {}
+        for rule in getattr(spider, '_rules', ()):
+            if callable(rule.callback):
+                rule.callback = self._profiled(rule.callback.__name__, rule.callback, spider)
+        if hasattr(spider, '_requests_to_follow'):
+            spider._requests_to_follow = self._profiledGenerator('links', spider._requests_to_follow, spider)
+        if not self.pipelines_profiled:
+            itemproc = self.crawler.engine.scraper.itemproc
+            itemproc.methods['process_item'] = [
+                self._profiled(pipelineName(method), method)
+                for method in itemproc.methods['process_item']]
+            self.pipelines_profiled = True
+
+    def spider_closed(self, spider):
+        profilers = self.profilers.pop(spider)
+        calls = self.calls.pop(spider)
+        out_dir = os.path.join(self.out_dir, '%s %s' % (spider.name, datetime.utcnow().strftime('%Y%m%dT%H%M%S')))
+        for name, profiler in sorted(profilers.items()):
+            profiler.write(out_dir)
+            log.msg("Profiled %d of %d %s calls." % (profiler.calls, calls.get(name, 0), name), spider=spider)
+        if profilers:
+            log.msg("Profiles written to " + out_dir, spider=spider)
+
+    def _sample(self, name, spider):
+        """Return the hook's CallProfiler if this call should be profiled."""
+        calls = self.calls.get(spider)
+        if calls is None:
+            return None
+        calls[name] = calls.get(name, 0) + 1
+        if self.active or random.random() >= self.sample_rate:
+            return None
+        profilers = self.profilers[spider]
+        if name not in profilers:
+            from polldata.utils.profiling import CallProfiler
+            profilers[name] = CallProfiler(name, self.trace_frames)
+        return profilers[name]
+
+    def _profiled(self, name, function, spider=None):
+        """Wrap a callback of the spider, or a pipeline's process_item(item, spider)."""
+        def profiled(*a, **kw):
+            profiler = self._sample(name, spider or a[-1])
+            if profiler is None:
+                return function(*a, **kw)
+            self.active = True
+            profiler.start()
+            try:
+                return function(*a, **kw)
+            finally:
+                profiler.stop()
+                self.active = False
+        profiled.pipeline_name = getattr(function, 'pipeline_name', None)
+        return profiled
+
+    def _profiledGenerator(self, name, function, spider):
+        """Wrap a generator method of the spider, profiling each step of a sampled call."""
+        def profiled(*a, **kw):
+            profiler = self._sample(name, spider)
+            if profiler is None:
+                for output in function(*a, **kw):
+                    yield output
+                return
+            outputs = function(*a, **kw)
+            new_call = True
+            while True:
+                self.active = True
+                profiler.start(new_call)
+                new_call = False
+                try:
+                    output = next(outputs)
+                except StopIteration:
+                    return
+                finally:
+                    profiler.stop()
+                    self.active = False
+                yield output
+        return profiled
+
+class AdaptiveConcurrency(object):
+    '''
+    Adjusts each site's concurrent requests and download delay to what it
+    can sustain, from the latency and errors of its responses.
+
+    Every site (downloader slot) gets a DomainThrottle (see
+    polldata.utils.adaptiveConcurrency), fed by AdaptiveConcurrencyMiddleware.
+    It starts at ADAPTIVE_CONCURRENCY_START requests and adds one, up to
+    CONCURRENT_REQUESTS_PER_DOMAIN, while the median latency stays near the
+    fastest seen, takes one away when requests
+    start queueing at the server, and halves the concurrency (or doubles the
+    delay) on a 429 or 503 response or too many errors.  Each change is
+    logged, eg.
+
+        Adaptive concurrency for www.realclearpolitics.com: increase
+        (latency 52ms), 5 requests, delay 0.00s
+
+    and counted in the stats ('adaptive_concurrency/increase', ...).  The
+    throttles outlive the spider, so the daemon's crawls start where the last
+    one ended.
+
+    When ROBOTSTXT_OBEY is set, a site's robots.txt Crawl-delay is the
+    lowest delay it gets.  DOWNLOAD_DELAY is the lowest delay for every site.
+    Responses replayed from the archive have no latency and are ignored.
+
+    The extension tunes the slots of Scrapy's downloader (its 'slots' and
+    'inactive_slots'); it turns itself off, with a warning, if the
+    downloader doesn't have them.
+
+    Settings:
+        ADAPTIVE_CONCURRENCY_ENABLED
+            Set to True to adapt each site's concurrency and delay.  Off by
+            default: CONCURRENT_REQUESTS_PER_DOMAIN and DOWNLOAD_DELAY are
+            used as they are.
+        ADAPTIVE_CONCURRENCY_START, ADAPTIVE_CONCURRENCY_MAX
+            The starting and highest concurrent requests per site.  Neither
+            goes above CONCURRENT_REQUESTS_PER_DOMAIN.
+        ADAPTIVE_CONCURRENCY_MAX_DELAY
+            The longest delay, in seconds, a back off can set.
+        ADAPTIVE_CONCURRENCY_WINDOW
+            Responses per decision.
+        ADAPTIVE_CONCURRENCY_LATENCY_RATIO
+            How many times the fastest latency counts as queueing.
+        ADAPTIVE_CONCURRENCY_ERROR_RATE
+            The fraction of a window's responses that may be errors (5xx,
+            timeouts...) before backing off.
+    '''
+
+    def __init__(self, crawler, start, options, obey_robots):
+        self.crawler = crawler
+        self.start = start
+        self.options = options
+        self.obey_robots = obey_robots
+        self.throttles = {}
+        self.enabled = True
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        settings = crawler.settings
+        if not settings.getbool('ADAPTIVE_CONCURRENCY_ENABLED', False):
+            raise NotConfigured
+        # never more than a site would get without the extension
+        per_domain = settings.getint('CONCURRENT_REQUESTS_PER_DOMAIN', 8)
+        options = {
+            'max_concurrency': min(settings.getint('ADAPTIVE_CONCURRENCY_MAX', per_domain), per_domain),
+            'min_delay': settings.getfloat('DOWNLOAD_DELAY', 0),
+            'max_delay': settings.getfloat('ADAPTIVE_CONCURRENCY_MAX_DELAY', 60),
+            'window': settings.getint('ADAPTIVE_CONCURRENCY_WINDOW', 10),
+            'latency_ratio': settings.getfloat('ADAPTIVE_CONCURRENCY_LATENCY_RATIO', 1.5),
+            'error_rate': settings.getfloat('ADAPTIVE_CONCURRENCY_ERROR_RATE', 0.1),
+        }
+        extension = cls(crawler, min(settings.getint('ADAPTIVE_CONCURRENCY_START', 2), per_domain), options,
+                        settings.getbool('ROBOTSTXT_OBEY', False))
+        # found by the middleware, see adaptiveConcurrency()
+        crawler.adaptive_concurrency = extension
+        crawler.signals.connect(extension.spider_opened, signals.spider_opened)
+        crawler.signals.connect(extension.spider_closed, signals.spider_closed)
+        crawler.signals.connect(extension.response_received, signals.response_received)
+        return extension
+
+    def spider_opened(self, spider):
+        downloader = self.crawler.engine.downloader
+        if not isinstance(getattr(downloader, 'slots', None), dict) or \
+                not isinstance(getattr(downloader, 'inactive_slots', None), dict):
+            self.enabled = False
+            log.msg("Adaptive concurrency disabled: this Scrapy's downloader has no slots to tune",
+                    level=log.WARNING, spider=spider)
+            return
+        # new slots start at the starting concurrency, not CONCURRENT_REQUESTS_PER_DOMAIN
+        spider.max_concurrent_requests = self.start
+
+    def spider_closed(self, spider):
+        if not self.enabled:
+            return
+        for key, throttle in sorted(self.throttles.items()):
+            log.msg(format="Adaptive concurrency for %(key)s: %(concurrency)d requests, delay %(delay).2fs "
+                           "after %(decisions)d changes",
+                    spider=spider, key=key, concurrency=throttle.concurrency, delay=throttle.delay,
+                    decisions=throttle.decisions)
+
+    def response_received(self, response, request, spider):
+        if response.status == 200 and urlparse_cached(response).path == '/robots.txt':
+            self.robotsTxt(request, response.body, spider)
+
+    def robotsTxt(self, request, body, spider):
+        """Apply the Crawl-delay of a site's robots.txt (fetched by request)."""
+        if not self.obey_robots or not self.enabled:
+            return
+        delay = crawlDelay(body, spider.settings.get('USER_AGENT') or '')
+        if delay:
+            self.throttle(self._slotKey(request)).setMinDelay(delay)
+            log.msg(format="Adaptive concurrency for %(key)s: robots.txt Crawl-delay is %(delay).2fs",
+                    spider=spider, key=self._slotKey(request), delay=delay)
+
+    def throttle(self, key):
+        throttle = self.throttles.get(key)
+        if throttle is None:
+            throttle = self.throttles[key] = DomainThrottle(self.start, **self.options)
+        return throttle
+
+    def apply(self, request):
+        """Set the request's downloader slot to its site's concurrency and delay."""
+        if not self.enabled:
+            return
+        key = self._slotKey(request)
+        slot = self._slot(key)
+        if slot is not None:
+            throttle = self.throttle(key)
+            slot.concurrency = throttle.concurrency
+            slot.delay = throttle.delay
+
+    def record(self, request, spider, response=None, exception=None):
+        """Feed a response, or a download error, to its site's throttle."""
+        if not self.enabled:
+            return
+        key = self._slotKey(request)
+        throttle = self.throttle(key)
+        if response is not None:
+            latency = request.meta.get('download_latency')
+            if latency is None:
+                return
+            decision = throttle.record(latency, response.status,
+                                       retry_after=retryAfter(response.headers.get('Retry-After')))
+        else:
+            decision = throttle.record(error=True)
+        if decision is None:
+            return
+
+        self.apply(request)
+        self.crawler.stats.inc_value('adaptive_concurrency/' + decision['action'].replace(' ', '_'), spider=spider)
+        log.msg(format="Adaptive concurrency for %(key)s: %(action)s (%(reason)s), %(concurrency)d requests, "
+                       "delay %(delay).2fs",
+                spider=spider, key=key, **decision)
+
+    def _slotKey(self, request):
+        # as the downloader names its slots
+        key = urlparse_cached(request).hostname or ''
+        if getattr(self.crawler.engine.downloader, 'ip_concurrency', None):
+            key = dnscache.get(key, key)
+        return key
+
+    def _slot(self, key):
+        downloader = self.crawler.engine.downloader
+        return downloader.slots.get(key) or downloader.inactive_slots.get(key)
+
+def adaptiveConcurrency(crawler):
+    """Return the crawler's AdaptiveConcurrency extension, or raise NotConfigured."""
+    extension = getattr(crawler, 'adaptive_concurrency', None)
+    if extension is None:
+        raise NotConfigured
+    return extension
+
+class AdaptiveConcurrencyMiddleware(object):
+    '''
+    Reports each download's latency, status or error to AdaptiveConcurrency,
+    and keeps the downloader's slots at its settings.  It must come after
+    (have a higher DOWNLOADER_MIDDLEWARES order than) RetryMiddleware, so it
+    sees the 503s that are retried.
+    '''
+
+    def __init__(self, throttle):
+        self.throttle = throttle
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        return cls(adaptiveConcurrency(crawler))
+
+    def process_request(self, request, spider):
+        self.throttle.apply(request)
+
+    def process_response(self, request, response, spider):
+        self.throttle.record(request, spider, response=response)
+        return response
+
+    def process_exception(self, request, exception, spider):
+        # IgnoreRequest comes from other middlewares (robots.txt), not the site
+        if not isinstance(exception, IgnoreRequest):
+            self.throttle.record(request, spider, exception=exception)
+
+def stageTiming(crawler):
+    """Return the crawler's StageTiming extension, or raise NotConfigured."""
+    extension = getattr(crawler, 'stage_timing', None)
+    if extension is None:
+        raise NotConfigured
+    return extension
+
+class StageTimingSpiderMiddleware(object):
+    '''
+    Times the spider's work on each page for StageTiming.
+
+    CrawlSpider callbacks are generators that run as their output is
+    consumed, so the time is the time spent getting each output from the
+    spider.  It must be the middleware closest to the spider (the highest
+    SPIDER_MIDDLEWARES order) so other middlewares aren't counted.
+    '''
+
+    def __init__(self, timing):
+        self.timing = timing
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        return cls(stageTiming(crawler))
+
+    def process_spider_output(self, response, result, spider):
+        # state pages are requested by the spider's rules
+        stage = 'parse' if response.meta.get('rule') is not None else 'links'
+        return self._timed(stage, result, spider)
+
+    def _timed(self, stage, result, spider):
+        elapsed = 0.0
+        items = 0
+        start = timer()
+        try:
+            for output in result:
+                elapsed += timer() - start
+                if isinstance(output, BaseItem):
+                    items += 1
+                yield output
+                start = timer()
+            elapsed += timer() - start
+        finally:
+            self.timing.observe(spider, 'stage_seconds', elapsed, stage=stage)
+            self.timing.inc(spider, 'pages_total', stage=stage)
+            if stage == 'parse':
+                self.timing.observe(spider, 'rows_per_page', items)
+
+class DownloadTimingMiddleware(object):
+    '''
+    Times each download for StageTiming.  It must be the downloader
+    middleware closest to the downloader (the highest DOWNLOADER_MIDDLEWARES
+    order).
+    '''
+
+    def __init__(self, timing):
+        self.timing = timing
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        return cls(stageTiming(crawler))
+
+    def process_request(self, request, spider):
+        request.meta['download_timing_start'] = timer()
+
+    def process_response(self, request, response, spider):
+        start = request.meta.pop('download_timing_start', None)
+        if start is not None:
+            self.timing.observe(spider, 'stage_seconds', timer() - start, stage='download')
+        return response
+
+    def process_exception(self, request, exception, spider):
+        if request.meta.pop('download_timing_start', None) is not None:
+            self.timing.inc(spider, 'download_errors_total', error=exception.__class__.__name__)
+
+class WarmStart(object):
+    '''
+    Keeps what a crawl otherwise looks up again every run in
+    WARM_START_FILE (see polldata.utils.warmStart.WarmStartCache), so the
+    next run's first requests don't wait for it:
+        robots.txt
+            Each site's robots.txt, kept for ROBOTSTXT_CACHE_TTL seconds and
+            restored by RobotsTxtCacheMiddleware (see
+            polldata.middlewares).
+        DNS
+            The downloader's DNS answers, kept for WARM_START_DNS_TTL
+            seconds and put back in its DNS cache (when DNSCACHE_ENABLED).
+        state page links
+            The links each race's widget lists, kept for
+            WARM_START_LINKS_TTL seconds.  The spider requests them as it
+            starts, alongside the widget, instead of after the widget has
+            been downloaded and scanned (see RaceSpider.start_requests).
+
+    The file is read when the spider opens, which takes a few milliseconds
+    (the 'warm_start/load_seconds' stat), and written when it closes; in
+    the daemon it is kept in its StateCache and written on its timer.  The
+    stats count what was restored ('warm_start/robots', 'warm_start/dns',
+    'warm_start/links'), and 'time_to_first_item' is set like StageTiming
+    does, so the gain can be measured without it.
+
+    Settings:
+        WARM_START_ENABLED
+            Set to False to look everything up again every run.  It is off
+            when ARCHIVE_REPLAY is set.
+    '''
+
+    def __init__(self, crawler, fName, ttls):
+        self.crawler = crawler
+        self.fName = fName
+        self.ttls = ttls
+        self.dns_enabled = crawler.settings.getbool('DNSCACHE_ENABLED')
+        self.started = None
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        settings = crawler.settings
+        # a replayed archive must be requested as it was recorded
+        if not settings.getbool('WARM_START_ENABLED', False) or settings.get('ARCHIVE_REPLAY'):
+            raise NotConfigured
+        ttls = {
+            'robots': settings.getint('ROBOTSTXT_CACHE_TTL', 24 * 3600) if settings.getbool('ROBOTSTXT_OBEY') else 0,
+            'dns': settings.getint('WARM_START_DNS_TTL', 3600),
+            'links': settings.getint('WARM_START_LINKS_TTL', 6 * 3600),
+        }
+        extension = cls(crawler, settings.get('WARM_START_FILE', 'data/warmstart.json'), ttls)
+        crawler.signals.connect(extension.spider_opened, signals.spider_opened)
+        crawler.signals.connect(extension.spider_closed, signals.spider_closed)
+        crawler.signals.connect(extension.item_scraped, signals.item_scraped)
+        crawler.signals.connect(extension.item_dropped, signals.item_dropped)
+        return extension
+
+    def spider_opened(self, spider):
+        start = self.started = timer()
+        load = lambda: WarmStartCache(self.fName, self.ttls)
+        cache = stateCache(self.crawler)
+        if cache is None:
+            self.cache = load()
+        else:
+            # shared by the daemon's crawls, which save it on a timer
+            self.cache = cache.get(('warm_start',), load, flush=WarmStartCache.save)
+        # found by the spider and RobotsTxtCacheMiddleware, see warmStartCache()
+        self.crawler.warm_start_cache = self.cache
+
+        stats = self.crawler.stats
+        stats.set_value('warm_start/load_seconds', round(timer() - start, 6), spider=spider)
+        if self.dns_enabled:
+            restored = 0
+            for host, address in self.cache.items('dns'):
+                if host not in dnscache:
+                    dnscache[str(host)] = str(address)
+                    restored += 1
+            stats.set_value('warm_start/dns', restored, spider=spider)
+
+    def spider_closed(self, spider):
+        if self.dns_enabled:
+            now = time.time()
+            for host, address in list(dnscache.items()):
+                if self.cache.get('dns', host, now) != address:
+                    self.cache.put('dns', host, address, now)
+        if stateCache(self.crawler) is None:
+            self.cache.save()
+
+    def item_scraped(self, item, response, spider):
+        self._firstItem(spider)
+
+    def item_dropped(self, item, spider, exception):
+        self._firstItem(spider)
+
+    def _firstItem(self, spider):
+        if self.started is not None:
+            firstItem(self.crawler.stats, spider, timer() - self.started)
+            self.started = None
@@ -7,6 +7,7 @@ from scrapy.item import Item, Field
 
 class PresPollItem(Item):
     # define the fields for your item here like:
+    race    = Field()   # the race's output name, see polldata.races
     state   = Field()
     service = Field()
     start   = Field()
@@ -15,4 +16,6 @@ class PresPollItem(Item):
     voters  = Field()
     dem     = Field()
     rep     = Field()
+    spread  = Field()   # dem - rep as a float, NaN if either is missing
     ind     = Field()
+    legacy  = Field()   # end and sample as read before normalization, see CsvExportPipeline
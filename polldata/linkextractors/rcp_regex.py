@@ -6,25 +6,68 @@ from w3lib.html import remove_tags, remove_entities, replace_escape_chars
 from scrapy.link import Link
 from scrapy.contrib.linkextractors.sgml import SgmlLinkExtractor
 
-linkre = re.compile(
-        "\\\\x3Coption\s.*?value=(\\\"[.#]+?\\\"|\\\'[.#]+?\\\'|[^\s]+?)(\\\\x3E|\s.*?\\\\x3E)(.*?)\\\\x3C[/ ]?option\\\\x3E",
-        re.DOTALL | re.IGNORECASE)
+# The widget's select box is written by javascript, so its tags are escaped:
+#     document.write('\x3Coption value="http://..."\x3EOhio: Romney vs. Obama\x3C/option\x3E');
+# Each pattern below only matches a short literal, so scanning the widget is
+# linear in its size (see iterOptions).
+optionStart = re.compile(r"\\x3Coption\s", re.IGNORECASE)
+valueAttr = re.compile(r"value=", re.IGNORECASE)
+valueEnd = re.compile(r"\s|\\x3E", re.IGNORECASE)
+tagEnd = re.compile(r"\\x3E", re.IGNORECASE)
+optionEnd = re.compile(r"\\x3C[/ ]?option\\x3E", re.IGNORECASE)
+anyTag = re.compile(r"\\x3C", re.IGNORECASE)
 
 def clean_link(link_text):
     """Remove leading and trailing whitespace and punctuation"""
     return link_text.strip("\t\r\n '\"\\")
 
+def iterOptions(text):
+    """Yield the raw (value, text) of each escaped option tag, in order.
+
+    Each option is only searched up to the start of the next one, so the scan
+    is linear in the size of the text, and options are yielded as soon as
+    they are read.  An option without a closing tag (which html allows) ends
+    at the next tag.  An option without a value is skipped.
+
+    Ex: '\\x3Coption value="/ohio.html"\\x3EOhio\\x3C/option\\x3E' -> ('"/ohio.html"', 'Ohio')
+    """
+    starts = optionStart.finditer(text)
+    current = next(starts, None)
+    while current is not None:
+        following = next(starts, None)
+        end = following.start() if following is not None else len(text)
+
+        value = valueAttr.search(text, current.end(), end)
+        value_end = value and valueEnd.search(text, value.end() + 1, end)
+        tag_end = value_end and tagEnd.search(text, value_end.start(), end)
+        if tag_end:
+            option_end = optionEnd.search(text, tag_end.end(), end) or anyTag.search(text, tag_end.end(), end)
+            yield text[value.end():value_end.start()], \
+                text[tag_end.end():option_end.start() if option_end else end]
+
+        current = following
+
 class RCP_RegexLinkExtractor(SgmlLinkExtractor):
     """High performant link extractor"""
 
-    def _extract_links(self, response_text, response_url, response_encoding, base_url=None):
+    def iterLinks(self, response_text, response_url, response_encoding, base_url=None):
+        """Yield each unique link of the widget as soon as it is read.
+
+        The links aren't filtered by the extractor's allow, deny, ... rules;
+        see RaceSpider._requests_to_follow.
+        """
         if base_url is None:
             base_url = urljoin(response_url, self.base_url) if self.base_url else response_url
 
         clean_url = lambda u: urljoin(base_url, remove_entities(clean_link(u.decode(response_encoding))))
         clean_text = lambda t: replace_escape_chars(remove_tags(t.decode(response_encoding))).strip()
 
-        links_text = linkre.findall(response_text)
-        urlstext = set([(clean_url(url), clean_text(text)) for url, _, text in links_text])
+        seen = set()
+        for url, text in iterOptions(response_text):
+            urltext = (clean_url(url), clean_text(text))
+            if urltext not in seen:
+                seen.add(urltext)
+                yield Link(*urltext)
 
-        return [Link(url, text) for url, text in urlstext]
+    def _extract_links(self, response_text, response_url, response_encoding, base_url=None):
+        return list(self.iterLinks(response_text, response_url, response_encoding, base_url))
@@ -0,0 +1,343 @@
+# Define your downloader middlewares here
+#
+# Don't forget to add your middleware to the DOWNLOADER_MIDDLEWARES setting
+# See: http://doc.scrapy.org/topics/downloader-middleware.html
+
+from scrapy import signals
+from scrapy import log
+from scrapy.contrib.downloadermiddleware.robotstxt import RobotsTxtMiddleware
+from scrapy.exceptions import IgnoreRequest, NotConfigured
+from scrapy.http import Headers, Request
+from scrapy.responsetypes import responsetypes
+from scrapy.utils.httpobj import urlparse_cached
+from datetime import datetime
+import base64
+import binascii
+import hashlib
+import json
+import os
+import time
+
+try:
+    import robotparser
+except ImportError:
+    from urllib import robotparser
+
+from polldata.utils.fileLock import updateJson
+from polldata.utils.responseArchive import ResponseArchive
+from polldata.utils.stateCache import stateCache
+from polldata.utils.warmStart import warmStartCache
+
+class ConditionalRequestMiddleware(object):
+    '''
+    Skips state pages that haven't changed since the last run.
+
+    For every state page (a request made by one of the spider's rules) the
+    page's validators are remembered between runs in
+    'data/<spider>_validators.json':
+     - the ETag and Last-Modified response headers, which are sent back as
+       If-None-Match and If-Modified-Since so the server can answer 304
+     - an md5 hash of the body, for servers that ignore the conditional
+       headers and send the same page again
+
+    When a page is unchanged the request is ignored, so the rule's callback
+    (eg. parseStatePolls) never runs.  The pages and bytes skipped are
+    recorded in the crawl stats under 'conditional/'.
+
+    The widget that lists the state pages is always downloaded, since the
+    state links are extracted from it.
+
+    When the crawler has a StateCache (see the daemon command), the
+    validators stay in memory between crawls and the cache writes them to
+    disk.  Only the pages whose validators changed are written, merged into
+    the file under its lock, so processes crawling different races with the
+    same spider don't lose each other's validators.
+
+    Settings:
+        CONDITIONAL_RECRAWL_ENABLED
+            Set to False to download and parse every page.  The middleware is
+            also disabled when replaying an archive (see
+            ResponseArchiveMiddleware), so every archived page is parsed.
+    '''
+
+    def __init__(self, stats, state_cache=None):
+        self.stats = stats
+        self.state_cache = state_cache
+        self.validators_fNames = {}
+        self.validators = {}
+        self.changed = {}
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        if not crawler.settings.getbool('CONDITIONAL_RECRAWL_ENABLED', True):
+            raise NotConfigured
+        if crawler.settings.get('ARCHIVE_REPLAY'):
+            raise NotConfigured
+        middleware = cls(crawler.stats, stateCache(crawler))
+        crawler.signals.connect(middleware.spider_opened, signals.spider_opened)
+        crawler.signals.connect(middleware.spider_closed, signals.spider_closed)
+        return middleware
+
+    def spider_opened(self, spider):
+        validators_fName = 'data/' + spider.name + '_validators.json'
+        changed = self.changed.setdefault(spider.name, set())
+        load = lambda: self._loadValidators(validators_fName, spider)
+        if self.state_cache is None:
+            validators = load()
+        else:
+            validators = self.state_cache.get(('validators', spider.name), load,
+                flush=lambda validators: self._saveValidators(validators_fName, validators, changed))
+        self.validators_fNames[spider] = validators_fName
+        self.validators[spider] = validators
+
+    def spider_closed(self, spider):
+        validators_fName = self.validators_fNames.pop(spider)
+        validators = self.validators.pop(spider)
+        if self.state_cache is None:
+            self._saveValidators(validators_fName, validators, self.changed.pop(spider.name))
+
+        log.msg("Conditional recrawl: skipped %d unchanged pages (%d bytes), %d pages changed." % (
+                    self.stats.get_value('conditional/pages_skipped', 0, spider=spider),
+                    self.stats.get_value('conditional/bytes_skipped', 0, spider=spider),
+                    self.stats.get_value('conditional/pages_changed', 0, spider=spider),
+                ), spider=spider)
+
+    def process_request(self, request, spider):
+        if not self._isConditional(request):
+            return None
+
+        validators = self.validators[spider].get(request.url)
+        if validators:
+            if validators.get('etag'):
+                request.headers.setdefault('If-None-Match', validators['etag'])
+            if validators.get('last_modified'):
+                request.headers.setdefault('If-Modified-Since', validators['last_modified'])
+        return None
+
+    def process_response(self, request, response, spider):
+        if not self._isConditional(request):
+            return response
+
+        validators = self.validators[spider].get(request.url)
+
+        if response.status == 304 and validators:
+            self._skip(spider, request, validators, "not modified")
+
+        if response.status != 200:
+            return response
+
+        body_hash = hashlib.md5(response.body).hexdigest()
+        if validators and validators.get('body_hash') == body_hash:
+            self._skip(spider, request, validators, "content unchanged")
+
+        self.validators[spider][request.url] = {
+            'etag': response.headers.get('ETag'),
+            'last_modified': response.headers.get('Last-Modified'),
+            'body_hash': body_hash,
+            'length': len(response.body),
+        }
+        self.changed[spider.name].add(request.url)
+        self.stats.inc_value('conditional/pages_changed', spider=spider)
+        return response
+
+    def _loadValidators(self, validators_fName, spider):
+        try:
+            validators_file = open(validators_fName, 'r')
+            validators = json.load(validators_file)
+            validators_file.close()
+        except IOError:
+            # first run, every page is new
+            validators = {}
+        except ValueError:
+            # a malformed file only costs a full crawl, so start over
+            log.msg("Malformed validators file " + validators_fName + ", ignoring it.",
+                    level=log.WARNING, spider=spider)
+            validators = {}
+        return validators
+
+    def _saveValidators(self, validators_fName, validators, changed):
+        if not changed and os.path.exists(validators_fName):
+            return
+        merged = updateJson(validators_fName, dict((url, validators[url]) for url in changed))
+        changed.clear()
+        # pick up the pages other processes saved
+        validators.update(merged)
+
+    def _isConditional(self, request):
+        """Only pages found by the spider's rules can be skipped."""
+        return request.meta.get('rule') is not None
+
+    def _skip(self, spider, request, validators, reason):
+        self.stats.inc_value('conditional/pages_skipped', spider=spider)
+        self.stats.inc_value('conditional/bytes_skipped', validators.get('length', 0), spider=spider)
+        log.msg(format="Skipping %(request)s: %(reason)s", level=log.DEBUG, spider=spider,
+                request=request, reason=reason)
+        # without a message, so the scraper doesn't log the skip as an error
+        raise IgnoreRequest()
+
+class ResponseArchiveMiddleware(object):
+    '''
+    Archives every downloaded response, and replays archived crawls offline.
+
+    When recording, each response is stored in the archive at
+    ARCHIVE_DIR (see polldata.utils.responseArchive): bodies are gzipped and
+    deduplicated by their sha1, and every crawl gets an index of the urls it
+    fetched.
+
+    When ARCHIVE_REPLAY is set, nothing is downloaded.  Each request is
+    answered from the archive, so the archived pages go through the spider's
+    rules, callbacks and item pipelines exactly as in a live crawl.  Requests
+    for pages that aren't archived are ignored.  Replayed responses skip the
+    downloader (and its delays), so a replay runs as fast as the pages can be
+    parsed; the elapsed time is logged when the spider closes.
+
+    Nothing is ever removed from the archive while recording; `scrapy
+    prunearchive` removes the crawls and pages older than
+    ARCHIVE_MAX_AGE_DAYS (see ResponseArchive.prune).
+
+    Settings:
+        ARCHIVE_ENABLED
+            Set to True to record every crawl.  Off by default; a replay
+            (ARCHIVE_REPLAY) doesn't need it.
+        ARCHIVE_DIR
+            The archive directory.
+        ARCHIVE_REPLAY
+            Empty to record; 'latest' to replay the newest copy of every page
+            the spider has fetched; or a crawl id (see
+            ResponseArchive.crawls) to replay a single crawl.
+    '''
+
+    def __init__(self, stats, archive, replay):
+        self.stats = stats
+        self.archive = archive
+        self.replay = replay
+        self.crawl_ids = {}
+        self.indexes = {}
+        self.start_times = {}
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        settings = crawler.settings
+        # a replay needs the archive, whether or not new crawls are recorded
+        if not settings.getbool('ARCHIVE_ENABLED', False) and not settings.get('ARCHIVE_REPLAY'):
+            raise NotConfigured
+        archive = ResponseArchive(settings.get('ARCHIVE_DIR', 'data/archive'))
+        middleware = cls(crawler.stats, archive, settings.get('ARCHIVE_REPLAY'))
+        crawler.signals.connect(middleware.spider_opened, signals.spider_opened)
+        crawler.signals.connect(middleware.spider_closed, signals.spider_closed)
+        return middleware
+
+    def spider_opened(self, spider):
+        self.start_times[spider] = time.time()
+        if self.replay:
+            self.indexes[spider] = self.archive.index(spider.name, self.replay)
+            log.msg("Replaying %d archived pages from crawl '%s'." % (len(self.indexes[spider]), self.replay),
+                    spider=spider)
+        else:
+            self.crawl_ids[spider] = datetime.utcnow().strftime('%Y%m%dT%H%M%S')
+
+    def spider_closed(self, spider):
+        elapsed = time.time() - self.start_times.pop(spider)
+        if self.replay:
+            self.indexes.pop(spider)
+            replayed = self.stats.get_value('archive/replayed', 0, spider=spider)
+            log.msg("Replayed %d pages in %.2f seconds (%.1f pages/second)." % (
+                        replayed, elapsed, replayed / elapsed if elapsed else 0.0,
+                    ), spider=spider)
+        else:
+            self.archive.closeCrawl(spider.name, self.crawl_ids.pop(spider))
+
+    def process_request(self, request, spider):
+        if not self.replay:
+            return None
+
+        entry = self.indexes[spider].get(request.url)
+        if entry is None:
+            self.stats.inc_value('archive/missing', spider=spider)
+            log.msg(format="Page not archived: %(request)s", level=log.DEBUG, spider=spider, request=request)
+            raise IgnoreRequest()
+
+        body = self.archive.loadBody(entry['sha1'])
+        headers = Headers(entry['headers'])
+        respcls = responsetypes.from_args(headers=headers, url=request.url, body=body)
+        self.stats.inc_value('archive/replayed', spider=spider)
+        return respcls(url=request.url, status=entry['status'], headers=headers, body=body, flags=['archived'])
+
+    def process_response(self, request, response, spider):
+        if self.replay or 'archived' in response.flags or response.status == 304:
+            return response
+
+        # The body has already been decompressed, so the encoding headers no
+        # longer apply to it.
+        headers = dict((name, response.headers.getlist(name)) for name in response.headers.keys()
+                       if name.lower() not in ('content-encoding', 'content-length', 'transfer-encoding'))
+        self.archive.record(spider.name, self.crawl_ids[spider], response.url, response.status, headers, response.body)
+        self.stats.inc_value('archive/recorded', spider=spider)
+        return response
+
+class RobotsTxtCacheMiddleware(RobotsTxtMiddleware):
+    '''
+    Obeys robots.txt like Scrapy's RobotsTxtMiddleware, which it replaces in
+    DOWNLOADER_MIDDLEWARES, but keeps each site's parsed robots.txt until it
+    is ROBOTSTXT_CACHE_TTL seconds old instead of dropping it when the spider
+    closes.  The crawls of a long-running process (see the daemon command)
+    then only fetch robots.txt once a day.
+
+    With the WarmStart extension (see polldata.extensions), each robots.txt
+    fetched is also saved for the next run, which restores the fresh ones
+    when its spider opens: its first requests are checked against them at
+    once, rather than let through while robots.txt is being fetched.
+    '''
+
+    def __init__(self, crawler):
+        super(RobotsTxtCacheMiddleware, self).__init__(crawler)
+        self.ttl = crawler.settings.getint('ROBOTSTXT_CACHE_TTL', 24 * 3600)
+        self._fetched = {}
+
+    def robot_parser(self, request, spider):
+        netloc = urlparse_cached(request).netloc
+        fetched = self._fetched.get(netloc)
+        if fetched is not None and time.time() - fetched >= self.ttl:
+            del self._parsers[netloc]
+            del self._fetched[netloc]
+        if netloc not in self._parsers:
+            self._fetched[netloc] = time.time()
+        return super(RobotsTxtCacheMiddleware, self).robot_parser(request, spider)
+
+    def _parse_robots(self, response):
+        super(RobotsTxtCacheMiddleware, self)._parse_robots(response)
+        cache = warmStartCache(self.crawler)
+        if cache is not None:
+            # anything but a robots.txt allows everything, as an empty one does
+            body = response.body if response.status == 200 else b''
+            # the body is stored base64 encoded, as it may not be valid UTF-8
+            cache.put('robots', urlparse_cached(response).netloc,
+                      {'base64': base64.b64encode(body).decode('ascii')})
+
+    def spider_opened(self, spider):
+        super(RobotsTxtCacheMiddleware, self).spider_opened(spider)
+        cache = warmStartCache(self.crawler)
+        if cache is None:
+            return
+        restored = 0
+        for netloc, value in cache.items('robots'):
+            if netloc in self._parsers:
+                continue
+            try:
+                body = base64.b64decode(value['base64'].encode('ascii'))
+            except (TypeError, KeyError, ValueError, binascii.Error):
+                continue
+            rp = robotparser.RobotFileParser('http://%s/robots.txt' % netloc)
+            rp.parse(body.splitlines())
+            self._parsers[netloc] = rp
+            # it expires ROBOTSTXT_CACHE_TTL after it was fetched, not now
+            self._fetched[netloc] = cache.stored('robots', netloc)
+            restored += 1
+            throttle = getattr(self.crawler, 'adaptive_concurrency', None)
+            if throttle is not None:
+                throttle.robotsTxt(Request('http://%s/robots.txt' % netloc), body, spider)
+        self.crawler.stats.set_value('warm_start/robots', restored, spider=spider)
+
+    def spider_closed(self, spider):
+        del self._spider_netlocs[spider]
+        del self._useragents[spider]
@@ -3,11 +3,89 @@
 # Don't forget to add your pipeline to the ITEM_PIPELINES setting
 # See: http://doc.scrapy.org/topics/item-pipeline.html
 
-from scrapy import signals
+from scrapy import log, signals
 from scrapy.contrib.exporter import CsvItemExporter
-from scrapy.exceptions import DropItem
-import json
+from scrapy.exceptions import DropItem, NotConfigured
+from scrapy.utils.misc import load_object
+from datetime import datetime
+import csv
 import hashlib
+import json
+import os
+import shutil
+
+from polldata.utils.externalSort import ExternalSorter
+from polldata.utils.fileLock import AtomicFile, FileLock, FileLocked
+from polldata.utils.partitions import PartitionedOutput, stateSlug
+from polldata.utils.pollAverage import StateAverage, toOrdinal
+from polldata.utils.pollDatabase import PollDatabase, pollRow
+from polldata.utils.pollRecords import PollRecord
+from polldata.utils.pollRevisions import PollRevisions
+from polldata.utils.stateCache import stateCache
+
+class DuplicatePoll(DropItem):
+    """A poll that was already exported by an earlier run."""
+
+def spiderOutputs(spider):
+    """Return the names of a spider's outputs (one per race it crawls)."""
+    return getattr(spider, 'outputs', None) or [spider.name]
+
+def itemOutput(item, spider):
+    """Return the name of the output an item belongs to."""
+    return item.get('race') or spider.name
+
+def pollFingerprint(item, end=None, sample=None):
+    """Return the md5 hexdigest that identifies a poll in the seen stores.
+
+    end and sample replace the item's own, eg. with its legacy fields.
+    """
+    end = item['end'] if end is None else end
+    sample = item['sample'] if sample is None else sample
+    identifier = item['dem'] + end + item['rep'] + str(item['ind']) + sample + item['service']
+    hasher = hashlib.md5()
+    hasher.update(identifier)
+    return hasher.hexdigest()
+
+def lockOutputs(outputs, settings):
+    """Lock outputs (see spiderOutputs) for as long as the process runs.
+
+    Two processes writing the same output (eg. `scrapy crawl pres2012` and
+    `scrapy crawl races`, which both write pres2012) would overwrite each
+    other's files in data/, so each output has a lock file,
+    'data/<output>.lock', that the crawl, daemon, reparse and compact
+    commands take before starting.  Spiders with different outputs, like
+    `races -a races=pres2012` and `races -a races=senate2012`, run in
+    parallel.
+
+    Settings:
+        SPIDER_LOCK_ENABLED
+            Set to False to not lock outputs.
+        SPIDER_LOCK_TIMEOUT
+            Seconds to wait for another process to finish (default: 0, fail
+            at once).
+
+    Returns:
+        The FileLocks, held until they are released or the process exits.
+
+    Raises:
+        FileLocked if an output is still locked after SPIDER_LOCK_TIMEOUT.
+        None of the locks are held then.
+    """
+    if not settings.getbool('SPIDER_LOCK_ENABLED', True):
+        return []
+    timeout = settings.getfloat('SPIDER_LOCK_TIMEOUT', 0)
+    locks = []
+    try:
+        # always in the same order, so two waiting processes can't deadlock
+        for output in sorted(set(outputs)):
+            lock = FileLock('data/' + output + '.lock')
+            lock.acquire(timeout)
+            locks.append(lock)
+    except FileLocked:
+        for lock in locks:
+            lock.release()
+        raise
+    return locks
 
 class CsvExportPipeline(object):
     '''
@@ -19,18 +97,46 @@ class CsvExportPipeline(object):
         - Define them in the item itself?
      - From BaseItemExporter:
         - fields_to_export (CsvItemExporter will respect the order)
-    '''
 
-    # TODO: Track spider names to make sure the same spider isn't running twice.
-    #       Use some sort of persistent tracking?  ie a file that indicates a
-    #       lock?
-    #           - this would prevent the same spider from being run twice by
-    #             two different calls to crawl
+    A spider that crawls several races (see RaceSpider) gets one set of files
+    per race, named after the race's output name, and each item is routed by
+    its 'race' field.
 
-    def __init__(self):
+    Polls that were exported by a previous run are remembered in a seen store,
+    selected with the SEEN_STORE setting (see polldata.utils.seenStore).  When
+    the crawler has a StateCache (see the daemon command), the seen stores
+    stay open between crawls and the cache writes them to disk.
+
+    '_latest.csv' is written under a temporary name and renamed over the
+    previous one when the spider closes, so readers never see a partial
+    file.  Crawls of the same output are kept apart by lockOutputs.
+
+    New polls are sorted by state before they are written.  They are held in
+    memory, as compact PollRecords (see polldata.utils.pollRecords), up to
+    CSV_EXPORT_MAX_BUFFERED_ITEMS (50000 by default): whenever the cap is
+    reached the buffered polls are sorted and spilled to a run file in
+    'data/<spider>_runs/', and the runs are merged into '_latest.csv' when the
+    spider closes.  Setting it to 0 holds every poll until the spider
+    closes.  The run files are plain CSV, so a long backfill's partial
+    results can be read while it is running.
+
+    A revised poll has a new fingerprint, so it is exported again as a new
+    row; PollRevisionPipeline's change feed reports it as an update instead.
+
+    The spiders used to read the end date and sample of a poll differently
+    (see polldata.utils.statePage.legacyFields), so polls they exported
+    before the normalization was added have another fingerprint.  Each item
+    carries its legacy fields, and a poll whose legacy fingerprint is in the
+    seen store is not new: its new fingerprint is added, and it is dropped.
+    '''
+
+    def __init__(self, settings, state_cache=None):
+        self.settings = settings
+        self.state_cache = state_cache
+        self.seen_store_cls = load_object(
+            settings.get('SEEN_STORE', 'polldata.utils.seenStore.SharedSeenStore'))
+        self.max_buffered_items = settings.getint('CSV_EXPORT_MAX_BUFFERED_ITEMS', 50000)
         self.latest_polls_files = {}
-        self.exporters = {}
-        self.prev_polls_fNames = {}
         self.prev_polls = {}
         self.newitems = {}
 
@@ -38,60 +144,456 @@ class CsvExportPipeline(object):
     # this is the main entry point for the pipeline
     @classmethod
     def from_crawler(cls, crawler):
-        pipeline = cls()
+        pipeline = cls(crawler.settings, stateCache(crawler))
         crawler.signals.connect(pipeline.spider_opened, signals.spider_opened)
         crawler.signals.connect(pipeline.spider_closed, signals.spider_closed)
         return pipeline
 
     def spider_opened(self, spider):
-        latest_polls_file = open('data/' + spider.name + '_latest.csv', 'w')
-        self.latest_polls_files[spider] = latest_polls_file
+        for output in spiderOutputs(spider):
+            latest_polls_file = AtomicFile('data/' + output + '_latest.csv')
+            self.latest_polls_files[output] = latest_polls_file
 
-        exporter = CsvItemExporter(latest_polls_file, fields_to_export=spider.fields_to_export)
-        exporter.start_exporting()
-        self.exporters[spider] = exporter
+            self.prev_polls[output] = self._seenStore(output)
 
-        prev_polls_fName = 'data/' + spider.name + '_dict.json'
-        try:
-            prev_polls_file = open(prev_polls_fName, 'r')
-            prev_polls = json.load(prev_polls_file)
-            prev_polls_file.close()
-        except (IOError):
-            # data/dict.json doesn't exist
-            prev_polls = []
-        except ValueError:
-            # dict.json is malformed, should be inspected before being overwritten
-            raise ValueError("Malformed prev_polls_file for " + spider.name + ".")
-        self.prev_polls_fNames[spider] = prev_polls_fName
-        self.prev_polls[spider] = prev_polls
-
-        self.newitems[spider] = []
+            self.newitems[output] = ExternalSorter(
+                'data/' + output + '_runs',
+                spider.fields_to_export,
+                'state',
+                self.max_buffered_items or None,
+                CsvItemExporter,
+                PollRecord,
+            )
 
     def spider_closed(self, spider):
-        sorteditems = sorted(self.newitems[spider], key=lambda item: item['state'])
-        for item in sorteditems:
-            self.exporters[spider].export_item(item)
-        self.exporters[spider].finish_exporting()
+        for output in spiderOutputs(spider):
+            newitems = self.newitems.pop(output)
+            latest_polls_file = self.latest_polls_files.pop(output)
+            newitems.merge(latest_polls_file)
+            latest_polls_file.commit()
+            newitems.cleanup()
 
-        latest_polls_file = self.latest_polls_files.pop(spider)
-        latest_polls_file.close()
+            prev_polls = self.prev_polls.pop(output)
+            if self.state_cache is None:
+                prev_polls.close()
 
-        prev_polls_fName = self.prev_polls_fNames.pop(spider)
-        prev_polls_file = open(prev_polls_fName, 'w')
-        prev_polls_file.write( json.dumps(self.prev_polls[spider]) )
-        prev_polls_file.close()
+    def _seenStore(self, output):
+        load = lambda: self.seen_store_cls.from_settings(self.settings, 'data/' + output)
+        if self.state_cache is None:
+            return load()
+        return self.state_cache.get(('seen', output), load,
+                                    flush=lambda store: store.flush(),
+                                    close=lambda store: store.close())
 
     def process_item(self, item, spider):
-        prev_polls = self.prev_polls[spider]
+        output = itemOutput(item, spider)
+        prev_polls = self.prev_polls[output]
 
-        identifier = item['dem']+item['end']+item['rep']+str(item['ind'])+item['sample']+item['service']
-        hasher = hashlib.md5()
-        hasher.update(identifier)
+        poll_hash = pollFingerprint(item)
+        legacy = item.get('legacy')
+        if legacy:
+            legacy_hash = pollFingerprint(item, legacy['end'], legacy['sample'])
+            if legacy_hash != poll_hash and legacy_hash in prev_polls:
+                # exported before the polls were normalized: remember it by
+                # its new fingerprint from now on
+                prev_polls.add(poll_hash)
+                raise DuplicatePoll("Poll is not new.")
 
-        poll_hash = hasher.hexdigest()
-        if poll_hash not in prev_polls:
-            prev_polls.append(poll_hash)
-            self.newitems[spider].append(item)
+        if prev_polls.add(poll_hash):
+            self.newitems[output].add(item)
             return item
         else:
-            raise DropItem("Poll is not new.")
+            raise DuplicatePoll("Poll is not new.")
+
+class TypedExportPipeline(object):
+    '''
+    Exports Poll Items as typed NumPy columns, next to the CSV files.
+
+    Items are converted to float percentages, integer sample sizes, real
+    dates and categorical states, services and sample types (see
+    polldata.utils.typedColumns for the format), so they can be loaded without
+    parsing any text:
+
+        from polldata.utils.typedColumns import loadColumns
+        columns = loadColumns('data/pres2012_latest.typed')
+
+    Like '_latest.csv', 'data/<output>_latest.typed/' only holds the polls
+    that are new in this run, and only the spider's fields_to_export.  It must
+    come after CsvExportPipeline in ITEM_PIPELINES, so polls that aren't new
+    have already been dropped.  Items are written in arrival order, in row
+    groups of TYPED_EXPORT_BATCH_ITEMS items, so memory stays bounded and the
+    row groups written so far can be read during a crawl.
+
+    The pipeline is disabled if NumPy isn't installed or TYPED_EXPORT_ENABLED
+    is False.
+    '''
+
+    def __init__(self, batch_items):
+        self.batch_items = batch_items
+        self.fields = {}
+        self.rows = {}
+        self.row_groups = {}
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        if not crawler.settings.getbool('TYPED_EXPORT_ENABLED', True):
+            raise NotConfigured
+        try:
+            import polldata.utils.typedColumns
+        except ImportError:
+            raise NotConfigured("TypedExportPipeline requires numpy")
+        pipeline = cls(crawler.settings.getint('TYPED_EXPORT_BATCH_ITEMS', 10000))
+        crawler.signals.connect(pipeline.spider_opened, signals.spider_opened)
+        crawler.signals.connect(pipeline.spider_closed, signals.spider_closed)
+        return pipeline
+
+    def spider_opened(self, spider):
+        for output in spiderOutputs(spider):
+            out_dir = 'data/' + output + '_latest.typed'
+            # replaced every run, like _latest.csv
+            if os.path.isdir(out_dir):
+                shutil.rmtree(out_dir)
+            self.fields[output] = list(spider.fields_to_export)
+            self.rows[output] = dict((field, []) for field in spider.fields_to_export)
+            self.row_groups[output] = 0
+
+    def spider_closed(self, spider):
+        for output in spiderOutputs(spider):
+            self._flush(output)
+            del self.fields[output]
+            del self.rows[output]
+            del self.row_groups[output]
+
+    def process_item(self, item, spider):
+        output = itemOutput(item, spider)
+        rows = self.rows[output]
+        for field in self.fields[output]:
+            rows[field].append(item.get(field))
+
+        if len(rows[self.fields[output][0]]) >= self.batch_items:
+            self._flush(output)
+        return item
+
+    def _flush(self, output):
+        from polldata.utils.typedColumns import writeRowGroup
+
+        fields = self.fields[output]
+        if not fields or not self.rows[output][fields[0]]:
+            return
+        writeRowGroup('data/' + output + '_latest.typed', self.row_groups[output], fields,
+                      self.rows[output])
+        self.row_groups[output] += 1
+        self.rows[output] = dict((field, []) for field in fields)
+
+class PartitionedExportPipeline(object):
+    '''
+    Exports Poll Items into an append-only output, partitioned by run and state.
+
+    '_latest.csv' is replaced every run, so a consumer that misses a run
+    loses its polls.  This pipeline keeps every run instead: each run's new
+    polls are written to 'data/<output>/runs/<run id>/<state>.csv', and when
+    the spider closes the files are listed in 'data/<output>/manifest.json'
+    with their row counts and checksums.  A consumer remembers the highest
+    partition seq it has read and asks for the partitions added since (see
+    polldata.utils.partitions.PartitionedOutput).  Files are written under
+    temporary names and only appear in the manifest once complete, so a
+    crashed run never exposes partial partitions.
+
+    Older partitions can be merged with `scrapy compact <output>`.
+
+    It must come after CsvExportPipeline in ITEM_PIPELINES, so polls that
+    aren't new have already been dropped.  Set PARTITIONED_EXPORT_ENABLED to
+    False to disable it.
+    '''
+
+    def __init__(self):
+        self.run_ids = {}
+        self.partitions = {}
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        if not crawler.settings.getbool('PARTITIONED_EXPORT_ENABLED', True):
+            raise NotConfigured
+        pipeline = cls()
+        crawler.signals.connect(pipeline.spider_opened, signals.spider_opened)
+        crawler.signals.connect(pipeline.spider_closed, signals.spider_closed)
+        return pipeline
+
+    def spider_opened(self, spider):
+        run_id = datetime.utcnow().strftime('%Y%m%dT%H%M%SZ') + '-%d' % os.getpid()
+        for output in spiderOutputs(spider):
+            self.run_ids[output] = run_id
+            self.partitions[output] = {}
+
+    def spider_closed(self, spider):
+        for output in spiderOutputs(spider):
+            run_id = self.run_ids.pop(output)
+            partitions = self.partitions.pop(output)
+            root = 'data/' + output
+
+            committed = []
+            for partition in partitions.values():
+                partition['exporter'].finish_exporting()
+                partition['file'].commit()
+                committed.append({'state': partition['state'], 'path': partition['path'],
+                                  'rows': partition['rows']})
+
+            if committed:
+                PartitionedOutput(root).commit(run_id, committed, {'spider': spider.name})
+
+    def process_item(self, item, spider):
+        output = itemOutput(item, spider)
+        slug = stateSlug(item.get('state'))
+
+        partitions = self.partitions[output]
+        partition = partitions.get(slug)
+        if partition is None:
+            path = 'runs/%s/%s.csv' % (self.run_ids[output], slug)
+            fName = os.path.join('data', output, path)
+            if not os.path.isdir(os.path.dirname(fName)):
+                os.makedirs(os.path.dirname(fName))
+            # appears under its name, complete, when the spider closes
+            partition_file = AtomicFile(fName, 'wb')
+            exporter = CsvItemExporter(partition_file, fields_to_export=spider.fields_to_export)
+            exporter.start_exporting()
+            partition = partitions[slug] = {
+                'state': item.get('state'),
+                'path': path,
+                'file': partition_file,
+                'exporter': exporter,
+                'rows': 0,
+            }
+
+        partition['exporter'].export_item(item)
+        partition['rows'] += 1
+        return item
+
+class PollingAveragePipeline(object):
+    '''
+    Keeps a polling average per state, updated as new polls arrive.
+
+    Each state's average is the mean of the latest poll from each service
+    whose end date is within POLLING_AVERAGE_WINDOW_DAYS of the state's
+    newest poll (see polldata.utils.pollAverage).  Only the latest poll of
+    each service is kept, in 'data/<output>_averages.json', so the next run
+    picks up where this one stopped without rereading any CSV files.
+
+    When the spider closes, the averages of the states that received new
+    polls are recomputed, and every state's current average is written to
+    'data/<output>_averages.csv'.
+
+    It must come after CsvExportPipeline in ITEM_PIPELINES, so each poll is
+    only counted once.  Set POLLING_AVERAGE_ENABLED to False to disable it.
+    '''
+
+    fields = ['state', 'polls', 'start', 'end', 'dem', 'rep', 'spread']
+
+    def __init__(self, window_days):
+        self.window_days = window_days
+        self.states = {}
+        self.averages = {}
+        self.changed = {}
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        if not crawler.settings.getbool('POLLING_AVERAGE_ENABLED', True):
+            raise NotConfigured
+        pipeline = cls(crawler.settings.getint('POLLING_AVERAGE_WINDOW_DAYS', 30))
+        crawler.signals.connect(pipeline.spider_opened, signals.spider_opened)
+        crawler.signals.connect(pipeline.spider_closed, signals.spider_closed)
+        return pipeline
+
+    def spider_opened(self, spider):
+        for output in spiderOutputs(spider):
+            saved = {}
+            fName = 'data/' + output + '_averages.json'
+            if os.path.exists(fName):
+                saved_file = open(fName, 'r')
+                try:
+                    saved = json.load(saved_file)
+                except ValueError:
+                    # don't lose the saved polls by writing over them
+                    raise ValueError("Malformed averages file " + fName + ".")
+                finally:
+                    saved_file.close()
+
+            self.states[output] = dict((state, StateAverage(entry['latest']))
+                                       for state, entry in saved.get('states', {}).items())
+            self.averages[output] = dict((state, entry.get('average'))
+                                         for state, entry in saved.get('states', {}).items())
+            # a different window changes every average
+            if saved.get('window_days') != self.window_days:
+                self.changed[output] = set(self.states[output])
+            else:
+                self.changed[output] = set()
+
+    def spider_closed(self, spider):
+        for output in spiderOutputs(spider):
+            states = self.states.pop(output)
+            averages = self.averages.pop(output)
+            changed = self.changed.pop(output)
+
+            for state in changed:
+                averages[state] = states[state].average(self.window_days)
+
+            self._writeJson('data/' + output + '_averages.json', {
+                'window_days': self.window_days,
+                'states': dict((state, {'latest': states[state].toJson(),
+                                        'average': averages.get(state)})
+                               for state in states),
+            })
+            self._writeCsv('data/' + output + '_averages.csv', averages)
+            log.msg("Averages for %s: recomputed %d of %d states" % (output, len(changed), len(states)),
+                    spider=spider)
+
+    def process_item(self, item, spider):
+        end = toOrdinal(item.get('end'))
+        try:
+            dem = float(item.get('dem'))
+            rep = float(item.get('rep'))
+        except (TypeError, ValueError):
+            return item
+        if end is None:
+            return item
+
+        output = itemOutput(item, spider)
+        state = item.get('state')
+        states = self.states[output]
+        if state not in states:
+            states[state] = StateAverage()
+        if states[state].add(item.get('service'), end, dem, rep):
+            self.changed[output].add(state)
+        return item
+
+    def _writeJson(self, fName, data):
+        with AtomicFile(fName) as data_file:
+            data_file.write( json.dumps(data, indent=1, sort_keys=True) )
+
+    def _writeCsv(self, fName, averages):
+        with AtomicFile(fName, 'wb') as data_file:
+            writer = csv.writer(data_file)
+            writer.writerow(self.fields)
+            for state in sorted(averages):
+                average = averages[state]
+                if average is not None:
+                    writer.writerow([state.encode('utf-8')] +
+                                    [average[field] for field in self.fields[1:]])
+
+class SqlitePollPipeline(object):
+    '''
+    Stores every scraped poll in a SQLite database, SQLITE_DATABASE.
+
+    Unlike the CSV files, the database isn't deduplicated by the md5 of each
+    poll's values: polls are upserted on their natural key (race, state,
+    service, dates and sample type, see polldata.utils.pollDatabase), so a
+    poll that RCP revises updates its row.  The table is indexed on
+    (state, end_date), (service) and (race, year) for queries like "all LV
+    polls in Ohio since September".
+
+    Items are written in batches of SQLITE_BATCH_ITEMS, one transaction each,
+    and the database is in WAL mode so it can be queried during a crawl.
+
+    It comes before CsvExportPipeline in ITEM_PIPELINES so it sees every poll,
+    including the ones that aren't new.  It is disabled unless
+    SQLITE_EXPORT_ENABLED is True.  Existing CSV and _dict.json files can be
+    loaded once with `scrapy importdb`.
+    '''
+
+    def __init__(self, fName, batch_items, stats):
+        self.fName = fName
+        self.batch_items = batch_items
+        self.stats = stats
+        self.database = None
+        self.batch = []
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        if not crawler.settings.getbool('SQLITE_EXPORT_ENABLED', False):
+            raise NotConfigured
+        pipeline = cls(crawler.settings.get('SQLITE_DATABASE', 'data/polls.db'),
+                       crawler.settings.getint('SQLITE_BATCH_ITEMS', 500), crawler.stats)
+        crawler.signals.connect(pipeline.spider_opened, signals.spider_opened)
+        crawler.signals.connect(pipeline.spider_closed, signals.spider_closed)
+        return pipeline
+
+    def spider_opened(self, spider):
+        self.database = PollDatabase(self.fName)
+
+    def spider_closed(self, spider):
+        self._flush(spider)
+        self.database.close()
+        self.database = None
+
+    def process_item(self, item, spider):
+        self.batch.append(pollRow(item, itemOutput(item, spider)))
+        if len(self.batch) >= self.batch_items:
+            self._flush(spider)
+        return item
+
+    def _flush(self, spider):
+        if not self.batch:
+            return
+        inserted, updated = self.database.upsert(self.batch)
+        self.stats.inc_value('sqlite/upserted', len(self.batch), spider=spider)
+        self.stats.inc_value('sqlite/inserted', inserted, spider=spider)
+        self.stats.inc_value('sqlite/updated', updated, spider=spider)
+        self.batch = []
+
+class PollRevisionPipeline(object):
+    '''
+    Writes a change feed of each race's polls, 'data/<race>_changes.jsonl'.
+
+    Polls are keyed by race, state, service, dates and sample type, like
+    SqlitePollPipeline's rows, so a poll whose numbers RCP revises is an
+    update rather than a new poll, and a poll that disappears from its state
+    page is a delete.  Consumers apply the changes after the last one they
+    saw instead of reloading the CSV files (see
+    polldata.utils.pollRevisions).  The first crawl inserts every poll.
+
+    It comes before CsvExportPipeline in ITEM_PIPELINES so it sees every
+    poll.  It is disabled unless POLL_REVISIONS_ENABLED is True.  When the
+    crawler has a StateCache (see the daemon command), the revisions stay in
+    memory between crawls and the cache writes them to disk.
+    '''
+
+    def __init__(self, stats, state_cache=None):
+        self.stats = stats
+        self.state_cache = state_cache
+        self.revisions = {}
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        if not crawler.settings.getbool('POLL_REVISIONS_ENABLED', False):
+            raise NotConfigured
+        pipeline = cls(crawler.stats, stateCache(crawler))
+        crawler.signals.connect(pipeline.spider_opened, signals.spider_opened)
+        crawler.signals.connect(pipeline.spider_closed, signals.spider_closed)
+        return pipeline
+
+    def spider_opened(self, spider):
+        for output in spiderOutputs(spider):
+            self.revisions[output] = self._revisions(output)
+
+    def spider_closed(self, spider):
+        for output in spiderOutputs(spider):
+            revisions = self.revisions.pop(output)
+            deleted = revisions.finish()
+            if deleted:
+                self.stats.inc_value('revisions/delete', deleted, spider=spider)
+            if self.state_cache is None:
+                revisions.close()
+
+    def _revisions(self, output):
+        load = lambda: PollRevisions('data/' + output)
+        if self.state_cache is None:
+            return load()
+        return self.state_cache.get(('revisions', output), load,
+                                    flush=lambda revisions: revisions.flush(),
+                                    close=lambda revisions: revisions.close())
+
+    def process_item(self, item, spider):
+        output = itemOutput(item, spider)
+        change = self.revisions[output].observe(pollRow(item, output))
+        if change is not None:
+            self.stats.inc_value('revisions/' + change, spider=spider)
+        return item
@@ -0,0 +1,119 @@
+"""
+This module describes the races the spiders can crawl.  See each function's
+documentation for details.
+
+Every race is a dict:
+    name
+        The race's output name, used for its files in data/.
+        Ex: 'pres2012', 'senate2010'
+    kind
+        One of KINDS: 'president', 'senate', 'governor' or 'house'.
+    year
+        The election year.
+    widget
+        The url of the search_by_race.js widget that links to the race's
+        state pages.  All races for a year share it.
+    allow
+        A regex matching the urls of the race's state pages.
+    noPollLinks
+        Urls that match allow but never list polls.
+
+Races are built from the KINDS templates, filled in with the year, and then
+any OVERRIDES for that race name are applied.
+"""
+
+WIDGET = "http://www.realclearpolitics.com/epolls/%(year)d/widget/search_by_race.js"
+
+NO_POLL_LINK = "http://www.realclearpolitics.com/epolls/%(year)d/%(kind)s/%(year)d_elections_electoral_college_map.html"
+
+# Regex explanation:
+#     [a-z]{2}    - matches a two character state abbreviation
+#     [a-z_0-9]+  - matches a state name and race info
+#     [0-9]{4}    - matches a 4 number unique webpage identifier
+KINDS = [
+    {
+        'kind': 'president',
+        'prefix': 'pres',
+        'allow': r"epolls/%(year)d/president/[a-z]{2}/[a-z_]+_vs_[a-z_]+-[0-9]{4}\.html",
+    },
+    {
+        'kind': 'senate',
+        'prefix': 'senate',
+        'allow': r"epolls/%(year)d/senate/[a-z]{2}/[a-z_]+-[0-9]{4}\.html",
+    },
+    {
+        'kind': 'governor',
+        'prefix': 'governor',
+        'allow': r"epolls/%(year)d/governor/[a-z]{2}/[a-z_]+-[0-9]{4}\.html",
+    },
+    {
+        'kind': 'house',
+        'prefix': 'house',
+        'allow': r"epolls/%(year)d/house/[a-z]{2}/[a-z_0-9]+-[0-9]{4}\.html",
+    },
+]
+
+OVERRIDES = {
+    'pres2012': {
+        'allow': r"epolls/2012/president/[a-z]{2}/[a-z]+_romney_vs_obama-[0-9]{4}\.html",
+    },
+}
+
+DEFAULT_YEAR = 2012
+
+
+def getRace(kind, year):
+    """Return the race for a kind of election in a year.
+
+    Raises:
+        KeyError if kind isn't one of KINDS.
+    """
+    for template in KINDS:
+        if template['kind'] == kind:
+            break
+    else:
+        raise KeyError("Unknown race kind: " + kind)
+
+    params = {'year': int(year), 'kind': kind}
+    race = {
+        'name': template['prefix'] + str(year),
+        'kind': kind,
+        'year': int(year),
+        'widget': WIDGET % params,
+        'allow': template['allow'] % params,
+        'noPollLinks': [NO_POLL_LINK % params],
+    }
+    race.update(OVERRIDES.get(race['name'], {}))
+    return race
+
+
+def getRaceByName(name):
+    """Return the race with an output name, eg. 'pres2012'.
+
+    Raises:
+        KeyError if the name isn't a known prefix followed by a year.
+    """
+    for template in KINDS:
+        prefix = template['prefix']
+        if name.startswith(prefix) and name[len(prefix):].isdigit():
+            return getRace(template['kind'], name[len(prefix):])
+    raise KeyError("Unknown race: " + name)
+
+
+def getRaces(years=None, kinds=None, names=None):
+    """Return a list of races.
+
+    Args:
+        years
+            The election years, if names isn't given.  Defaults to DEFAULT_YEAR.
+        kinds
+            The kinds of election for each year.  Defaults to all KINDS.
+        names
+            Race output names.  If given, years and kinds are ignored.
+    """
+    if names:
+        return [getRaceByName(name) for name in names]
+
+    years = years or [DEFAULT_YEAR]
+    kinds = kinds or [template['kind'] for template in KINDS]
+    return [getRace(kind, year) for year in years for kind in kinds]
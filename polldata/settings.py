@@ -12,11 +12,154 @@ BOT_NAME = 'polldata'
 
 SPIDER_MODULES = ['polldata.spiders']
 NEWSPIDER_MODULE = 'polldata.spiders'
+COMMANDS_MODULE = 'polldata.commands'
 
 ITEM_PIPELINES = [
+    # before CsvExportPipeline, so it sees every poll
+    'polldata.pipelines.SqlitePollPipeline',
+    'polldata.pipelines.PollRevisionPipeline',
     'polldata.pipelines.CsvExportPipeline',
+    # after CsvExportPipeline, which drops polls that aren't new
+    'polldata.pipelines.TypedExportPipeline',
+    'polldata.pipelines.PartitionedExportPipeline',
+    'polldata.pipelines.PollingAveragePipeline',
 ]
 
+EXTENSIONS = {
+    'polldata.extensions.StageTiming': 500,
+    'polldata.extensions.Profiling': 510,
+    'polldata.extensions.AdaptiveConcurrency': 520,
+    'polldata.extensions.WarmStart': 530,
+}
+
+SPIDER_MIDDLEWARES = {
+    # closest to the spider, so only the spider's own time is counted
+    'polldata.extensions.StageTimingSpiderMiddleware': 990,
+}
+
+DOWNLOADER_MIDDLEWARES = {
+    # closest to the downloader
+    'polldata.extensions.DownloadTimingMiddleware': 990,
+    # after RetryMiddleware (500), so it sees the 503s that are retried
+    'polldata.extensions.AdaptiveConcurrencyMiddleware': 980,
+    # after HttpCompressionMiddleware (590) has decompressed the body
+    'polldata.middlewares.ConditionalRequestMiddleware': 580,
+    # after ConditionalRequestMiddleware, so replayed pages are never skipped
+    'polldata.middlewares.ResponseArchiveMiddleware': 570,
+    # keeps robots.txt between the daemon's crawls
+    'scrapy.contrib.downloadermiddleware.robotstxt.RobotsTxtMiddleware': None,
+    'polldata.middlewares.RobotsTxtCacheMiddleware': 100,
+}
+
 LOG_FILE = 'logs/%s | %s.txt' % (datetime.today(), BOT_NAME)
 
 ROBOTSTXT_OBEY = True
+# seconds a site's robots.txt is kept (see
+# polldata.middlewares.RobotsTxtCacheMiddleware)
+ROBOTSTXT_CACHE_TTL = 24 * 3600
+
+# Keep robots.txt, DNS answers and the state page links of each race's
+# widget between runs, so a run's first requests don't wait for them (see
+# polldata.extensions.WarmStart); robots.txt is kept for ROBOTSTXT_CACHE_TTL,
+# the others for their TTL in seconds
+WARM_START_ENABLED = True
+WARM_START_FILE = 'data/warmstart.json'
+WARM_START_DNS_TTL = 3600
+WARM_START_LINKS_TTL = 6 * 3600
+
+# Adjust each site's concurrent requests and delay to its latency and errors
+# (see polldata.extensions.AdaptiveConcurrency); off by default.  DOWNLOAD_DELAY
+# and robots.txt's Crawl-delay are the lowest delays, and
+# CONCURRENT_REQUESTS_PER_DOMAIN caps ADAPTIVE_CONCURRENCY_MAX
+ADAPTIVE_CONCURRENCY_ENABLED = False
+ADAPTIVE_CONCURRENCY_START = 2
+ADAPTIVE_CONCURRENCY_MAX = 8
+ADAPTIVE_CONCURRENCY_MAX_DELAY = 60
+ADAPTIVE_CONCURRENCY_WINDOW = 10
+ADAPTIVE_CONCURRENCY_LATENCY_RATIO = 1.5
+ADAPTIVE_CONCURRENCY_ERROR_RATE = 0.1
+
+# Remembers which polls have already been exported (see polldata.utils.seenStore)
+SEEN_STORE = 'polldata.utils.seenStore.SharedSeenStore'
+SEEN_STORE_COMPACT_RATIO = 2.0
+
+# Lock the outputs a crawl writes, so two processes never write the same
+# files in data/ (see polldata.pipelines.lockOutputs)
+SPIDER_LOCK_ENABLED = True
+# seconds to wait for another process's crawl of the same output (0 fails at once)
+SPIDER_LOCK_TIMEOUT = 0
+
+# Maximum number of new polls CsvExportPipeline holds in memory before spilling
+# sorted runs to disk (0 holds them all until the spider closes).  A normal
+# crawl finds far fewer and never spills; a long backfill stays bounded.
+CSV_EXPORT_MAX_BUFFERED_ITEMS = 50000
+
+# Skip state pages that haven't changed since the last run (see
+# polldata.middlewares.ConditionalRequestMiddleware)
+CONDITIONAL_RECRAWL_ENABLED = True
+
+# Archive every downloaded page, or replay an archived crawl without network
+# access (see polldata.middlewares.ResponseArchiveMiddleware); off by
+# default, as the archive grows with every crawl until `scrapy prunearchive`
+# removes what is older than ARCHIVE_MAX_AGE_DAYS
+ARCHIVE_ENABLED = False
+ARCHIVE_DIR = 'data/archive'
+ARCHIVE_REPLAY = ''
+ARCHIVE_MAX_AGE_DAYS = 30
+
+# Typed NumPy columns written next to _latest.csv (see
+# polldata.pipelines.TypedExportPipeline)
+TYPED_EXPORT_ENABLED = True
+TYPED_EXPORT_BATCH_ITEMS = 10000
+
+# Append-only output partitioned by run and state, with a manifest (see
+# polldata.pipelines.PartitionedExportPipeline)
+PARTITIONED_EXPORT_ENABLED = True
+
+# Per state polling averages, updated as new polls arrive (see
+# polldata.pipelines.PollingAveragePipeline)
+POLLING_AVERAGE_ENABLED = True
+POLLING_AVERAGE_WINDOW_DAYS = 30
+
+# Upsert every poll into a SQLite database (see
+# polldata.pipelines.SqlitePollPipeline)
+SQLITE_EXPORT_ENABLED = False
+SQLITE_DATABASE = 'data/polls.db'
+SQLITE_BATCH_ITEMS = 500
+
+# A change feed of inserted, updated and deleted polls, keyed by race, state,
+# service, dates and sample type (see polldata.pipelines.PollRevisionPipeline)
+POLL_REVISIONS_ENABLED = True
+
+# The `scrapy pollserver` query service (see
+# polldata.commands.pollserver); it checks for finished crawls every
+# POLL_SERVER_RELOAD_INTERVAL seconds
+POLL_SERVER_HOST = '127.0.0.1'
+POLL_SERVER_PORT = 6091
+POLL_SERVER_RELOAD_INTERVAL = 2
+
+# Request state pages by how often they change (see
+# polldata.utils.recrawlSchedule.RecrawlSchedule); intervals in seconds
+RECRAWL_SCHEDULE_ENABLED = True
+RECRAWL_MIN_INTERVAL = 3600
+RECRAWL_MAX_INTERVAL = 14 * 24 * 3600
+
+# `scrapy daemon`: seconds between the starts of two crawl cycles, seconds
+# between writes of the in-memory state to data/, and the local health and
+# metrics endpoint (see polldata.commands.daemon)
+DAEMON_INTERVAL = 1800
+DAEMON_FLUSH_INTERVAL = 300
+DAEMON_HTTP_HOST = '127.0.0.1'
+DAEMON_HTTP_PORT = 6090
+
+# Per stage timing and counters, written next to the log file when a spider
+# closes (see polldata.extensions.StageTiming)
+STAGE_TIMING_ENABLED = True
+
+# Profile a sample of the spider callbacks, link extraction and item
+# pipelines with cProfile and tracemalloc (see
+# polldata.extensions.Profiling); off by default
+PROFILE_ENABLED = False
+PROFILE_SAMPLE_RATE = 0.1
+PROFILE_DIR = 'logs/profiles'
+PROFILE_TRACEMALLOC_FRAMES = 25
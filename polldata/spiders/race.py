@@ -0,0 +1,283 @@
+import time
+
+from scrapy.contrib.spiders import CrawlSpider, Rule
+from scrapy.http import Request
+from scrapy.link import Link
+from scrapy import signals
+
+from polldata import races as polldata_races
+from polldata.items import PresPollItem
+from polldata.utils.normalize import recentPolls
+from polldata.utils.recrawlSchedule import RecrawlSchedule
+from polldata.utils.statePage import parseStatePage
+from polldata.utils.stateCache import stateCache
+from polldata.utils.warmStart import warmStartCache
+from polldata.utils.tableExtractor import PollTableExtractor
+from polldata.linkextractors.rcp_regex import RCP_RegexLinkExtractor
+
+class RaceSpider(CrawlSpider):
+    """Create State-Level Polls for Any Set of Races
+
+    RaceSpider crawls the state poll pages on RealClearPolitics.com for every
+    race it is given (see polldata.races), and produces pollitems based on the
+    polls listed on those pages.  The source for these pages (how each are
+    found) is the search_by_race.js widget that builds the select box found in
+    the top of http://www.realclearpolitics.com/epolls/latest_polls/.  The
+    widget lists every race for a year, so it is fetched and scanned once per
+    year, and its links are routed to each race by the race's rule.
+
+    Each pollitem's 'race' field holds the name of the race it belongs to, and
+    the item pipelines write one set of output files per race (listed in the
+    spider's 'outputs'), eg. data/pres2012_latest.csv and
+    data/senate2012_latest.csv.
+
+    Spider arguments (scrapy crawl races -a name=value):
+        races
+            Comma separated race names.  Ex: "pres2012,senate2012"
+        years
+            Comma separated election years, used if races isn't given.
+            Defaults to polldata.races.DEFAULT_YEAR.
+        kinds
+            Comma separated kinds of race for each year, used if races isn't
+            given.  Defaults to all of them.  Ex: "president,senate"
+
+    Subclasses can fix the races by setting 'race_names'.
+
+    State pages are requested according to a RecrawlSchedule kept in
+    'data/<spider>_schedule.json': pages that rarely change are skipped until
+    they are due, and the rest are requested hottest first (see
+    processLinks and processRequest).  Set RECRAWL_SCHEDULE_ENABLED to False
+    to request every page every run.
+
+    With the WarmStart extension (see polldata.extensions), the links each
+    race's widget listed are saved, and the next run requests them as it
+    starts instead of waiting for the widget (see start_requests).
+
+    Assumptions:
+        Certain html tags and attributes exist in order to identify where on the
+        page the polling data is located.
+
+        Assumes a certain structure to the polling data container (its a table
+        with certain column headers) in order to extract each poll's data.
+    """
+    name = "races"
+    allowed_domains = ["realclearpolitics.com"]
+    fields_to_export = ['state', 'service', 'end', 'sample', 'voters', 'dem', 'rep', 'ind']
+    race_names = None
+    table_extractor = PollTableExtractor()
+    schedule = None
+    # urls requested from the warm start cache, see start_requests
+    warm_urls = ()
+
+    def __init__(self, races=None, years=None, kinds=None, *a, **kw):
+        if races:
+            self.races = polldata_races.getRaces(names=races.split(','))
+        elif self.race_names:
+            self.races = polldata_races.getRaces(names=self.race_names)
+        else:
+            self.races = polldata_races.getRaces(
+                years=[int(year) for year in years.split(',')] if years else None,
+                kinds=kinds.split(',') if kinds else None,
+            )
+
+        self.outputs = [race['name'] for race in self.races]
+        self.races_by_name = dict((race['name'], race) for race in self.races)
+        self.no_poll_links = set(link for race in self.races for link in race['noPollLinks'])
+
+        self.start_urls = []
+        for race in self.races:
+            if race['widget'] not in self.start_urls:
+                self.start_urls.append(race['widget'])
+
+        self.rules = tuple(
+            Rule(
+                RCP_RegexLinkExtractor(
+                    allow=(race['allow'],),
+                    allow_domains=('realclearpolitics.com',),
+                ),
+                callback='parseStatePolls',
+                cb_kwargs={'race': race['name']},
+                # follow=None, # default 
+                process_links='processLinks',
+                process_request='processRequest',
+            )
+            for race in self.races
+        )
+
+        super(RaceSpider, self).__init__(*a, **kw)
+
+    def set_crawler(self, crawler):
+        super(RaceSpider, self).set_crawler(crawler)
+        settings = crawler.settings
+        # a replayed archive must be parsed in full
+        if settings.getbool('RECRAWL_SCHEDULE_ENABLED', True) and not settings.get('ARCHIVE_REPLAY'):
+            load = lambda: RecrawlSchedule(
+                'data/' + self.name + '_schedule.json',
+                min_interval=settings.getint('RECRAWL_MIN_INTERVAL', 3600),
+                max_interval=settings.getint('RECRAWL_MAX_INTERVAL', 14 * 24 * 3600),
+            )
+            cache = stateCache(crawler)
+            if cache is None:
+                self.schedule = load()
+                crawler.signals.connect(self._saveSchedule, signals.spider_closed)
+            else:
+                # shared by the daemon's crawls, which save it on a timer
+                self.schedule = cache.get(('schedule', self.name), load, flush=RecrawlSchedule.save)
+
+    def start_requests(self):
+        """
+        Request the widgets, then the state pages their links led to last
+        time, if the warm start cache still has them (see
+        polldata.utils.warmStart): those go through the rules' process_links
+        and process_request like the widget's, and _requests_to_follow skips
+        them when the widget lists them again.
+        """
+        for request in super(RaceSpider, self).start_requests():
+            yield request
+
+        cache = warmStartCache(self.crawler)
+        if cache is None or not self._rules:
+            return
+        self.warm_urls = set()
+        for n, race in enumerate(self.races):
+            rule = self._rules[n]
+            # json gives back unicode urls, which Link expects encoded like the extractor's
+            links = [Link(url if isinstance(url, str) else url.encode('utf-8'), text)
+                     for url, text in cache.get('links', race['name']) or []]
+            for link in rule.process_links(links) if rule.process_links else links:
+                self.warm_urls.add(link.url)
+                # counted as they go: Scrapy can close the spider before asking for the end of this
+                self.crawler.stats.inc_value('warm_start/links', spider=self)
+                r = Request(url=link.url, callback=self._response_downloaded)
+                r.meta.update(rule=n, link_text=link.text)
+                yield rule.process_request(r)
+
+    def _saveSchedule(self, spider, reason):
+        if spider is self:
+            self.schedule.save()
+
+    def parseStatePolls(self, response, race=None):
+        """Find pollitems for a state.
+
+        For every poll in this state: find the poll's data and process it into
+        a pollitem.  The polling data table is read by a PollTableExtractor,
+        which walks the table once and caches the column layout for each set
+        of table headers it sees, and the rows are then normalized by
+        polldata.utils.normalize.normalizeRows (poll years, sample size and
+        type, numeric spread).  The parsing itself is
+        polldata.utils.statePage.parseStatePage, which the reparse command
+        also runs outside Scrapy.
+
+        Args:
+            response
+                An html response that contains the polling data for a state.
+            race
+                The name of the race the page belongs to.  Defaults to the
+                spider's first race.
+
+        Returns:
+            A list of pollitems that each represent a unique state-level poll.
+        """
+        race = self.races_by_name[race] if race else self.races[0]
+
+        columns, polls = parseStatePage(response.body, response.encoding, race, self.table_extractor)
+
+        if self.schedule is not None:
+            newest, recent = recentPolls(columns)
+            if self.schedule.recordPolls(response.url, len(polls), newest, recent):
+                self.crawler.stats.inc_value('recrawl/pages_changed', spider=self)
+
+        return [PresPollItem(poll) for poll in polls]
+
+    def processLinks(self, links):
+        """
+        Remove links to states with no polls, and to pages that aren't due
+        for a recrawl (see RecrawlSchedule).
+
+        Args:
+            links
+                A list of links to follow, each of which represents a different
+                state, which may or may not contain polling data.
+
+        Returns
+            A list of links to follow, each of which represents a different
+            state that has polling data.
+        """
+        links = [link for link in links if link.url not in self.no_poll_links]
+        if self.schedule is None:
+            return links
+
+        now = time.time()
+        due = [link for link in links if self.schedule.isDue(link.url, now)]
+        if len(due) < len(links):
+            self.crawler.stats.inc_value('recrawl/pages_deferred', len(links) - len(due), spider=self)
+        return due
+
+    def processRequest(self, request):
+        """Give a state page's request its priority from the schedule."""
+        if self.schedule is None:
+            return request
+        now = time.time()
+        self.schedule.checked(request.url, now)
+        return request.replace(priority=self.schedule.priority(request.url, now))
+
+    def _requests_to_follow(self, response):
+        """
+        Override the requests_to_follow function from CrawlSpider to allow link
+        extraction from all files.  Specifically, javascript files need to work
+        to get links from the RCP javascript file that generates the select box
+        on http://www.realclearpolitics.com/epolls/latest_polls/president/.
+
+        The widget is scanned once, as a stream: every rule uses an
+        RCP_RegexLinkExtractor, so the first rule's extractor reads the links
+        and each one is routed to the first rule that allows it as soon as it
+        is read.  Requests are yielded while the rest of the widget is still
+        being scanned, so Scrapy can start downloading state pages early.
+        Links start_requests already requested from the warm start cache are
+        skipped, and every link a rule allows is saved in it for the next run.
+
+        Args:
+            response
+                The search_by_race.js widget response.
+
+        Yields:
+            A request for every link allowed by a rule (and its process_links).
+        """
+        #if not isinstance(response, HtmlResponse):
+        #    return
+        if not self._rules:
+            return
+        extractor = self._rules[0].link_extractor
+
+        cache = warmStartCache(self.crawler)
+        # every link a rule allows, for the warm start cache
+        race_links = dict((n, []) for n in range(len(self._rules)))
+        listed = set()
+
+        seen = set()
+        for link in extractor.iterLinks(response.body, response.url, response.encoding):
+            if link.url in seen:
+                continue
+            for n, rule in enumerate(self._rules):
+                if not rule.link_extractor._link_allowed(link):
+                    continue
+                if (n, link.url) not in listed:
+                    listed.add((n, link.url))
+                    race_links[n].append([link.url, link.text])
+                if link.url in self.warm_urls:
+                    # already requested by start_requests
+                    seen.add(link.url)
+                    break
+                links = rule.process_links([link]) if rule.process_links else [link]
+                if not links:
+                    continue
+                seen.add(link.url)
+                r = Request(url=link.url, callback=self._response_downloaded)
+                r.meta.update(rule=n, link_text=link.text)
+                yield rule.process_request(r)
+                break
+
+        if cache is not None:
+            for n, links in race_links.items():
+                if links:
+                    cache.put('links', self.races[n]['name'], links)
@@ -0,0 +1,191 @@
+"""
+This module decides how many concurrent requests a site gets, and how long to
+wait between them, from the latency and errors of its recent responses.  See
+DomainThrottle's documentation for details.  It doesn't depend on Scrapy: the
+AdaptiveConcurrency extension (see polldata.extensions) feeds it responses and
+applies its decisions to the downloader's slots.
+"""
+
+# seconds of delay added by the first back off when there was none
+BACKOFF_DELAY = 0.25
+# how much the baseline latency may rise per window at the minimum
+# concurrency, so that a site which became slower for good is probed again
+BASELINE_DRIFT = 0.05
+# statuses a site sends when it is overloaded or throttling us
+THROTTLE_STATUSES = (429, 503)
+
+
+class DomainThrottle(object):
+    """A closed loop controller for one site's concurrency and download delay.
+
+    Responses are recorded with record().  Every window responses (and
+    download errors) it compares the median latency of the window with the
+    site's baseline, the lowest median seen so far:
+     - too many errors (more than error_rate of the window): back off;
+     - latency above latency_ratio times the baseline, ie. requests are
+       queueing at the server: one request less;
+     - otherwise, halve the delay until it is min_delay, then one request
+       more, up to max_concurrency.
+    This is additive increase, multiplicative decrease: the concurrency
+    settles just below the point where the server starts to queue, which is
+    its highest sustainable throughput.
+
+    A 429 or 503 response backs off at once, without waiting for the end of
+    the window: the concurrency is halved (or, at min_concurrency, the delay
+    doubled), and the delay is raised to the response's Retry-After.  The
+    requests already sent when it backs off aren't held against the new
+    settings.
+
+    Args:
+        concurrency, delay
+            The starting values.
+        min_delay
+            The lowest delay, eg. DOWNLOAD_DELAY or the site's robots.txt
+            Crawl-delay (see setMinDelay).
+    """
+
+    def __init__(self, concurrency, delay=0.0, min_concurrency=1, max_concurrency=16, min_delay=0.0,
+                 max_delay=60.0, window=10, latency_ratio=1.5, error_rate=0.1):
+        self.min_concurrency = min_concurrency
+        self.max_concurrency = max(max_concurrency, min_concurrency)
+        self.min_delay = min_delay
+        self.max_delay = max(max_delay, min_delay)
+        self.window = window
+        self.latency_ratio = latency_ratio
+        self.error_rate = error_rate
+        self.concurrency = min(max(concurrency, min_concurrency), self.max_concurrency)
+        self.delay = min(max(delay, min_delay), self.max_delay)
+        self.baseline = None
+        self.decisions = 0
+        # responses still to ignore after a back off
+        self.cooldown = 0
+        self._reset()
+
+    def _reset(self):
+        self.latencies = []
+        self.errors = 0
+
+    def setMinDelay(self, min_delay):
+        """Raise (or lower) the lowest delay, eg. to a robots.txt Crawl-delay."""
+        self.min_delay = min(min_delay, self.max_delay)
+        self.delay = max(self.delay, self.min_delay)
+
+    def record(self, latency=None, status=None, error=False, retry_after=None):
+        """Record a response (its latency in seconds and status) or a download error.
+
+        Returns:
+            A decision dict (see _decide) if the concurrency or delay changed,
+            otherwise None.
+        """
+        if self.cooldown:
+            self.cooldown -= 1
+            return None
+        if status in THROTTLE_STATUSES:
+            return self._backoff('%d response' % status, retry_after)
+        if error or (status is not None and status >= 500):
+            self.errors += 1
+        elif latency is not None:
+            self.latencies.append(latency)
+
+        samples = len(self.latencies) + self.errors
+        if samples < self.window:
+            return None
+        if self.errors > self.error_rate * samples:
+            return self._backoff('%d errors in %d responses' % (self.errors, samples))
+
+        latency = median(self.latencies)
+        if self.baseline is None or latency < self.baseline:
+            self.baseline = latency
+        elif self.concurrency <= self.min_concurrency:
+            # the latency isn't ours to lower: the site is slower now
+            self.baseline = min(latency, self.baseline * (1 + BASELINE_DRIFT))
+        self._reset()
+
+        if latency > self.baseline * self.latency_ratio and self.concurrency > self.min_concurrency:
+            return self._decide('decrease', self.concurrency - 1, self.delay, latency,
+                                'latency %.0fms is over %.1fx the baseline' % (latency * 1000, self.latency_ratio))
+        if self.delay > self.min_delay:
+            delay = self.delay / 2
+            if delay < BACKOFF_DELAY / 2:
+                delay = self.min_delay
+            return self._decide('speed up', self.concurrency, max(delay, self.min_delay), latency,
+                                'latency %.0fms' % (latency * 1000))
+        if self.concurrency < self.max_concurrency:
+            return self._decide('increase', self.concurrency + 1, self.delay, latency,
+                                'latency %.0fms' % (latency * 1000))
+        return None
+
+    def _backoff(self, reason, retry_after=None):
+        if self.concurrency > self.min_concurrency:
+            concurrency, delay = max(self.min_concurrency, self.concurrency // 2), self.delay
+        else:
+            concurrency, delay = self.concurrency, max(self.delay * 2, BACKOFF_DELAY)
+        if retry_after:
+            delay = max(delay, retry_after)
+        # the requests already in flight were sent at the old concurrency
+        self.cooldown = self.concurrency
+        self._reset()
+        return self._decide('back off', concurrency, min(delay, self.max_delay), None, reason)
+
+    def _decide(self, action, concurrency, delay, latency, reason):
+        """Apply a decision.
+
+        Returns:
+            {'action', 'reason', 'concurrency', 'delay', 'latency', 'baseline'}
+        """
+        self.concurrency = concurrency
+        self.delay = delay
+        self.decisions += 1
+        return {'action': action, 'reason': reason, 'concurrency': concurrency, 'delay': delay,
+                'latency': latency, 'baseline': self.baseline}
+
+
+def median(values):
+    values = sorted(values)
+    if not values:
+        return 0.0
+    return values[len(values) // 2]
+
+
+def retryAfter(value):
+    """Return a Retry-After header's delay in seconds, or None (http dates aren't supported)."""
+    try:
+        return max(0.0, float(value))
+    except (TypeError, ValueError):
+        return None
+
+
+def crawlDelay(body, useragent):
+    """Return the Crawl-delay a robots.txt sets for useragent, or None.
+
+    Python's robotparser ignores Crawl-delay, so the groups are matched here:
+    the delay of the first group naming a part of useragent, else of the '*'
+    group.
+    """
+    delays = {}
+    agents = []
+    in_rules = False
+    for line in body.splitlines():
+        line = line.split('#', 1)[0].strip()
+        name, _, value = line.partition(':')
+        name, value = name.strip().lower(), value.strip()
+        if name == 'user-agent':
+            if in_rules:
+                agents = []
+                in_rules = False
+            agents.append(value.lower())
+        elif name:
+            in_rules = True
+            if name == 'crawl-delay':
+                try:
+                    delay = float(value)
+                except ValueError:
+                    continue
+                for agent in agents:
+                    delays.setdefault(agent, delay)
+
+    useragent = useragent.lower()
+    for agent, delay in delays.items():
+        if agent != '*' and agent in useragent:
+            return delay
+    return delays.get('*')
@@ -0,0 +1,157 @@
+"""
+This module provides an external (spill-to-disk) sort for exported poll items.
+See ExternalSorter's documentation for details.
+"""
+
+import csv
+import heapq
+import os
+import shutil
+
+
+class ExternalSorter(object):
+    """Sort poll items by one field while holding a bounded number in memory.
+
+    Items are buffered until max_items are held, then the buffer is sorted and
+    spilled to disk as a CSV run file.  Run files are complete CSV files with a
+    header line, so the polls found so far can be inspected while a long crawl
+    is still going.  merge() combines the runs and the final buffer with a
+    k-way merge, so writing the sorted output only holds one row per run in
+    memory.
+
+    The sort is stable: items with equal keys keep the order they were added
+    in, which is the order the original in-memory sort produced.
+
+    Args:
+        run_dir
+            The directory to write the run files to.  It is created when the
+            first run is spilled and removed by cleanup().
+        fields
+            The item fields to write, in order.
+        key
+            The item field to sort by.  It does not need to be one of fields.
+        max_items
+            The maximum number of items held in memory, or None to hold every
+            item in memory and never spill.
+        exporter_cls
+            The item exporter class used to write the run files, eg.
+            CsvItemExporter.  It must accept fields_to_export.
+        record_cls
+            A compact class to hold the buffered items in, eg. PollRecord
+            (see polldata.utils.pollRecords), or None to hold the items
+            themselves.  Items are converted with record_cls.fromItem(item,
+            values) when added and back with toItem() when exported; values
+            is the sorter's table of interned values, emptied whenever the
+            buffer is spilled.
+    """
+
+    def __init__(self, run_dir, fields, key, max_items, exporter_cls, record_cls=None):
+        self.run_dir = run_dir
+        self.fields = list(fields)
+        self.key = key
+        self.max_items = max(int(max_items), 1) if max_items else None
+        self.exporter_cls = exporter_cls
+        self.record_cls = record_cls
+
+        # The key is written as the first column of the run files, so it can
+        # be recovered when merging even if it isn't an exported field.
+        if key in self.fields:
+            self.run_fields = self.fields
+            self.key_position = self.fields.index(key)
+        else:
+            self.run_fields = [key] + self.fields
+            self.key_position = 0
+
+        self.buffer = []
+        self.values = {}
+        self.runs = []
+        self.count = 0
+
+    def __len__(self):
+        return self.count
+
+    def add(self, item):
+        if self.record_cls is not None:
+            item = self.record_cls.fromItem(item, self.values)
+        self.buffer.append(item)
+        self.count += 1
+        if self.max_items is not None and len(self.buffer) >= self.max_items:
+            self.spill()
+
+    def spill(self):
+        """Sort the buffered items and write them to a new run file."""
+        if not self.buffer:
+            return
+        if not os.path.isdir(self.run_dir):
+            os.makedirs(self.run_dir)
+
+        run_fName = os.path.join(self.run_dir, 'run-%04d.csv' % len(self.runs))
+        run_file = open(run_fName, 'wb')
+        exporter = self.exporter_cls(run_file, fields_to_export=self.run_fields)
+        exporter.start_exporting()
+        for item in self._sortedBuffer():
+            exporter.export_item(self._item(item))
+        exporter.finish_exporting()
+        run_file.close()
+
+        self.runs.append(run_fName)
+        self.buffer = []
+        self.values = {}
+
+    def merge(self, out_file):
+        """Write every item, sorted by key, to a CSV file.
+
+        The output matches what exporter_cls would write for the sorted items:
+        a header line followed by one row per item.  Nothing is written if no
+        items were added.
+        """
+        if not self.count:
+            return
+
+        if not self.runs:
+            exporter = self.exporter_cls(out_file, fields_to_export=self.fields)
+            exporter.start_exporting()
+            for item in self._sortedBuffer():
+                exporter.export_item(self._item(item))
+            exporter.finish_exporting()
+            return
+
+        # Serialize the in-memory buffer with the exporter too, so every row
+        # is formatted the same way before merging.
+        self.spill()
+
+        writer = csv.writer(out_file)
+        writer.writerow(self.fields)
+        strip_key = self.run_fields is not self.fields
+
+        run_files = [open(run_fName, 'rb') for run_fName in self.runs]
+        try:
+            streams = [self._rows(run_file, i) for i, run_file in enumerate(run_files)]
+            for _, _, _, row in heapq.merge(*streams):
+                writer.writerow(row[1:] if strip_key else row)
+        finally:
+            for run_file in run_files:
+                run_file.close()
+
+    def cleanup(self):
+        """Remove the run files."""
+        if os.path.isdir(self.run_dir):
+            shutil.rmtree(self.run_dir)
+        self.runs = []
+        self.buffer = []
+        self.values = {}
+
+    def _item(self, item):
+        return item if self.record_cls is None else item.toItem()
+
+    def _sortedBuffer(self):
+        return sorted(self.buffer, key=lambda item: item[self.key])
+
+    def _rows(self, run_file, run):
+        """Yield (key, run, position, row) for each row in a run file."""
+        reader = csv.reader(run_file)
+        next(reader, None)  # header
+        position = 0
+        for row in reader:
+            yield row[self.key_position], run, position, row
+            position += 1
@@ -0,0 +1,256 @@
+"""
+This module lets several crawl processes share the files in data/.  See each
+class's documentation for details.
+
+    FileLock
+        An advisory lock on a lock file, released when the process exits.
+    AtomicFile
+        A file written under a temporary name and renamed over the real one
+        once complete, so readers never see a partial file.
+    updateJson
+        Merges entries into a json object file that other processes update
+        too.
+
+The locks use fcntl.flock, so they are only advisory: they keep out the
+processes that take them, ie. every polldata command.  Without fcntl (eg. on
+Windows) locking does nothing.
+"""
+
+import errno
+import json
+import os
+import time
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+
+class FileLocked(Exception):
+    """The lock is held by another process."""
+
+    def __init__(self, fName, owner=None):
+        self.fName = fName
+        self.owner = owner
+        if owner:
+            message = "%s is held by process %s." % (fName, owner)
+        else:
+            message = "%s is held by another process." % fName
+        super(FileLocked, self).__init__(message)
+
+
+class FileLock(object):
+    """An exclusive advisory lock on a file, eg. 'data/pres2012.lock'.
+
+    The holder's pid is written in the file, for the error messages of the
+    processes that wait for it.  The lock file itself is left in place, since
+    removing it would let two processes lock different files under the same
+    name.  The lock is released by release(), or by the OS when the process
+    exits, however it exits.  Nested acquires of the same FileLock are
+    counted, and only the outermost release() unlocks the file.
+
+    It is also a context manager, which waits for the lock:
+
+        with FileLock('data/pres2012_validators.json.lock'):
+            ...
+
+    Args:
+        fName
+            The lock file, created if it doesn't exist.
+        keep_open
+            Keep the lock file open between acquires, for locks that are
+            taken very often (see SharedSeenStore); close() closes it.
+    """
+
+    def __init__(self, fName, keep_open=False):
+        self.fName = fName
+        self.keep_open = keep_open
+        self.fd = None
+        self.open_fd = None
+        self.depth = 0
+
+    def acquire(self, timeout=None, poll_interval=0.1):
+        """Take the lock.
+
+        Args:
+            timeout
+                Seconds to wait for another process to release it: None to
+                wait as long as it takes, 0 to fail at once.
+
+        Raises:
+            FileLocked if the lock is still held after timeout seconds.
+        """
+        if self.fd is not None:
+            # nested, eg. a store's compaction inside its close()
+            self.depth += 1
+            return
+        fd = self.open_fd
+        if fd is None:
+            fd = os.open(self.fName, os.O_RDWR | os.O_CREAT, 0o644)
+        if fcntl is None:
+            self.fd = fd
+            self.depth = 1
+            return
+
+        deadline = None if timeout is None else time.time() + timeout
+        while True:
+            try:
+                flags = fcntl.LOCK_EX if deadline is None else fcntl.LOCK_EX | fcntl.LOCK_NB
+                fcntl.flock(fd, flags)
+                break
+            except (IOError, OSError) as error:
+                if error.errno not in (errno.EAGAIN, errno.EACCES, errno.EWOULDBLOCK):
+                    self._close(fd)
+                    raise
+                if time.time() >= deadline:
+                    self._close(fd)
+                    raise FileLocked(self.fName, self.owner())
+                time.sleep(poll_interval)
+
+        # fixed width, so the file never needs truncating
+        os.lseek(fd, 0, os.SEEK_SET)
+        os.write(fd, ('%10d\n' % os.getpid()).encode('ascii'))
+        self.fd = fd
+        self.depth = 1
+
+    def release(self):
+        if self.fd is None:
+            return
+        self.depth -= 1
+        if self.depth:
+            return
+        if fcntl is not None:
+            fcntl.flock(self.fd, fcntl.LOCK_UN)
+        self._close(self.fd)
+        self.fd = None
+
+    def close(self):
+        """Release the lock and close the lock file (see keep_open)."""
+        if self.fd is not None:
+            self.depth = 1
+            self.release()
+        if self.open_fd is not None:
+            os.close(self.open_fd)
+            self.open_fd = None
+
+    def _close(self, fd):
+        if self.keep_open:
+            self.open_fd = fd
+        else:
+            os.close(fd)
+
+    def owner(self):
+        """Return the pid written by the lock's last holder, or None."""
+        try:
+            lock_file = open(self.fName, 'r')
+        except IOError:
+            return None
+        try:
+            return int(lock_file.read().strip() or 0) or None
+        except ValueError:
+            return None
+        finally:
+            lock_file.close()
+
+    @property
+    def locked(self):
+        return self.fd is not None
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.release()
+
+
+class AtomicFile(object):
+    """A file that replaces fName in one step, once it is complete.
+
+    The data is written to '<fName>.tmp<pid>', so processes writing the same
+    file don't share a temporary file, and commit() flushes it to disk and
+    renames it over fName.  Until then readers keep seeing the previous
+    version; if the writer dies, only the temporary file is left behind.
+
+    It is also a context manager, which commits on success and discards the
+    temporary file on an exception:
+
+        with AtomicFile('data/pres2012_dict.json') as seen_file:
+            seen_file.write(...)
+
+    Args:
+        fName
+            The file to replace.
+        mode
+            The temporary file's mode, 'w' or 'wb'.
+    """
+
+    def __init__(self, fName, mode='w'):
+        self.fName = fName
+        self.tmp_fName = '%s.tmp%d' % (fName, os.getpid())
+        self.file = open(self.tmp_fName, mode)
+
+    def write(self, data):
+        self.file.write(data)
+
+    def __getattr__(self, name):
+        # everything else (writelines, flush, tell...) is the file's
+        return getattr(self.file, name)
+
+    def commit(self):
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        self.file.close()
+        os.rename(self.tmp_fName, self.fName)
+
+    def discard(self):
+        self.file.close()
+        if os.path.exists(self.tmp_fName):
+            os.remove(self.tmp_fName)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.commit()
+        else:
+            self.discard()
+
+
+def readJson(fName, default=None):
+    """Return the contents of a json file, or default if it is missing or malformed."""
+    try:
+        json_file = open(fName, 'r')
+    except IOError:
+        return default
+    try:
+        return json.load(json_file)
+    except ValueError:
+        return default
+    finally:
+        json_file.close()
+
+
+def updateJson(fName, entries, **dumps_options):
+    """Merge entries into a json object file that other processes update too.
+
+    Under the file's lock ('<fName>.lock'), the file is read again, updated
+    with entries (which replace the saved entries with the same keys) and
+    rewritten atomically.  Entries that other processes saved in the
+    meantime are kept, so no process loses another's updates as long as each
+    only passes the entries it changed.  A missing or malformed file is
+    started over.
+
+    Returns:
+        The merged entries, which include the other processes' latest ones.
+    """
+    with FileLock(fName + '.lock'):
+        merged = readJson(fName, {})
+        if not isinstance(merged, dict):
+            merged = {}
+        merged.update(entries)
+        with AtomicFile(fName) as json_file:
+            json_file.write( json.dumps(merged, **dumps_options) )
+    return merged
@@ -0,0 +1,432 @@
+"""
+This module normalizes the raw poll rows read from state pages.  See
+normalizePolls' documentation for details.
+
+There are two implementations of the same rules:
+    normalizeRows
+        Plain Python, a row at a time.  It is what a crawl runs on each
+        state page as it arrives: a page only has tens of polls, too few to
+        pay for NumPy's fixed cost per call.
+    normalizePolls
+        NumPy string and number arrays, so each step (split the date range,
+        split the sample info, convert the percentages, ...) is one
+        operation over every row.  It is for many pages at once, eg. the
+        reparse command's batches, and needs NumPy.
+
+HAVE_NUMPY tells whether normalizePolls can be used.
+"""
+
+import datetime
+import re
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+HAVE_NUMPY = numpy is not None
+
+MISSING_INT = -1
+
+# How far (in days) an end date may be later than the row above it before the
+# row is taken to be from the year before.  RCP lists polls newest first, but
+# polls ending a few days apart are sometimes out of order.
+YEAR_ROLLOVER_DAYS = 60
+
+_unicode = type(u'')
+
+# the raw row layout, see polldata.utils.tableExtractor.FIELDS
+SERVICE, DATES, SAMPLE, DEM, REP = range(5)
+
+_SPACE, _COMMA, _DOT, _SLASH, _ZERO, _NINE = [ord(c) for c in u' ,./09']
+
+
+def toCodes(values):
+    """View strings as an (n, width) uint32 matrix of code points.
+
+    Shorter strings are padded with 0, which is also what NumPy strips when
+    the matrix is viewed as strings again (see fromCodes).
+    """
+    values = numpy.ascontiguousarray(numpy.asarray(values, dtype=_unicode))
+    width = max(values.dtype.itemsize // 4, 1)
+    if values.dtype.itemsize == 0:
+        values = values.astype('U1')
+    return values.view(numpy.uint32).reshape(len(values), width)
+
+
+def fromCodes(codes):
+    """The strings of a code point matrix, see toCodes."""
+    codes = numpy.ascontiguousarray(codes, dtype=numpy.uint32)
+    return codes.view('U%d' % codes.shape[1]).reshape(len(codes))
+
+
+def _shiftLeft(codes, offsets):
+    """Drop each row's first offsets[row] code points."""
+    shifted = codes.copy()
+    for offset in numpy.unique(offsets):
+        if offset == 0:
+            continue
+        rows = offsets == offset
+        shifted[rows, :codes.shape[1] - offset] = codes[rows, offset:]
+        shifted[rows, codes.shape[1] - offset:] = 0
+    return shifted
+
+
+def strip(codes):
+    """Remove leading and trailing spaces from a code point matrix."""
+    if not codes.size:
+        return codes
+    space = codes == _SPACE
+    if not space.any():
+        return codes
+    text = (codes != 0) & ~space
+    after = numpy.cumsum(text[:, ::-1], axis=1)[:, ::-1] == 0
+    codes = numpy.where(after, 0, codes).astype(numpy.uint32)
+    leading = numpy.where(text.any(axis=1), numpy.argmax(text, axis=1), 0)
+    return _shiftLeft(codes, leading) if leading.any() else codes
+
+
+def integers(codes, count):
+    """Read the first count runs of digits in each row as integers.
+
+    Ex: "10/1 - 10/3" -> [10, 1, 10, 3] with count 4
+
+    Returns:
+        (values, found) where values is an (n, count) int64 matrix (0 where a
+        row has fewer runs) and found holds the number of runs in each row.
+    """
+    digit = (codes >= _ZERO) & (codes <= _NINE)
+    starts = digit.copy()
+    starts[:, 1:] &= ~digit[:, :-1]
+    run = numpy.cumsum(starts, axis=1) - 1
+
+    # the place value of each digit: 10 ** (digits left in its run)
+    left = numpy.zeros(codes.shape, dtype=numpy.int64, order='F')
+    for column in range(codes.shape[1] - 1, -1, -1):
+        following = left[:, column + 1] if column + 1 < codes.shape[1] else 0
+        left[:, column] = numpy.where(digit[:, column], following + 1, 0)
+    place = numpy.where(digit, (codes.astype(numpy.int64) - _ZERO) * 10 ** numpy.maximum(left - 1, 0), 0)
+
+    values = numpy.zeros((len(codes), count), dtype=numpy.int64)
+    for i in range(count):
+        values[:, i] = numpy.where(run == i, place, 0).sum(axis=1)
+    return values, starts.sum(axis=1)
+
+
+def formatIntegers(parts, separator=u'/'):
+    """Write rows of non-negative integers as text, eg. [10, 3, 2012] -> "10/3/2012".
+
+    Args:
+        parts
+            A list of int arrays, one per part.
+    """
+    n = len(parts[0])
+    digits = []
+    for part in parts:
+        count = numpy.ones(n, dtype=numpy.int64)
+        power = 10
+        while n and power <= part.max():
+            count += part >= power
+            power *= 10
+        digits.append(count)
+
+    width = sum(int(count.max()) if n else 1 for count in digits) + len(parts) - 1
+    codes = numpy.zeros(n * width, dtype=numpy.uint32)
+    position = numpy.arange(n) * width
+    for i, (part, count) in enumerate(zip(parts, digits)):
+        if i:
+            codes[position] = ord(separator)
+            position += 1
+        # write the digits from the last one, while the row has any left
+        position += count
+        value = part.copy()
+        for k in range(int(count.max()) if n else 0):
+            write = k < count
+            codes[(position - 1 - k)[write]] = _ZERO + value[write] % 10
+            value //= 10
+    return fromCodes(codes.reshape(n, width))
+
+
+def toNumbers(values):
+    """Convert an array of strings into float64, with NaN for non-numbers.
+
+    Ex: ["48", "47.5", "--", ""] -> [48.0, 47.5, nan, nan]
+    """
+    codes = strip(toCodes(values))
+    digit = (codes >= _ZERO) & (codes <= _NINE)
+    dot = codes == _DOT
+    valid = ((digit | dot | (codes == 0)).all(axis=1) & digit.any(axis=1) & (dot.sum(axis=1) <= 1))
+
+    whole = numpy.zeros(len(codes), dtype=numpy.float64)
+    fraction = numpy.zeros(len(codes), dtype=numpy.float64)
+    scale = numpy.ones(len(codes), dtype=numpy.float64)
+    after_dot = numpy.zeros(len(codes), dtype=bool)
+    for column in range(codes.shape[1]):
+        value = codes[:, column].astype(numpy.float64) - _ZERO
+        in_whole = digit[:, column] & ~after_dot
+        in_fraction = digit[:, column] & after_dot
+        whole = numpy.where(in_whole, whole * 10 + value, whole)
+        fraction = numpy.where(in_fraction, fraction * 10 + value, fraction)
+        scale = numpy.where(in_fraction, scale * 10, scale)
+        after_dot |= dot[:, column]
+    return numpy.where(valid, whole + fraction / scale, numpy.nan)
+
+
+def _toDates(years, months, days, valid):
+    """Build datetime64[D] from int arrays; NaT where not valid."""
+    dates = numpy.full(len(years), numpy.datetime64('NaT'), dtype='datetime64[D]')
+    if valid.any():
+        dates[valid] = (years[valid] - 1970).astype('datetime64[Y]').astype('datetime64[M]') \
+            + (months[valid] - 1).astype('timedelta64[M]')
+        dates[valid] += (days[valid] - 1).astype('timedelta64[D]')
+    return dates
+
+
+def _emptyColumns():
+    columns = dict((field, numpy.array([], dtype=_unicode))
+                   for field in ('service', 'start', 'end', 'voters', 'sample', 'dem', 'rep'))
+    columns['start_date'] = numpy.array([], dtype='datetime64[D]')
+    columns['end_date'] = numpy.array([], dtype='datetime64[D]')
+    columns['sample_size'] = numpy.array([], dtype=numpy.int64)
+    for field in ('dem_pct', 'rep_pct', 'spread', 'ind_pct'):
+        columns[field] = numpy.array([], dtype=numpy.float64)
+    return columns
+
+
+def inferYears(months, days, valid, year, page_starts=None):
+    """Find the year of each end date in newest first tables.
+
+    The first row of each table is taken to be in the election year.  Going
+    down a table the dates get older, so a date that is much later in the year
+    than the valid date above it (eg. 12/28 below 1/3) is a year older.
+
+    Args:
+        months, days, valid
+            The end dates' months and days, and which of them could be read.
+        year
+            The election year, or an array with each row's election year.
+        page_starts
+            The offsets of the rows that start a new table, if the rows hold
+            more than one page.  Defaults to one table.
+
+    Returns:
+        An int64 array of years (only meaningful where valid).
+    """
+    n = len(months)
+    days_in_year = (months - 1) * 31 + days
+
+    page = numpy.zeros(n, dtype=numpy.int64)
+    if page_starts is not None and len(page_starts):
+        starts = numpy.zeros(n, dtype=numpy.int64)
+        starts[numpy.asarray(page_starts, dtype=numpy.int64)] = 1
+        starts[0] = 1
+        page = numpy.cumsum(starts) - 1
+
+    years = numpy.zeros(n, dtype=numpy.int64) + numpy.asarray(year, dtype=numpy.int64)
+    index = numpy.flatnonzero(valid)
+    if not len(index):
+        return years
+
+    # compare every valid date with the valid date above it in the same table
+    rollover = numpy.zeros(len(index), dtype=numpy.int64)
+    first = numpy.ones(len(index), dtype=bool)
+    first[1:] = page[index[1:]] != page[index[:-1]]
+    rollover[1:] = (days_in_year[index[1:]] > days_in_year[index[:-1]] + YEAR_ROLLOVER_DAYS) & ~first[1:]
+    older = numpy.cumsum(rollover)
+
+    # restart the count at each table's first valid date
+    table_first = numpy.maximum.accumulate(numpy.where(first, numpy.arange(len(index)), 0))
+    years[index] -= older - older[table_first]
+    return years
+
+
+def normalizePolls(rows, year, page_starts=None):
+    """Normalize the raw rows of one or more poll tables.
+
+    Args:
+        rows
+            The raw rows, newest first, as returned by
+            PollTableExtractor.extract: one (service, dates, sample, dem, rep)
+            tuple of strings per poll.
+            Ex: [(u"Rasmussen Reports", u"10/1 - 10/3", u"595 LV", u"48", u"47"), ...]
+        year
+            The race's election year, or an array with each row's year.
+        page_starts
+            The offsets of the rows that start each table, when rows holds
+            several pages.  Poll years are inferred per table.
+
+    Returns:
+        A dict of arrays, one entry per row.  The item fields, as strings:
+            service
+            start, end      "month/day/year", or "" if unknown.  A poll with
+                            one date only has an end date.
+                            Ex: "10/1/2012", "12/28/2011"
+            voters          the sample size, or "".  Ex: "595"
+            sample          the sample type, or "".  Ex: "LV", "RV"
+            dem, rep        the percentages as listed
+        And their values:
+            start_date, end_date    datetime64[D], NaT if unknown
+            sample_size             int64, -1 if unknown
+            dem_pct, rep_pct        float64, NaN if not a number
+            spread                  dem_pct - rep_pct
+            ind_pct                 0; the tables don't list independents
+
+        The year of each date is inferred from the row order (see
+        inferYears) rather than assumed to be the election year, and a sample
+        with only one component is read as the size if it is a number and as
+        the type otherwise.
+    """
+    if not len(rows):
+        return _emptyColumns()
+    raw = list(zip(*rows))
+    columns = {'service': numpy.array(raw[SERVICE], dtype=_unicode)}
+
+    # dates: "10/1 - 10/3" or "10/3"; anything else (eg. "--") is unknown
+    dates, found = integers(toCodes(raw[DATES]), 4)
+    ranged = found == 4
+    end_valid = ranged | (found == 2)
+    end_month = numpy.where(ranged, dates[:, 2], dates[:, 0])
+    end_day = numpy.where(ranged, dates[:, 3], dates[:, 1])
+    start_month = numpy.where(ranged, dates[:, 0], 0)
+    start_day = numpy.where(ranged, dates[:, 1], 0)
+    end_valid &= (end_month >= 1) & (end_month <= 12) & (end_day >= 1) & (end_day <= 31)
+    start_valid = end_valid & ranged & (start_month >= 1) & (start_month <= 12) & \
+        (start_day >= 1) & (start_day <= 31)
+
+    end_year = inferYears(end_month, end_day, end_valid, year, page_starts)
+    # a range that crosses new year's: "12/28 - 1/3"
+    start_year = end_year - ((start_month * 32 + start_day) > (end_month * 32 + end_day))
+
+    columns['start'] = numpy.where(start_valid, formatIntegers([start_month, start_day, start_year]), u'')
+    columns['end'] = numpy.where(end_valid, formatIntegers([end_month, end_day, end_year]), u'')
+    columns['start_date'] = _toDates(start_year, start_month, start_day, start_valid)
+    columns['end_date'] = _toDates(end_year, end_month, end_day, end_valid)
+
+    # sample info: "595 LV", "1,337", "RV"; the first word is the size if it
+    # is a number, and the type otherwise
+    sample = strip(toCodes(raw[SAMPLE]))
+    space = sample == _SPACE
+    first_end = numpy.where(space.any(axis=1), numpy.argmax(space, axis=1), sample.shape[1])
+    in_first = numpy.arange(sample.shape[1]) < first_end[:, None]
+    digit = (sample >= _ZERO) & (sample <= _NINE)
+    is_size = (digit | (sample == _COMMA) | (sample == 0) | ~in_first).all(axis=1) & (digit & in_first).any(axis=1)
+
+    size = numpy.zeros(len(sample), dtype=numpy.int64)
+    for column in range(sample.shape[1]):
+        present = digit[:, column] & in_first[:, column]
+        size[present] = size[present] * 10 + sample[present, column] - _ZERO
+    size[~is_size] = MISSING_INT
+    kind = numpy.where(is_size[:, None], strip(_shiftLeft(sample, numpy.minimum(first_end, sample.shape[1]))), sample)
+    columns['voters'] = numpy.where(is_size, formatIntegers([numpy.maximum(size, 0)]), u'')
+    columns['sample'] = fromCodes(kind)
+    columns['sample_size'] = size
+
+    columns['dem'] = numpy.array(raw[DEM], dtype=_unicode)
+    columns['rep'] = numpy.array(raw[REP], dtype=_unicode)
+    columns['dem_pct'] = toNumbers(columns['dem'])
+    columns['rep_pct'] = toNumbers(columns['rep'])
+    columns['spread'] = columns['dem_pct'] - columns['rep_pct']
+    columns['ind_pct'] = numpy.zeros(len(rows), dtype=numpy.float64)
+    return columns
+
+
+_digitRuns = re.compile(u'[0-9]+', re.UNICODE)
+_number = re.compile(u'^([0-9]*)(?:\\.([0-9]*))?$', re.UNICODE)
+
+# the columns of normalizeRows, in the order of its row tuples
+ROW_COLUMNS = ('service', 'start', 'end', 'voters', 'sample', 'dem', 'rep', 'start_date', 'end_date',
+               'sample_size', 'dem_pct', 'rep_pct', 'spread', 'ind_pct')
+
+
+def _toNumber(value):
+    """toNumbers for one string, computed the same way so the floats are equal."""
+    match = _number.match(value.strip(u' '))
+    if match is None:
+        return float('nan')
+    whole, fraction = match.groups()
+    if not fraction:
+        return float(int(whole)) if whole else float('nan')
+    return float(int(whole or 0)) + float(int(fraction)) / 10.0 ** len(fraction)
+
+
+def _toDate(year, month, day):
+    try:
+        return datetime.date(year, month, day)
+    except ValueError:
+        # like _toDates, a day past the end of its month runs into the next one
+        return datetime.date(year, month, 1) + datetime.timedelta(days=day - 1)
+
+
+def normalizeRows(rows, year):
+    """Normalize the raw rows of one poll table, a row at a time.
+
+    It finds the same values as normalizePolls, but returns lists rather
+    than arrays, with datetime.date (None if unknown) for start_date and
+    end_date.  It doesn't need NumPy.
+
+    Args:
+        rows
+            The raw rows, newest first, see normalizePolls.
+        year
+            The race's election year.
+    """
+    normalized = []
+    append = normalized.append
+    above = None
+    end_year = year
+    for service, dates, sample, dem, rep in rows:
+        # dates: "10/1 - 10/3" or "10/3"; anything else (eg. "--") is unknown
+        parts = _digitRuns.findall(dates)
+        start = end = u''
+        start_date = end_date = None
+        if len(parts) == 2 or len(parts) == 4:
+            end_month, end_day = int(parts[-2]), int(parts[-1])
+            if 1 <= end_month <= 12 and 1 <= end_day <= 31:
+                day = (end_month - 1) * 31 + end_day
+                if above is not None and day > above + YEAR_ROLLOVER_DAYS:
+                    end_year -= 1
+                above = day
+                end = u'%d/%d/%d' % (end_month, end_day, end_year)
+                end_date = _toDate(end_year, end_month, end_day)
+                if len(parts) == 4:
+                    start_month, start_day = int(parts[0]), int(parts[1])
+                    if 1 <= start_month <= 12 and 1 <= start_day <= 31:
+                        # a range that crosses new year's: "12/28 - 1/3"
+                        start_year = end_year - (start_month * 32 + start_day > end_month * 32 + end_day)
+                        start = u'%d/%d/%d' % (start_month, start_day, start_year)
+                        start_date = _toDate(start_year, start_month, start_day)
+
+        # sample info: "595 LV", "1,337", "RV"; the first word is the size if
+        # it is a number, and the type otherwise
+        sample = _unicode(sample).strip(u' ')
+        first, _, rest = sample.partition(u' ')
+        size = first.replace(u',', u'')
+        if size and not size.strip(u'0123456789'):
+            size = int(size)
+            voters, sample = u'%d' % size, rest.strip(u' ')
+        else:
+            voters, size = u'', MISSING_INT
+
+        dem_pct, rep_pct = _toNumber(dem), _toNumber(rep)
+        append((_unicode(service), start, end, voters, sample, _unicode(dem), _unicode(rep), start_date, end_date,
+                size, dem_pct, rep_pct, dem_pct - rep_pct, 0.0))
+
+    if not normalized:
+        return dict((column, []) for column in ROW_COLUMNS)
+    return dict(zip(ROW_COLUMNS, [list(values) for values in zip(*normalized)]))
+
+
+def recentPolls(columns, days=30):
+    """Find the newest poll of normalizeRows' columns, and the polls near it.
+
+    Returns:
+        (newest, recent): the newest end date as 'YYYY-MM-DD' (None if no
+        poll has an end date), and the number of polls that ended within
+        days of it.
+    """
+    ends = [end for end in columns['end_date'] if end is not None]
+    if not ends:
+        return None, 0
+    newest = max(ends)
+    recent = sum(1 for end in ends if end >= newest - datetime.timedelta(days=days))
+    return newest.isoformat(), recent
@@ -0,0 +1,229 @@
+"""
+This module provides an append-only, partitioned output for new polls.  See
+PartitionedOutput's documentation for details.
+
+Layout of an output directory (eg. data/pres2012/):
+    manifest.json
+        The list of committed partitions.  Only partitions listed here
+        exist as far as readers are concerned.
+    runs/<run id>/<state>.csv
+        The polls a run found for a state, as CSV with a header line.
+    compacted/<state>-<seq>.csv
+        Older partitions of a state merged into one file.
+
+Each manifest partition is a dict:
+    {"seq": 12, "run": "20121018T161500Z", "state": "Ohio",
+     "path": "runs/20121018T161500Z/ohio.csv", "rows": 20,
+     "bytes": 1234, "sha1": "..."}
+Compacted partitions also list the seqs they replaced in "covers".
+
+Every partition gets a sequence number (seq) when it is committed, higher
+than any before it, so a consumer only needs to remember the highest seq it
+has read (its cursor) to find the partitions added since.
+"""
+
+import csv
+import hashlib
+import json
+import os
+import re
+import shutil
+import time
+
+from polldata.utils.fileLock import AtomicFile
+
+MANIFEST_VERSION = 1
+
+
+def stateSlug(state):
+    """Return a file name for a state.  Ex: "New Hampshire" -> "new_hampshire" """
+    slug = re.sub(r'[^a-z0-9]+', '_', (state or '').lower()).strip('_')
+    return slug or 'unknown'
+
+
+def fileChecksum(fName):
+    hasher = hashlib.sha1()
+    data_file = open(fName, 'rb')
+    for block in iter(lambda: data_file.read(65536), b''):
+        hasher.update(block)
+    data_file.close()
+    return hasher.hexdigest()
+
+
+class PartitionedOutput(object):
+    """An output directory of partitions, described by its manifest.
+
+    Args:
+        root
+            The output directory, eg. 'data/pres2012'.
+    """
+
+    def __init__(self, root):
+        self.root = root
+        self.manifest_fName = os.path.join(root, 'manifest.json')
+
+    def manifest(self):
+        try:
+            manifest_file = open(self.manifest_fName, 'r')
+        except IOError:
+            return {'version': MANIFEST_VERSION, 'next_seq': 1, 'runs': [], 'partitions': []}
+        try:
+            return json.load(manifest_file)
+        except ValueError:
+            # should be inspected before anything is written over it
+            raise ValueError("Malformed manifest " + self.manifest_fName + ".")
+        finally:
+            manifest_file.close()
+
+    def writeManifest(self, manifest):
+        if not os.path.isdir(self.root):
+            os.makedirs(self.root)
+        with AtomicFile(self.manifest_fName) as manifest_file:
+            manifest_file.write( json.dumps(manifest, indent=1, sort_keys=True) )
+
+    def commit(self, run_id, partitions, info=None):
+        """Add a run's partitions to the manifest.
+
+        Args:
+            run_id
+                The run's id.
+            partitions
+                A list of dicts with 'state', 'path' (relative to root) and
+                'rows'.  Their files must already be complete.
+            info
+                Extra details about the run to record, eg. the spider name.
+
+        Returns:
+            The committed partitions, with their seq, bytes and sha1 set.
+        """
+        manifest = self.manifest()
+        committed = []
+        for partition in sorted(partitions, key=lambda p: p['state']):
+            fName = os.path.join(self.root, partition['path'])
+            partition = dict(partition)
+            partition['run'] = run_id
+            partition['seq'] = manifest['next_seq']
+            partition['bytes'] = os.path.getsize(fName)
+            partition['sha1'] = fileChecksum(fName)
+            manifest['next_seq'] += 1
+            manifest['partitions'].append(partition)
+            committed.append(partition)
+
+        run = dict(info or {})
+        run.update({'run': run_id, 'committed': time.time(), 'partitions': len(committed),
+                    'rows': sum(p['rows'] for p in committed)})
+        manifest['runs'].append(run)
+        self.writeManifest(manifest)
+        return committed
+
+    def partitionsSince(self, cursor=0):
+        """Return the partitions committed after a cursor, oldest first.
+
+        Args:
+            cursor
+                The highest seq the consumer has already read, or 0 to read
+                everything.  The new cursor is the last partition's seq.
+        """
+        return sorted([p for p in self.manifest()['partitions'] if p['seq'] > cursor],
+                      key=lambda p: p['seq'])
+
+    def readPartition(self, partition, verify=True):
+        """Yield a partition's rows as dicts.
+
+        Raises:
+            ValueError if verify is set and the file doesn't match the
+            checksum in the manifest.
+        """
+        fName = os.path.join(self.root, partition['path'])
+        if verify and fileChecksum(fName) != partition['sha1']:
+            raise ValueError("Partition " + fName + " doesn't match its checksum.")
+        data_file = open(fName, 'rb')
+        try:
+            for row in csv.DictReader(data_file):
+                yield row
+        finally:
+            data_file.close()
+
+    def compact(self, before_seq):
+        """Merge the partitions of each state up to a seq into one file.
+
+        Only compact partitions every consumer has already read (all their
+        cursors are at least before_seq): a compacted partition takes the
+        highest seq it covers, so a consumer whose cursor is inside the
+        covered range would read some rows twice.
+
+        Returns:
+            The number of partitions that were replaced.
+        """
+        manifest = self.manifest()
+        old = [p for p in manifest['partitions'] if p['seq'] <= before_seq]
+        by_state = {}
+        for partition in old:
+            by_state.setdefault(partition['state'], []).append(partition)
+
+        replaced = []
+        compacted = []
+        for state, partitions in sorted(by_state.items()):
+            if len(partitions) < 2:
+                continue
+            partitions.sort(key=lambda p: p['seq'])
+            seq = partitions[-1]['seq']
+            path = 'compacted/%s-%d.csv' % (stateSlug(state), seq)
+            self._concatenate([p['path'] for p in partitions], path)
+
+            covers = []
+            for partition in partitions:
+                covers.extend(partition.get('covers', [partition['seq']]))
+            fName = os.path.join(self.root, path)
+            compacted.append({
+                'seq': seq,
+                'run': 'compacted',
+                'state': state,
+                'path': path,
+                'rows': sum(p['rows'] for p in partitions),
+                'bytes': os.path.getsize(fName),
+                'sha1': fileChecksum(fName),
+                'covers': sorted(covers),
+            })
+            replaced.extend(partitions)
+
+        if not replaced:
+            return 0
+
+        replaced_seqs = set(p['seq'] for p in replaced)
+        manifest['partitions'] = sorted(
+            [p for p in manifest['partitions'] if p['seq'] not in replaced_seqs] + compacted,
+            key=lambda p: p['seq'])
+        self.writeManifest(manifest)
+
+        # the manifest no longer refers to the old files
+        for partition in replaced:
+            fName = os.path.join(self.root, partition['path'])
+            if os.path.exists(fName):
+                os.remove(fName)
+        self._removeEmptyRunDirs()
+        return len(replaced)
+
+    def _concatenate(self, paths, path):
+        fName = os.path.join(self.root, path)
+        if not os.path.isdir(os.path.dirname(fName)):
+            os.makedirs(os.path.dirname(fName))
+        with AtomicFile(fName, 'wb') as out_file:
+            header = None
+            for source in paths:
+                source_file = open(os.path.join(self.root, source), 'rb')
+                first = source_file.readline()
+                if header is None:
+                    header = first
+                    out_file.write(header)
+                shutil.copyfileobj(source_file, out_file)
+                source_file.close()
+
+    def _removeEmptyRunDirs(self):
+        runs_dir = os.path.join(self.root, 'runs')
+        if not os.path.isdir(runs_dir):
+            return
+        for run_id in os.listdir(runs_dir):
+            run_dir = os.path.join(runs_dir, run_id)
+            if os.path.isdir(run_dir) and not os.listdir(run_dir):
+                os.rmdir(run_dir)
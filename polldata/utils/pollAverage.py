@@ -0,0 +1,156 @@
+"""
+This module keeps RCP-style polling averages up to date as polls arrive.  See
+StateAverage's documentation for details.
+
+An average covers the latest poll of each service whose end date falls in a
+window of days ending at the state's newest poll.  Ex: with a 30 day window
+and a newest poll ending 11/4/2012, the average is the mean of each service's
+latest poll that ended between 10/5/2012 and 11/4/2012.
+"""
+
+import datetime
+
+
+def toOrdinal(value):
+    """Convert a 'month/day/year' poll date into a day number, or None.
+
+    Ex: "11/4/2012" -> datetime.date(2012, 11, 4).toordinal()
+    """
+    try:
+        month, day, year = value.split('/')
+        return datetime.date(int(year), int(month), int(day)).toordinal()
+    except (AttributeError, TypeError, ValueError):
+        return None
+
+
+def fromOrdinal(ordinal):
+    date = datetime.date.fromordinal(ordinal)
+    return '%d/%d/%d' % (date.month, date.day, date.year)
+
+
+class SumTree(object):
+    """A Fenwick tree holding sums of several values for a range of days.
+
+    Adding to a day and summing a range of days each take O(log days).
+
+    Args:
+        first
+            The first day number the tree covers.
+        size
+            The number of days covered.
+        width
+            The number of values summed for each day.
+    """
+
+    def __init__(self, first, size, width):
+        self.first = first
+        self.size = size
+        self.width = width
+        self.sums = [[0.0] * (size + 1) for _ in range(width)]
+
+    def covers(self, ordinal):
+        return self.first <= ordinal < self.first + self.size
+
+    def add(self, ordinal, values):
+        i = ordinal - self.first + 1
+        while i <= self.size:
+            for sums, value in zip(self.sums, values):
+                sums[i] += value
+            i += i & -i
+
+    def prefix(self, ordinal):
+        """The sums for the days before ordinal."""
+        totals = [0.0] * self.width
+        i = min(max(ordinal - self.first, 0), self.size)
+        while i > 0:
+            for n, sums in enumerate(self.sums):
+                totals[n] += sums[i]
+            i -= i & -i
+        return totals
+
+    def range(self, start, end):
+        """The sums for the days from start to end, inclusive."""
+        return [high - low for high, low in zip(self.prefix(end + 1), self.prefix(start))]
+
+
+class StateAverage(object):
+    """The polling average of one state in one race.
+
+    Only the latest poll of each service is kept.  They are summed by end date
+    in a SumTree, so adding a poll and computing the average over the window
+    each take O(log days) rather than a pass over the state's polls.
+
+    Args:
+        latest
+            The latest poll of each service, as saved by toJson().
+    """
+
+    # days the tree covers on either side of the first poll; it is rebuilt
+    # with twice the size if a poll falls outside
+    MARGIN = 512
+
+    def __init__(self, latest=None):
+        self.latest = {}
+        self.tree = None
+        self.newest = None
+        for service, poll in (latest or {}).items():
+            end = toOrdinal(poll['end'])
+            if end is not None:
+                self.add(service, end, poll['dem'], poll['rep'])
+
+    def add(self, service, end, dem, rep):
+        """Add a poll, given its end date's day number.
+
+        Returns:
+            True if the poll is now its service's latest (and so might change
+            the average), False if the service already has a later poll.
+        """
+        current = self.latest.get(service)
+        if current is not None and current[0] > end:
+            return False
+
+        if self.tree is None or not self.tree.covers(end):
+            self._rebuild(end)
+        if current is not None:
+            self.tree.add(current[0], (-1, -current[1], -current[2]))
+        self.latest[service] = (end, dem, rep)
+        self.tree.add(end, (1, dem, rep))
+        self.newest = end if self.newest is None else max(self.newest, end)
+        return True
+
+    def average(self, window_days):
+        """Return the average of the polls in the window, as a dict.
+
+        Ex: {'polls': 5, 'dem': 47.2, 'rep': 46.0, 'spread': 1.2,
+             'start': '10/5/2012', 'end': '11/4/2012'}
+        """
+        if self.newest is None:
+            return None
+        start = self.newest - window_days
+        polls, dem, rep = self.tree.range(start, self.newest)
+        polls = int(round(polls))
+        if not polls:
+            return None
+        return {
+            'polls': polls,
+            'dem': round(dem / polls, 2),
+            'rep': round(rep / polls, 2),
+            'spread': round((dem - rep) / polls, 2),
+            'start': fromOrdinal(start),
+            'end': fromOrdinal(self.newest),
+        }
+
+    def toJson(self):
+        return dict((service, {'end': fromOrdinal(end), 'dem': dem, 'rep': rep})
+                    for service, (end, dem, rep) in self.latest.items())
+
+    def _rebuild(self, ordinal):
+        ordinals = [end for end, _, _ in self.latest.values()] + [ordinal]
+        first = min(ordinals) - self.MARGIN
+        size = self.tree.size * 2 if self.tree is not None else 2 * self.MARGIN
+        while first + size <= max(ordinals):
+            size *= 2
+
+        self.tree = SumTree(first, size, 3)
+        for end, dem, rep in self.latest.values():
+            self.tree.add(end, (1, dem, rep))
@@ -0,0 +1,283 @@
+"""
+This module stores polls in a SQLite database.  See PollDatabase's
+documentation for details.
+
+Polls are kept in one table, 'polls', with a row per poll.  A poll is
+identified by its natural key:
+    (race, state, service, start_date, end_date, sample)
+so a poll that RCP revises (eg. new percentages) updates its row instead of
+being stored a second time.  The exported CSV files have no start column, so
+the importdb command takes the start dates of their polls from the race's
+revisions (see startDates).  Dates are stored as ISO 'YYYY-MM-DD' strings, so
+they sort and compare correctly:
+
+    SELECT * FROM polls
+    WHERE state = 'Ohio' AND sample = 'LV' AND end_date >= '2012-09-01'
+"""
+
+import csv
+import os
+import sqlite3
+import time
+
+from polldata import races as polldata_races
+
+SCHEMA = [
+    """CREATE TABLE IF NOT EXISTS polls (
+        id          INTEGER PRIMARY KEY,
+        race        TEXT NOT NULL,
+        year        INTEGER,
+        state       TEXT NOT NULL,
+        service     TEXT NOT NULL,
+        start_date  TEXT NOT NULL,
+        end_date    TEXT NOT NULL,
+        sample      TEXT NOT NULL,
+        voters      INTEGER,
+        dem         REAL,
+        rep         REAL,
+        ind         REAL,
+        spread      REAL,
+        first_seen  REAL NOT NULL,
+        last_seen   REAL NOT NULL,
+        UNIQUE (race, state, service, start_date, end_date, sample)
+    )""",
+    "CREATE INDEX IF NOT EXISTS polls_state_end ON polls (state, end_date)",
+    "CREATE INDEX IF NOT EXISTS polls_service ON polls (service)",
+    "CREATE INDEX IF NOT EXISTS polls_race_year ON polls (race, year)",
+    # the fingerprints of the seen stores the database replaced, see importSeenStore
+    """CREATE TABLE IF NOT EXISTS legacy_fingerprints (
+        race        TEXT NOT NULL,
+        fingerprint TEXT NOT NULL,
+        PRIMARY KEY (race, fingerprint)
+    )""",
+]
+
+KEY = ('race', 'state', 'service', 'start_date', 'end_date', 'sample')
+VALUES = ('year', 'voters', 'dem', 'rep', 'ind', 'spread')
+
+_INSERT = "INSERT OR IGNORE INTO polls (%s, first_seen, last_seen) VALUES (%s, ?, ?)" % (
+    ', '.join(KEY + VALUES), ', '.join('?' * len(KEY + VALUES)))
+
+# only rows whose values changed count as updated
+_UPDATE = "UPDATE polls SET %s, last_seen = ? WHERE %s AND NOT (%s)" % (
+    ', '.join('%s = ?' % field for field in VALUES),
+    ' AND '.join('%s = ?' % field for field in KEY),
+    ' AND '.join('%s IS ?' % field for field in VALUES))
+
+_TOUCH = "UPDATE polls SET last_seen = ? WHERE %s" % ' AND '.join('%s = ?' % field for field in KEY)
+
+# what the CSV files export of a poll's key
+_UNDATED_KEY = tuple(field for field in KEY if field != 'start_date')
+
+
+def isoDate(value):
+    """Convert a 'month/day/year' poll date into 'YYYY-MM-DD', or ''.
+
+    Ex: "10/3/2012" -> "2012-10-03"
+    """
+    try:
+        month, day, year = [int(part) for part in value.split('/')]
+    except (AttributeError, TypeError, ValueError):
+        return ''
+    return '%04d-%02d-%02d' % (year, month, day)
+
+
+def _number(value, kind=float):
+    try:
+        return kind(value)
+    except (TypeError, ValueError):
+        return None
+
+
+_years = {}
+
+def raceYear(race):
+    """Return a race's election year from its output name, or None."""
+    if race not in _years:
+        try:
+            _years[race] = polldata_races.getRaceByName(race)['year']
+        except KeyError:
+            _years[race] = None
+    return _years[race]
+
+
+def pollRow(poll, race=None):
+    """Convert a pollitem (or a dict read from an exported CSV) into a row.
+
+    Args:
+        poll
+            The poll's fields, as the spiders produce them.
+        race
+            The race's output name, for polls without a 'race' field (the
+            CSV files don't export it).
+
+    Returns:
+        A dict with the KEY and VALUES fields.
+    """
+    race = poll.get('race') or race
+    dem = _number(poll.get('dem'))
+    rep = _number(poll.get('rep'))
+    spread = poll.get('spread')
+    if spread is None or spread != spread:
+        spread = dem - rep if dem is not None and rep is not None else None
+    return {
+        'race': race,
+        'year': raceYear(race),
+        'state': poll.get('state') or '',
+        'service': poll.get('service') or '',
+        'start_date': isoDate(poll.get('start')),
+        'end_date': isoDate(poll.get('end')),
+        'sample': poll.get('sample') or '',
+        'voters': _number(poll.get('voters'), int),
+        'dem': dem,
+        'rep': rep,
+        'ind': _number(poll.get('ind')),
+        'spread': spread,
+    }
+
+
+def startDates(rows):
+    """Map polls to their start dates, for the CSV files' polls, which lack them.
+
+    Args:
+        rows
+            Rows (see pollRow), eg. the race's revisions.
+
+    Returns:
+        {(race, state, service, end_date, sample): start_date}.  Polls that
+        share all of these with another poll, or that have no start date,
+        are left out, since a CSV row couldn't tell which poll it is.
+    """
+    starts = {}
+    for row in rows:
+        key = tuple(row[field] for field in _UNDATED_KEY)
+        if starts.setdefault(key, row['start_date']) != row['start_date']:
+            starts[key] = ''
+    return dict((key, start) for key, start in starts.items() if start)
+
+
+def _openCsv(fName):
+    """Open a CSV file for the csv module: as bytes on Python 2, text on Python 3."""
+    if str is bytes:
+        return open(fName, 'rb')
+    return open(fName, 'r', newline='', encoding='utf-8')
+
+
+def _csvRows(data_file, race, start_dates):
+    for poll in csv.DictReader(data_file):
+        poll = dict((field, value.decode('utf-8') if isinstance(value, bytes) else value)
+                    for field, value in poll.items())
+        row = pollRow(poll, race)
+        if start_dates and 'start' not in poll:
+            row['start_date'] = start_dates.get(tuple(row[field] for field in _UNDATED_KEY), '')
+        yield row
+
+
+class PollDatabase(object):
+    """A SQLite database of polls.
+
+    The database is opened in WAL mode, so readers are never blocked while a
+    crawl writes to it, and rows are written in batches, one transaction
+    each.
+
+    Args:
+        fName
+            The database file, eg. 'data/polls.db'.
+    """
+
+    def __init__(self, fName):
+        if os.path.dirname(fName) and not os.path.isdir(os.path.dirname(fName)):
+            os.makedirs(os.path.dirname(fName))
+        self.fName = fName
+        self.connection = sqlite3.connect(fName)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        # durable at each checkpoint rather than each transaction; a crash
+        # loses at most the last batches, which the next crawl upserts again
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        with self.connection:
+            for statement in SCHEMA:
+                self.connection.execute(statement)
+
+    def upsert(self, rows, now=None):
+        """Insert or update a batch of rows in one transaction.
+
+        Args:
+            rows
+                A list of dicts, see pollRow.
+
+        Returns:
+            (inserted, updated): the number of new polls, and of existing polls
+            whose values changed.
+        """
+        now = now or time.time()
+        keys = [tuple(row[field] for field in KEY) for row in rows]
+        values = [tuple(row[field] for field in VALUES) for row in rows]
+
+        with self.connection:
+            cursor = self.connection.executemany(
+                _INSERT, [key + value + (now, now) for key, value in zip(keys, values)])
+            inserted = cursor.rowcount
+            cursor = self.connection.executemany(
+                _UPDATE, [value + (now,) + key + value for key, value in zip(keys, values)])
+            updated = cursor.rowcount
+            self.connection.executemany(_TOUCH, [(now,) + key for key in keys])
+        return inserted, updated
+
+    def importRows(self, rows, batch_rows=1000):
+        """Upsert rows (see pollRow) in batches of batch_rows.
+
+        Returns:
+            (inserted, updated), see upsert.
+        """
+        inserted = updated = 0
+        batch = []
+        for row in rows:
+            batch.append(row)
+            if len(batch) >= batch_rows:
+                counts = self.upsert(batch)
+                inserted, updated, batch = inserted + counts[0], updated + counts[1], []
+        if batch:
+            counts = self.upsert(batch)
+            inserted, updated = inserted + counts[0], updated + counts[1]
+        return inserted, updated
+
+    def importCsv(self, fName, race, batch_rows=1000, start_dates=None):
+        """Upsert the polls of an exported CSV file (eg. a partition).
+
+        Args:
+            start_dates
+                The start dates of the file's polls, see startDates.  They
+                are only used if the file has no start column.
+
+        Returns:
+            (inserted, updated), see upsert.
+        """
+        data_file = _openCsv(fName)
+        try:
+            return self.importRows(_csvRows(data_file, race, start_dates), batch_rows)
+        finally:
+            data_file.close()
+
+    def importSeenStore(self, store, race):
+        """Keep the fingerprints of a seen store (eg. a race's _dict.json).
+
+        The fingerprints are md5 hashes of the polls' values, so the polls
+        can't be rebuilt from them; they are kept in 'legacy_fingerprints' so
+        the files can be retired without losing the record.
+
+        Returns:
+            The number of fingerprints that weren't stored yet.
+        """
+        with self.connection:
+            cursor = self.connection.executemany(
+                "INSERT OR IGNORE INTO legacy_fingerprints (race, fingerprint) VALUES (?, ?)",
+                ((race, fingerprint) for fingerprint in store))
+        return cursor.rowcount
+
+    def count(self, race=None):
+        if race is None:
+            return self.connection.execute("SELECT COUNT(*) FROM polls").fetchone()[0]
+        return self.connection.execute("SELECT COUNT(*) FROM polls WHERE race = ?", (race,)).fetchone()[0]
+
+    def close(self):
+        self.connection.close()
@@ -0,0 +1,302 @@
+"""
+This module answers queries over the scraped polls from memory.  See
+PollIndex's documentation for details; the pollserver command serves it over
+HTTP.
+
+The polls come from each race's 'data/<race>_revisions.log' (see
+polldata.utils.pollRevisions), which holds the latest values of every poll
+the race's crawls have seen, keyed by race, state, service, dates and sample
+type.  Dates are ISO 'YYYY-MM-DD' strings, so they compare correctly as
+strings.
+"""
+
+import bisect
+import glob
+import os
+import time
+
+from polldata.utils.pollRevisions import loadRevisions
+
+STATE_ABBREVIATIONS = {
+    'AL': 'Alabama', 'AK': 'Alaska', 'AZ': 'Arizona', 'AR': 'Arkansas', 'CA': 'California',
+    'CO': 'Colorado', 'CT': 'Connecticut', 'DE': 'Delaware', 'DC': 'District of Columbia',
+    'FL': 'Florida', 'GA': 'Georgia', 'HI': 'Hawaii', 'ID': 'Idaho', 'IL': 'Illinois',
+    'IN': 'Indiana', 'IA': 'Iowa', 'KS': 'Kansas', 'KY': 'Kentucky', 'LA': 'Louisiana',
+    'ME': 'Maine', 'MD': 'Maryland', 'MA': 'Massachusetts', 'MI': 'Michigan', 'MN': 'Minnesota',
+    'MS': 'Mississippi', 'MO': 'Missouri', 'MT': 'Montana', 'NE': 'Nebraska', 'NV': 'Nevada',
+    'NH': 'New Hampshire', 'NJ': 'New Jersey', 'NM': 'New Mexico', 'NY': 'New York',
+    'NC': 'North Carolina', 'ND': 'North Dakota', 'OH': 'Ohio', 'OK': 'Oklahoma', 'OR': 'Oregon',
+    'PA': 'Pennsylvania', 'RI': 'Rhode Island', 'SC': 'South Carolina', 'SD': 'South Dakota',
+    'TN': 'Tennessee', 'TX': 'Texas', 'UT': 'Utah', 'VT': 'Vermont', 'VA': 'Virginia',
+    'WA': 'Washington', 'WV': 'West Virginia', 'WI': 'Wisconsin', 'WY': 'Wyoming',
+}
+
+
+# candidates above which a field date query also asks the interval tree
+TREE_THRESHOLD = 256
+
+
+def stateName(state):
+    """Return the lowercase state name for a name or postal abbreviation.  Ex: "FL" -> "florida" """
+    return STATE_ABBREVIATIONS.get(state.upper(), state).lower()
+
+
+class IntervalTree(object):
+    """A static centered interval tree over (start, end, value) triples.
+
+    overlapping(low, high) returns the values of the intervals that share at
+    least a point with [low, high], in O(log n + matches).  The tree is built
+    once; a changed race is indexed again from scratch (see PollIndex.reload).
+    """
+
+    def __init__(self, intervals):
+        self.root = self._build(list(intervals))
+
+    def _build(self, intervals):
+        if not intervals:
+            return None
+        points = sorted([interval[0] for interval in intervals] + [interval[1] for interval in intervals])
+        center = points[len(points) // 2]
+        left, right, here = [], [], []
+        for interval in intervals:
+            if interval[1] < center:
+                left.append(interval)
+            elif interval[0] > center:
+                right.append(interval)
+            else:
+                here.append(interval)
+        by_start = sorted(here, key=lambda interval: interval[0])
+        by_end = sorted(here, key=lambda interval: interval[1], reverse=True)
+        return (center, [interval[0] for interval in by_start], by_start,
+                [interval[1] for interval in by_end], by_end,
+                self._build(left), self._build(right))
+
+    def overlapping(self, low, high):
+        values = []
+        stack = [self.root]
+        while stack:
+            node = stack.pop()
+            if node is None:
+                continue
+            center, starts, by_start, ends, by_end, left, right = node
+            if high < center:
+                # every interval here ends at or after center: those starting by high overlap
+                values.extend(interval[2] for interval in by_start[:bisect.bisect_right(starts, high)])
+                stack.append(left)
+            elif low > center:
+                # every interval here starts by center: those ending at or after low overlap
+                for interval in by_end:
+                    if interval[1] < low:
+                        break
+                    values.append(interval[2])
+                stack.append(right)
+            else:
+                values.extend(interval[2] for interval in by_start)
+                stack.append(left)
+                stack.append(right)
+        return values
+
+
+class RaceIndex(object):
+    """The polls of one race, indexed by state, service, state and service, end date and field dates."""
+
+    def __init__(self, race, polls):
+        self.race = race
+        # newest first, so every index lists its polls newest first too
+        self.polls = sorted(polls, key=lambda poll: (poll['end_date'], poll['start_date']), reverse=True)
+        self.by_state = {}
+        self.by_service = {}
+        self.by_state_service = {}
+        for position, poll in enumerate(self.polls):
+            state, service = poll['state'].lower(), poll['service'].lower()
+            self.by_state.setdefault(state, []).append(position)
+            self.by_service.setdefault(service, []).append(position)
+            self.by_state_service.setdefault((state, service), []).append(position)
+        # oldest first, for bisect
+        self.ends = [poll['end_date'] for poll in reversed(self.polls)]
+        self.dates = IntervalTree((min(poll['start_date'] or poll['end_date'], poll['end_date']),
+                                   poll['end_date'], position)
+                                  for position, poll in enumerate(self.polls) if poll['end_date'])
+
+    def __len__(self):
+        return len(self.polls)
+
+    def query(self, state=None, service=None, sample=None, ended_after=None, ended_before=None,
+              field_from=None, field_to=None, latest=False):
+        """Return the positions of the matching polls, newest first.
+
+        The candidates come from the most selective index, and every other
+        condition is checked on each candidate.  With latest, only the newest
+        matching poll of each service in each state is kept.
+        """
+        if state is not None:
+            state = stateName(state)
+        if service is not None:
+            service = service.lower()
+        if latest:
+            if (sample, ended_after, ended_before, field_from, field_to) == (None,) * 5:
+                # the newest poll of each series is the head of its list
+                return sorted(positions[0] for (series_state, series_service), positions
+                              in self.by_state_service.items()
+                              if state in (None, series_state) and service in (None, series_service))
+            newest = {}
+            for position in self.query(state, service, sample, ended_after, ended_before, field_from, field_to):
+                poll = self.polls[position]
+                newest.setdefault((poll['state'].lower(), poll['service'].lower()), position)
+            return sorted(newest.values())
+
+        # (condition the index answers, positions)
+        sources = []
+        if state is not None and service is not None:
+            sources.append(('state and service', self.by_state_service.get((state, service), [])))
+        elif state is not None:
+            sources.append(('state', self.by_state.get(state, [])))
+        elif service is not None:
+            sources.append(('service', self.by_service.get(service, [])))
+        ended = ended_after is not None or ended_before is not None
+        if ended:
+            # self.ends is oldest first, positions are newest first
+            low = bisect.bisect_left(self.ends, ended_after) if ended_after is not None else 0
+            high = bisect.bisect_right(self.ends, ended_before) if ended_before is not None else len(self.ends)
+            sources.append(('ended', range(len(self.polls) - high, len(self.polls) - low)))
+        in_field = field_from is not None or field_to is not None
+        if in_field:
+            field_from, field_to = field_from or '', field_to or '9999-12-31'
+        sources.sort(key=lambda source: len(source[1]))
+        if in_field and (not sources or len(sources[0][1]) > TREE_THRESHOLD):
+            sources.insert(0, ('field', sorted(self.dates.overlapping(field_from, field_to))))
+        if not sources:
+            sources.append((None, range(len(self.polls))))
+        if sample is not None:
+            sample = sample.upper()
+
+        answered, candidates = sources[0]
+        check_state = state is not None and answered not in ('state', 'state and service')
+        check_service = service is not None and answered not in ('service', 'state and service')
+        check_ended = ended and answered != 'ended'
+        check_field = in_field and answered != 'field'
+        if not (check_state or check_service or check_ended or check_field or sample is not None):
+            return list(candidates)
+
+        positions = []
+        for position in candidates:
+            poll = self.polls[position]
+            if check_state and poll['state'].lower() != state:
+                continue
+            if check_service and poll['service'].lower() != service:
+                continue
+            if sample is not None and poll['sample'] != sample:
+                continue
+            if check_ended and not ((ended_after is None or poll['end_date'] >= ended_after) and
+                                    (ended_before is None or poll['end_date'] <= ended_before)):
+                continue
+            if check_field and not (poll['end_date'] >= field_from and
+                                    min(poll['start_date'] or poll['end_date'], poll['end_date']) <= field_to):
+                continue
+            positions.append(position)
+        return positions
+
+
+class PollIndex(object):
+    """The polls of every race in a data directory, kept up to date with reload().
+
+    Ex:
+        index = PollIndex('data')
+        index.reload()
+        index.query(state='FL', limit=10)               # latest polls in Florida
+        index.query(ended_after='2012-10-01', ended_before='2012-10-07')
+        index.query(field_from='2012-10-03', field_to='2012-10-03')  # in the field that day
+
+    Args:
+        data_dir
+            The directory with the '<race>_revisions.log' files.
+    """
+
+    def __init__(self, data_dir):
+        self.data_dir = data_dir
+        self.races = {}
+        self.versions = {}
+        self.loaded = None
+
+    def reload(self):
+        """Index again the races whose revisions file changed (or appeared, or went).
+
+        Only the complete flushes of a race's log are read (see
+        loadRevisions), so a crawl that is writing it is picked up by a later
+        reload.
+
+        Returns:
+            The names of the races indexed again.
+        """
+        changed = []
+        found = set()
+        files = {}
+        # the json files of older versions, until a crawl rewrites them as logs
+        for suffix in ('_revisions.json', '_revisions.log'):
+            for fName in glob.glob(os.path.join(self.data_dir, '*' + suffix)):
+                files[os.path.basename(fName)[:-len(suffix)]] = fName
+        for race, fName in sorted(files.items()):
+            found.add(race)
+            try:
+                stat = os.stat(fName)
+            except OSError:
+                continue
+            version = (stat.st_mtime, stat.st_size, stat.st_ino)
+            if self.versions.get(race) == version:
+                continue
+            polls = []
+            for entry in loadRevisions(os.path.join(self.data_dir, race))[1].values():
+                poll = dict(entry['key'])
+                poll.update(entry['values'])
+                poll['revision'] = entry.get('revision')
+                poll['first_seen'] = entry.get('first_seen')
+                poll['last_seen'] = entry.get('last_seen')
+                polls.append(poll)
+            # built before it replaces the old index, so queries never see half of one
+            self.races[race] = RaceIndex(race, polls)
+            self.versions[race] = version
+            changed.append(race)
+        for race in set(self.races) - found:
+            del self.races[race]
+            del self.versions[race]
+            changed.append(race)
+        if changed:
+            self.loaded = time.time()
+        return sorted(changed)
+
+    def __len__(self):
+        return sum(len(race) for race in self.races.values())
+
+    def query(self, race=None, limit=100, **conditions):
+        """Return (matches, polls): the number of matching polls and the first limit of them, newest first.
+
+        Args:
+            race
+                A race's output name, eg. 'pres2012', or None for every race.
+            conditions
+                See RaceIndex.query: state (a name or postal abbreviation),
+                service, sample, ended_after and ended_before (the end date
+                range), field_from and field_to (polls in the field at any
+                time in the range), and latest (only the newest matching poll
+                of each service in each state).
+        """
+        if race is not None:
+            indexes = [self.races[race]] if race in self.races else []
+        else:
+            indexes = list(self.races.values())
+
+        matches = 0
+        polls = []
+        for index in indexes:
+            positions = index.query(**conditions)
+            matches += len(positions)
+            polls.extend(index.polls[position] for position in positions[:limit])
+        if len(indexes) > 1:
+            polls.sort(key=lambda poll: (poll['end_date'], poll['start_date']), reverse=True)
+        return matches, polls[:limit]
+
+    def summary(self):
+        """Return {race: {'polls', 'states', 'services', 'newest'}}."""
+        return dict((race, {'polls': len(index), 'states': len(index.by_state), 'services': len(index.by_service),
+                            'newest': index.polls[0]['end_date'] if index.polls else None})
+                    for race, index in self.races.items())
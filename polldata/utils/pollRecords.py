@@ -0,0 +1,102 @@
+"""
+This module provides PollRecord, a compact stand-in for PresPollItem for code
+that holds many polls at once.  See PollRecord's documentation for details.
+
+A PresPollItem keeps its fields in a dict, and each field's value is its own
+string, so a poll costs well over a kilobyte.  A PollRecord keeps them in
+__slots__, and shares the values that repeat across polls (states, services,
+dates, percentages...) through a table of interned values, so a poll costs
+little more than its slots.  The table belongs to whoever holds the records
+(eg. an ExternalSorter, see polldata.utils.externalSort) and goes away with
+them, so a long-running process doesn't keep every value it ever saw.
+`python -m benchmarks.pollmemory` measures both.
+"""
+
+from polldata.utils.statePage import POLL_FIELDS
+
+FIELDS = ('race', 'state') + POLL_FIELDS + ('ind',)
+
+
+def internValue(value, values):
+    """Return the copy in values of a value equal to value, and of the same type.
+
+    values is a dict the value is added to if it isn't there yet.  Unlike the
+    builtin intern(), it accepts unicode strings and numbers on python 2.  The
+    type is part of the key so that, eg., an ind of 0 never comes back as a
+    spread of 0.0.  NaN isn't equal to itself, so each NaN is kept as it is.
+    """
+    if value != value:
+        return value
+    return values.setdefault((type(value), value), value)
+
+
+class PollRecord(object):
+    """A poll's fields, held in slots with their values interned.
+
+    Records are made from pollitems (or the dicts parseStatePage returns)
+    with fromItem() and turned back into a PresPollItem with toItem() at the
+    Scrapy boundary, eg. before a record is exported.  In between they can
+    be read like a pollitem: record['state'], record.get('voters'),
+    'start' in record.  A field the item didn't have is None.
+
+    Records made with the same values table share their repeated values;
+    drop the table with the records.
+
+    Ex:
+        values = {}
+        records = [PollRecord.fromItem(item, values) for item in items]
+        records.sort(key=lambda record: record.state)
+        exporter.export_item(records[0].toItem())
+    """
+
+    __slots__ = FIELDS
+
+    @classmethod
+    def fromItem(cls, item, values=None):
+        """Return a record of item, its values interned in values (a dict)."""
+        if values is None:
+            values = {}
+        record = cls.__new__(cls)
+        get = item.get
+        record.race = internValue(get('race'), values)
+        record.state = internValue(get('state'), values)
+        record.service = internValue(get('service'), values)
+        record.start = internValue(get('start'), values)
+        record.end = internValue(get('end'), values)
+        record.voters = internValue(get('voters'), values)
+        record.sample = internValue(get('sample'), values)
+        record.dem = internValue(get('dem'), values)
+        record.rep = internValue(get('rep'), values)
+        record.spread = internValue(get('spread'), values)
+        record.ind = internValue(get('ind'), values)
+        return record
+
+    def toItem(self, item_cls=None):
+        """Return the record as a PresPollItem (or an item_cls), without its missing fields."""
+        if item_cls is None:
+            from polldata.items import PresPollItem as item_cls
+        item = item_cls()
+        for field in FIELDS:
+            value = getattr(self, field)
+            if value is not None:
+                item[field] = value
+        return item
+
+    def __getitem__(self, field):
+        try:
+            return getattr(self, field)
+        except (AttributeError, TypeError):
+            raise KeyError(field)
+
+    def get(self, field, default=None):
+        value = getattr(self, field, None)
+        return default if value is None else value
+
+    def __contains__(self, field):
+        return field in FIELDS and getattr(self, field) is not None
+
+    def keys(self):
+        return [field for field in FIELDS if getattr(self, field) is not None]
+
+    def __repr__(self):
+        return 'PollRecord(%s)' % ', '.join('%s=%r' % (field, getattr(self, field)) for field in FIELDS)
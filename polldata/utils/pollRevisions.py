@@ -0,0 +1,344 @@
+"""
+This module tracks each poll's revisions and writes them to a change feed.
+See PollRevisions' documentation for details.
+
+A poll is identified by the natural key of polldata.utils.pollDatabase:
+    (race, state, service, start_date, end_date, sample)
+unlike CsvExportPipeline's fingerprint, which covers the poll's numbers, so a
+poll that RCP revises is an update of the same poll instead of a new one.
+
+The feed, 'data/<race>_changes.jsonl', has a json object per line:
+
+    {"seq": 12, "op": "update", "time": 1349300000.0, "revision": 2,
+     "key": {"race": "pres2012", "state": "Ohio", "service": "Rasmussen Reports",
+             "start_date": "2012-10-01", "end_date": "2012-10-03", "sample": "LV"},
+     "values": {"year": 2012, "voters": 500, "dem": 48.0, "rep": 47.0, ...},
+     "previous": {"year": 2012, "voters": 500, "dem": 49.0, "rep": 46.0, ...}}
+
+    op          "insert", "update" or "delete"
+    seq         increases by one per change, so a consumer only has to
+                remember the last one it applied (see readChanges)
+    values      the poll's values, for inserts and updates
+    previous    the values it replaces, for updates and deletes
+
+The latest values of the polls are kept in 'data/<race>_revisions.log', an
+append-only log that loadRevisions() reads (see PollRevisions).
+"""
+
+import json
+import os
+import time
+
+from polldata.utils.fileLock import AtomicFile, readJson
+from polldata.utils.pollDatabase import KEY, VALUES
+
+
+def pollKey(row):
+    """Return the string a poll row (see pollDatabase.pollRow) is stored under."""
+    return u'\t'.join(u'%s' % row[field] for field in KEY)
+
+
+def _replay(fName):
+    """Read a revisions log up to its last commit.
+
+    Returns:
+        {'seq', 'polls', 'records', 'end'}: the last committed seq, the polls
+        ({key: entry}), the number of committed records and the offset just
+        after the last commit, or None if there is no log.
+    """
+    try:
+        log_file = open(fName, 'rb')
+    except IOError:
+        return None
+    state = {'seq': 0, 'polls': {}, 'records': 0, 'end': 0}
+    polls = state['polls']
+    seen = {}
+    pending = []
+    offset = 0
+    try:
+        for line in log_file:
+            offset += len(line)
+            # a flush that was cut short ends without its commit
+            if not line.endswith(b'\n'):
+                break
+            try:
+                record = json.loads(line.decode('utf-8'))
+            except ValueError:
+                break
+            if 'seq' not in record:
+                pending.append(record)
+                continue
+            for change in pending:
+                if 'put' in change:
+                    polls[pollKey(change['put']['key'])] = change['put']
+                elif 'delete' in change:
+                    polls.pop(pollKey(change['delete']), None)
+                elif 'seen' in change:
+                    page = tuple(change['seen'])
+                    seen[page] = max(seen.get(page, 0), change['time'])
+            state['seq'] = max(state['seq'], record['seq'])
+            pending.append(record)
+            state['records'] += len(pending)
+            state['end'] = offset
+            pending = []
+    finally:
+        log_file.close()
+
+    # every poll still on a page was seen whenever the page was
+    for entry in polls.values():
+        page_seen = seen.get((entry['key']['race'], entry['key']['state']))
+        if page_seen is not None and page_seen > entry['last_seen']:
+            entry['last_seen'] = page_seen
+    return state
+
+
+def loadRevisions(basename):
+    """Return (seq, polls) as saved by a race's PollRevisions, without changing its files.
+
+    polls is {key: {'key', 'values', 'revision', 'first_seen', 'last_seen'}}.
+    Readers that run beside a crawl, like importdb and pollserver, use this
+    rather than a PollRevisions: they see each flush completely or not at all.
+    """
+    state = _replay(basename + '_revisions.log')
+    if state is not None:
+        return state['seq'], state['polls']
+    # the format of older versions, rewritten as a log by the next crawl
+    saved = readJson(basename + '_revisions.json', {})
+    if not isinstance(saved, dict):
+        saved = {}
+    return saved.get('seq', 0), saved.get('polls', {})
+
+
+def revisionRows(polls):
+    """Yield the latest values of polls (see loadRevisions) as rows (see pollDatabase.pollRow)."""
+    for entry in polls.values():
+        row = dict(entry['key'])
+        row.update(entry['values'])
+        yield row
+
+
+class PollRevisions(object):
+    """The latest values of a race's polls, and the changes to them.
+
+    Each crawl passes every poll it scrapes to observe(), which compares it
+    with the values stored under its key: a poll that isn't stored yet is an
+    insert, and one whose values differ is an update.  When the spider
+    closes, finish() looks for deletes: a stored poll is deleted when its
+    state page was parsed in this crawl (at least one of its polls was
+    observed) but the poll wasn't on it.  Pages that weren't downloaded, eg.
+    because they were unchanged, are left alone.
+
+    flush() appends the changes to '<basename>_changes.jsonl', then the
+    polls that changed to '<basename>_revisions.log', so a crawl writes what
+    it changed rather than every poll.  Each line of the log is a json
+    record:
+
+        {"put": {"key": ..., "values": ..., "revision": ..., ...}}
+                                        a poll's latest values
+        {"delete": {"race": ..., ...}}  a poll was deleted
+        {"seen": [race, state], "time": ...}
+                                        the polls on a page were all seen
+        {"seq": ...}                    commits the records before it
+
+    Readers (see loadRevisions) only apply the records up to the last commit,
+    so they never see part of a flush, and the next flush first cuts off
+    what a crash left after it.  When the log holds more than compact_ratio
+    records per poll it is compacted: rewritten with a put per poll, then
+    renamed over the old log.
+
+    A crash between the two appends can repeat changes in the feed but never
+    loses one, so consumers should apply inserts and updates as upserts.
+
+    Args:
+        basename
+            The path prefix for the files, usually 'data/<race>'.
+        compact_ratio
+            The number of log records per poll that triggers compaction when
+            the revisions are flushed.
+    """
+
+    def __init__(self, basename, compact_ratio=2.0):
+        self.fName = basename + '_revisions.log'
+        self.feed_fName = basename + '_changes.jsonl'
+        self.compact_ratio = compact_ratio
+
+        state = _replay(self.fName)
+        if state is not None:
+            saved_seq, self.polls = state['seq'], state['polls']
+            self.records, self.end = state['records'], state['end']
+        else:
+            saved_seq, self.polls = loadRevisions(basename)
+            # written out in full by the first flush
+            self.records, self.end = float('inf'), None
+        # the feed can be ahead of the saved polls after a crash
+        self.seq = max(saved_seq, lastSeq(self.feed_fName))
+        self.changes = []
+        # the log records to append: {key: 'put' or 'delete'} and {page: time seen}
+        self.changed = {}
+        self.seen_pages = {}
+        self.observed = set()
+        self.pages = set()
+
+    def observe(self, row, now=None):
+        """Compare a poll row (see pollDatabase.pollRow) with its stored values.
+
+        Returns:
+            'insert', 'update', or None if the poll is unchanged.
+        """
+        now = now or time.time()
+        key = pollKey(row)
+        values = dict((field, row[field]) for field in VALUES)
+        page = (row['race'], row['state'])
+        self.observed.add(key)
+        self.pages.add(page)
+        self.seen_pages[page] = now
+
+        stored = self.polls.get(key)
+        if stored is None:
+            self.polls[key] = {'key': dict((field, row[field]) for field in KEY), 'values': values,
+                               'revision': 1, 'first_seen': now, 'last_seen': now}
+            self.changed[key] = 'put'
+            self._change('insert', self.polls[key], now, values=values)
+            return 'insert'
+
+        stored['last_seen'] = now
+        if stored['values'] == values:
+            return None
+        previous = stored['values']
+        stored['values'] = values
+        stored['revision'] += 1
+        self.changed[key] = 'put'
+        self._change('update', stored, now, values=values, previous=previous)
+        return 'update'
+
+    def finish(self, now=None):
+        """Delete the polls missing from the pages observed since the last call.
+
+        Returns:
+            The number of deleted polls.
+        """
+        now = now or time.time()
+        deleted = 0
+        for key in sorted(self.polls):
+            stored = self.polls[key]
+            page = (stored['key']['race'], stored['key']['state'])
+            if page in self.pages and key not in self.observed:
+                del self.polls[key]
+                self.changed[key] = stored['key']
+                self._change('delete', stored, now, previous=stored['values'])
+                deleted += 1
+        self.observed = set()
+        self.pages = set()
+        return deleted
+
+    def _change(self, op, stored, now, values=None, previous=None):
+        self.seq += 1
+        change = {'seq': self.seq, 'op': op, 'time': now, 'revision': stored['revision'], 'key': stored['key']}
+        if values is not None:
+            change['values'] = values
+        if previous is not None:
+            change['previous'] = previous
+        self.changes.append(change)
+
+    def flush(self):
+        """Append the pending changes to the feed, then the changed polls to the log."""
+        if self.changes:
+            feed_file = open(self.feed_fName, 'a')
+            for change in self.changes:
+                feed_file.write(json.dumps(change, sort_keys=True) + '\n')
+            feed_file.flush()
+            os.fsync(feed_file.fileno())
+            feed_file.close()
+            self.changes = []
+        if not self.changed and not self.seen_pages:
+            return
+
+        if self.records + len(self.changed) + len(self.seen_pages) + 1 > \
+                max(len(self.polls), 1) * self.compact_ratio:
+            self.compact()
+            return
+
+        lines = []
+        for key, change in self.changed.items():
+            if change == 'put':
+                lines.append(json.dumps({'put': self.polls[key]}, sort_keys=True))
+            else:
+                lines.append(json.dumps({'delete': change}, sort_keys=True))
+        for page, seen in sorted(self.seen_pages.items()):
+            lines.append(json.dumps({'seen': list(page), 'time': seen}, sort_keys=True))
+        lines.append(json.dumps({'seq': self.seq}))
+
+        # cut off what a crash left after the last commit
+        if os.path.getsize(self.fName) != self.end:
+            log_file = open(self.fName, 'r+b')
+            log_file.truncate(self.end)
+            log_file.close()
+        data = ('\n'.join(lines) + '\n').encode('utf-8')
+        log_file = open(self.fName, 'ab')
+        log_file.write(data)
+        log_file.flush()
+        os.fsync(log_file.fileno())
+        log_file.close()
+        self.end += len(data)
+        self.records += len(lines)
+        self.changed = {}
+        self.seen_pages = {}
+
+    def compact(self):
+        """Rewrite the log so that it only holds a put per poll."""
+        with AtomicFile(self.fName, 'wb') as log_file:
+            for key in sorted(self.polls):
+                log_file.write((json.dumps({'put': self.polls[key]}, sort_keys=True) + '\n').encode('utf-8'))
+            log_file.write((json.dumps({'seq': self.seq}) + '\n').encode('utf-8'))
+            end = log_file.tell()
+        self.records = len(self.polls) + 1
+        self.end = end
+        self.changed = {}
+        self.seen_pages = {}
+
+    def close(self):
+        self.flush()
+
+
+def lastSeq(fName):
+    """Return the seq of the last complete change in a feed, or 0."""
+    try:
+        feed_file = open(fName, 'rb')
+    except IOError:
+        return 0
+    try:
+        feed_file.seek(0, os.SEEK_END)
+        size = feed_file.tell()
+        # a change is well under 4KB, so the last complete one is in the last 8KB
+        feed_file.seek(max(0, size - 8192))
+        lines = feed_file.read().splitlines()
+    finally:
+        feed_file.close()
+    for line in reversed(lines):
+        try:
+            return json.loads(line.decode('utf-8'))['seq']
+        except (ValueError, KeyError, TypeError):
+            continue
+    return 0
+
+
+def readChanges(fName, since=0):
+    """Yield the changes in a feed whose seq is greater than since.
+
+    A consumer that applied changes up to seq N reads the next ones with
+    readChanges('data/pres2012_changes.jsonl', N).  A partly written last
+    line (from a crawl that is still running or died) is skipped.
+    """
+    try:
+        feed_file = open(fName, 'rb')
+    except IOError:
+        return
+    try:
+        for line in feed_file:
+            if not line.endswith(b'\n'):
+                break
+            change = json.loads(line.decode('utf-8'))
+            if change['seq'] > since:
+                yield change
+    finally:
+        feed_file.close()
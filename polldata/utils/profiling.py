@@ -0,0 +1,122 @@
+"""
+This module profiles sampled calls of a function with cProfile, and the
+memory they allocate with tracemalloc.  See CallProfiler's documentation for
+details.
+
+tracemalloc is part of Python 3.4+ (and the pytracemalloc backport for
+Python 2); without it only cProfile is used.
+"""
+
+import cProfile
+import os
+import pstats
+
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+
+
+class CallProfiler(object):
+    """Accumulates the profile of every sampled call of one hook.
+
+    Wrap each sampled call in start() and stop() (or each step of a
+    generator, with start(new_call=False) after the first).  The cProfile
+    stats of all the calls are merged, and so are the allocations that were
+    still alive when each call returned, grouped by traceback.  write() saves:
+
+        <name>.prof          cProfile stats, for pstats, snakeviz, flameprof,
+                             gprof2dot...
+        <name>.txt           the top functions by cumulative time
+        <name>.alloc.txt     the top allocating lines (only with tracemalloc)
+        <name>.alloc.folded  the allocations as folded stacks ('frame;frame
+                             bytes' per line), for flamegraph.pl or speedscope
+
+    Args:
+        name
+            The hook's name, used for the file names.  Ex: 'parseStatePolls'
+        trace_frames
+            The traceback depth kept for each allocation; 0 to not trace
+            allocations.
+        top
+            The number of lines in the text reports.
+    """
+
+    def __init__(self, name, trace_frames=25, top=30):
+        self.name = name
+        self.trace_frames = trace_frames if tracemalloc is not None else 0
+        self.top = top
+        self.profile = cProfile.Profile()
+        self.calls = 0
+        self.allocations = {}
+
+    def start(self, new_call=True):
+        """Start profiling, for a new call or (new_call=False) to resume one."""
+        if new_call:
+            self.calls += 1
+        if self.trace_frames:
+            tracemalloc.start(self.trace_frames)
+        self.profile.enable()
+
+    def stop(self):
+        self.profile.disable()
+        if self.trace_frames:
+            snapshot = tracemalloc.take_snapshot()
+            tracemalloc.stop()
+            self._addSnapshot(snapshot)
+
+    def _addSnapshot(self, snapshot):
+        snapshot = snapshot.filter_traces([
+            tracemalloc.Filter(False, tracemalloc.__file__),
+            tracemalloc.Filter(False, __file__.replace('.pyc', '.py')),
+        ])
+        for stat in snapshot.statistics('traceback'):
+            # outermost frame first
+            frames = tuple('%s:%d' % (frame.filename, frame.lineno) for frame in reversed(stat.traceback))
+            totals = self.allocations.setdefault(frames, [0, 0])
+            totals[0] += stat.size
+            totals[1] += stat.count
+
+    def write(self, dirname):
+        """Write the reports in a directory.
+
+        Returns:
+            The paths of the files written.
+        """
+        if not self.calls:
+            return []
+        if not os.path.isdir(dirname):
+            os.makedirs(dirname)
+        base = os.path.join(dirname, self.name)
+        written = [base + '.prof', base + '.txt']
+
+        self.profile.dump_stats(base + '.prof')
+        report_file = open(base + '.txt', 'w')
+        report_file.write("%s: %d sampled calls\n\n" % (self.name, self.calls))
+        stats = pstats.Stats(base + '.prof', stream=report_file)
+        stats.sort_stats('cumulative').print_stats(self.top)
+        report_file.close()
+
+        if self.allocations:
+            written.extend([base + '.alloc.txt', base + '.alloc.folded'])
+            self._writeAllocations(base)
+        return written
+
+    def _writeAllocations(self, base):
+        by_line = {}
+        for frames, (size, count) in self.allocations.items():
+            totals = by_line.setdefault(frames[-1], [0, 0])
+            totals[0] += size
+            totals[1] += count
+
+        report_file = open(base + '.alloc.txt', 'w')
+        report_file.write("%s: allocations alive at the end of %d sampled calls\n\n" % (self.name, self.calls))
+        report_file.write("%12s %10s  %s\n" % ('bytes', 'blocks', 'line'))
+        for line, (size, count) in sorted(by_line.items(), key=lambda entry: -entry[1][0])[:self.top]:
+            report_file.write("%12d %10d  %s\n" % (size, count, line))
+        report_file.close()
+
+        folded_file = open(base + '.alloc.folded', 'w')
+        for frames, (size, _) in sorted(self.allocations.items()):
+            folded_file.write("%s %d\n" % (';'.join(frame.replace(';', ':') for frame in frames), size))
+        folded_file.close()
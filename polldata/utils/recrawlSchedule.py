@@ -0,0 +1,137 @@
+"""
+This module decides how often each state page is worth fetching, from the
+history of its changes.  See RecrawlSchedule's documentation for details.
+"""
+
+import json
+import math
+import os
+import time
+
+from polldata.utils.fileLock import updateJson
+
+
+class RecrawlSchedule(object):
+    """Recrawl intervals and request priorities for state pages.
+
+    For every page the schedule remembers, in a json file:
+        checked     when the page was last requested
+        changes     when its polls were seen to change (the latest few)
+        polls       the number of polls it listed
+        newest      the end date of its newest poll
+        recent      the number of its polls that ended within 30 days of
+                    the newest one
+
+    A page changes when its poll count or newest poll does.  Its expected
+    time between changes is the mean gap between its recorded changes, or
+    the time since its last change if that is longer (so a page that goes
+    quiet backs off), and it is checked twice in that time:
+
+        interval = expected time between changes / 2,
+                   between min_interval and max_interval
+
+    Pages that aren't due yet are not requested.  Pages that are requested
+    get a priority from how hot they are, so battleground states are fetched
+    first:
+
+        priority = 10 * log2(max_interval / interval) + recent polls (up to 50)
+
+    Pages the schedule hasn't seen yet are always due, with NEW_PRIORITY.
+
+    save() only writes the pages recorded since the last save, merged into
+    the file under its lock (see polldata.utils.fileLock.updateJson), so
+    processes crawling different races with the same spider can share it.
+
+    Args:
+        fName
+            The json file, usually 'data/<spider>_schedule.json'.
+        min_interval, max_interval
+            The bounds of each page's recrawl interval, in seconds.
+        history
+            The number of changes remembered per page.
+    """
+
+    NEW_PRIORITY = 100
+
+    def __init__(self, fName, min_interval=3600, max_interval=14 * 24 * 3600, history=10):
+        self.fName = fName
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.history = history
+        self.pages = {}
+        self.changed = set()
+
+        try:
+            schedule_file = open(fName, 'r')
+        except IOError:
+            return
+        try:
+            self.pages = json.load(schedule_file)
+        except ValueError:
+            # a lost schedule only costs one full crawl
+            self.pages = {}
+        finally:
+            schedule_file.close()
+
+    def interval(self, url, now=None):
+        """Return a page's recrawl interval in seconds (0 if it is unknown)."""
+        page = self.pages.get(url)
+        if not page or not page.get('changes'):
+            return 0
+        now = now or time.time()
+        changes = page['changes']
+
+        expected = now - changes[-1]
+        if len(changes) > 1:
+            expected = max(expected, (changes[-1] - changes[0]) / float(len(changes) - 1))
+        return min(max(expected / 2.0, self.min_interval), self.max_interval)
+
+    def isDue(self, url, now=None):
+        page = self.pages.get(url)
+        if not page or 'checked' not in page:
+            return True
+        now = now or time.time()
+        return now - page['checked'] >= self.interval(url, now)
+
+    def priority(self, url, now=None):
+        page = self.pages.get(url)
+        if not page or not page.get('changes'):
+            return self.NEW_PRIORITY
+        heat = math.log(self.max_interval / max(float(self.interval(url, now)), 1.0), 2)
+        return int(round(10 * heat)) + min(page.get('recent', 0), 50)
+
+    def checked(self, url, now=None):
+        """Record that a page is being requested."""
+        self.pages.setdefault(url, {})['checked'] = now or time.time()
+        self.changed.add(url)
+
+    def recordPolls(self, url, polls, newest, recent, now=None):
+        """Record what a page listed.
+
+        Args:
+            polls
+                The number of polls on the page.
+            newest
+                The end date of the newest poll, or None.
+            recent
+                The number of polls that ended within 30 days of the newest.
+
+        Returns:
+            True if the page changed since it was last recorded.
+        """
+        page = self.pages.setdefault(url, {})
+        changed = (page.get('polls'), page.get('newest')) != (polls, newest)
+        if changed:
+            page['changes'] = (page.get('changes', []) + [now or time.time()])[-self.history:]
+        page.update({'polls': polls, 'newest': newest, 'recent': recent})
+        self.changed.add(url)
+        return changed
+
+    def save(self):
+        if not self.changed and os.path.exists(self.fName):
+            return
+        merged = updateJson(self.fName, dict((url, self.pages[url]) for url in self.changed),
+                            indent=1, sort_keys=True)
+        self.changed.clear()
+        # pick up the pages other processes recorded
+        self.pages.update(merged)
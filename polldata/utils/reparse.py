@@ -0,0 +1,245 @@
+"""
+This module re-parses stored state pages in a pool of worker processes.
+
+Parsing a state page is independent of every other page and CPU bound, so
+the pages are fanned out in batches to one process per core, each running
+parseStatePages, the batch version of the spiders' own parseStatePage.
+
+The workers are started fresh, as `python -m polldata.utils.reparse`, rather
+than forked from the reparse command, which has already imported Scrapy and
+Twisted (and may be running the reactor).  Nothing here, or in what it
+imports, imports either, so the workers only carry lxml, NumPy (if
+installed) and the polldata.utils parsers.  Batches and their polls go over
+the workers' stdin and stdout, pickled; the reparse command merges the polls
+through the item pipelines in the parent process.
+
+Pages come from either:
+    a ResponseArchive (see polldata.utils.responseArchive)
+        The pages of one archived crawl, or the newest copy of every page.
+    a directory of saved pages
+        Every file under it, routed to a race by its path relative to the
+        directory.  Ex: 'epolls/2012/president/oh/ohio_romney_vs_obama-1860.html'
+"""
+
+import multiprocessing
+import os
+import re
+import subprocess
+import sys
+
+try:
+    import cPickle as pickle
+except ImportError:
+    import pickle
+
+from polldata.utils.responseArchive import ResponseArchive
+from polldata.utils.statePage import parseStatePages
+from polldata.utils.tableExtractor import PollTableExtractor
+
+# the directory polldata is in, for the workers' sys.path
+PACKAGE_PARENT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+_charset = re.compile(r'charset=([\w.:-]+)', re.I)
+_host = re.compile(r'^[a-z]+://[^/]+/', re.I)
+
+
+def headerEncoding(headers):
+    """Return the charset of an archived response's Content-Type, or None."""
+    for name, values in headers.items():
+        if name.lower() == 'content-type':
+            for value in values:
+                match = _charset.search(value)
+                if match:
+                    return match.group(1)
+    return None
+
+
+def archivePages(root, spider_name, crawl_id='latest'):
+    """Yield (url, location, encoding) for every page of an archived crawl."""
+    for url, entry in sorted(ResponseArchive(root).index(spider_name, crawl_id).items()):
+        if entry['status'] == 200:
+            yield url, ('archive', root, entry['sha1']), headerEncoding(entry['headers'])
+
+
+def directoryPages(root):
+    """Yield (path, location, None) for every file under a directory."""
+    for dirpath, dirnames, fNames in os.walk(root):
+        dirnames.sort()
+        for fName in sorted(fNames):
+            fName = os.path.join(dirpath, fName)
+            yield os.path.relpath(fName, root).replace(os.sep, '/'), ('file', fName), None
+
+
+def routePages(pages, races):
+    """Pair each page with the first race whose state pages it matches.
+
+    Pages that match no race, or that are one of its noPollLinks, are
+    skipped.
+
+    Yields:
+        (url, location, encoding, race) tasks for parsePages.
+    """
+    patterns = [(re.compile(race['allow']), race,
+                 set(_host.sub('', link) for link in race['noPollLinks'])) for race in races]
+    for url, location, encoding in pages:
+        path = _host.sub('', url)
+        for pattern, race, no_poll in patterns:
+            if pattern.search(url) and path not in no_poll:
+                yield url, location, encoding, race
+                break
+
+
+def loadPage(location):
+    if location[0] == 'archive':
+        return ResponseArchive(location[1]).loadBody(location[2])
+    page_file = open(location[1], 'rb')
+    body = page_file.read()
+    page_file.close()
+    return body
+
+
+_extractor = None
+
+def _initWorker():
+    global _extractor
+    _extractor = PollTableExtractor()
+
+
+def _describe(error):
+    return '%s: %s' % (error.__class__.__name__, error)
+
+
+def parsePages(tasks):
+    """Parse a batch of pages, in a worker process.
+
+    Returns:
+        A list of (url, polls, error) per task: the page's polls as dicts of
+        pollitem fields and None, or None and a description of why the page
+        couldn't be parsed.
+    """
+    loaded = []
+    for url, location, encoding, race in tasks:
+        try:
+            loaded.append((url, (loadPage(location), encoding, race)))
+        except Exception as error:
+            loaded.append((url, error))
+    parsed = iter(parseStatePages([page for _, page in loaded if not isinstance(page, Exception)], _extractor))
+
+    results = []
+    for url, page in loaded:
+        polls = page if isinstance(page, Exception) else next(parsed)
+        if isinstance(polls, Exception):
+            results.append((url, None, _describe(polls)))
+        else:
+            results.append((url, polls, None))
+    return results
+
+
+def _batches(tasks, batch_pages):
+    batch = []
+    for task in tasks:
+        batch.append(task)
+        if len(batch) >= batch_pages:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def reparsePages(tasks, processes=None, batch_pages=50):
+    """Parse pages in a pool of processes, yielding results in task order.
+
+    Args:
+        tasks
+            The (url, location, encoding, race) tasks, see routePages.
+        processes
+            The number of worker processes; defaults to one per core.  With
+            1, the pages are parsed in this process.
+        batch_pages
+            The pages handed to a worker at a time, and normalized together.
+
+    Yields:
+        (url, polls, error), see parsePages.
+    """
+    processes = processes or multiprocessing.cpu_count()
+    if processes == 1:
+        _initWorker()
+        for batch in _batches(tasks, batch_pages):
+            for result in parsePages(batch):
+                yield result
+        return
+
+    workers = []
+    try:
+        for _ in range(processes):
+            workers.append(_startWorker())
+        # one batch in flight per worker, collected in the order they were sent
+        batches = _batches(tasks, batch_pages)
+        busy = []
+        for worker in workers:
+            batch = next(batches, None)
+            if batch is None:
+                break
+            _send(worker, batch)
+            busy.append(worker)
+        while busy:
+            worker = busy.pop(0)
+            results = _receive(worker)
+            batch = next(batches, None)
+            if batch is not None:
+                _send(worker, batch)
+                busy.append(worker)
+            for result in results:
+                yield result
+    finally:
+        for worker in workers:
+            _stopWorker(worker)
+
+
+def _startWorker():
+    path = [PACKAGE_PARENT] + [p for p in [os.environ.get('PYTHONPATH')] if p]
+    return subprocess.Popen([sys.executable, '-m', 'polldata.utils.reparse'],
+                            stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+                            env=dict(os.environ, PYTHONPATH=os.pathsep.join(path)))
+
+
+def _send(worker, batch):
+    pickle.dump(batch, worker.stdin, pickle.HIGHEST_PROTOCOL)
+    worker.stdin.flush()
+
+
+def _receive(worker):
+    try:
+        return pickle.load(worker.stdout)
+    except EOFError:
+        raise RuntimeError("A reparse worker exited with status %s" % worker.wait())
+
+
+def _stopWorker(worker):
+    # closing its stdin ends a worker between batches
+    try:
+        worker.stdin.close()
+    except (IOError, OSError):
+        pass
+    if worker.poll() is None:
+        worker.terminate()
+    worker.wait()
+    worker.stdout.close()
+
+
+def _workerMain():
+    """Parse the batches read from stdin, writing their results to stdout."""
+    stdin = getattr(sys.stdin, 'buffer', sys.stdin)
+    stdout = getattr(sys.stdout, 'buffer', sys.stdout)
+    _initWorker()
+    while True:
+        try:
+            batch = pickle.load(stdin)
+        except EOFError:
+            return
+        pickle.dump(parsePages(batch), stdout, pickle.HIGHEST_PROTOCOL)
+        stdout.flush()
+
+
+if __name__ == '__main__':
+    _workerMain()
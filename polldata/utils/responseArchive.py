@@ -0,0 +1,208 @@
+"""
+This module provides a content-addressed archive of downloaded pages.  See
+ResponseArchive's documentation for details.
+
+Layout of the archive directory:
+    objects/<xx>/<sha1>.gz
+        A gzip compressed response body, named by the sha1 of the
+        uncompressed body.  A body is stored once however many times it is
+        fetched.
+    <spider>/crawls/<crawl id>.jsonl
+        One json entry per response fetched during a crawl.
+    <spider>/latest.json
+        The newest entry for every url the spider has fetched, across crawls.
+
+Each entry is a dict:
+    {"url": ..., "status": 200, "headers": {name: [values]}, "sha1": ...,
+     "fetched": <unix time>, "crawl": <crawl id>}
+
+The archive only grows while crawls record into it; prune() removes the
+crawls and pages older than a given age.
+"""
+
+import gzip
+import hashlib
+import json
+import os
+import time
+
+from polldata.utils.fileLock import AtomicFile
+
+
+class ResponseArchive(object):
+    """Store and look up archived responses.
+
+    Args:
+        root
+            The archive directory, eg. 'data/archive'.
+    """
+
+    def __init__(self, root):
+        self.root = root
+        self.crawl_files = {}
+
+    def storeBody(self, body):
+        """Store a response body, if it isn't stored already.
+
+        Returns:
+            The body's sha1 hexdigest, which is used to load it again.
+        """
+        digest = hashlib.sha1(body).hexdigest()
+        fName = self._objectPath(digest)
+        if os.path.exists(fName):
+            # in use again, so prune() leaves it alone until the crawl's index is written
+            os.utime(fName, None)
+        else:
+            obj_dir = os.path.dirname(fName)
+            if not os.path.isdir(obj_dir):
+                os.makedirs(obj_dir)
+            # write under a temporary name so a partial object is never used
+            tmp_fName = fName + '.tmp%d' % os.getpid()
+            obj_file = gzip.open(tmp_fName, 'wb')
+            obj_file.write(body)
+            obj_file.close()
+            os.rename(tmp_fName, fName)
+        return digest
+
+    def loadBody(self, digest):
+        obj_file = gzip.open(self._objectPath(digest), 'rb')
+        body = obj_file.read()
+        obj_file.close()
+        return body
+
+    def record(self, spider_name, crawl_id, url, status, headers, body):
+        """Store a response and add its entry to the crawl's index.
+
+        Returns:
+            The entry that was recorded.
+        """
+        entry = {
+            'url': url,
+            'status': status,
+            'headers': headers,
+            'sha1': self.storeBody(body),
+            'fetched': time.time(),
+            'crawl': crawl_id,
+        }
+
+        key = (spider_name, crawl_id)
+        crawl_file = self.crawl_files.get(key)
+        if crawl_file is None:
+            crawl_dir = os.path.join(self.root, spider_name, 'crawls')
+            if not os.path.isdir(crawl_dir):
+                os.makedirs(crawl_dir)
+            crawl_file = open(os.path.join(crawl_dir, crawl_id + '.jsonl'), 'a')
+            self.crawl_files[key] = crawl_file
+        crawl_file.write(json.dumps(entry) + '\n')
+
+        return entry
+
+    def closeCrawl(self, spider_name, crawl_id):
+        """Finish a crawl's index and merge it into the spider's latest index."""
+        crawl_file = self.crawl_files.pop((spider_name, crawl_id), None)
+        if crawl_file is None:
+            return
+        crawl_file.close()
+
+        latest = self.index(spider_name)
+        latest.update(self.index(spider_name, crawl_id))
+
+        self._writeLatest(spider_name, latest)
+
+    def _writeLatest(self, spider_name, latest):
+        with AtomicFile(os.path.join(self.root, spider_name, 'latest.json')) as latest_file:
+            latest_file.write( json.dumps(latest) )
+
+    def index(self, spider_name, crawl_id='latest'):
+        """Return a dict mapping each archived url to its entry.
+
+        Args:
+            spider_name
+                The spider that fetched the pages.
+            crawl_id
+                A crawl id to look up only that crawl's pages, or 'latest'
+                for the newest copy of every page.
+        """
+        if crawl_id == 'latest':
+            try:
+                latest_file = open(os.path.join(self.root, spider_name, 'latest.json'), 'r')
+            except IOError:
+                return {}
+            latest = json.load(latest_file)
+            latest_file.close()
+            return latest
+
+        entries = {}
+        try:
+            crawl_file = open(os.path.join(self.root, spider_name, 'crawls', crawl_id + '.jsonl'), 'r')
+        except IOError:
+            return entries
+        for line in crawl_file:
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                # a partial line left by an interrupted crawl
+                continue
+            entries[entry['url']] = entry
+        crawl_file.close()
+        return entries
+
+    def crawls(self, spider_name):
+        """Return the ids of a spider's archived crawls, oldest first."""
+        crawl_dir = os.path.join(self.root, spider_name, 'crawls')
+        if not os.path.isdir(crawl_dir):
+            return []
+        return sorted(fName[:-len('.jsonl')] for fName in os.listdir(crawl_dir) if fName.endswith('.jsonl'))
+
+    def spiders(self):
+        """Return the names of the spiders with archived crawls."""
+        if not os.path.isdir(self.root):
+            return []
+        return sorted(name for name in os.listdir(self.root)
+                      if name != 'objects' and os.path.isdir(os.path.join(self.root, name, 'crawls')))
+
+    def prune(self, max_age, now=None):
+        """Remove what was archived more than max_age seconds ago.
+
+        A crawl's index goes once it is max_age old, and so do the entries of
+        the latest index (see index) fetched before then.  A body then goes
+        when no index that is left refers to it, unless it was stored or
+        used again within max_age: a crawl that is still recording hasn't
+        written its index yet.
+
+        Returns:
+            (crawls removed, bodies removed, bytes freed)
+        """
+        cutoff = (now or time.time()) - max_age
+        crawls_removed = 0
+        referenced = set()
+        for spider_name in self.spiders():
+            crawl_dir = os.path.join(self.root, spider_name, 'crawls')
+            for crawl_id in self.crawls(spider_name):
+                fName = os.path.join(crawl_dir, crawl_id + '.jsonl')
+                if os.path.getmtime(fName) < cutoff:
+                    os.remove(fName)
+                    crawls_removed += 1
+                else:
+                    referenced.update(entry['sha1'] for entry in self.index(spider_name, crawl_id).values())
+
+            latest = self.index(spider_name)
+            kept = dict((url, entry) for url, entry in latest.items() if entry['fetched'] >= cutoff)
+            if len(kept) < len(latest):
+                self._writeLatest(spider_name, kept)
+            referenced.update(entry['sha1'] for entry in kept.values())
+
+        bodies_removed = bytes_freed = 0
+        objects_dir = os.path.join(self.root, 'objects')
+        for dirpath, _, fNames in os.walk(objects_dir):
+            for fName in fNames:
+                path = os.path.join(dirpath, fName)
+                if fName.split('.', 1)[0] in referenced or os.path.getmtime(path) >= cutoff:
+                    continue
+                bytes_freed += os.path.getsize(path)
+                os.remove(path)
+                bodies_removed += 1
+        return crawls_removed, bodies_removed, bytes_freed
+
+    def _objectPath(self, digest):
+        return os.path.join(self.root, 'objects', digest[:2], digest + '.gz')
@@ -0,0 +1,361 @@
+"""
+This module provides stores that remember which polls a spider has already
+exported, so that each run only outputs the polls that are new since the last
+one.  See each class's documentation for details.
+
+Every store is keyed by a poll fingerprint (the md5 hexdigest built in
+CsvExportPipeline.process_item) and supports O(1) membership tests.  Stores are
+selected with the SEEN_STORE setting and created through from_settings().
+
+Available stores:
+    LogSeenStore
+        An in-memory hash set backed by an append-only log on disk.  This is
+        the default store.
+    SharedSeenStore
+        A LogSeenStore that several processes can update at once.
+    JsonSeenStore
+        The original format: a json list of every fingerprint, rewritten in
+        full when the store is closed.
+"""
+
+import binascii
+import json
+import os
+import re
+
+from polldata.utils.fileLock import AtomicFile, FileLock
+
+# a complete log record: an operation and a 32 hex digit md5 fingerprint
+_record_line = re.compile(br'([+-])([0-9a-fA-F]{32})\r?\n\Z')
+
+
+class SeenStore(object):
+    """Base class for poll fingerprint stores.
+
+    Subclasses hold the fingerprints in memory and decide how they are
+    persisted.  Fingerprints are hex strings; they are kept in memory as raw
+    bytes to halve the size of large histories.
+
+    Args:
+        basename
+            The path prefix for the store's files, usually 'data/<spider name>'.
+    """
+
+    def __init__(self, basename):
+        self.basename = basename
+        self.seen = set()
+
+    @classmethod
+    def from_settings(cls, settings, basename):
+        return cls(basename)
+
+    def __contains__(self, fingerprint):
+        return binascii.unhexlify(fingerprint) in self.seen
+
+    def __len__(self):
+        return len(self.seen)
+
+    def __iter__(self):
+        for key in self.seen:
+            yield _hexlify(key)
+
+    def add(self, fingerprint):
+        """Remember a fingerprint.
+
+        Returns:
+            True if the fingerprint was not in the store yet, False otherwise.
+        """
+        key = binascii.unhexlify(fingerprint)
+        if key in self.seen:
+            return False
+        self.seen.add(key)
+        self._record('+', fingerprint)
+        return True
+
+    def discard(self, fingerprint):
+        """Forget a fingerprint, if it is in the store.
+
+        Returns:
+            True if the fingerprint was removed, False if it wasn't stored.
+        """
+        key = binascii.unhexlify(fingerprint)
+        if key not in self.seen:
+            return False
+        self.seen.remove(key)
+        self._record('-', fingerprint)
+        return True
+
+    def flush(self):
+        """Persist the store, which stays open."""
+        pass
+
+    def close(self):
+        """Persist the store.  It should not be used afterwards."""
+        self.flush()
+
+    def _record(self, op, fingerprint):
+        pass
+
+    def _loadLegacy(self, fName):
+        """Load the fingerprints from a json list (the original _dict.json).
+
+        Raises:
+            ValueError if the file exists but is malformed.  It should be
+            inspected before being overwritten.
+        """
+        try:
+            legacy_file = open(fName, 'r')
+        except IOError:
+            return False
+        try:
+            fingerprints = json.load(legacy_file)
+        except ValueError:
+            raise ValueError("Malformed seen store file " + fName + ".")
+        finally:
+            legacy_file.close()
+
+        for fingerprint in fingerprints:
+            self.seen.add(binascii.unhexlify(fingerprint))
+        return True
+
+
+class JsonSeenStore(SeenStore):
+    """Store the fingerprints as a json list in '<basename>_dict.json'.
+
+    The whole list is rewritten when the store is closed.  This is the format
+    used before LogSeenStore existed, and is kept for tools that still read it.
+    The list is rewritten under '<basename>_dict.json.lock' and merged with the
+    fingerprints other processes saved since it was loaded, so none of theirs
+    are lost (but a fingerprint discarded here comes back if another process
+    still has it).
+    """
+
+    def __init__(self, basename):
+        super(JsonSeenStore, self).__init__(basename)
+        self.fName = basename + '_dict.json'
+        self._loadLegacy(self.fName)
+
+    def flush(self):
+        with FileLock(self.fName + '.lock'):
+            self._loadLegacy(self.fName)
+            with AtomicFile(self.fName) as seen_file:
+                seen_file.write( json.dumps(sorted(self)) )
+
+
+class LogSeenStore(SeenStore):
+    """Store the fingerprints in an append-only log, '<basename>_seen.log'.
+
+    Each line of the log is an operation followed by a fingerprint:
+        +<fingerprint>    the fingerprint was added
+        -<fingerprint>    the fingerprint was discarded
+
+    The log is replayed into a set when the store is opened, and new
+    operations are appended to it, so a run only writes what it changed.
+    Lines that aren't an operation and a 32 digit fingerprint are skipped.  A
+    partial last line, left by a write that was interrupted, is cut off
+    before the store first appends to the log, so the next record isn't glued
+    to it; a store that only reads leaves the log as it is.  When
+    the log holds more than compact_ratio records per live fingerprint it is
+    compacted: rewritten with one '+' line per fingerprint, then renamed over
+    the old log.
+
+    The first time a store is opened for a spider without a log, the legacy
+    '<basename>_dict.json' list is imported.  The json file is left in place.
+
+    Args:
+        basename
+            The path prefix for the store's files, usually 'data/<spider name>'.
+        compact_ratio
+            The number of log records per live fingerprint that triggers
+            compaction when the store is closed.
+    """
+
+    def __init__(self, basename, compact_ratio=2.0):
+        super(LogSeenStore, self).__init__(basename)
+        self.fName = basename + '_seen.log'
+        self.compact_ratio = compact_ratio
+        self.records = 0
+        self.log_file = None
+        # where a partial last line starts, if the log has one
+        self.torn_at = None
+
+        if os.path.exists(self.fName):
+            self._replay()
+        elif self._loadLegacy(basename + '_dict.json'):
+            self.compact()
+
+    @classmethod
+    def from_settings(cls, settings, basename):
+        return cls(basename, settings.getfloat('SEEN_STORE_COMPACT_RATIO', 2.0))
+
+    def _replay(self):
+        log_file = open(self.fName, 'rb')
+        end = self._applyRecords(log_file)
+        size = os.fstat(log_file.fileno()).st_size
+        log_file.close()
+        self.torn_at = end if end < size else None
+
+    def _applyRecords(self, log_file):
+        """Apply the complete lines of a log opened in binary mode, from its position.
+
+        Returns:
+            The number of bytes read, up to the end of the last complete line.
+        """
+        seen = self.seen
+        read = 0
+        for line in log_file:
+            if not line.endswith(b'\n'):
+                break
+            read += len(line)
+            match = _record_line.match(line)
+            if match is None:
+                continue
+            if match.group(1) == b'+':
+                seen.add(binascii.unhexlify(match.group(2)))
+            else:
+                seen.discard(binascii.unhexlify(match.group(2)))
+            self.records += 1
+        return read
+
+    def _cutTornLine(self):
+        if self.torn_at is not None:
+            log_file = open(self.fName, 'r+b')
+            log_file.truncate(self.torn_at)
+            log_file.close()
+            self.torn_at = None
+
+    def _record(self, op, fingerprint):
+        if self.log_file is None:
+            self._cutTornLine()
+            self.log_file = open(self.fName, 'a')
+        self.log_file.write(op + fingerprint + '\n')
+        self.records += 1
+
+    def compact(self):
+        """Rewrite the log so that it only holds the live fingerprints."""
+        if self.log_file is not None:
+            self.log_file.close()
+            self.log_file = None
+
+        with AtomicFile(self.fName) as tmp_file:
+            for fingerprint in self:
+                tmp_file.write('+' + fingerprint + '\n')
+        self.records = len(self.seen)
+        self.torn_at = None
+
+    def flush(self):
+        if self.log_file is not None:
+            self.log_file.flush()
+
+    def close(self):
+        if self.log_file is not None:
+            self.log_file.close()
+            self.log_file = None
+
+        if self.records > max(len(self.seen), 1) * self.compact_ratio:
+            self.compact()
+
+
+class SharedSeenStore(LogSeenStore):
+    """A LogSeenStore that several processes can update at once.
+
+    Each LogSeenStore only replays its log when it is opened, so two crawls
+    sharing an output would both export a poll that is new to both.  Here
+    every add() and discard() takes '<basename>_seen.lock', first applies the
+    records the other processes appended to the log since this process last
+    read it, and only then checks the fingerprint and appends its record.
+    Each poll is thus exported by exactly one process, and no process's
+    fingerprints are lost.  Records are written straight through, so the
+    next process to take the lock sees them.
+
+    A process that finds the log was compacted by another (a new inode, or a
+    shorter file) replays it in full.  Writers only append under the lock, so
+    a partial last line seen under it was left by a process that died
+    mid-write, and is cut off before the next record.  The log format is LogSeenStore's, so a
+    store can be switched between the two classes.
+
+    Args:
+        basename
+            The path prefix for the store's files, usually 'data/<spider name>'.
+        compact_ratio
+            See LogSeenStore.
+    """
+
+    def __init__(self, basename, compact_ratio=2.0):
+        self.lock = FileLock(basename + '_seen.lock', keep_open=True)
+        # how far the log was read, and which log it was
+        self.offset = 0
+        self.inode = None
+        with self.lock:
+            super(SharedSeenStore, self).__init__(basename, compact_ratio)
+
+    def __contains__(self, fingerprint):
+        with self.lock:
+            self._replay()
+            return super(SharedSeenStore, self).__contains__(fingerprint)
+
+    def add(self, fingerprint):
+        with self.lock:
+            self._replay()
+            return super(SharedSeenStore, self).add(fingerprint)
+
+    def discard(self, fingerprint):
+        with self.lock:
+            self._replay()
+            return super(SharedSeenStore, self).discard(fingerprint)
+
+    def _replay(self):
+        """Apply the records appended to the log since it was last read."""
+        try:
+            stat = os.stat(self.fName)
+        except OSError:
+            return
+        if stat.st_ino != self.inode or stat.st_size < self.offset:
+            # compacted by another process: start over from the new log
+            if self.log_file is not None:
+                self.log_file.close()
+                self.log_file = None
+            self.seen = set()
+            self.records = 0
+            self.offset = 0
+            self.inode = stat.st_ino
+        if stat.st_size == self.offset:
+            self.torn_at = None
+            return
+
+        log_file = open(self.fName, 'rb')
+        log_file.seek(self.offset)
+        self.offset += self._applyRecords(log_file)
+        log_file.close()
+        self.torn_at = self.offset if self.offset < stat.st_size else None
+
+    def _record(self, op, fingerprint):
+        if self.log_file is None:
+            self.log_file = open(self.fName, 'ab')
+            self.inode = os.fstat(self.log_file.fileno()).st_ino
+        self._cutTornLine()
+        self.log_file.write((op + fingerprint + '\n').encode('ascii'))
+        self.log_file.flush()
+        self.offset = os.fstat(self.log_file.fileno()).st_size
+        self.records += 1
+
+    def compact(self):
+        with self.lock:
+            self._replay()
+            super(SharedSeenStore, self).compact()
+            stat = os.stat(self.fName)
+            self.inode = stat.st_ino
+            self.offset = stat.st_size
+
+    def close(self):
+        with self.lock:
+            self._replay()
+            super(SharedSeenStore, self).close()
+        self.lock.close()
+
+
+def _hexlify(key):
+    fingerprint = binascii.hexlify(key)
+    if not isinstance(fingerprint, str):
+        fingerprint = fingerprint.decode('ascii')
+    return fingerprint
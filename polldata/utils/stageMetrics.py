@@ -0,0 +1,192 @@
+"""
+This module collects counters and latency histograms for the stages of a
+crawl, and writes them as json or in the Prometheus text format.  See
+StageMetrics' documentation for details.
+
+Histograms use fixed buckets, like Prometheus histograms: each bucket counts
+the observations less than or equal to its upper bound ('le'), so the
+buckets of every crawl can be added together.
+"""
+
+import json
+import math
+import os
+
+# seconds, from half a millisecond to 10 seconds
+SECONDS_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+# polls per page
+ROWS_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 200, 500, 1000)
+
+
+class Histogram(object):
+    """Counts of observations by bucket, with their sum, min and max.
+
+    Args:
+        buckets
+            The buckets' upper bounds, in increasing order.  Larger
+            observations are only counted in the implicit '+Inf' bucket.
+    """
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.count = 0
+        self.sum = 0.0
+        self.min = None
+        self.max = None
+
+    def observe(self, value):
+        for n, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[n] += 1
+                break
+        self.count += 1
+        self.sum += value
+        self.min = value if self.min is None else min(self.min, value)
+        self.max = value if self.max is None else max(self.max, value)
+
+    def cumulative(self):
+        """Return [(upper bound, observations <= bound)], ending with +Inf."""
+        total = 0
+        cumulative = []
+        for bound, count in zip(self.buckets, self.counts):
+            total += count
+            cumulative.append((bound, total))
+        cumulative.append((float('inf'), self.count))
+        return cumulative
+
+    def quantile(self, q):
+        """Estimate a quantile as the upper bound of the bucket it falls in."""
+        if not self.count:
+            return None
+        rank = q * self.count
+        for bound, total in self.cumulative():
+            if total >= rank:
+                return min(bound, self.max)
+        return self.max
+
+    def toJson(self):
+        return {
+            'count': self.count,
+            'sum': self.sum,
+            'min': self.min,
+            'max': self.max,
+            'mean': self.sum / self.count if self.count else None,
+            'p50': self.quantile(0.5),
+            'p95': self.quantile(0.95),
+            'buckets': [[_bound(bound), total] for bound, total in self.cumulative()],
+        }
+
+
+class StageMetrics(object):
+    """Counters and histograms, each identified by a name and labels.
+
+    Ex:
+        metrics = StageMetrics()
+        metrics.observe('stage_seconds', 0.012, spider='pres2012', stage='parse')
+        metrics.inc('items_dropped_total', spider='pres2012', reason='DuplicatePoll')
+        metrics.toPrometheus()
+
+    Args:
+        prefix
+            Prepended to every name in the Prometheus output.
+        buckets
+            The buckets of each histogram name; names not listed use
+            SECONDS_BUCKETS.
+    """
+
+    def __init__(self, prefix='polldata_', buckets=None):
+        self.prefix = prefix
+        self.buckets = buckets or {}
+        self.histograms = {}
+        self.counters = {}
+        self.help = {}
+
+    def describe(self, name, help):
+        self.help[name] = help
+
+    def observe(self, name, value, **labels):
+        key = (name, _labelKey(labels))
+        histogram = self.histograms.get(key)
+        if histogram is None:
+            histogram = self.histograms[key] = Histogram(self.buckets.get(name, SECONDS_BUCKETS))
+        histogram.observe(value)
+
+    def inc(self, name, count=1, **labels):
+        key = (name, _labelKey(labels))
+        self.counters[key] = self.counters.get(key, 0) + count
+
+    def toJson(self):
+        """Return the metrics as a dict of lists, one entry per set of labels."""
+        histograms = {}
+        for (name, labels), histogram in sorted(self.histograms.items()):
+            entry = dict(labels)
+            entry.update(histogram.toJson())
+            histograms.setdefault(name, []).append(entry)
+        counters = {}
+        for (name, labels), value in sorted(self.counters.items()):
+            entry = dict(labels)
+            entry['value'] = value
+            counters.setdefault(name, []).append(entry)
+        return {'histograms': histograms, 'counters': counters}
+
+    def toPrometheus(self):
+        """Return the metrics in the Prometheus text exposition format."""
+        lines = []
+        for name in sorted(set(name for name, _ in self.counters)):
+            self._header(lines, name, 'counter')
+            for (other, labels), value in sorted(self.counters.items()):
+                if other == name:
+                    lines.append('%s%s%s %s' % (self.prefix, name, _labelText(labels), _number(value)))
+
+        for name in sorted(set(name for name, _ in self.histograms)):
+            self._header(lines, name, 'histogram')
+            for (other, labels), histogram in sorted(self.histograms.items()):
+                if other != name:
+                    continue
+                for bound, total in histogram.cumulative():
+                    lines.append('%s%s_bucket%s %d' % (self.prefix, name,
+                                 _labelText(labels + (('le', _bound(bound)),)), total))
+                lines.append('%s%s_sum%s %s' % (self.prefix, name, _labelText(labels), _number(histogram.sum)))
+                lines.append('%s%s_count%s %d' % (self.prefix, name, _labelText(labels), histogram.count))
+        return '\n'.join(lines) + '\n'
+
+    def writeJson(self, fName, **extra):
+        metrics = dict(extra)
+        metrics.update(self.toJson())
+        _writeAtomic(fName, json.dumps(metrics, indent=1, sort_keys=True))
+
+    def writePrometheus(self, fName):
+        _writeAtomic(fName, self.toPrometheus())
+
+    def _header(self, lines, name, kind):
+        if name in self.help:
+            lines.append('# HELP %s%s %s' % (self.prefix, name, self.help[name]))
+        lines.append('# TYPE %s%s %s' % (self.prefix, name, kind))
+
+
+def _labelKey(labels):
+    return tuple(sorted((key, str(value)) for key, value in labels.items()))
+
+
+def _labelText(labels):
+    if not labels:
+        return ''
+    return '{%s}' % ','.join('%s="%s"' % (key, value.replace('\\', '\\\\').replace('"', '\\"'))
+                             for key, value in labels)
+
+
+def _bound(bound):
+    return '+Inf' if math.isinf(bound) else repr(bound)
+
+
+def _number(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def _writeAtomic(fName, text):
+    tmp_fName = fName + '.tmp'
+    out_file = open(tmp_fName, 'w')
+    out_file.write(text)
+    out_file.close()
+    os.rename(tmp_fName, fName)
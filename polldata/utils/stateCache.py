@@ -0,0 +1,78 @@
+"""
+This module keeps the state that crawl components load from data/ (seen
+stores, page validators, recrawl schedules) in memory between the crawls of
+one long-running process.  See StateCache's documentation for details.
+
+A component finds the cache through stateCache(crawler), which returns None
+in a normal `scrapy crawl`, where every run loads its state when the spider
+opens and saves it when the spider closes.
+"""
+
+import time
+
+
+def stateCache(crawler):
+    """Return the crawler's StateCache, or None if it doesn't have one."""
+    return getattr(crawler, 'state_cache', None)
+
+
+class StateCache(object):
+    """State objects shared by successive crawls, flushed to disk on demand.
+
+    Each object is loaded once, the first time it is asked for, and then
+    handed to every later crawl as it is.  Nothing is written when a spider
+    closes: the owner of the cache (see the daemon command) calls flush() on
+    a timer, and close() when the process exits.
+
+    Ex:
+        store = cache.get(('seen', 'pres2012'),
+                          lambda: LogSeenStore('data/pres2012'),
+                          flush=LogSeenStore.flush, close=LogSeenStore.close)
+    """
+
+    def __init__(self):
+        self.entries = {}
+        self.last_flush = None
+        self.flush_seconds = 0.0
+
+    def get(self, key, load, flush, close=None):
+        """Return the object cached under key, loading it the first time.
+
+        Args:
+            key
+                Any hashable key, usually (kind, spider or output name).
+            load
+                Called without arguments to create the object.
+            flush
+                Called with the object to write it to disk.
+            close
+                Called with the object when the cache is closed.  Defaults to
+                flush.
+        """
+        if key not in self.entries:
+            self.entries[key] = (load(), flush, close or flush)
+        return self.entries[key][0]
+
+    def __contains__(self, key):
+        return key in self.entries
+
+    def __len__(self):
+        return len(self.entries)
+
+    def flush(self):
+        """Write every cached object to disk.
+
+        Returns:
+            The number of objects flushed.
+        """
+        start = time.time()
+        for obj, flush, _ in self.entries.values():
+            flush(obj)
+        self.last_flush = time.time()
+        self.flush_seconds = self.last_flush - start
+        return len(self.entries)
+
+    def close(self):
+        for obj, _, close in self.entries.values():
+            close(obj)
+        self.entries = {}
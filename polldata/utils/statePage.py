@@ -0,0 +1,119 @@
+"""
+This module turns state pages into polls, without Scrapy.  parseStatePage is
+what RaceSpider.parseStatePolls runs on every state page, and
+parseStatePages what the reparse command runs on its batches of pages in its
+worker processes.
+"""
+
+from polldata.utils.normalize import HAVE_NUMPY, normalizePolls, normalizeRows
+
+# the pollitem fields filled from the normalized columns
+POLL_FIELDS = ('service', 'start', 'end', 'voters', 'sample', 'dem', 'rep', 'spread')
+
+
+def parseStatePage(body, encoding, race, extractor):
+    """Find the polls listed on a state page.
+
+    Args:
+        body
+            The page's html.
+        encoding
+            The page's encoding, or None to use the one the page declares.
+        race
+            The race the page belongs to (see polldata.races).
+        extractor
+            A PollTableExtractor, which caches the column plans it sees.
+
+    Returns:
+        (columns, polls): the normalized columns (see normalizeRows), and a
+        dict of pollitem fields per poll.
+    """
+    state, rows = extractor.extract(body, encoding)
+    columns = normalizeRows(rows, race['year'])
+    return columns, _polls(columns, rows, 0, race, state)
+
+
+def parseStatePages(pages, extractor):
+    """Find the polls listed on several state pages, normalizing them together.
+
+    With NumPy, the rows of every page go through one normalizePolls call,
+    which is much faster than normalizing each page on its own once there
+    are more than a few pages; without it, each page is normalized with
+    normalizeRows.  The polls are the same either way.
+
+    Args:
+        pages
+            A list of (body, encoding, race), see parseStatePage.
+        extractor
+            A PollTableExtractor.
+
+    Returns:
+        A list with, for each page, its polls (see parseStatePage) or the
+        exception raised while reading it.
+    """
+    tables = []
+    for body, encoding, race in pages:
+        try:
+            tables.append(extractor.extract(body, encoding) + (race,))
+        except Exception as error:
+            tables.append(error)
+    read = [table for table in tables if not isinstance(table, Exception)]
+    if HAVE_NUMPY:
+        polls = iter(_normalizeTogether(read))
+    else:
+        polls = iter([_polls(normalizeRows(rows, race['year']), rows, 0, race, state)
+                      for state, rows, race in read])
+    return [table if isinstance(table, Exception) else next(polls) for table in tables]
+
+
+def _normalizeTogether(tables):
+    """The polls of each (state, rows, race) table, from one normalizePolls call."""
+    rows, years, page_starts = [], [], []
+    for _, table_rows, race in tables:
+        if table_rows:
+            page_starts.append(len(rows))
+            rows.extend(table_rows)
+            years.extend([race['year']] * len(table_rows))
+    columns = normalizePolls(rows, years, page_starts)
+    columns = dict((field, columns[field].tolist()) for field in POLL_FIELDS)
+
+    polls = []
+    start = 0
+    for state, table_rows, race in tables:
+        polls.append(_polls(columns, table_rows, start, race, state))
+        start += len(table_rows)
+    return polls
+
+
+def legacyFields(dates, sample, year):
+    """Return the end date and sample type the spiders read before normalization.
+
+    The spiders used to append the election year to both dates, and to read a
+    sample with one component ("RV", but also "1,337") as its type.  The
+    fingerprints of the polls they exported were made of these fields, so
+    CsvExportPipeline compares them too (see the pollitem's legacy field).
+
+    Ex: ("12/28 - 1/3", "1,337", 2012) -> {'end': "1/3/2012", 'sample': "1,337"}
+    """
+    dates = dates.split(' - ')
+    sample = sample.split(' ')
+    return {
+        'end': (dates[1] if len(dates) > 1 else dates[0]) + '/%d' % year,
+        'sample': sample[1] if len(sample) > 1 else sample[0],
+    }
+
+
+def _polls(columns, rows, start, race, state):
+    """The pollitem fields of rows, which start at row start of normalized columns."""
+    polls = []
+    end = start + len(rows)
+    for row, values in zip(rows, zip(*[columns[field][start:end] for field in POLL_FIELDS])):
+        poll = dict(zip(POLL_FIELDS, values))
+        poll['race'] = race['name']
+        poll['state'] = state
+        # the tables don't list independents; ind stays 0, as it is in the
+        # fingerprints of the polls exported so far (see CsvExportPipeline)
+        poll['ind'] = 0
+        poll['legacy'] = legacyFields(row[1], row[2], race['year'])
+        polls.append(poll)
+    return polls
@@ -0,0 +1,152 @@
+"""
+This module provides a fast extractor for the Polling Data table on a state
+page.  See PollTableExtractor's documentation for details.
+
+The extractor finds the same values as the spiders' original XPath selectors:
+    state      //*[@id="main-poll-title"]/text()  (the part before the ':')
+    headers    //*[@id="polling-data-full"]/table/tr[1]/th/text()
+    polls      //*[@id="polling-data-full"]/table/tr[not(@class) or @class="isInRcpAvg"]
+    cells      td/text() | td/a/text()  (for each poll)
+but it parses the page with lxml directly and walks each table once, instead
+of running a new selector for every row.
+"""
+
+from lxml import etree
+
+from polldata.utils import parsePollData
+
+_unicode = type(u'')
+
+_findTitles = etree.XPath('//*[@id="main-poll-title"]')
+_findTables = etree.XPath('//*[@id="polling-data-full"]/table')
+
+_pollRowClasses = (None, 'isInRcpAvg')
+
+# The pollitem fields read from each row, in the order rows are returned.
+FIELDS = ('service', 'date', 'sample', 'dem', 'rep')
+
+
+def textNodes(element):
+    """Return an element's own text nodes, like the XPath 'text()'.
+
+    These are the element's text and the tails of its children (including
+    comments), in document order.  Text inside the children is not included.
+    """
+    texts = []
+    if element.text is not None:
+        texts.append(element.text)
+    for child in element:
+        if child.tail is not None:
+            texts.append(child.tail)
+    return texts
+
+
+def cellTexts(row):
+    """Return a row's cell values, like the XPath 'td/text() | td/a/text()'.
+
+    Each td contributes its own text nodes, and the text nodes of any links
+    directly inside it, in document order.
+    """
+    texts = []
+    for cell in row:
+        if cell.tag != 'td':
+            continue
+        if cell.text is not None:
+            texts.append(cell.text)
+        for child in cell:
+            if child.tag == 'a':
+                texts.extend(textNodes(child))
+            if child.tail is not None:
+                texts.append(child.tail)
+    return texts
+
+
+def compilePlan(headers):
+    """Build the column plan for a table's headers.
+
+    Args:
+        headers
+            The text values of the table's headers.
+            Ex: ("Poll", "Date", "Sample", "MoE", "Romney (R)", "Obama (D)", "Spread")
+
+    Returns:
+        A tuple with the cell position of each of FIELDS.
+        Ex: (0, 1, 2, 5, 4)
+
+    Raises:
+        KeyError if one of the FIELDS has no column.
+    """
+    lookup = {}
+    for i, header in enumerate(headers):
+        attribute = parsePollData.getAttribute(header)
+        if attribute is not None:
+            lookup[attribute] = i
+    return tuple(lookup[field] for field in FIELDS)
+
+
+class PollTableExtractor(object):
+    """Extract the raw poll values from state pages.
+
+    Plans (see compilePlan) are cached by the table's header signature, so a
+    header layout is only interpreted the first time it is seen.
+    """
+
+    def __init__(self):
+        self.plans = {}
+
+    def plan(self, headers):
+        headers = tuple(headers)
+        plan = self.plans.get(headers)
+        if plan is None:
+            plan = self.plans[headers] = compilePlan(headers)
+        return plan
+
+    def extract(self, body, encoding):
+        """Find the state and the polls listed on a state page.
+
+        Args:
+            body
+                The page's html.
+            encoding
+                The page's encoding, eg. response.encoding.
+
+        Returns:
+            (state, rows) where rows holds one tuple of raw strings per poll,
+            with the values of FIELDS in order.
+            Ex: (u"Ohio", [(u"Rasmussen Reports", u"10/1 - 10/3", u"595 LV", u"48", u"47"), ...])
+        """
+        root = etree.fromstring(body, parser=etree.HTMLParser(recover=True, encoding=encoding))
+        if root is None:
+            raise ValueError("Empty state page.")
+
+        titles = []
+        for title in _findTitles(root):
+            titles.extend(textNodes(title))
+        state = _unicode(titles[0]).split(':')[0]
+
+        tables = _findTables(root)
+        headers = []
+        for table in tables:
+            for tr in table:
+                if tr.tag == 'tr':
+                    for th in tr:
+                        if th.tag == 'th':
+                            headers.extend(textNodes(th))
+                    break
+        service, date, sample, dem, rep = self.plan(headers)
+
+        rows = []
+        for table in tables:
+            for tr in table:
+                if tr.tag != 'tr' or tr.get('class') not in _pollRowClasses:
+                    continue
+                cells = cellTexts(tr)
+                rows.append((
+                    _unicode(cells[service]),
+                    _unicode(cells[date]),
+                    _unicode(cells[sample]),
+                    _unicode(cells[dem]),
+                    _unicode(cells[rep]),
+                ))
+
+        return state, rows
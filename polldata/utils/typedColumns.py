@@ -0,0 +1,190 @@
+"""
+This module converts poll items into typed NumPy columns, and reads them back.
+See each function's documentation for details.
+
+A typed output is a directory of row groups, 'part-00000.npz',
+'part-00001.npz', ..., each written with numpy.savez.  Every exported field is
+stored according to its type in COLUMN_TYPES:
+    float       float64, NaN when missing.  Ex: dem, rep
+    int         int64, -1 when missing.  Ex: voters
+    date        datetime64[D], NaT when missing.  Ex: start, end
+    category    '<field>.codes' (int32, -1 when missing) indexing into
+                '<field>.categories' (unicode).  Ex: state, service, sample
+    string      unicode, for fields without a known type
+
+Use loadColumns() to read a whole output back as one dict of arrays.
+"""
+
+import datetime
+import os
+
+import numpy
+
+# The spiders store the sample size in 'voters' and the sample type (LV, RV,
+# ...) in 'sample'; see RaceSpider.parseStatePolls.
+COLUMN_TYPES = {
+    'race':     'category',
+    'state':    'category',
+    'service':  'category',
+    'sample':   'category',
+    'voters':   'int',
+    'start':    'date',
+    'end':      'date',
+    'dem':      'float',
+    'rep':      'float',
+    'ind':      'float',
+}
+
+MISSING_INT = -1
+
+_unicode = type(u'')
+
+
+def toFloat(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return float('nan')
+
+
+def toInt(value):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return MISSING_INT
+
+
+def toDate(value):
+    """Convert a 'month/day/year' poll date into a datetime64[D].
+
+    Ex: "10/1/2012" -> numpy.datetime64('2012-10-01')
+        ""          -> numpy.datetime64('NaT')
+    """
+    try:
+        month, day, year = value.split('/')
+        return numpy.datetime64(datetime.date(int(year), int(month), int(day)), 'D')
+    except (AttributeError, TypeError, ValueError):
+        return numpy.datetime64('NaT', 'D')
+
+
+def columnType(field):
+    return COLUMN_TYPES.get(field, 'string')
+
+
+def buildColumns(fields, rows):
+    """Convert rows of raw values into typed arrays.
+
+    Args:
+        fields
+            The field names, in the order of each row's values.
+        rows
+            A dict mapping each field to the list of its raw values.
+
+    Returns:
+        A dict of arrays, ready for numpy.savez.  Categorical fields produce
+        two arrays (see the module documentation).
+    """
+    arrays = {}
+    for field in fields:
+        values = rows[field]
+        kind = columnType(field)
+
+        if kind == 'float':
+            arrays[field] = numpy.array([toFloat(value) for value in values], dtype=numpy.float64)
+        elif kind == 'int':
+            arrays[field] = numpy.array([toInt(value) for value in values], dtype=numpy.int64)
+        elif kind == 'date':
+            arrays[field] = numpy.array([toDate(value) for value in values], dtype='datetime64[D]')
+        elif kind == 'category':
+            categories = {}
+            codes = numpy.empty(len(values), dtype=numpy.int32)
+            for i, value in enumerate(values):
+                if value is None or value == '':
+                    codes[i] = MISSING_INT
+                else:
+                    codes[i] = categories.setdefault(_unicode(value), len(categories))
+            ordered = sorted(categories, key=categories.get)
+            arrays[field + '.codes'] = codes
+            arrays[field + '.categories'] = numpy.array(ordered, dtype=_unicode) if ordered \
+                else numpy.array([], dtype='U1')
+        else:
+            arrays[field] = numpy.array([_unicode(value) if value is not None else u'' for value in values],
+                                        dtype=_unicode)
+    return arrays
+
+
+def writeRowGroup(out_dir, index, fields, rows):
+    """Write one row group of an output.
+
+    The file is written under a temporary name and renamed, so a reader never
+    sees a partial row group.
+
+    Returns:
+        The row group's file name.
+    """
+    if not os.path.isdir(out_dir):
+        os.makedirs(out_dir)
+    fName = os.path.join(out_dir, 'part-%05d.npz' % index)
+    tmp_fName = fName + '.tmp'
+    tmp_file = open(tmp_fName, 'wb')
+    numpy.savez(tmp_file, **buildColumns(fields, rows))
+    tmp_file.close()
+    os.rename(tmp_fName, fName)
+    return fName
+
+
+def rowGroups(out_dir):
+    """Return the row group files of an output, in order."""
+    if not os.path.isdir(out_dir):
+        return []
+    return [os.path.join(out_dir, fName) for fName in sorted(os.listdir(out_dir))
+            if fName.startswith('part-') and fName.endswith('.npz')]
+
+
+def loadColumns(out_dir):
+    """Load every row group of an output into one dict of arrays.
+
+    Categorical fields are merged across row groups: the result holds
+    '<field>.codes' and '<field>.categories' for the whole output, and
+    '<field>' with the decoded values for convenience.
+
+    Ex: columns = loadColumns('data/pres2012_latest.typed')
+        columns['dem'].mean(), columns['end'].max()
+    """
+    groups = [numpy.load(fName) for fName in rowGroups(out_dir)]
+    if not groups:
+        return {}
+
+    columns = {}
+    names = set()
+    for group in groups:
+        names.update(group.files)
+
+    for name in sorted(names):
+        if name.endswith('.categories'):
+            continue
+        if name.endswith('.codes'):
+            field = name[:-len('.codes')]
+            categories = numpy.unique(numpy.concatenate([group[field + '.categories'] for group in groups]))
+            codes = []
+            for group in groups:
+                local = group[field + '.categories']
+                group_codes = group[name]
+                remap = numpy.searchsorted(categories, local).astype(numpy.int32)
+                merged = numpy.full(len(group_codes), MISSING_INT, dtype=numpy.int32)
+                present = group_codes != MISSING_INT
+                if len(local):
+                    merged[present] = remap[group_codes[present]]
+                codes.append(merged)
+            codes = numpy.concatenate(codes)
+            columns[field + '.codes'] = codes
+            columns[field + '.categories'] = categories
+            decoded = numpy.full(len(codes), u'', dtype=categories.dtype if len(categories) else 'U1')
+            decoded[codes != MISSING_INT] = categories[codes[codes != MISSING_INT]]
+            columns[field] = decoded
+        else:
+            columns[name] = numpy.concatenate([group[name] for group in groups])
+
+    for group in groups:
+        group.close()
+    return columns
@@ -0,0 +1,107 @@
+"""
+This module keeps what every crawl otherwise looks up again when it starts
+(robots.txt, DNS answers, the state page links of each race's widget) in a
+json file between runs.  See WarmStartCache's documentation for details; the
+WarmStart extension (see polldata.extensions) loads it when a spider opens.
+
+A component finds the cache through warmStartCache(crawler), which returns
+None when the extension is disabled.
+"""
+
+import time
+
+from polldata.utils.fileLock import readJson, updateJson
+
+
+def warmStartCache(crawler):
+    """Return the crawler's WarmStartCache, or None if it doesn't have one."""
+    return getattr(crawler, 'warm_start_cache', None)
+
+
+class WarmStartCache(object):
+    """Entries with a time to live, saved in a json file that crawls share.
+
+    Entries are grouped in sections, each with its own TTL, eg.
+
+        'robots'    netloc -> {'base64': robots.txt body}
+        'dns'       hostname -> IP address
+        'links'     race -> [[url, link text], ...] from its widget
+
+    An entry is fresh until it is its section's TTL old, counted from when it
+    was put; stale entries are never returned, and are left out when the file
+    is loaded.  A section without a TTL is never used.
+
+    save() only writes the entries put since the last save, merged into the
+    file under its lock (see polldata.utils.fileLock.updateJson), so parallel
+    crawls keep each other's entries.
+
+    Ex:
+        cache = WarmStartCache('data/warmstart.json', {'dns': 3600})
+        address = cache.get('dns', 'www.realclearpolitics.com')
+        cache.put('dns', 'www.realclearpolitics.com', '23.45.67.89')
+        cache.save()
+
+    Args:
+        fName
+            The json file, usually 'data/warmstart.json'.
+        ttls
+            {section: seconds}.
+    """
+
+    def __init__(self, fName, ttls, now=None):
+        self.fName = fName
+        self.ttls = ttls
+        self.entries = {}
+        self.changed = set()
+
+        now = now or time.time()
+        saved = readJson(fName, {})
+        for name, entry in (saved.items() if isinstance(saved, dict) else []):
+            if isinstance(entry, dict) and self._fresh(name.partition(' ')[0], entry.get('stored'), now):
+                self.entries[name] = entry
+
+    def _fresh(self, section, stored, now):
+        ttl = self.ttls.get(section)
+        return bool(ttl) and stored is not None and now - stored < ttl
+
+    def get(self, section, key, now=None):
+        """Return a fresh entry's value, or None."""
+        entry = self.entries.get(section + ' ' + key)
+        if entry is None or not self._fresh(section, entry['stored'], now or time.time()):
+            return None
+        return entry['value']
+
+    def stored(self, section, key):
+        """Return when an entry was put (seconds since the epoch), or None."""
+        entry = self.entries.get(section + ' ' + key)
+        return entry['stored'] if entry is not None else None
+
+    def items(self, section, now=None):
+        """Return [(key, value)] for the section's fresh entries."""
+        now = now or time.time()
+        prefix = section + ' '
+        return sorted((name[len(prefix):], entry['value']) for name, entry in self.entries.items()
+                      if name.startswith(prefix) and self._fresh(section, entry['stored'], now))
+
+    def put(self, section, key, value, now=None):
+        """Store value under key, fresh from now."""
+        name = section + ' ' + key
+        self.entries[name] = {'stored': now or time.time(), 'value': value}
+        self.changed.add(name)
+
+    def __len__(self):
+        return len(self.entries)
+
+    def save(self):
+        if not self.changed:
+            return
+        merged = updateJson(self.fName, dict((name, self.entries[name]) for name in self.changed),
+                            indent=1, sort_keys=True)
+        self.changed.clear()
+        # pick up the entries other processes saved
+        now = time.time()
+        for name, entry in merged.items():
+            if not isinstance(entry, dict) or not self._fresh(name.partition(' ')[0], entry.get('stored'), now):
+                continue
+            if name not in self.entries or entry['stored'] > self.entries[name]['stored']:
+                self.entries[name] = entry
@@ -0,0 +1,87 @@
+"""Tests for polldata.utils.adaptiveConcurrency."""
+
+import unittest
+
+from polldata.utils.adaptiveConcurrency import BACKOFF_DELAY, DomainThrottle, crawlDelay, retryAfter
+
+
+def respond(throttle, latency, count, **kwargs):
+    """Record count responses, and return the decisions made."""
+    decisions = [throttle.record(latency, **kwargs) for _ in range(count)]
+    return [decision for decision in decisions if decision is not None]
+
+
+class DomainThrottleTest(unittest.TestCase):
+
+    def test_increase_while_latency_holds(self):
+        throttle = DomainThrottle(2, window=10, max_concurrency=4)
+        decisions = respond(throttle, 0.1, 10)
+        self.assertEqual([(d['action'], d['concurrency']) for d in decisions], [('increase', 3)])
+        self.assertEqual(decisions[0]['baseline'], 0.1)
+        respond(throttle, 0.1, 20)
+        self.assertEqual(throttle.concurrency, 4)
+        self.assertEqual(respond(throttle, 0.1, 10), [])
+
+    def test_decrease_when_requests_queue(self):
+        throttle = DomainThrottle(4, window=10, latency_ratio=1.5)
+        respond(throttle, 0.1, 10)
+        decisions = respond(throttle, 0.2, 10)
+        self.assertEqual([(d['action'], d['concurrency']) for d in decisions], [('decrease', 4)])
+        # under latency_ratio times the baseline still counts as holding
+        decisions = respond(throttle, 0.14, 10)
+        self.assertEqual(decisions[0]['action'], 'increase')
+
+    def test_speed_up_before_increase(self):
+        throttle = DomainThrottle(2, delay=1.0, min_delay=0.1, window=10)
+        actions = [(d['action'], d['delay']) for d in respond(throttle, 0.1, 40)]
+        self.assertEqual(actions[:3], [('speed up', 0.5), ('speed up', 0.25), ('speed up', 0.125)])
+        self.assertEqual(actions[3][0], 'speed up')
+        self.assertEqual(throttle.delay, 0.1)
+
+    def test_back_off_on_errors(self):
+        throttle = DomainThrottle(8, window=10, error_rate=0.1)
+        respond(throttle, 0.1, 8)
+        decisions = respond(throttle, None, 2, error=True)
+        self.assertEqual([(d['action'], d['concurrency']) for d in decisions], [('back off', 4)])
+        # the requests sent at the old concurrency are ignored
+        self.assertEqual(throttle.cooldown, 8)
+        self.assertEqual(respond(throttle, None, 8, error=True), [])
+
+    def test_back_off_on_throttle_status(self):
+        throttle = DomainThrottle(4)
+        decision = throttle.record(0.1, status=429, retry_after=5.0)
+        self.assertEqual((decision['action'], decision['concurrency'], decision['delay']), ('back off', 2, 5.0))
+
+    def test_back_off_at_min_concurrency_raises_the_delay(self):
+        throttle = DomainThrottle(1, max_delay=1.0)
+        decision = throttle.record(0.1, status=503)
+        self.assertEqual((decision['concurrency'], decision['delay']), (1, BACKOFF_DELAY))
+        throttle.cooldown = 0
+        throttle.record(0.1, status=503)
+        throttle.cooldown = 0
+        throttle.record(0.1, status=503)
+        throttle.cooldown = 0
+        self.assertEqual(throttle.record(0.1, status=503)['delay'], 1.0)
+
+    def test_limits(self):
+        throttle = DomainThrottle(100, delay=0.0, min_concurrency=2, max_concurrency=8, min_delay=0.5)
+        self.assertEqual((throttle.concurrency, throttle.delay), (8, 0.5))
+        throttle.setMinDelay(2.0)
+        self.assertEqual(throttle.delay, 2.0)
+
+
+class RobotsTest(unittest.TestCase):
+
+    def test_crawl_delay(self):
+        body = "User-agent: *\nCrawl-delay: 5\n\nUser-agent: polldata\nUser-agent: other\nCrawl-delay: 2\n"
+        self.assertEqual(crawlDelay(body, 'polldata (+http://example.com)'), 2.0)
+        self.assertEqual(crawlDelay(body, 'Mozilla/5.0'), 5.0)
+        self.assertEqual(crawlDelay("User-agent: *\nDisallow: /\n", 'polldata'), None)
+
+    def test_retry_after(self):
+        self.assertEqual(retryAfter('120'), 120.0)
+        self.assertEqual(retryAfter('Wed, 21 Oct 2015 07:28:00 GMT'), None)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,59 @@
+"""Tests for polldata.extensions."""
+
+import os
+import shutil
+import tempfile
+import unittest
+
+try:
+    from scrapy.settings import Settings
+    from scrapy.statscol import MemoryStatsCollector
+    from polldata.extensions import WarmStart
+except ImportError:
+    WarmStart = None
+
+
+class Spider(object):
+    name = 'pres2012'
+
+
+class Crawler(object):
+
+    def __init__(self, **settings):
+        self.settings = Settings(settings)
+        self.stats = MemoryStatsCollector(self)
+
+
+@unittest.skipIf(WarmStart is None, "needs scrapy")
+class WarmStartTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.crawler = Crawler(STAGE_TIMING_ENABLED=False)
+        self.spider = Spider()
+        self.extension = WarmStart(self.crawler, os.path.join(self.tmpdir, 'warmstart.json'),
+                                   {'robots': 0, 'dns': 3600, 'links': 3600})
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_time_to_first_item(self):
+        stats = self.crawler.stats
+        self.extension.spider_opened(self.spider)
+        self.assertIsNone(stats.get_value('time_to_first_item'))
+
+        self.extension.item_dropped({}, self.spider, Exception())
+        seconds = stats.get_value('time_to_first_item')
+        self.assertGreaterEqual(seconds, 0)
+        self.extension.item_scraped({}, None, self.spider)
+        self.assertEqual(stats.get_value('time_to_first_item'), seconds)
+
+    def test_set_by_stage_timing_first(self):
+        self.crawler.stats.set_value('time_to_first_item', 1.5)
+        self.extension.spider_opened(self.spider)
+        self.extension.item_scraped({}, None, self.spider)
+        self.assertEqual(self.crawler.stats.get_value('time_to_first_item'), 1.5)
+
+
+if __name__ == '__main__':
+    unittest.main()
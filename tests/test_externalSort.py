@@ -0,0 +1,90 @@
+"""Tests for polldata.utils.externalSort."""
+
+import os
+import random
+import shutil
+import tempfile
+import unittest
+from io import BytesIO
+
+try:
+    from scrapy.contrib.exporter import CsvItemExporter
+    from polldata.items import PresPollItem
+except ImportError:
+    CsvItemExporter = None
+
+from polldata.utils.externalSort import ExternalSorter
+from polldata.utils.pollRecords import PollRecord
+
+FIELDS = ['state', 'service', 'end', 'sample', 'voters', 'dem', 'rep', 'ind']
+
+
+def pollItems(count, seed=0):
+    """Items with few distinct states, so many share a key, numbered by their service."""
+    rand = random.Random(seed)
+    return [PresPollItem(race='pres2012', state=rand.choice(['Ohio', 'Iowa', 'Florida', 'Nevada']),
+                         service='Pollster %03d' % number, start='10/1/2012', end='10/3/2012',
+                         sample=rand.choice(['LV', 'RV']), voters=str(rand.randint(400, 2000)),
+                         dem=str(rand.randint(40, 55)), rep=str(rand.randint(40, 55)), spread=0.0, ind=0)
+            for number in range(count)]
+
+
+def export(items, fields):
+    out_file = BytesIO()
+    exporter = CsvItemExporter(out_file, fields_to_export=fields)
+    exporter.start_exporting()
+    for item in items:
+        exporter.export_item(item)
+    exporter.finish_exporting()
+    return out_file.getvalue()
+
+
+@unittest.skipIf(CsvItemExporter is None, "needs scrapy")
+class ExternalSorterTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.run_dir = os.path.join(self.tmpdir, 'runs')
+        self.items = pollItems(100)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def sort(self, max_items, fields=FIELDS, record_cls=None):
+        sorter = ExternalSorter(self.run_dir, fields, 'state', max_items, CsvItemExporter, record_cls)
+        for item in self.items:
+            sorter.add(item)
+        self.assertEqual(len(sorter), len(self.items))
+        if max_items:
+            self.assertEqual(len(sorter.runs), len(self.items) // max_items)
+        if sorter.runs:
+            self.assertEqual(len(os.listdir(self.run_dir)), len(sorter.runs))
+        out_file = BytesIO()
+        sorter.merge(out_file)
+        sorter.cleanup()
+        self.assertFalse(os.path.exists(self.run_dir))
+        return out_file.getvalue()
+
+    def test_matches_sorted(self):
+        # sorted() is stable, so equal states keep the order they were added in
+        expected = export(sorted(self.items, key=lambda item: item['state']), FIELDS)
+        for max_items in (None, 1, 7, 30, 1000):
+            self.assertEqual(self.sort(max_items), expected, max_items)
+            self.assertEqual(self.sort(max_items, record_cls=PollRecord), expected, max_items)
+
+    def test_key_not_exported(self):
+        fields = [field for field in FIELDS if field != 'state']
+        expected = export(sorted(self.items, key=lambda item: item['state']), fields)
+        self.assertEqual(self.sort(None, fields), expected)
+        self.assertEqual(self.sort(9, fields), expected)
+
+    def test_nothing_added(self):
+        sorter = ExternalSorter(self.run_dir, FIELDS, 'state', 10, CsvItemExporter)
+        out_file = BytesIO()
+        sorter.merge(out_file)
+        sorter.cleanup()
+        self.assertEqual(out_file.getvalue(), b'')
+
+
+if __name__ == '__main__':
+    unittest.main()
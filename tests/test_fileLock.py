@@ -0,0 +1,130 @@
+"""Tests for polldata.utils.fileLock."""
+
+import json
+import multiprocessing
+import os
+import shutil
+import tempfile
+import unittest
+
+from polldata.utils.fileLock import AtomicFile, FileLock, FileLocked, readJson, updateJson
+
+
+def holdLock(fName, held, release):
+    lock = FileLock(fName)
+    lock.acquire()
+    held.set()
+    release.wait()
+    lock.release()
+
+
+def updateMany(fName, prefix, count):
+    for n in range(count):
+        updateJson(fName, {'%s%d' % (prefix, n): n})
+
+
+class FileLockTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.fName = os.path.join(self.tmpdir, 'pres2012.lock')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_held_by_another_process(self):
+        held, release = multiprocessing.Event(), multiprocessing.Event()
+        holder = multiprocessing.Process(target=holdLock, args=(self.fName, held, release))
+        holder.start()
+        try:
+            self.assertTrue(held.wait(30))
+            lock = FileLock(self.fName)
+            with self.assertRaises(FileLocked) as raised:
+                lock.acquire(timeout=0)
+            self.assertEqual(raised.exception.owner, holder.pid)
+            self.assertFalse(lock.locked)
+        finally:
+            release.set()
+            holder.join()
+        lock.acquire(timeout=5)
+        self.assertTrue(lock.locked)
+        lock.release()
+
+    def test_nested_acquires(self):
+        lock = FileLock(self.fName)
+        with lock:
+            with lock:
+                pass
+            self.assertTrue(lock.locked)
+        self.assertFalse(lock.locked)
+
+
+class AtomicFileTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.fName = os.path.join(self.tmpdir, 'pres2012_latest.csv')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def read(self):
+        data_file = open(self.fName)
+        data = data_file.read()
+        data_file.close()
+        return data
+
+    def test_replaced_once_complete(self):
+        with AtomicFile(self.fName) as data_file:
+            data_file.write('old\n')
+        data_file = AtomicFile(self.fName)
+        data_file.write('new\n')
+        self.assertEqual(self.read(), 'old\n')
+        data_file.commit()
+        self.assertEqual(self.read(), 'new\n')
+        self.assertEqual(os.listdir(self.tmpdir), ['pres2012_latest.csv'])
+
+    def test_discarded_on_error(self):
+        with AtomicFile(self.fName) as data_file:
+            data_file.write('old\n')
+        try:
+            with AtomicFile(self.fName) as data_file:
+                data_file.write('partial')
+                raise RuntimeError
+        except RuntimeError:
+            pass
+        self.assertEqual(self.read(), 'old\n')
+        self.assertEqual(os.listdir(self.tmpdir), ['pres2012_latest.csv'])
+
+
+class UpdateJsonTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.fName = os.path.join(self.tmpdir, 'warmstart.json')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_malformed_file_is_started_over(self):
+        json_file = open(self.fName, 'w')
+        json_file.write('{"truncated": ')
+        json_file.close()
+        self.assertEqual(readJson(self.fName, 'default'), 'default')
+        self.assertEqual(updateJson(self.fName, {'a': 1}), {'a': 1})
+
+    def test_processes_keep_each_others_entries(self):
+        writers = [multiprocessing.Process(target=updateMany, args=(self.fName, prefix, 50))
+                   for prefix in 'abcd']
+        for writer in writers:
+            writer.start()
+        for writer in writers:
+            writer.join()
+            self.assertEqual(writer.exitcode, 0)
+        json_file = open(self.fName)
+        self.assertEqual(len(json.load(json_file)), 4 * 50)
+        json_file.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,145 @@
+"""Tests for polldata.middlewares."""
+
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+try:
+    from urllib2 import HTTPError, Request as UrlRequest, urlopen
+except ImportError:
+    from urllib.error import HTTPError
+    from urllib.request import Request as UrlRequest, urlopen
+
+try:
+    from scrapy.exceptions import IgnoreRequest
+    from scrapy.http import Request, Response
+    from scrapy.settings import Settings
+    from scrapy.statscol import MemoryStatsCollector
+    from polldata.middlewares import ConditionalRequestMiddleware
+except ImportError:
+    ConditionalRequestMiddleware = None
+
+from benchmarks.rcpserver import RCPServer
+
+PAGE = b'<html><body><div id="polling-data-full"><table></table></div></body></html>'
+
+
+class Spider(object):
+    name = 'pres2012'
+
+
+class Crawler(object):
+
+    def __init__(self):
+        self.settings = Settings()
+
+
+@unittest.skipIf(ConditionalRequestMiddleware is None, "needs scrapy")
+class ConditionalRequestMiddlewareTest(unittest.TestCase):
+
+    def setUp(self):
+        self.cwd = os.getcwd()
+        self.tmpdir = tempfile.mkdtemp()
+        os.chdir(self.tmpdir)
+        os.mkdir('data')
+        os.makedirs('site/epolls')
+        self.writePage(PAGE)
+        self.server = RCPServer('site')
+        self.server.start()
+        self.url = self.server.base_url + '/epolls/ohio.html'
+        self.spider = Spider()
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        os.chdir(self.cwd)
+        shutil.rmtree(self.tmpdir)
+
+    def writePage(self, body):
+        page_file = open('site/epolls/ohio.html', 'wb')
+        page_file.write(body)
+        page_file.close()
+
+    def crawl(self, conditional=True):
+        """Request the page through a new middleware, as a new run would.
+
+        Returns:
+            (the headers sent, the response, or None if the page was skipped)
+        """
+        self.stats = MemoryStatsCollector(Crawler())
+        middleware = ConditionalRequestMiddleware(self.stats)
+        middleware.spider_opened(self.spider)
+        request = Request(self.url, meta={'rule': 0})
+        self.assertIsNone(middleware.process_request(request, self.spider))
+        sent = dict((name, request.headers.get(name)) for name in ('If-None-Match', 'If-Modified-Since')
+                    if name in request.headers)
+
+        # a server that ignores the conditional headers doesn't get them
+        url_request = UrlRequest(self.url, headers=sent if conditional else {})
+        try:
+            url_response = urlopen(url_request)
+            status, body = url_response.getcode(), url_response.read()
+            headers = dict(url_response.info().items())
+            url_response.close()
+        except HTTPError as error:
+            status, body, headers = error.code, b'', dict(error.info().items())
+        response = Response(self.url, status=status, headers=headers, body=body)
+
+        try:
+            response = middleware.process_response(request, response, self.spider)
+        except IgnoreRequest:
+            response = None
+        middleware.spider_closed(self.spider)
+        return sent, response
+
+    def validators(self):
+        validators_file = open('data/pres2012_validators.json')
+        validators = json.load(validators_file)
+        validators_file.close()
+        return validators[self.url]
+
+    def test_first_run_saves_validators(self):
+        sent, response = self.crawl()
+        self.assertEqual(sent, {})
+        self.assertEqual(response.status, 200)
+        self.assertEqual(self.stats.get_value('conditional/pages_changed'), 1)
+        validators = self.validators()
+        self.assertEqual(validators['etag'], response.headers.get('ETag'))
+        self.assertEqual(validators['last_modified'], response.headers.get('Last-Modified'))
+        self.assertEqual(validators['length'], len(PAGE))
+
+    def test_not_modified(self):
+        self.crawl()
+        validators = self.validators()
+        sent, response = self.crawl()
+        self.assertEqual(sent, {'If-None-Match': validators['etag'],
+                                'If-Modified-Since': validators['last_modified']})
+        self.assertIsNone(response)
+        self.assertEqual(self.server.counts['not_modified'], 1)
+        self.assertEqual(self.stats.get_value('conditional/pages_skipped'), 1)
+        self.assertEqual(self.stats.get_value('conditional/bytes_skipped'), len(PAGE))
+        self.assertIsNone(self.stats.get_value('conditional/pages_changed'))
+
+    def test_same_body(self):
+        self.crawl()
+        sent, response = self.crawl(conditional=False)
+        self.assertIsNone(response)
+        self.assertEqual(self.server.counts['not_modified'], 0)
+        self.assertEqual(self.stats.get_value('conditional/pages_skipped'), 1)
+
+    def test_changed_page(self):
+        self.crawl()
+        old = self.validators()
+        self.writePage(PAGE.replace(b'<table>', b'<table class="data">'))
+        sent, response = self.crawl()
+        self.assertEqual(response.status, 200)
+        self.assertEqual(self.stats.get_value('conditional/pages_changed'), 1)
+        self.assertIsNone(self.stats.get_value('conditional/pages_skipped'))
+        self.assertNotEqual(self.validators()['body_hash'], old['body_hash'])
+        self.assertEqual(self.validators()['etag'], response.headers.get('ETag'))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,91 @@
+# -*- coding: utf-8 -*-
+"""Tests for polldata.utils.normalize."""
+
+import datetime
+import math
+import unittest
+
+from polldata.utils.normalize import HAVE_NUMPY, MISSING_INT, normalizePolls, normalizeRows, recentPolls
+
+ROWS = [
+    (u"Rasmussen Reports", u"1/2 - 1/5", u"1,337", u"48", u"47"),
+    (u"PPP (D)", u"12/28 - 1/3", u"595 LV", u"--", u"45"),
+    (u"Gravis", u"12/20 - 12/22", u"RV", u"50.5", u"40"),
+    (u"Quinnipiac", u"--", u"--", u"40", u"41"),
+    (u"SurveyUSA", u"11/3", u"1000 A", u"44", u"44"),
+]
+
+
+def sameValue(a, b):
+    if isinstance(a, float) and isinstance(b, float) and math.isnan(a) and math.isnan(b):
+        return True
+    return a == b
+
+
+class NormalizeRowsTest(unittest.TestCase):
+
+    def setUp(self):
+        self.columns = normalizeRows(ROWS, 2012)
+
+    def test_year_rollover(self):
+        # newest first: a date later in the year than the one above it is
+        # from the year before
+        self.assertEqual(self.columns['end'], [u'1/5/2012', u'1/3/2012', u'12/22/2011', u'', u'11/3/2011'])
+        self.assertEqual(self.columns['end_date'][2], datetime.date(2011, 12, 22))
+
+    def test_range_across_new_year(self):
+        self.assertEqual(self.columns['start'][1], u'12/28/2011')
+        self.assertEqual(self.columns['start_date'][1], datetime.date(2011, 12, 28))
+        self.assertEqual(self.columns['end_date'][1], datetime.date(2012, 1, 3))
+
+    def test_single_date_is_the_end_date(self):
+        self.assertEqual(self.columns['start'][4], u'')
+        self.assertEqual(self.columns['start_date'][4], None)
+        self.assertEqual(self.columns['end'][4], u'11/3/2011')
+
+    def test_sample_size_with_thousands_separator(self):
+        self.assertEqual(self.columns['voters'][0], u'1337')
+        self.assertEqual(self.columns['sample_size'][0], 1337)
+        self.assertEqual(self.columns['sample'][0], u'')
+
+    def test_sample_size_and_type(self):
+        self.assertEqual(self.columns['voters'][1], u'595')
+        self.assertEqual(self.columns['sample'][1], u'LV')
+        self.assertEqual(self.columns['voters'][2], u'')
+        self.assertEqual(self.columns['sample_size'][2], MISSING_INT)
+        self.assertEqual(self.columns['sample'][2], u'RV')
+
+    def test_missing_values(self):
+        self.assertEqual(self.columns['dem'][1], u'--')
+        self.assertTrue(math.isnan(self.columns['dem_pct'][1]))
+        self.assertTrue(math.isnan(self.columns['spread'][1]))
+        self.assertEqual(self.columns['end'][3], u'')
+        self.assertEqual(self.columns['end_date'][3], None)
+
+    def test_spread(self):
+        self.assertEqual(self.columns['spread'][0], 1.0)
+        self.assertEqual(self.columns['spread'][2], 10.5)
+
+    def test_empty_table(self):
+        columns = normalizeRows([], 2012)
+        self.assertEqual(columns['service'], [])
+
+    def test_recent_polls(self):
+        self.assertEqual(recentPolls(self.columns, days=30), ('2012-01-05', 3))
+        self.assertEqual(recentPolls(normalizeRows([], 2012)), (None, 0))
+
+    @unittest.skipUnless(HAVE_NUMPY, "needs numpy")
+    def test_same_as_normalizePolls(self):
+        arrays = normalizePolls(ROWS, 2012)
+        for field, values in self.columns.items():
+            if field in ('start_date', 'end_date'):
+                expected = [value.astype(object) if value == value else None for value in arrays[field]]
+            else:
+                expected = arrays[field].tolist()
+            self.assertEqual(len(values), len(expected))
+            for value, other in zip(values, expected):
+                self.assertTrue(sameValue(value, other), (field, value, other))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,85 @@
+"""Tests for polldata.pipelines."""
+
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+try:
+    from scrapy.settings import Settings
+    from polldata.items import PresPollItem
+    from polldata.pipelines import CsvExportPipeline, DuplicatePoll, pollFingerprint
+    from polldata.utils.seenStore import SharedSeenStore
+except ImportError:
+    CsvExportPipeline = None
+
+POLL = {'race': 'pres2012', 'state': 'Ohio', 'service': 'PPP (D)', 'start': '12/28/2011',
+        'end': '12/30/2011', 'sample': '', 'voters': '1337', 'dem': '50', 'rep': '46', 'spread': 4.0,
+        'ind': 0, 'legacy': {'end': '12/30/2012', 'sample': '1,337'}}
+
+
+class Spider(object):
+    name = 'pres2012'
+    fields_to_export = ['state', 'service', 'end', 'sample', 'voters', 'dem', 'rep', 'ind']
+
+
+@unittest.skipIf(CsvExportPipeline is None, "needs scrapy")
+class CsvExportPipelineTest(unittest.TestCase):
+
+    def setUp(self):
+        self.cwd = os.getcwd()
+        self.tmpdir = tempfile.mkdtemp()
+        os.chdir(self.tmpdir)
+        os.mkdir('data')
+        self.spider = Spider()
+
+    def tearDown(self):
+        os.chdir(self.cwd)
+        shutil.rmtree(self.tmpdir)
+
+    def crawl(self, *polls):
+        """Run polls through a CsvExportPipeline, returning those it exported."""
+        pipeline = CsvExportPipeline(Settings())
+        pipeline.spider_opened(self.spider)
+        exported = []
+        for poll in polls:
+            try:
+                exported.append(pipeline.process_item(PresPollItem(poll), self.spider))
+            except DuplicatePoll:
+                pass
+        pipeline.spider_closed(self.spider)
+        return exported
+
+    def test_new_polls_are_exported_once(self):
+        other = dict(POLL, service='Rasmussen Reports')
+        self.assertEqual(len(self.crawl(POLL, other, POLL)), 2)
+        latest_file = open('data/pres2012_latest.csv')
+        self.assertEqual(len(latest_file.read().splitlines()), 3)
+        latest_file.close()
+        self.assertEqual(self.crawl(POLL, other), [])
+
+    def test_polls_exported_before_normalization(self):
+        # a _dict.json written before the polls were normalized
+        legacy = pollFingerprint(POLL, POLL['legacy']['end'], POLL['legacy']['sample'])
+        legacy_file = open('data/pres2012_dict.json', 'w')
+        json.dump([legacy], legacy_file)
+        legacy_file.close()
+
+        self.assertEqual(self.crawl(POLL), [])
+        store = SharedSeenStore('data/pres2012')
+        self.assertIn(pollFingerprint(POLL), store)
+        store.close()
+
+        # a revised poll is still new
+        self.assertEqual(len(self.crawl(dict(POLL, dem='51'))), 1)
+
+    def test_unchanged_legacy_fields(self):
+        poll = dict(POLL, end='12/30/2012', sample='', voters='1337',
+                    legacy={'end': '12/30/2012', 'sample': ''})
+        self.assertEqual(len(self.crawl(poll)), 1)
+        self.assertEqual(self.crawl(poll), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,120 @@
+"""Tests for polldata.utils.pollDatabase."""
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from polldata.utils.pollDatabase import PollDatabase, isoDate, pollRow, startDates
+
+POLL = {'race': 'pres2012', 'state': 'Ohio', 'service': 'Rasmussen Reports', 'start': '10/1/2012',
+        'end': '10/3/2012', 'sample': 'LV', 'voters': '595', 'dem': '48', 'rep': '47', 'ind': 0}
+
+
+def poll(**fields):
+    return pollRow(dict(POLL, **fields))
+
+
+class PollDatabaseTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.database = PollDatabase(os.path.join(self.tmpdir, 'polls.db'))
+
+    def tearDown(self):
+        self.database.close()
+        shutil.rmtree(self.tmpdir)
+
+    def rows(self):
+        return self.database.connection.execute(
+            "SELECT start_date, end_date, service, dem, rep, spread, first_seen, last_seen FROM polls "
+            "ORDER BY end_date, service").fetchall()
+
+    def test_row(self):
+        row = poll(spread=None)
+        self.assertEqual((row['start_date'], row['end_date'], row['year']),
+                         ('2012-10-01', '2012-10-03', 2012))
+        self.assertEqual((row['voters'], row['dem'], row['spread']), (595, 48.0, 1.0))
+        self.assertEqual(isoDate('--'), '')
+
+    def test_insert_then_touch(self):
+        self.assertEqual(self.database.upsert([poll()], now=1.0), (1, 0))
+        self.assertEqual(self.database.upsert([poll()], now=2.0), (0, 0))
+        rows = self.rows()
+        self.assertEqual(len(rows), 1)
+        self.assertEqual(rows[0][-2:], (1.0, 2.0))
+
+    def test_revision_updates_the_same_row(self):
+        self.database.upsert([poll()], now=1.0)
+        self.assertEqual(self.database.upsert([poll(dem='49')], now=2.0), (0, 1))
+        rows = self.rows()
+        self.assertEqual(len(rows), 1)
+        self.assertEqual(rows[0][3:6], (49.0, 47.0, 2.0))
+        self.assertEqual(rows[0][-2:], (1.0, 2.0))
+
+    def test_key_fields(self):
+        # each key field tells polls apart; the values don't
+        self.database.upsert([poll()])
+        for field, value in [('state', 'Iowa'), ('service', 'PPP (D)'), ('start', '9/30/2012'),
+                             ('end', '10/4/2012'), ('sample', 'RV'), ('race', 'senate2012')]:
+            self.assertEqual(self.database.upsert([poll(**{field: value})]), (1, 0), field)
+        self.assertEqual(self.database.upsert([poll(voters='600', rep='46')]), (0, 1))
+        self.assertEqual(self.database.count(), 7)
+        self.assertEqual(self.database.count('senate2012'), 1)
+
+    def test_undated_poll_is_a_poll_of_its_own(self):
+        # a poll listed without a start date isn't the dated poll with the
+        # same end date and sample
+        self.assertEqual(self.database.upsert([poll(start='')]), (1, 0))
+        self.assertEqual(self.database.upsert([poll()]), (1, 0))
+        self.assertEqual([row[:2] for row in self.rows()],
+                         [('', '2012-10-03'), ('2012-10-01', '2012-10-03')])
+
+    def test_start_dates(self):
+        start_dates = startDates([poll(), poll(service='PPP (D)', start=''),
+                                  poll(state='Iowa', start='9/30/2012'), poll(state='Iowa')])
+        self.assertEqual(start_dates,
+                         {('pres2012', 'Ohio', 'Rasmussen Reports', '2012-10-03', 'LV'): '2012-10-01'})
+
+    def writeCsv(self, text):
+        fName = os.path.join(self.tmpdir, 'pres2012_latest.csv')
+        csv_file = open(fName, 'w')
+        csv_file.write(text)
+        csv_file.close()
+        return fName
+
+    def test_import_csv(self):
+        fName = self.writeCsv("state,service,end,sample,voters,dem,rep,ind\n"
+                              "Ohio,Rasmussen Reports,10/3/2012,LV,595,48,47,0\n"
+                              "Ohio,PPP (D),10/2/2012,LV,600,50,45,0\n")
+        self.assertEqual(self.database.importCsv(fName, 'pres2012', batch_rows=1), (2, 0))
+        self.assertEqual(self.database.importCsv(fName, 'pres2012'), (0, 0))
+        self.assertEqual(self.database.count('pres2012'), 2)
+
+    def test_import_csv_with_start_dates(self):
+        fName = self.writeCsv("state,service,end,sample,voters,dem,rep,ind\n"
+                              "Ohio,Rasmussen Reports,10/3/2012,LV,595,48,47,0\n"
+                              "Ohio,PPP (D),10/2/2012,LV,600,50,45,0\n")
+        revisions = [poll(dem='49')]
+        counts = self.database.importCsv(fName, 'pres2012', start_dates=startDates(revisions))
+        self.assertEqual(counts, (2, 0))
+        # the revision is the same poll, with its latest values
+        self.assertEqual(self.database.upsert(revisions), (0, 1))
+        self.assertEqual([row[:4] for row in self.rows()],
+                         [('', '2012-10-02', 'PPP (D)', 50.0),
+                          ('2012-10-01', '2012-10-03', 'Rasmussen Reports', 49.0)])
+
+    def test_start_column_is_kept(self):
+        fName = self.writeCsv("state,service,start,end,sample,voters,dem,rep,ind\n"
+                              "Ohio,Rasmussen Reports,,10/3/2012,LV,595,48,47,0\n")
+        self.database.importCsv(fName, 'pres2012', start_dates=startDates([poll()]))
+        self.assertEqual([row[:2] for row in self.rows()], [('', '2012-10-03')])
+
+    def test_import_seen_store(self):
+        fingerprints = ['%032x' % n for n in range(3)]
+        self.assertEqual(self.database.importSeenStore(fingerprints, 'pres2012'), 3)
+        self.assertEqual(self.database.importSeenStore(fingerprints, 'pres2012'), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
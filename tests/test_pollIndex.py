@@ -0,0 +1,165 @@
+"""Tests for polldata.utils.pollIndex."""
+
+import datetime
+import os
+import random
+import shutil
+import tempfile
+import unittest
+
+from polldata.utils.pollDatabase import pollRow
+from polldata.utils.pollIndex import TREE_THRESHOLD, IntervalTree, PollIndex, RaceIndex
+from polldata.utils.pollRevisions import PollRevisions
+
+STATES = ['Ohio', 'Florida', 'Iowa', 'Virginia']
+SERVICES = ['Rasmussen Reports', 'PPP (D)', 'SurveyUSA']
+
+
+def isoDay(day):
+    return (datetime.date(2012, 1, 1) + datetime.timedelta(days=day)).isoformat()
+
+
+def randomPolls(count, seed=0):
+    """Polls over a year, with some single day and some undated start dates."""
+    rand = random.Random(seed)
+    polls = []
+    for _ in range(count):
+        end = rand.randint(0, 365)
+        start = end - rand.choice([0, 0, 1, 2, 3, 7])
+        polls.append({'race': 'pres2012', 'state': rand.choice(STATES), 'service': rand.choice(SERVICES),
+                      'sample': rand.choice(['LV', 'RV', '']),
+                      'start_date': '' if rand.random() < 0.1 else isoDay(start), 'end_date': isoDay(end)})
+    return polls
+
+
+def matches(poll, state=None, service=None, sample=None, ended_after=None, ended_before=None,
+            field_from=None, field_to=None):
+    """Whether a poll matches the conditions, the slow way."""
+    start = poll['start_date'] or poll['end_date']
+    return ((state is None or poll['state'] == state) and
+            (service is None or poll['service'].lower() == service.lower()) and
+            (sample is None or poll['sample'] == sample) and
+            (ended_after is None or poll['end_date'] >= ended_after) and
+            (ended_before is None or poll['end_date'] <= ended_before) and
+            (field_from is None or poll['end_date'] >= field_from) and
+            (field_to is None or start <= field_to))
+
+
+class IntervalTreeTest(unittest.TestCase):
+
+    def test_boundaries(self):
+        tree = IntervalTree([(1, 3, 'a'), (3, 5, 'b'), (5, 5, 'c'), (6, 9, 'd')])
+        self.assertEqual(sorted(tree.overlapping(3, 3)), ['a', 'b'])
+        self.assertEqual(sorted(tree.overlapping(5, 5)), ['b', 'c'])
+        self.assertEqual(sorted(tree.overlapping(4, 6)), ['b', 'c', 'd'])
+        self.assertEqual(sorted(tree.overlapping(9, 20)), ['d'])
+        self.assertEqual(tree.overlapping(10, 20), [])
+        self.assertEqual(tree.overlapping(-5, 0), [])
+        self.assertEqual(IntervalTree([]).overlapping(0, 10), [])
+
+    def test_random_intervals(self):
+        rand = random.Random(1)
+        intervals = []
+        for value in range(500):
+            start = rand.randint(0, 100)
+            intervals.append((start, start + rand.randint(0, 10), value))
+        tree = IntervalTree(intervals)
+        for _ in range(200):
+            low = rand.randint(-5, 110)
+            high = low + rand.randint(0, 15)
+            self.assertEqual(sorted(tree.overlapping(low, high)),
+                             [value for start, end, value in intervals if start <= high and end >= low])
+
+
+class RaceIndexTest(unittest.TestCase):
+
+    def setUp(self):
+        # enough polls that field date queries use the interval tree
+        self.polls = randomPolls(4 * TREE_THRESHOLD)
+        self.index = RaceIndex('pres2012', self.polls)
+
+    def check(self, **conditions):
+        found = [self.index.polls[position] for position in self.index.query(**conditions)]
+        expected = sorted([poll for poll in self.polls if matches(poll, **conditions)],
+                          key=lambda poll: (poll['end_date'], poll['start_date']), reverse=True)
+        self.assertEqual(found, expected, conditions)
+
+    def test_filters(self):
+        self.check()
+        self.check(state='Ohio')
+        self.check(service='ppp (d)')
+        self.check(state='Ohio', service='SurveyUSA')
+        self.check(sample='LV')
+        self.check(ended_after=isoDay(100), ended_before=isoDay(130))
+        self.check(ended_after=isoDay(365))
+        self.check(ended_before=isoDay(0))
+        self.check(field_from=isoDay(50), field_to=isoDay(50))
+        self.check(field_from=isoDay(200))
+        self.check(state='Iowa', field_from=isoDay(10), field_to=isoDay(40), sample='RV')
+        self.check(service='Rasmussen Reports', ended_after=isoDay(300), field_to=isoDay(320))
+
+    def test_state_abbreviation(self):
+        self.assertEqual(self.index.query(state='OH'), self.index.query(state='Ohio'))
+        self.assertEqual(self.index.query(state='oh'), self.index.query(state='Ohio'))
+
+    def test_latest(self):
+        for conditions in ({}, {'state': 'Ohio'}, {'sample': 'LV', 'ended_before': isoDay(200)}):
+            newest = {}
+            for position in self.index.query(**conditions):
+                poll = self.index.polls[position]
+                newest.setdefault((poll['state'], poll['service']), position)
+            self.assertEqual(self.index.query(latest=True, **conditions), sorted(newest.values()))
+
+
+class PollIndexTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def crawl(self, race, *polls):
+        revisions = PollRevisions(os.path.join(self.tmpdir, race))
+        for poll in polls:
+            revisions.observe(pollRow(dict({'race': race, 'state': 'Ohio', 'service': 'PPP (D)', 'start': '',
+                                            'sample': 'LV', 'voters': '500', 'dem': '48', 'rep': '47',
+                                            'ind': 0}, **poll)))
+        revisions.finish()
+        revisions.close()
+
+    def test_reload_changed_races(self):
+        index = PollIndex(self.tmpdir)
+        self.assertEqual(index.reload(), [])
+        self.crawl('pres2012', {'end': '10/3/2012'}, {'end': '10/9/2012', 'state': 'Iowa'})
+        self.crawl('senate2012', {'end': '10/5/2012'})
+        self.assertEqual(index.reload(), ['pres2012', 'senate2012'])
+        self.assertEqual(len(index), 3)
+        self.assertEqual(index.reload(), [])
+
+        senate = index.races['senate2012']
+        self.crawl('pres2012', {'end': '10/3/2012', 'dem': '49'}, {'end': '10/9/2012', 'state': 'Iowa'})
+        self.assertEqual(index.reload(), ['pres2012'])
+        self.assertIs(index.races['senate2012'], senate)
+        self.assertEqual(index.query(race='pres2012', state='OH')[1][0]['dem'], 49.0)
+
+        os.remove(os.path.join(self.tmpdir, 'senate2012_revisions.log'))
+        self.assertEqual(index.reload(), ['senate2012'])
+        self.assertEqual(sorted(index.races), ['pres2012'])
+
+    def test_query_every_race(self):
+        self.crawl('pres2012', {'end': '10/3/2012'}, {'end': '10/9/2012', 'state': 'Iowa'})
+        self.crawl('senate2012', {'end': '10/5/2012'})
+        index = PollIndex(self.tmpdir)
+        index.reload()
+        matches, polls = index.query(limit=2)
+        self.assertEqual(matches, 3)
+        self.assertEqual([(poll['race'], poll['end_date']) for poll in polls],
+                         [('pres2012', '2012-10-09'), ('senate2012', '2012-10-05')])
+        self.assertEqual(index.query(race='house2012'), (0, []))
+        self.assertEqual(index.summary()['pres2012'],
+                         {'polls': 2, 'states': 2, 'services': 1, 'newest': '2012-10-09'})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,112 @@
+"""Tests for polldata.utils.pollRevisions."""
+
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+from polldata.utils.pollDatabase import KEY, pollRow
+from polldata.utils.pollRevisions import PollRevisions, lastSeq, loadRevisions, pollKey, readChanges
+
+POLL = {'race': 'pres2012', 'state': 'Ohio', 'service': 'Rasmussen Reports', 'start': '10/1/2012',
+        'end': '10/3/2012', 'sample': 'LV', 'voters': '595', 'dem': '48', 'rep': '47', 'ind': 0}
+
+
+def poll(**fields):
+    return pollRow(dict(POLL, **fields))
+
+
+class PollRevisionsTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.basename = os.path.join(self.tmpdir, 'pres2012')
+        self.feed = self.basename + '_changes.jsonl'
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def crawl(self, *rows, **kw):
+        """Observe rows like a crawl does, returning the changes and deletes."""
+        revisions = PollRevisions(self.basename, **kw)
+        changes = [revisions.observe(row, now=1000.0) for row in rows]
+        deleted = revisions.finish(now=1000.0)
+        revisions.close()
+        return changes, deleted
+
+    def test_insert_update_delete(self):
+        other = poll(service='PPP (D)')
+        self.assertEqual(self.crawl(poll(), other), (['insert', 'insert'], 0))
+        self.assertEqual(self.crawl(poll(dem='49'), other), (['update', None], 0))
+        self.assertEqual(self.crawl(poll(dem='49')), ([None], 1))
+
+        changes = list(readChanges(self.feed))
+        self.assertEqual([(change['seq'], change['op']) for change in changes],
+                         [(1, 'insert'), (2, 'insert'), (3, 'update'), (4, 'delete')])
+        self.assertEqual((changes[2]['values']['dem'], changes[2]['previous']['dem']), (49.0, 48.0))
+        self.assertEqual(changes[2]['revision'], 2)
+        self.assertEqual(changes[3]['key']['service'], 'PPP (D)')
+        self.assertNotIn('values', changes[3])
+        self.assertEqual([change['seq'] for change in readChanges(self.feed, since=3)], [4])
+
+        seq, polls = loadRevisions(self.basename)
+        self.assertEqual((seq, list(polls)), (4, [pollKey(poll())]))
+        self.assertEqual(polls[pollKey(poll())]['values']['dem'], 49.0)
+
+    def test_deletes_only_parsed_pages(self):
+        self.crawl(poll(), poll(state='Iowa'))
+        # Iowa's page was skipped, so its poll is kept
+        self.assertEqual(self.crawl(poll(service='PPP (D)')), (['insert'], 1))
+        seq, polls = loadRevisions(self.basename)
+        self.assertEqual(sorted(entry['key']['state'] for entry in polls.values()), ['Iowa', 'Ohio'])
+        self.assertEqual([change['key']['state'] for change in readChanges(self.feed)
+                          if change['op'] == 'delete'], ['Ohio'])
+
+    def test_crash_after_last_commit(self):
+        self.crawl(poll(), compact_ratio=100)
+        log_fName = self.basename + '_revisions.log'
+        size = os.path.getsize(log_fName)
+        # a flush cut short: a record without its commit, and a torn line
+        key = dict((field, poll()[field]) for field in KEY)
+        log_file = open(log_fName, 'ab')
+        log_file.write(json.dumps({'delete': key}).encode('utf-8') + b'\n{"put": {"key"')
+        log_file.close()
+
+        seq, polls = loadRevisions(self.basename)
+        self.assertEqual((seq, list(polls)), (1, [pollKey(poll())]))
+
+        self.assertEqual(self.crawl(poll(dem='49'), compact_ratio=100), (['update'], 0))
+        log_file = open(log_fName, 'rb')
+        log_file.seek(size)
+        appended = log_file.read()
+        log_file.close()
+        self.assertTrue(appended.startswith(b'{"put": {"first_seen"'))
+        self.assertEqual(loadRevisions(self.basename)[0], 2)
+
+    def test_feed_ahead_of_log(self):
+        self.crawl(poll())
+        # the feed was written but the log wasn't
+        os.remove(self.basename + '_revisions.log')
+        self.assertEqual(lastSeq(self.feed), 1)
+        self.assertEqual(self.crawl(poll()), (['insert'], 0))
+        self.assertEqual([change['seq'] for change in readChanges(self.feed)], [1, 2])
+
+    def test_compaction(self):
+        log_fName = self.basename + '_revisions.log'
+        for dem in range(40, 50):
+            self.crawl(poll(dem=str(dem)), poll(service='PPP (D)'))
+            log_file = open(log_fName, 'rb')
+            records = len(log_file.readlines())
+            log_file.close()
+            # never more than compact_ratio records per poll
+            self.assertLessEqual(records, 2 * 2)
+
+        seq, polls = loadRevisions(self.basename)
+        self.assertEqual(seq, 11)
+        self.assertEqual(polls[pollKey(poll())]['values']['dem'], 49.0)
+        self.assertEqual(polls[pollKey(poll())]['revision'], 10)
+
+
+if __name__ == '__main__':
+    unittest.main()
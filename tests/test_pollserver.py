@@ -0,0 +1,91 @@
+"""Tests for polldata.commands.pollserver."""
+
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+try:
+    from polldata.commands.pollserver import PollResource
+except ImportError:
+    PollResource = None
+
+from polldata.utils.pollDatabase import pollRow
+from polldata.utils.pollIndex import PollIndex
+from polldata.utils.pollRevisions import PollRevisions
+
+POLLS = [
+    {'state': 'Ohio', 'service': 'PPP (D)', 'start': '10/1/2012', 'end': '10/3/2012', 'sample': 'LV'},
+    {'state': 'Ohio', 'service': 'PPP (D)', 'start': '9/20/2012', 'end': '9/22/2012', 'sample': 'LV'},
+    {'state': 'Ohio', 'service': 'SurveyUSA', 'start': '10/5/2012', 'end': '10/8/2012', 'sample': 'RV'},
+    {'state': 'Florida', 'service': 'PPP (D)', 'start': '10/2/2012', 'end': '10/2/2012', 'sample': 'LV'},
+]
+
+
+class Request(object):
+
+    def __init__(self, path, **args):
+        self.path = path
+        self.args = dict((name, [value.encode('utf-8')]) for name, value in args.items())
+        self.code = 200
+
+    def setHeader(self, name, value):
+        pass
+
+    def setResponseCode(self, code):
+        self.code = code
+
+
+@unittest.skipIf(PollResource is None, "needs scrapy")
+class PollResourceTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        revisions = PollRevisions(os.path.join(self.tmpdir, 'pres2012'))
+        for poll in POLLS:
+            revisions.observe(pollRow(dict(poll, race='pres2012', voters='500', dem='48', rep='47', ind=0)))
+        revisions.close()
+        index = PollIndex(self.tmpdir)
+        index.reload()
+        self.resource = PollResource(index)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def get(self, path, **args):
+        request = Request(path, **args)
+        answer = json.loads(self.resource.render_GET(request))
+        return request.code, answer
+
+    def polls(self, **args):
+        code, answer = self.get('/polls', **args)
+        self.assertEqual(code, 200)
+        return answer['matches'], [(poll['state'], poll['end_date']) for poll in answer['polls']]
+
+    def test_filters(self):
+        self.assertEqual(self.polls(), (4, [('Ohio', '2012-10-08'), ('Ohio', '2012-10-03'),
+                                            ('Florida', '2012-10-02'), ('Ohio', '2012-09-22')]))
+        self.assertEqual(self.polls(state='FL'), (1, [('Florida', '2012-10-02')]))
+        self.assertEqual(self.polls(service='ppp (d)', limit='1'), (3, [('Ohio', '2012-10-03')]))
+        self.assertEqual(self.polls(sample='rv'), (1, [('Ohio', '2012-10-08')]))
+        self.assertEqual(self.polls(ended_after='2012-10-02', ended_before='2012-10-03'),
+                         (2, [('Ohio', '2012-10-03'), ('Florida', '2012-10-02')]))
+        self.assertEqual(self.polls(**{'from': '2012-10-04', 'to': '2012-10-05'}),
+                         (1, [('Ohio', '2012-10-08')]))
+        self.assertEqual(self.polls(state='Ohio', service='PPP (D)', latest='1'), (1, [('Ohio', '2012-10-03')]))
+        self.assertEqual(self.polls(race='senate2012'), (0, []))
+
+    def test_bad_queries(self):
+        self.assertEqual(self.get('/polls', ended_after='10/3/2012')[0], 400)
+        self.assertEqual(self.get('/polls', limit='ten')[0], 400)
+        self.assertEqual(self.get('/nothing')[0], 404)
+
+    def test_races_and_health(self):
+        self.assertEqual(self.get('/races')[1]['pres2012']['polls'], 4)
+        code, health = self.get('/health')
+        self.assertEqual((code, health['status'], health['polls']), (200, 'ok', 4))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,55 @@
+"""Tests for polldata.linkextractors.rcp_regex."""
+
+import unittest
+
+try:
+    from polldata.linkextractors.rcp_regex import iterOptions
+except ImportError:
+    iterOptions = None
+
+from benchmarks import synthetic
+from benchmarks.suite import regexLinks
+
+# quoting, extra attributes, case, a tag in the text, a bare closing tag and
+# options without a value
+WIDGET = (b"document.write('\\x3Cselect id=\"race-select\"\\x3E');\n"
+          b"document.write('\\x3Coption value=\"\"\\x3ESelect a race\\x3C/option\\x3E');\n"
+          b"document.write('\\x3Coption value=\"/a.html\" selected\\x3EA: One\\x3C/option\\x3E');\n"
+          b"document.write('\\x3COPTION VALUE='/b.html'\\x3EB: Two\\x3C/OPTION\\x3E');\n"
+          b"document.write('\\x3Coption value=/c.html\\x3EC\\x3C option\\x3E');\n"
+          b"document.write('\\x3Coption class=\"x\" value=\"/d.html\"\\x3ED: \\x3Cb\\x3EFour\\x3C/b\\x3E"
+          b"\\x3C/option\\x3E');\n"
+          b"document.write('\\x3Coption\\x3ENo value\\x3C/option\\x3E');\n"
+          b"document.write('\\x3Coption value=\"/e.html\"\\x3EE\\x3Coption\\x3E');\n"
+          b"document.write('\\x3C/select\\x3E');\n")
+
+
+@unittest.skipIf(iterOptions is None, "needs scrapy")
+class IterOptionsTest(unittest.TestCase):
+
+    def test_same_options_as_regex(self):
+        # the pattern the link extractor used before iterOptions
+        for body in (WIDGET, synthetic.widgetBody(300, seed=1)):
+            self.assertEqual(list(iterOptions(body)), regexLinks(body))
+        self.assertEqual([value for value, text in iterOptions(WIDGET)],
+                         ['""', '"/a.html"', "'/b.html'", '/c.html', '"/d.html"', '"/e.html"'])
+
+    def test_unclosed_options(self):
+        body = synthetic.widgetBody(50, seed=2)
+        closed = list(iterOptions(body))
+        # html lets options go unclosed: each one ends at the next
+        unclosed = body.replace(b'\\x3C/option\\x3E', b'', 5)
+        options = list(iterOptions(unclosed))
+        self.assertEqual([value for value, text in options], [value for value, text in closed])
+        for (value, text), (closed_value, closed_text) in zip(options[:5], closed):
+            self.assertTrue(text.startswith(closed_text))
+            self.assertNotIn(b'\\x3Coption', text)
+        self.assertEqual(options[5:], closed[5:])
+
+        # the regex runs each of them on to the next closing tag, losing the
+        # options in between
+        self.assertEqual(regexLinks(unclosed)[1:], closed[6:])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,200 @@
+"""Tests for polldata.utils.seenStore."""
+
+import hashlib
+import multiprocessing
+import os
+import random
+import shutil
+import tempfile
+import unittest
+
+from polldata.utils.seenStore import JsonSeenStore, LogSeenStore, SharedSeenStore
+
+
+def fingerprint(n):
+    return hashlib.md5(str(n).encode('ascii')).hexdigest()
+
+
+def addAll(store_class, basename, count, seed, ready, start, accepted):
+    """Add fingerprints 0 to count in a random order, in a worker process."""
+    order = list(range(count))
+    random.Random(seed).shuffle(order)
+    store = store_class(basename)
+    # every process opens the store before any adds to it
+    ready.release()
+    start.wait()
+    mine = [n for n in order if store.add(fingerprint(n))]
+    store.close()
+    accepted.put(mine)
+
+
+class LogSeenStoreTest(unittest.TestCase):
+
+    store_class = LogSeenStore
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.basename = os.path.join(self.tmpdir, 'pres2012')
+        self.fName = self.basename + '_seen.log'
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def readLog(self):
+        log_file = open(self.fName, 'rb')
+        data = log_file.read()
+        log_file.close()
+        return data
+
+    def appendLog(self, data):
+        log_file = open(self.fName, 'ab')
+        log_file.write(data)
+        log_file.close()
+
+    def test_reopen(self):
+        store = self.store_class(self.basename)
+        self.assertTrue(store.add(fingerprint(1)))
+        self.assertFalse(store.add(fingerprint(1)))
+        store.add(fingerprint(2))
+        self.assertTrue(store.discard(fingerprint(2)))
+        store.close()
+
+        store = self.store_class(self.basename)
+        self.assertIn(fingerprint(1), store)
+        self.assertNotIn(fingerprint(2), store)
+        self.assertEqual(len(store), 1)
+        store.close()
+
+    def test_torn_line_is_cut_before_the_next_record(self):
+        store = self.store_class(self.basename)
+        store.add(fingerprint(1))
+        store.close()
+        self.appendLog(b'+' + fingerprint(2).encode('ascii')[:20])
+
+        store = self.store_class(self.basename)
+        self.assertNotIn(fingerprint(2), store)
+        store.add(fingerprint(3))
+        store.close()
+        self.assertEqual(self.readLog(), b''.join(b'+' + fingerprint(n).encode('ascii') + b'\n' for n in (1, 3)))
+
+        store = self.store_class(self.basename)
+        self.assertEqual(sorted(store), sorted([fingerprint(1), fingerprint(3)]))
+        store.close()
+
+    def test_reading_leaves_a_torn_line(self):
+        store = self.store_class(self.basename)
+        store.add(fingerprint(1))
+        store.close()
+        self.appendLog(b'+' + fingerprint(2).encode('ascii')[:20])
+        size = os.path.getsize(self.fName)
+
+        store = LogSeenStore(self.basename)
+        self.assertEqual(len(store), 1)
+        self.assertEqual(os.path.getsize(self.fName), size)
+
+    def test_malformed_lines_are_skipped(self):
+        self.appendLog(b'+' + fingerprint(1).encode('ascii') + b'\n'
+                       b'+abcd\n'
+                       b'-' + fingerprint(1).encode('ascii') + b'0\n'
+                       b'*' + fingerprint(2).encode('ascii') + b'\n'
+                       b'+' + fingerprint(3).encode('ascii').upper() + b'\n')
+        store = self.store_class(self.basename)
+        self.assertEqual(sorted(store), sorted([fingerprint(1), fingerprint(3)]))
+        store.close()
+
+    def test_compaction(self):
+        store = self.store_class(self.basename, compact_ratio=2.0)
+        for n in range(10):
+            store.add(fingerprint(n))
+        for n in range(8):
+            store.discard(fingerprint(n))
+        store.close()
+        self.assertEqual(len(self.readLog().splitlines()), 2)
+
+    def test_legacy_import(self):
+        legacy_file = open(self.basename + '_dict.json', 'w')
+        legacy_file.write('["%s", "%s"]' % (fingerprint(1), fingerprint(2)))
+        legacy_file.close()
+        store = self.store_class(self.basename)
+        self.assertIn(fingerprint(2), store)
+        store.close()
+        self.assertEqual(len(self.readLog().splitlines()), 2)
+
+
+class SharedSeenStoreTest(LogSeenStoreTest):
+
+    store_class = SharedSeenStore
+
+    def test_sees_other_processes_records(self):
+        first = SharedSeenStore(self.basename)
+        second = SharedSeenStore(self.basename)
+        self.assertTrue(first.add(fingerprint(1)))
+        self.assertFalse(second.add(fingerprint(1)))
+        self.assertTrue(second.discard(fingerprint(1)))
+        self.assertNotIn(fingerprint(1), first)
+        first.close()
+        second.close()
+
+    def test_torn_line_from_a_dead_writer(self):
+        store = SharedSeenStore(self.basename)
+        store.add(fingerprint(1))
+        self.appendLog(b'+' + fingerprint(2).encode('ascii')[:20])
+        store.add(fingerprint(3))
+        store.close()
+        self.assertEqual(self.readLog(), b''.join(b'+' + fingerprint(n).encode('ascii') + b'\n' for n in (1, 3)))
+
+    def addConcurrently(self, store_class, count, processes=4):
+        """Return the fingerprints each process was first to add."""
+        ready = multiprocessing.Semaphore(0)
+        start = multiprocessing.Event()
+        accepted = multiprocessing.Queue()
+        workers = [multiprocessing.Process(target=addAll, args=(store_class, self.basename, count, seed,
+                                                                ready, start, accepted))
+                   for seed in range(processes)]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            ready.acquire()
+        start.set()
+        results = [accepted.get(timeout=120) for _ in workers]
+        for worker in workers:
+            worker.join()
+            self.assertEqual(worker.exitcode, 0)
+        return results
+
+    def test_each_key_accepted_exactly_once(self):
+        count = 2000
+        results = self.addConcurrently(SharedSeenStore, count)
+        keys = [n for mine in results for n in mine]
+        self.assertEqual(len(keys), count)
+        self.assertEqual(sorted(keys), list(range(count)))
+        store = LogSeenStore(self.basename)
+        self.assertEqual(len(store), count)
+
+    def test_log_store_accepts_keys_twice(self):
+        # the check above fails without SharedSeenStore's locking
+        results = self.addConcurrently(LogSeenStore, 100)
+        self.assertEqual(sum(len(mine) for mine in results), 4 * 100)
+
+
+class JsonSeenStoreTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.basename = os.path.join(self.tmpdir, 'pres2012')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_keeps_other_processes_fingerprints(self):
+        first = JsonSeenStore(self.basename)
+        second = JsonSeenStore(self.basename)
+        first.add(fingerprint(1))
+        second.add(fingerprint(2))
+        first.close()
+        second.close()
+        self.assertEqual(sorted(JsonSeenStore(self.basename)), sorted([fingerprint(1), fingerprint(2)]))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,50 @@
+"""Tests for polldata.utils.statePage."""
+
+import unittest
+
+from polldata.utils.statePage import legacyFields, parseStatePage, parseStatePages
+from polldata.utils.tableExtractor import PollTableExtractor
+
+RACE = {'name': 'pres2012', 'year': 2012}
+
+PAGE = b'''<html><body><h2 id="main-poll-title">Ohio: Romney vs. Obama</h2>
+<div id="polling-data-full"><table>
+<tr class="header"><th>Poll</th><th>Date</th><th>Sample</th><th>MoE</th><th>Obama (D)</th>
+<th>Romney (R)</th><th>Spread</th></tr>
+<tr><td><a>Rasmussen Reports</a></td><td>1/2 - 1/3</td><td>500 LV</td><td>4.5</td><td>48</td>
+<td>47</td><td>Obama +1</td></tr>
+<tr class="isInRcpAvg"><td><a>PPP (D)</a></td><td>12/28 - 12/30</td><td>1,337</td><td>3.0</td>
+<td>50</td><td>46</td><td>Obama +4</td></tr>
+</table></div></body></html>'''
+
+
+class StatePageTest(unittest.TestCase):
+
+    def test_legacy_fields(self):
+        self.assertEqual(legacyFields('12/28 - 1/3', '1,337', 2012), {'end': '1/3/2012', 'sample': '1,337'})
+        self.assertEqual(legacyFields('11/5', '600 LV', 2012), {'end': '11/5/2012', 'sample': 'LV'})
+        self.assertEqual(legacyFields('11/5', 'RV', 2012), {'end': '11/5/2012', 'sample': 'RV'})
+
+    def test_polls_keep_legacy_fields(self):
+        columns, polls = parseStatePage(PAGE, 'utf-8', RACE, PollTableExtractor())
+        self.assertEqual([(poll['end'], poll['sample'], poll['voters']) for poll in polls],
+                         [('1/3/2012', 'LV', '500'), ('12/30/2011', '', '1337')])
+        self.assertEqual([poll['legacy'] for poll in polls],
+                         [{'end': '1/3/2012', 'sample': 'LV'}, {'end': '12/30/2012', 'sample': '1,337'}])
+        self.assertEqual((polls[0]['state'], polls[0]['race'], polls[0]['ind']), ('Ohio', 'pres2012', 0))
+
+    def test_pages_together(self):
+        extractor = PollTableExtractor()
+        polls = parseStatePage(PAGE, 'utf-8', RACE, extractor)[1]
+        self.assertEqual(parseStatePages([(PAGE, 'utf-8', RACE), (PAGE, 'utf-8', RACE)], extractor),
+                         [polls, polls])
+
+    def test_page_errors_are_returned(self):
+        pages = parseStatePages([(b'<html></html>', 'utf-8', RACE), (PAGE, 'utf-8', RACE)],
+                                PollTableExtractor())
+        self.assertIsInstance(pages[0], Exception)
+        self.assertEqual(len(pages[1]), 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,61 @@
+"""Tests for polldata.utils.tableExtractor."""
+
+import unittest
+
+try:
+    from scrapy.http import HtmlResponse
+    from polldata.spiders.pres import PresSpider
+    from benchmarks.suite import xpathParseStatePolls
+except ImportError:
+    PresSpider = None
+
+from benchmarks import synthetic
+from polldata.utils.tableExtractor import PollTableExtractor, compilePlan
+
+# Romney's column before Obama's, a row left out of the average, the RCP
+# average and another row class (both skipped), and comments in the cells
+PAGE = b'''<html><body>
+<h2 id="main-poll-title">New Hampshire: Romney vs. Obama<span> (Latest)</span></h2>
+<div id="polling-data-full"><table class="data">
+<tr class="header"><th>Poll</th><th>Date</th><th>Sample</th><th>MoE</th><th>Romney (R)</th>
+<th>Obama (D)</th><th>Spread</th></tr>
+<tr class="rcpAvg"><td>RCP Average</td><td>10/1 - 11/5</td><td>--</td><td>--</td><td>47.0</td>
+<td>48.0</td><td>Obama +1.0</td></tr>
+<tr class="isInRcpAvg"><td class="noCenter"><a href="/poll/1.html">WMUR/UNH</a></td>
+<td>11/1 - 11/4</td><td>789 LV</td><td>3.5</td><td>48</td><td>50</td><td><span>Obama +2</span></td></tr>
+<tr><td><!-- note --><a href="/poll/2.html">Rasmussen Reports</a></td><td>10/28<!-- x --></td>
+<td>RV</td><td>4.5</td><td>49</td><td>49</td><td>Tie</td></tr>
+<tr class="other"><td>Skipped</td><td>10/1</td><td>500 LV</td><td>4.5</td><td>40</td><td>41</td>
+<td>Obama +1</td></tr>
+</table></div></body></html>'''
+
+
+class TableExtractorTest(unittest.TestCase):
+
+    def test_extract(self):
+        state, rows = PollTableExtractor().extract(PAGE, 'utf-8')
+        self.assertEqual(state, 'New Hampshire')
+        self.assertEqual(rows, [('WMUR/UNH', '11/1 - 11/4', '789 LV', '50', '48'),
+                                ('Rasmussen Reports', '10/28', 'RV', '49', '49')])
+
+    def test_plans_are_cached(self):
+        extractor = PollTableExtractor()
+        extractor.extract(PAGE, 'utf-8')
+        extractor.extract(PAGE, 'utf-8')
+        self.assertEqual(list(extractor.plans.values()), [(0, 1, 2, 5, 4)])
+        self.assertRaises(KeyError, compilePlan, ['Poll', 'Date', 'Sample'])
+
+    @unittest.skipIf(PresSpider is None, "needs scrapy")
+    def test_same_items_as_xpath(self):
+        # the XPath selectors parseStatePolls ran before the extractor
+        spider = PresSpider()
+        pages = [(synthetic.presUrl('nh', 'New Hampshire', 1), PAGE)] + \
+            list(synthetic.statePages(states=10, polls=40, seed=3))
+        for url, body in pages:
+            response = HtmlResponse(url, body=body, encoding='utf-8')
+            self.assertEqual([dict(item) for item in spider.parseStatePolls(response)],
+                             [dict(item) for item in xpathParseStatePolls(spider, response)], url)
+
+
+if __name__ == '__main__':
+    unittest.main()